@@ -1,24 +1,27 @@
 # app/__init__.py
 import os
+import threading
 from flask import Flask, request, session
 from app.security import SecurityMiddleware
+from app.query_monitor import QueryMonitor
+from app.metrics import MetricsMiddleware, JOB_QUEUE_DEPTH
+from app.profiling import RequestProfiler
+from app.static_assets import StaticAssets
+from app.db_engine import engine_options, apply_engine_profiles
+from app.db_routing import RoutingSession, ReplicaRouter
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from config import Config
-import markdown
 from markupsafe import Markup
 from flask_login import LoginManager
 from flask_babel import Babel, get_locale
 from flask_wtf.csrf import CSRFProtect
 import logging
-import stripe # Import stripe
+from app.integrations import markdown, stripe  # Imported on first use
 from logging.handlers import RotatingFileHandler
 
-# Sentry SDK for error monitoring
-import sentry_sdk
-from sentry_sdk.integrations.flask import FlaskIntegration
-
-db = SQLAlchemy()
+# Read-only views can route their SELECTs to a replica bind (see app/db_routing.py)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # Initialize login manager
 login_manager = LoginManager()
@@ -99,6 +102,10 @@ def setup_sentry(app):
     sentry_dsn = app.config.get('SENTRY_DSN') or os.environ.get('SENTRY_DSN')
     
     if sentry_dsn:
+        # Only imported when configured
+        import sentry_sdk
+        from sentry_sdk.integrations.flask import FlaskIntegration
+
         sentry_sdk.init(
             dsn=sentry_dsn,
             integrations=[FlaskIntegration()],
@@ -192,7 +199,12 @@ def create_app(config_class=None):
     # Ensure the instance folder exists
     os.makedirs(os.path.join(app.root_path, '..', 'instance'), exist_ok=True)
     
+    # Optional read replica (DATABASE_REPLICA_URL) for @replica_read views
+    ReplicaRouter(app)
+    # Dialect-specific pool settings; SQLite pragmas are applied on connect
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
     db.init_app(app)
+    apply_engine_profiles(app, db)
     
     # Models are already imported above
     # from app import models 
@@ -204,6 +216,18 @@ def create_app(config_class=None):
     # Initialize security middleware
     SecurityMiddleware(app)  # Initialize CSRF protection
 
+    # Per-request SQL counts, timings and N+1 detection (Server-Timing header, /monitoring)
+    QueryMonitor(app)
+    # Request rate, latency and DB time for /metrics (after QueryMonitor, see MetricsMiddleware)
+    MetricsMiddleware(app)
+    # Queue depth is counted in the queue tables whenever /metrics or /monitoring collects
+    from app.background_queue import queue_depths
+    JOB_QUEUE_DEPTH.set_function(lambda: {(queue,): depth for queue, depth in queue_depths().items()})
+    # Opt-in profiling of slow or admin-flagged requests (PROFILING_ENABLED)
+    RequestProfiler(app)
+    # static_url() and /static/dist/ for fingerprinted, precompressed assets (flask assets build)
+    StaticAssets(app)
+
     # TEMPORARY DEBUGGING for Stripe Webhook 403 - REMOVING THIS SECTION
     # from flask import request as flask_request 
     # @app.before_request
@@ -405,6 +429,26 @@ def create_app(config_class=None):
         
         return response
 
+    # Send queued email from a background thread of serving processes (EMAIL_OUTBOX_DISPATCHER_ENABLED)
+    if app.config.get('EMAIL_OUTBOX_DISPATCHER_ENABLED'):
+        from app.email_outbox import OutboxDispatcher
+        OutboxDispatcher(app)
+
+    # Apply stored Calendly webhook events from a background thread of serving processes (CALENDLY_INBOX_PROCESSOR_ENABLED)
+    if app.config.get('CALENDLY_INBOX_PROCESSOR_ENABLED'):
+        from app.calendly_webhooks import InboxProcessor
+        InboxProcessor(app)
+
+    # Optional: run due maintenance jobs from a background thread (MAINTENANCE_SCHEDULER_ENABLED)
+    if app.config.get('MAINTENANCE_SCHEDULER_ENABLED'):
+        from app.maintenance import MaintenanceScheduler
+        MaintenanceScheduler(app)
+
+    # Optional: compile templates and prime caches before serving (WARMUP_ON_START)
+    if app.config.get('WARMUP_ON_START'):
+        from app.warmup import warmup
+        warmup(app)
+
     return app
 
 # --- Helper function to replace get_locale_display_name ---
@@ -423,5 +467,17 @@ def get_locale_display_name(locale_identifier):
     return display_names.get(str(locale_identifier), str(locale_identifier))
 # ---------------------------------------------------------
 
-# Create the app instance
-app = create_app()
\ No newline at end of file
+# The app instance for `from app import app` and `gunicorn app:app`, created
+# on first use so that importing the package (CLI commands, scripts, tests
+# that build their own app) does not build one
+_app_lock = threading.Lock()
+
+def __getattr__(name):
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _app_lock:
+        if 'app' not in globals():
+            from app.background_queue import start_background_workers
+            globals()['app'] = create_app()
+            start_background_workers(globals()['app'])
+    return globals()['app']
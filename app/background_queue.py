@@ -0,0 +1,194 @@
+# app/background_queue.py
+"""
+Queue tables drained by background workers.
+
+The email outbox (app/email_outbox.py) and the Calendly webhook inbox
+(app/calendly_webhooks.py) are both tables of work items with a status,
+next_attempt_at, claimed_by and claimed_at. This module holds what they share:
+
+- claim_due() claims a batch of due rows with a conditional UPDATE, so any
+  number of workers can drain one table at once. Rows stuck in the working
+  status for longer than the claim timeout (a worker that died mid-batch)
+  are claimed again.
+- backoff() is the retry delay: doubling per attempt, capped.
+- QueueWorker runs a queue's drain on a daemon thread, when woken after new
+  rows are committed and every poll interval.
+- queue_depths() counts each queue's unfinished rows for the job_queue_depth
+  gauge. It is read from the tables when metrics are collected, so it is
+  right whichever process drains a queue (or none does).
+
+Workers only run in processes that serve requests. start_background_workers()
+starts them from the WSGI entry points (the lazily created `app.app` that
+gunicorn and WSGI files import, run.py, `flask run`) and again in each child
+after a fork (gunicorn --preload). Tests and other `flask` commands never
+start them: a command that queues work drains it before exiting, and
+`flask email worker` / `flask calendly worker` drain a queue in the
+foreground as a separate process.
+"""
+
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_, select, update
+
+from app import db
+
+MAX_BACKOFF_SECONDS = 6 * 3600
+
+
+def claim_due(model, working_status, batch_size, claim_timeout, now=None):
+    """
+    Claim up to batch_size due rows of model for this worker and mark them
+    working_status; returns them in queue order. Due rows are 'pending' ones
+    whose next_attempt_at has passed and rows claimed more than claim_timeout
+    seconds ago.
+    """
+    now = now or datetime.utcnow()
+    due = or_(
+        and_(model.status == 'pending', model.next_attempt_at <= now),
+        and_(model.status == working_status, model.claimed_at < now - timedelta(seconds=claim_timeout)),
+    )
+    ids = db.session.scalars(select(model.id).where(due).order_by(model.id).limit(batch_size)).all()
+    if not ids:
+        return []
+    claim = uuid.uuid4().hex
+    # Re-checking `due` makes the claim atomic: rows another worker took in between are skipped
+    db.session.execute(
+        update(model).where(model.id.in_(ids), due)
+        .values(status=working_status, claimed_by=claim, claimed_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return db.session.scalars(select(model).where(model.claimed_by == claim).order_by(model.id)).all()
+
+
+def backoff(base_seconds, attempts):
+    """Delay before retry number `attempts`: base_seconds doubling per attempt, at most six hours"""
+    return timedelta(seconds=min(base_seconds * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS))
+
+
+def queue_depths():
+    """{queue: rows pending or being worked on} for every queue table"""
+    from app.models import CalendlyWebhookEvent, EmailOutbox
+
+    queues = {'email_outbox': (EmailOutbox, 'sending'), 'calendly_inbox': (CalendlyWebhookEvent, 'processing')}
+    return {
+        name: db.session.scalar(select(func.count(model.id)).where(model.status.in_(('pending', working_status))))
+        for name, (model, working_status) in queues.items()
+    }
+
+
+def serving_process(app):
+    """Whether this process serves requests: not a test run and not a `flask` command other than `flask run`"""
+    if app.config.get('TESTING'):
+        return False
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        return sys.argv[1:2] == ['run']
+    return True
+
+
+def start_background_workers(app):
+    """Start the app's queue workers if this process serves requests; returns the started ones"""
+    if not serving_process(app):
+        return []
+    workers = [ext for ext in app.extensions.values() if isinstance(ext, QueueWorker)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+class QueueWorker:
+    """
+    Daemon thread that drains one queue. Subclasses set `extension` (the
+    app.extensions key), `poll_setting` (config key of the poll interval in
+    seconds) and implement process(), which drains the queue once inside an
+    app context and returns counts.
+    """
+
+    extension = None
+    poll_setting = None
+    default_poll = 30
+
+    def __init__(self, app=None):
+        self.app = None
+        self._reset()
+        if app is not None:
+            self.init_app(app)
+
+    def _reset(self):
+        self._thread = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._forks_handled = False
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions[self.extension] = self
+
+    def process(self):
+        raise NotImplementedError
+
+    @property
+    def poll(self):
+        return self.app.config.get(self.poll_setting, self.default_poll)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name=self.extension, daemon=True)
+            self._thread.start()
+            if not self._forks_handled and hasattr(os, 'register_at_fork'):
+                # Threads do not survive fork(): restart in each forked worker
+                os.register_at_fork(after_in_child=self._after_fork)
+                self._forks_handled = True
+
+    def _after_fork(self):
+        was_running = self._thread is not None
+        forks_handled = self._forks_handled
+        self._reset()
+        self._forks_handled = forks_handled
+        if was_running:
+            self.start()
+
+    def wake(self):
+        """Drain soon; a no-op where the worker is not running (the queue is drained elsewhere)"""
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def drain(self):
+        """Drain the queue once; returns the counts (empty if the queue could not be read)"""
+        with self.app.app_context():
+            try:
+                return self.process()
+            except Exception as e:
+                self.app.logger.warning(f"{self.extension} could not drain its queue: {e}")
+                return {}
+            finally:
+                db.session.remove()
+
+    def run_forever(self, poll=None):
+        """Drain in the foreground every poll seconds (the dedicated worker commands)"""
+        poll = poll or self.poll
+        while not self._stop.is_set():
+            self.drain()
+            time.sleep(poll)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            self.drain()
+            self._wake.wait(self.poll)
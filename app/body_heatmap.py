@@ -0,0 +1,195 @@
+# app/body_heatmap.py
+"""
+Body-chart heatmaps.
+
+Bins trigger points on the body chart's coordinate space (the 500x800 SVG
+viewBox points are placed in) into a grid with numpy.histogram2d, weighted by
+intensity. Points can be limited to one patient or to the user's whole
+caseload, and filtered by muscle, point type, treatment date range and ICD-10
+diagnosis (a code or a prefix such as "M54").
+
+Only the three numeric columns are read, straight into arrays. Results are
+cached per (database, scope, filters, grid size) and validated with a stamp
+(number of points, highest point id and latest treatment update in scope, plus
+the diagnoses when filtering by ICD-10), so added, removed or re-dated points
+show up on the next request, whichever worker made the change.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import datetime, time
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import exists, func, select
+
+from app import db
+from app.metrics import record_cache
+from app.models import Treatment, TriggerPoint
+from app.models_icd10 import ICD10Code, PatientDiagnosis
+from app.patient_access import accessible_patient_ids_query
+
+CHART_WIDTH = 500
+CHART_HEIGHT = 800
+DEFAULT_BINS_X = 50
+DEFAULT_BINS_Y = 80
+MAX_BINS_X = CHART_WIDTH
+MAX_BINS_Y = CHART_HEIGHT
+
+FILTER_NAMES = ('muscle', 'type', 'start', 'end', 'icd10')
+
+
+def parse_filters(args):
+    """Filters from request args; dates are YYYY-MM-DD. Raises ValueError for bad dates."""
+    filters = {}
+    for name in FILTER_NAMES:
+        value = (args.get(name) or '').strip()
+        if not value:
+            continue
+        if name in ('start', 'end'):
+            day = datetime.strptime(value, '%Y-%m-%d').date()
+            value = datetime.combine(day, time.min if name == 'start' else time.max)
+        elif name == 'icd10':
+            value = value.upper()
+        filters[name] = value
+    return filters
+
+
+def _grid_size(bins_x, bins_y):
+    bins_x = max(1, min(int(bins_x or DEFAULT_BINS_X), MAX_BINS_X))
+    bins_y = max(1, min(int(bins_y or DEFAULT_BINS_Y), MAX_BINS_Y))
+    return bins_x, bins_y
+
+
+def _conditions(scope, filters):
+    if scope[0] == 'patient':
+        conditions = [Treatment.patient_id == scope[1]]
+    else:
+        conditions = [Treatment.patient_id.in_(scope[1])]
+    if 'muscle' in filters:
+        conditions.append(func.lower(TriggerPoint.muscle) == filters['muscle'].lower())
+    if 'type' in filters:
+        conditions.append(TriggerPoint.type == filters['type'])
+    if 'start' in filters:
+        conditions.append(Treatment.created_at >= filters['start'])
+    if 'end' in filters:
+        conditions.append(Treatment.created_at <= filters['end'])
+    if 'icd10' in filters:
+        conditions.append(exists().where(
+            PatientDiagnosis.patient_id == Treatment.patient_id,
+            PatientDiagnosis.icd10_code_id == ICD10Code.id,
+            ICD10Code.code.like(filters['icd10'] + '%'),
+        ))
+    return conditions
+
+
+def _points_query(scope, filters):
+    return select(TriggerPoint.location_x, TriggerPoint.location_y, TriggerPoint.intensity).join(
+        Treatment, Treatment.id == TriggerPoint.treatment_id
+    ).where(*_conditions(scope, filters))
+
+
+def _stamp(scope, filters):
+    """Cheap aggregate that changes whenever the heatmap could"""
+    unfiltered = {k: v for k, v in filters.items() if k != 'icd10'}
+    stamp = tuple(db.session.execute(
+        select(func.count(TriggerPoint.id), func.max(TriggerPoint.id), func.max(Treatment.updated_at))
+        .join(Treatment, Treatment.id == TriggerPoint.treatment_id)
+        .where(*_conditions(scope, unfiltered))
+    ).one())
+    if 'icd10' in filters:
+        patients = (PatientDiagnosis.patient_id == scope[1] if scope[0] == 'patient'
+                    else PatientDiagnosis.patient_id.in_(scope[1]))
+        stamp += tuple(db.session.execute(
+            select(func.count(PatientDiagnosis.id), func.max(PatientDiagnosis.id)).where(patients)
+        ).one())
+    return stamp
+
+
+def compute_heatmap(scope, filters, bins_x=DEFAULT_BINS_X, bins_y=DEFAULT_BINS_Y):
+    """Histogram of the scope's trigger points; rows run top to bottom of the chart"""
+    rows = db.session.execute(_points_query(scope, filters)).all()
+    points = np.array(rows, dtype=float).reshape(-1, 3)
+    x, y, intensity = points[:, 0], points[:, 1], points[:, 2]
+    # Points without a recorded intensity count once
+    weights = np.where(np.isnan(intensity), 1.0, intensity)
+    grid, _, _ = np.histogram2d(y, x, bins=(bins_y, bins_x),
+                                range=((0, CHART_HEIGHT), (0, CHART_WIDTH)), weights=weights)
+    inside = (x >= 0) & (x <= CHART_WIDTH) & (y >= 0) & (y <= CHART_HEIGHT)
+    return {
+        'width': CHART_WIDTH,
+        'height': CHART_HEIGHT,
+        'bins_x': bins_x,
+        'bins_y': bins_y,
+        'cell_width': CHART_WIDTH / bins_x,
+        'cell_height': CHART_HEIGHT / bins_y,
+        'points': int(inside.sum()),
+        'outside_chart': int(len(points) - inside.sum()),
+        'max': float(grid.max()) if grid.size else 0.0,
+        'total': float(grid.sum()),
+        'grid': grid.round(3).tolist(),
+    }
+
+
+class HeatmapCache:
+    """Small LRU of computed heatmaps, each stored with the stamp it was built at"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key, stamp):
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None or cached[0] != stamp:
+                return None
+            self._entries.move_to_end(key)
+            return cached[1]
+
+    def put(self, key, stamp, heatmap, max_entries):
+        with self._lock:
+            self._entries[key] = (stamp, heatmap)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+heatmap_cache = HeatmapCache()
+
+
+def _cache_scope(scope, user):
+    # The caseload subquery object differs per call; the user identifies it
+    return scope if scope[0] == 'patient' else ('caseload', user.id)
+
+
+def body_heatmap(user, patient_id=None, filters=None, bins_x=None, bins_y=None):
+    """
+    Heatmap of one patient's trigger points, or of every patient the user can
+    access when patient_id is None. The caller checks access to patient_id.
+    """
+    filters = filters or {}
+    bins_x, bins_y = _grid_size(bins_x, bins_y)
+    if patient_id is not None:
+        scope = ('patient', int(patient_id))
+    else:
+        scope = ('caseload', accessible_patient_ids_query(user))
+
+    config = current_app.config
+    if not config.get('BODY_HEATMAP_CACHE_ENABLED', True):
+        return compute_heatmap(scope, filters, bins_x, bins_y)
+
+    key = (str(db.engine.url), _cache_scope(scope, user), tuple(sorted(filters.items())), bins_x, bins_y)
+    stamp = _stamp(scope, filters)
+    heatmap = heatmap_cache.get(key, stamp)
+    record_cache('body_heatmap', heatmap is not None)
+    if heatmap is None:
+        heatmap = compute_heatmap(scope, filters, bins_x, bins_y)
+        heatmap_cache.put(key, stamp, heatmap, config.get('BODY_HEATMAP_CACHE_SIZE', 256))
+    return heatmap
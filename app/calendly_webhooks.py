@@ -0,0 +1,258 @@
+# app/calendly_webhooks.py
+"""
+Calendly webhook inbox.
+
+Bookings used to arrive only by polling: sync_calendly_for_user() listed the
+next 90 days of events and their invitees on every dashboard view. Calendly
+now pushes `invitee.created` and `invitee.canceled` to /webhooks/calendly:
+
+- The request is verified against CALENDLY_WEBHOOK_SIGNING_KEY (the
+  Calendly-Webhook-Signature header is `t=<unix time>,v1=<hex HMAC-SHA256 of
+  "<t>.<body>">`) and rejected when the timestamp is more than
+  CALENDLY_WEBHOOK_TOLERANCE_SECONDS old.
+- The raw body is stored, encrypted, in calendly_webhook_event under the key
+  '<event>:<invitee uri>' and answered with 200 at once. Calendly retries
+  deliveries, so a key that is already stored is acknowledged and dropped.
+- process_pending() applies stored events off the request thread, through
+  the same matching rules as the polling sync (ingest_calendly_invitee() and
+  cancel_calendly_invitee() in app.utils). Events are claimed like outbox
+  email (app/background_queue.py), so several processors can run at once;
+  failures are retried with backoff up to CALENDLY_INBOX_MAX_ATTEMPTS. It
+  runs on an InboxProcessor thread of each serving process, woken by new
+  deliveries, or as `flask calendly worker`.
+
+subscribe() (`flask calendly subscribe`) creates a user's subscription and
+records it. For users with a recorded subscription, polling remains as a
+reconciliation pass every CALENDLY_RECONCILE_HOURS (app.utils.
+calendly_reconcile_due()) to pick up missed deliveries; everyone else is
+still polled on every view.
+"""
+
+import hashlib
+import hmac
+import json
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.metrics import track_external
+from app.background_queue import QueueWorker, backoff, claim_due
+from app.models import CalendlyWebhookEvent, User
+from app.utils import calendly_time, cancel_calendly_invitee, ingest_calendly_invitee
+
+SIGNATURE_HEADER = 'Calendly-Webhook-Signature'
+EVENTS = ('invitee.created', 'invitee.canceled')
+
+
+class SignatureError(ValueError):
+    """Missing, malformed, wrong or expired Calendly-Webhook-Signature"""
+
+
+def sign(body, signing_key, timestamp=None):
+    """Signature header for body, as Calendly computes it"""
+    timestamp = int(timestamp if timestamp is not None else time.time())
+    digest = hmac.new(signing_key.encode(), f'{timestamp}.'.encode() + body, hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={digest}'
+
+
+def verify_signature(body, header, signing_key, tolerance=180, now=None):
+    """Raise SignatureError unless header signs body with signing_key within tolerance seconds"""
+    if not header:
+        raise SignatureError('Missing signature header')
+    try:
+        parts = dict(item.strip().split('=', 1) for item in header.split(','))
+        timestamp, signature = int(parts['t']), parts['v1']
+    except (KeyError, ValueError):
+        raise SignatureError('Malformed signature header')
+    expected = sign(body, signing_key, timestamp).split('v1=', 1)[1]
+    if not hmac.compare_digest(expected, signature):
+        raise SignatureError('Signature mismatch')
+    if abs((now if now is not None else time.time()) - timestamp) > tolerance:
+        raise SignatureError('Signature timestamp outside the tolerance')
+
+
+def _owner(payload, created_by):
+    """Id of the user whose Calendly event this is, from the event's hosts (or the webhook's creator)"""
+    scheduled_event = payload.get('scheduled_event') or {}
+    uris = [membership.get('user') for membership in scheduled_event.get('event_memberships', [])]
+    uris = [uri for uri in uris + [created_by] if uri]
+    if not uris:
+        return None
+    return db.session.scalar(select(User.id).where(User.calendly_user_uri.in_(uris)).order_by(User.id).limit(1))
+
+
+def receive_event(body):
+    """
+    Store a verified delivery. Returns (row, stored): row is None for events
+    the app does not handle, stored is False for redeliveries. Raises
+    ValueError for a body that is not a Calendly invitee event.
+    """
+    data = json.loads(body)
+    event_type = data.get('event')
+    if event_type not in EVENTS:
+        return None, False
+    payload = data['payload']
+    invitee_uri = payload['uri']
+    key = f'{event_type}:{invitee_uri}'
+
+    existing = db.session.scalar(select(CalendlyWebhookEvent).where(CalendlyWebhookEvent.idempotency_key == key))
+    if existing is not None:
+        return existing, False
+    row = CalendlyWebhookEvent(
+        idempotency_key=key,
+        event_type=event_type,
+        invitee_uuid=invitee_uri.rstrip('/').split('/')[-1],
+        user_id=_owner(payload, data.get('created_by')),
+        status='pending',
+        attempts=0,
+        next_attempt_at=datetime.utcnow(),
+    )
+    row.payload = body.decode() if isinstance(body, bytes) else body
+    db.session.add(row)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # The same delivery arrived concurrently
+        db.session.rollback()
+        return db.session.scalar(select(CalendlyWebhookEvent).where(CalendlyWebhookEvent.idempotency_key == key)), False
+    return row, True
+
+
+def subscribe(user, callback_url):
+    """
+    Create a user-scoped Calendly webhook subscription delivering EVENTS to
+    callback_url, signed with CALENDLY_WEBHOOK_SIGNING_KEY, and record its
+    URI on the user; the caller commits. Raises RuntimeError when Calendly
+    refuses it.
+    """
+    import requests
+
+    signing_key = current_app.config.get('CALENDLY_WEBHOOK_SIGNING_KEY')
+    if not signing_key:
+        raise RuntimeError('CALENDLY_WEBHOOK_SIGNING_KEY is not set')
+    headers = {
+        'Authorization': f'Bearer {user.calendly_api_token}',
+        'Content-Type': 'application/json',
+        'User-Agent': 'PhysioTracker/1.0'
+    }
+    with track_external('calendly'):
+        response = requests.get(user.calendly_user_uri, headers=headers, timeout=30)
+    if response.status_code != 200:
+        raise RuntimeError(f'Could not read the Calendly user: {response.status_code} {response.text}')
+    subscription = {
+        'url': callback_url,
+        'events': list(EVENTS),
+        'organization': response.json()['resource']['current_organization'],
+        'user': user.calendly_user_uri,
+        'scope': 'user',
+        'signing_key': signing_key,
+    }
+    with track_external('calendly'):
+        response = requests.post('https://api.calendly.com/webhook_subscriptions', headers=headers,
+                                 json=subscription, timeout=30)
+    if response.status_code != 201:
+        raise RuntimeError(f'Calendly refused the subscription: {response.status_code} {response.text}')
+    user.calendly_webhook_subscription = response.json()['resource']['uri']
+    return user.calendly_webhook_subscription
+
+
+def wake_processor():
+    processor = current_app.extensions.get('calendly_inbox')
+    if processor is not None:
+        processor.wake()
+
+
+def retry_delay(attempts):
+    return backoff(current_app.config.get('CALENDLY_INBOX_RETRY_SECONDS', 60), attempts)
+
+
+def claim_batch(batch_size, now=None):
+    """Claim up to batch_size due events for this processor; returns them in arrival order"""
+    timeout = current_app.config.get('CALENDLY_INBOX_CLAIM_TIMEOUT', 300)
+    return claim_due(CalendlyWebhookEvent, 'processing', batch_size, timeout, now)
+
+
+def apply_event(row):
+    """Apply one stored event; returns 'processed' or 'ignored'. The caller commits."""
+    user = db.session.get(User, row.user_id) if row.user_id else None
+    if user is None or not user.calendly_enabled:
+        return 'ignored'
+    payload = json.loads(row.payload)['payload']
+
+    if row.event_type == 'invitee.canceled':
+        cancel_calendly_invitee(user, row.invitee_uuid)
+        return 'processed'
+
+    # A cancellation that overtook its booking: nothing to create
+    canceled = db.session.scalar(select(CalendlyWebhookEvent.id).where(
+        CalendlyWebhookEvent.idempotency_key == f"invitee.canceled:{payload['uri']}"))
+    if canceled is not None or payload.get('status') == 'canceled':
+        return 'ignored'
+    scheduled_event = payload['scheduled_event']
+    result = ingest_calendly_invitee(
+        user, row.invitee_uuid, payload['name'], payload['email'],
+        calendly_time(scheduled_event['start_time']), scheduled_event.get('name') or 'Calendly Booking'
+    )
+    return 'processed' if result else 'ignored'
+
+
+def process_pending(batch_size=None, max_batches=None):
+    """Apply due inbox events batch by batch; returns {'processed', 'ignored', 'retried', 'failed'} counts"""
+    config = current_app.config
+    batch_size = batch_size or config.get('CALENDLY_INBOX_BATCH_SIZE', 50)
+    max_attempts = config.get('CALENDLY_INBOX_MAX_ATTEMPTS', 5)
+    counts = {'processed': 0, 'ignored': 0, 'retried': 0, 'failed': 0}
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = [row.id for row in claim_batch(batch_size)]
+        if not ids:
+            break
+        batches += 1
+        for row_id in ids:
+            error = None
+            try:
+                # Each event commits on its own, so one bad event does not undo the batch
+                status = apply_event(db.session.get(CalendlyWebhookEvent, row_id))
+            except Exception as e:
+                db.session.rollback()
+                error = e
+            row = db.session.get(CalendlyWebhookEvent, row_id)
+            row.attempts += 1
+            row.claimed_by = None
+            if error is not None:
+                row.last_error = f'{type(error).__name__}: {error}'[:1000]
+                if row.attempts >= max_attempts:
+                    row.status = 'failed'
+                    counts['failed'] += 1
+                    current_app.logger.error(f"Giving up on Calendly webhook event {row_id}: {error}")
+                else:
+                    row.status = 'pending'
+                    row.next_attempt_at = datetime.utcnow() + retry_delay(row.attempts)
+                    counts['retried'] += 1
+                    current_app.logger.warning(f"Calendly webhook event {row_id} failed, retrying: {error}")
+            else:
+                row.status = status
+                row.processed_at = datetime.utcnow()
+                row.last_error = None
+                counts[status] += 1
+            db.session.commit()
+    if any(counts.values()):
+        current_app.logger.info(
+            "Calendly inbox: %(processed)s processed, %(ignored)s ignored, %(retried)s to retry, %(failed)s failed",
+            counts)
+    return counts
+
+
+class InboxProcessor(QueueWorker):
+    """Background thread that applies webhook events after they are stored, and on a timer"""
+
+    extension = 'calendly_inbox'
+    poll_setting = 'CALENDLY_INBOX_POLL_SECONDS'
+    default_poll = 60
+
+    def process(self):
+        return process_pending()
@@ -9,6 +9,15 @@ from app.models import RecurringAppointment, Treatment, Patient
 # Import the helper function from main routes
 # from app.routes.main import generate_scheduled_treatments
 
+def _send_queued_email():
+    """Send the email a command queued before it exits (no dispatcher thread runs in CLI processes)."""
+    from app.email_outbox import dispatch_pending
+    try:
+        counts = dispatch_pending()
+        click.echo(f"Email outbox: {counts['sent']} sent, {counts['retried']} to retry, {counts['failed']} failed.")
+    except Exception as e:
+        click.echo(f"Error sending queued email: {str(e)}")
+
 def register_commands(app):
     @app.cli.command('update-treatment-statuses')
     @with_appcontext
@@ -34,14 +43,24 @@ def register_commands(app):
             click.echo("Trial reminder emails sent successfully.")
         except Exception as e:
             click.echo(f"Error sending trial reminders: {str(e)}")
+        _send_queued_email()
     
-    @app.cli.command('maintenance')
+    @app.cli.group('maintenance', invoke_without_command=True)
     @with_appcontext
-    def run_maintenance():
-        """Run all maintenance tasks."""
-        treatment_count = mark_past_treatments_as_completed()
-        patient_count = mark_inactive_patients()
-        
+    @click.pass_context
+    def maintenance(ctx):
+        """Run all maintenance tasks, or manage maintenance jobs."""
+        if ctx.invoked_subcommand is not None:
+            return
+        from app.maintenance import JOBS, run_job
+
+        counts = {}
+        for name in JOBS:
+            run = run_job(name)
+            counts[name] = run.rows_affected or 0
+            if run.status == 'failed':
+                click.echo(f"Error running {name}: {run.error}")
+
         # Send trial reminders
         try:
             from app.email_utils import send_trial_reminder_emails
@@ -49,8 +68,331 @@ def register_commands(app):
             click.echo("Trial reminder emails sent.")
         except Exception as e:
             click.echo(f"Error sending trial reminders: {str(e)}")
-        
-        click.echo(f"Maintenance complete: {treatment_count} treatments updated, {patient_count} patients marked inactive.")
+        _send_queued_email()
+
+        click.echo(f"Maintenance complete: {counts['complete-past-treatments']} treatments updated, "
+                   f"{counts['mark-inactive-patients']} patients marked inactive.")
+
+    @maintenance.command('run')
+    @click.argument('jobs', nargs=-1)
+    @click.option('--due', is_flag=True, help='Only jobs whose interval has passed since their last run')
+    @click.option('--chunk-size', default=None, type=int, help='Rows per primary-key range (default: MAINTENANCE_CHUNK_SIZE)')
+    @with_appcontext
+    def maintenance_run(jobs, due, chunk_size):
+        """Run maintenance jobs (default: all) and record each run."""
+        from app.maintenance import JOBS, due_jobs, run_job
+
+        unknown = [name for name in jobs if name not in JOBS]
+        if unknown:
+            raise click.BadParameter(f"Unknown job(s): {', '.join(unknown)}. Jobs: {', '.join(JOBS)}")
+        names = list(jobs or JOBS)
+        if due:
+            pending = due_jobs()
+            names = [name for name in names if name in pending]
+        if not names:
+            click.echo('No jobs due.')
+            return
+        failed = False
+        for name in names:
+            run = run_job(name, chunk_size=chunk_size)
+            if run.status == 'failed':
+                failed = True
+                click.echo(f"{name}: failed after {run.duration_ms} ms: {run.error}")
+            else:
+                click.echo(f"{name}: {run.rows_affected} rows in {run.chunks} chunks, {run.duration_ms} ms")
+        if failed:
+            raise SystemExit(1)
+
+    @maintenance.command('status')
+    @with_appcontext
+    def maintenance_status():
+        """Show each job's interval and last run."""
+        from app.maintenance import JOBS, last_runs
+
+        runs = last_runs()
+        for name, job in JOBS.items():
+            run = runs.get(name)
+            last = (f"last run {run.started_at:%Y-%m-%d %H:%M:%S} UTC, {run.status}, {run.rows_affected} rows"
+                    if run else 'never run')
+            click.echo(f"{name} (every {job.interval}): {last}")
+            click.echo(f"    {job.description}")
+
+    @app.cli.group('email')
+    def email():
+        """Email outbox."""
+
+    @email.command('dispatch')
+    @click.option('--batch-size', default=None, type=int, help='Messages per batch (default: EMAIL_OUTBOX_BATCH_SIZE)')
+    @with_appcontext
+    def email_dispatch(batch_size):
+        """Send every due message in the outbox once."""
+        from app.email_outbox import dispatch_pending
+
+        counts = dispatch_pending(batch_size=batch_size)
+        click.echo(f"{counts['sent']} sent, {counts['retried']} to retry, {counts['failed']} failed.")
+
+    @email.command('worker')
+    @click.option('--poll', default=None, type=float, help='Seconds between drains (default: EMAIL_OUTBOX_POLL_SECONDS)')
+    @with_appcontext
+    def email_worker(poll):
+        """Drain the outbox continuously (the production email sender)."""
+        from flask import current_app
+        from app.email_outbox import OutboxDispatcher
+
+        worker = OutboxDispatcher(current_app._get_current_object())
+        click.echo(f"Email worker started, polling every {poll or worker.poll}s.")
+        worker.run_forever(poll)
+
+    @email.command('status')
+    @with_appcontext
+    def email_status():
+        """Show outbox message counts by status."""
+        from sqlalchemy import func
+        from app.models import EmailOutbox
+
+        counts = dict(db.session.query(EmailOutbox.status, func.count(EmailOutbox.id)).group_by(EmailOutbox.status).all())
+        for status in ('pending', 'sending', 'sent', 'failed'):
+            click.echo(f"{status}: {counts.get(status, 0)}")
+
+    @app.cli.group('calendly')
+    def calendly():
+        """Calendly webhook inbox and reconciliation."""
+
+    @calendly.command('process')
+    @click.option('--batch-size', default=None, type=int, help='Events per batch (default: CALENDLY_INBOX_BATCH_SIZE)')
+    @with_appcontext
+    def calendly_process(batch_size):
+        """Apply every due webhook event in the inbox once."""
+        from app.calendly_webhooks import process_pending
+
+        counts = process_pending(batch_size=batch_size)
+        click.echo(f"{counts['processed']} processed, {counts['ignored']} ignored, "
+                   f"{counts['retried']} to retry, {counts['failed']} failed.")
+
+    @calendly.command('worker')
+    @click.option('--poll', default=None, type=float, help='Seconds between drains (default: CALENDLY_INBOX_POLL_SECONDS)')
+    @with_appcontext
+    def calendly_worker(poll):
+        """Apply webhook events continuously (use with CALENDLY_INBOX_PROCESSOR_ENABLED=false)."""
+        from flask import current_app
+        from app.calendly_webhooks import InboxProcessor
+
+        worker = InboxProcessor(current_app._get_current_object())
+        click.echo(f"Calendly worker started, polling every {poll or worker.poll}s.")
+        worker.run_forever(poll)
+
+    @calendly.command('subscribe')
+    @click.argument('callback_url')
+    @click.option('--user-id', default=None, type=int, help='Subscribe one user (default: every Calendly user without one)')
+    @with_appcontext
+    def calendly_subscribe(callback_url, user_id):
+        """Subscribe users' Calendly accounts to CALLBACK_URL (https://<host>/webhooks/calendly)."""
+        from app.models import User
+        from app.calendly_webhooks import subscribe
+
+        query = User.query.filter_by(calendly_enabled=True)
+        query = query.filter_by(id=user_id) if user_id else query.filter(User.calendly_webhook_subscription.is_(None))
+        for user in query.order_by(User.id).all():
+            if not user.calendly_configured_and_enabled:
+                continue
+            try:
+                click.echo(f"User {user.id}: subscribed as {subscribe(user, callback_url)}")
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                click.echo(f"User {user.id}: {str(e)}")
+
+    @calendly.command('reconcile')
+    @click.option('--all', 'all_users', is_flag=True, help='Poll every user, not only those due')
+    @with_appcontext
+    def calendly_reconcile(all_users):
+        """Poll Calendly for users whose reconciliation is due (CALENDLY_RECONCILE_HOURS)."""
+        from app.models import User
+        from app.utils import calendly_reconcile_due, sync_calendly_for_user
+
+        users = User.query.filter_by(calendly_enabled=True).order_by(User.id).all()
+        for user in users:
+            if not user.calendly_configured_and_enabled or not (all_users or calendly_reconcile_due(user)):
+                continue
+            result = sync_calendly_for_user(user)
+            click.echo(f"User {user.id}: {result['new_treatments']} treatments, "
+                       f"{result['new_unmatched_bookings']} bookings for review.")
+
+    @calendly.command('status')
+    @with_appcontext
+    def calendly_status():
+        """Show webhook inbox event counts by status."""
+        from sqlalchemy import func
+        from app.models import CalendlyWebhookEvent
+
+        counts = dict(db.session.query(CalendlyWebhookEvent.status, func.count(CalendlyWebhookEvent.id))
+                      .group_by(CalendlyWebhookEvent.status).all())
+        for status in ('pending', 'processing', 'processed', 'ignored', 'failed'):
+            click.echo(f"{status}: {counts.get(status, 0)}")
+
+    @app.cli.group('crypto')
+    def crypto():
+        """Encryption key management."""
+
+    @crypto.command('rotate')
+    @click.option('--new-key', envvar='FERNET_SECRET_KEY', required=True,
+                  help='New Fernet key (default: FERNET_SECRET_KEY)')
+    @click.option('--old-keys', envvar='FERNET_OLD_KEYS', default='',
+                  help='Comma-separated previous keys (default: FERNET_OLD_KEYS)')
+    @click.option('--workers', default=None, type=int, help='Worker processes (default: CPU count)')
+    @click.option('--batch-size', default=500, help='Rows per primary-key range (default: 500)')
+    @click.option('--checkpoint', default=None,
+                  help='Checkpoint file (default: instance/key_rotation_checkpoint.json)')
+    @click.option('--table', 'tables', multiple=True, help='Only rotate this table (repeatable)')
+    @click.option('--restart', is_flag=True, help='Ignore any existing checkpoint and start over')
+    @with_appcontext
+    def crypto_rotate(new_key, old_keys, workers, batch_size, checkpoint, tables, restart):
+        """Re-encrypt all encrypted columns from the old keys to the new key."""
+        import os
+        from flask import current_app
+        from app.key_rotation import rotate_encrypted_columns, RotationCheckpoint
+
+        if not old_keys:
+            click.echo('No old keys given (--old-keys / FERNET_OLD_KEYS); values will be re-encrypted with the same key.')
+
+        checkpoint = checkpoint or os.path.join(current_app.root_path, '..', 'instance', 'key_rotation_checkpoint.json')
+        if restart:
+            RotationCheckpoint(checkpoint, new_key).clear()
+
+        def progress(table_name, lo, hi, scanned, rotated):
+            click.echo(f'  {table_name} [{lo}, {hi}): {rotated}/{scanned} rows rotated')
+
+        stats = rotate_encrypted_columns(
+            current_app.config['SQLALCHEMY_DATABASE_URI'],
+            new_key,
+            old_keys,
+            workers=workers,
+            batch_size=batch_size,
+            checkpoint_path=checkpoint,
+            tables=list(tables) or None,
+            progress=progress,
+        )
+        click.echo(
+            f"Rotation complete: {stats['rows_rotated']} of {stats['rows_scanned']} rows re-encrypted "
+            f"({stats['ranges_processed']} ranges, {stats['ranges_skipped']} already done) "
+            f"in {stats['elapsed_seconds']:.1f}s - {stats['rows_per_second']:.0f} rows/s"
+        )
+        click.echo('Remove the old keys from FERNET_OLD_KEYS once you have verified the data.')
+
+    @crypto.command('benchmark')
+    @click.option('--rows', default=10000, help='Synthetic rows to rotate (default: 10000)')
+    @click.option('--workers', default=None, type=int, help='Worker processes (default: CPU count)')
+    @click.option('--batch-size', default=500, help='Rows per primary-key range (default: 500)')
+    def crypto_benchmark(rows, workers, batch_size):
+        """Measure key rotation throughput on a temporary SQLite database."""
+        from app.key_rotation import benchmark_rotation
+
+        stats = benchmark_rotation(rows=rows, workers=workers, batch_size=batch_size)
+        click.echo(
+            f"Rotated {stats['rows_rotated']} rows in {stats['elapsed_seconds']:.2f}s "
+            f"({stats['rows_per_second']:.0f} rows/s, workers={workers or 'auto'}, batch={batch_size})"
+        )
+
+    @app.cli.group('bench')
+    def bench():
+        """Benchmark data and tooling."""
+
+    @bench.command('seed')
+    @click.option('--users', default=2, help='Practitioners to create (default: 2)')
+    @click.option('--patients', default=50, help='Patients per practitioner (default: 50)')
+    @click.option('--treatments', default=10, help='Treatments per patient (default: 10)')
+    @click.option('--recurring', default=5, help='Recurring rules per practitioner (default: 5)')
+    @click.option('--clinics', default=0, help='Clinics to spread practitioners over (default: 0)')
+    @click.option('--seed', 'random_seed', default=42, help='Random seed (default: 42)')
+    @click.option('--password', default='benchmark', help='Password for the generated practitioners')
+    @with_appcontext
+    def bench_seed(users, patients, treatments, recurring, clinics, random_seed, password):
+        """Create a reproducible synthetic practice for benchmarking."""
+        from app.synthetic_data import seed_synthetic_practice
+
+        created = seed_synthetic_practice(
+            users=users, patients=patients, treatments=treatments, recurring=recurring,
+            clinics=clinics, seed=random_seed, password=password
+        )
+        click.echo(
+            f"Created {len(created['users'])} practitioners, {created['clinics']} clinics, "
+            f"{created['patients']} patients, {created['treatments']} treatments, "
+            f"{created['trigger_points']} trigger points, {created['recurring']} recurring rules, "
+            f"{created['diagnoses']} diagnoses."
+        )
+        for email in created['users']:
+            click.echo(f'  - {email} / {password}')
+
+    @app.cli.group('trigger-points')
+    def trigger_points():
+        """Body-chart trigger point maintenance."""
+
+    @trigger_points.command('layout')
+    @click.option('--treatment', 'treatment_ids', multiple=True, type=int,
+                  help='Only this treatment (repeatable; default: all with trigger points)')
+    @click.option('--min-distance', default=None, type=float,
+                  help='Minimum distance between points (default: TRIGGER_POINT_MIN_DISTANCE)')
+    @click.option('--batch-size', default=500, help='Treatments per transaction (default: 500)')
+    @click.option('--dry-run', is_flag=True, help='Report what would move without saving')
+    @with_appcontext
+    def trigger_points_layout(treatment_ids, min_distance, batch_size, dry_run):
+        """Push overlapping trigger points apart on stored body charts."""
+        from flask import current_app
+        from app.point_layout import layout_treatments, MIN_DISTANCE
+
+        if min_distance is None:
+            min_distance = current_app.config.get('TRIGGER_POINT_MIN_DISTANCE', MIN_DISTANCE)
+
+        def progress(done, stats):
+            click.echo(f"  {done}/{stats['treatments']} treatments, {stats['points_moved']} points moved")
+
+        stats = layout_treatments(list(treatment_ids) or None, min_distance=min_distance,
+                                  batch_size=batch_size, dry_run=dry_run, progress=progress)
+        verb = 'would move' if dry_run else 'moved'
+        click.echo(f"Layout complete: {verb} {stats['points_moved']} points in "
+                   f"{stats['changed']} of {stats['treatments']} treatments.")
+
+    @app.cli.group('assets')
+    def assets():
+        """Static asset pipeline."""
+
+    @assets.command('build')
+    @click.option('--no-minify', is_flag=True, help='Copy JS and CSS without minifying')
+    @click.option('--no-compress', is_flag=True, help='Skip the gzip and brotli variants')
+    @click.option('--clean', is_flag=True, help='Remove previously built files first')
+    @with_appcontext
+    def assets_build(no_minify, no_compress, clean):
+        """Minify, fingerprint and precompress app/static into STATIC_ASSETS_DIR."""
+        from flask import current_app
+        from app.static_assets import build_assets
+
+        static_assets = current_app.extensions['static_assets']
+        manifest = build_assets(current_app.static_folder, static_assets.output_dir,
+                                minify=not no_minify, compress=not no_compress, clean=clean)
+        total = sum(entry['size'] for entry in manifest.values())
+        compressed = sum(1 for entry in manifest.values() if entry['encodings'])
+        click.echo(f"Built {len(manifest)} assets ({total / 1024:.0f} KiB, {compressed} precompressed) "
+                   f"into {static_assets.output_dir}")
+
+    @app.cli.group('replica')
+    def replica():
+        """Read replica management."""
+
+    @replica.command('snapshot')
+    @with_appcontext
+    def replica_snapshot():
+        """Refresh a SQLite read replica file from the primary database."""
+        from flask import current_app
+        from app.db_routing import snapshot_sqlite
+
+        replica_url = current_app.config.get('DATABASE_REPLICA_URL')
+        if not replica_url:
+            raise click.ClickException('DATABASE_REPLICA_URL is not set.')
+        try:
+            pages = snapshot_sqlite(current_app.config['SQLALCHEMY_DATABASE_URI'], replica_url)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f'Replica snapshot written ({pages} pages) to {replica_url}')
 
     @click.command('create-admin')
     @with_appcontext
@@ -242,9 +584,22 @@ def register_commands(app):
     #     else:
     #         click.echo("An error occurred during generation.")
 
+    @click.command('warmup')
+    def warmup_command():
+        """Compile templates and prime caches, reporting how long it takes."""
+        from flask import current_app
+        from app.warmup import warmup
+
+        summary = warmup(current_app._get_current_object())
+        click.echo(f"Compiled {summary['templates']} templates, primed: "
+                   f"{', '.join(summary['caches']) or 'none'} in {summary['seconds']}s")
+        for name in summary['failed_templates']:
+            click.echo(f'  failed: {name}')
+
     app.cli.add_command(create_admin)
     app.cli.add_command(create_user_command)
     app.cli.add_command(create_trial_subscriptions_command)
     app.cli.add_command(list_users_command)
     app.cli.add_command(generate_past_appointments_command)
+    app.cli.add_command(warmup_command)
     # app.cli.add_command(generate_recurring_command) 
\ No newline at end of file
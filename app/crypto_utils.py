@@ -1,12 +1,35 @@
 import os
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet
 import base64
 from flask import current_app
 import re
 
+def parse_key_list(keys):
+    """
+    Split a comma-separated list of Fernet keys (as used by FERNET_OLD_KEYS) into a list.
+    """
+    if not keys:
+        return []
+    if isinstance(keys, (list, tuple)):
+        return [k.strip() for k in keys if k and k.strip()]
+    return [k.strip() for k in keys.split(',') if k.strip()]
+
+def build_cipher(primary_key, old_keys=None):
+    """
+    Build a cipher for the primary key. When old keys are given a MultiFernet is returned,
+    which encrypts with the primary key and can still decrypt tokens from any old key.
+    """
+    ciphers = [Fernet(primary_key.encode() if isinstance(primary_key, str) else primary_key)]
+    for key in parse_key_list(old_keys):
+        ciphers.append(Fernet(key.encode()))
+    if len(ciphers) == 1:
+        return ciphers[0]
+    return MultiFernet(ciphers)
+
 def get_fernet_cipher():
     """
     Get a Fernet cipher instance using the environment key. Returns None if encryption disabled.
+    If FERNET_OLD_KEYS is set (during a key rotation) the cipher also decrypts data written with those keys.
     """
     try:
         # Allow global disabling via config/env
@@ -17,7 +40,7 @@ def get_fernet_cipher():
             # If encryption is enabled but key missing, disable gracefully
             current_app.logger.warning("Encryption disabled: FERNET_SECRET_KEY not set")
             return None
-        return Fernet(fernet_key.encode())
+        return build_cipher(fernet_key, os.environ.get('FERNET_OLD_KEYS'))
     except Exception as e:
         current_app.logger.error(f"Error creating Fernet cipher: {str(e)}")
         return None
@@ -38,6 +61,26 @@ def encrypt_text(text: str) -> str:
         current_app.logger.warning(f"Encryption unavailable, returning plaintext: {str(e)}")
         return text
 
+_BASE64_PATTERN = re.compile(r'^[A-Za-z0-9+/]*={0,2}$')
+
+def _decrypt_with(cipher, encrypted_text):
+    """Decrypt one value with an existing cipher, returning anything that is not a valid token unchanged."""
+    if not isinstance(encrypted_text, str):
+        return encrypted_text
+    if len(encrypted_text) < 20:
+        return encrypted_text
+    if not _BASE64_PATTERN.match(encrypted_text):
+        return encrypted_text
+    try:
+        encrypted_bytes = base64.b64decode(encrypted_text.encode())
+    except (base64.binascii.Error, ValueError):
+        return encrypted_text
+    try:
+        decrypted_data = cipher.decrypt(encrypted_bytes)
+        return decrypted_data.decode()
+    except Exception:
+        return encrypted_text
+
 def decrypt_text(encrypted_text: str) -> str:
     """
     Decrypt sensitive text data. If encryption is disabled or token not valid, return the input unchanged.
@@ -48,26 +91,26 @@ def decrypt_text(encrypted_text: str) -> str:
         cipher = get_fernet_cipher()
         if not cipher:
             return encrypted_text
-        if not isinstance(encrypted_text, str):
-            return encrypted_text
-        if len(encrypted_text) < 20:
-            return encrypted_text
-        base64_pattern = re.compile(r'^[A-Za-z0-9+/]*={0,2}$')
-        if not base64_pattern.match(encrypted_text):
-            return encrypted_text
-        try:
-            encrypted_bytes = base64.b64decode(encrypted_text.encode())
-        except (base64.binascii.Error, ValueError):
-            return encrypted_text
-        try:
-            decrypted_data = cipher.decrypt(encrypted_bytes)
-            return decrypted_data.decode()
-        except Exception:
-            return encrypted_text
+        return _decrypt_with(cipher, encrypted_text)
     except Exception as e:
         current_app.logger.warning(f"Decrypt unavailable, returning plaintext: {str(e)}")
         return encrypted_text
 
+def decrypt_many(values):
+    """
+    Decrypt a sequence of values with a single cipher instance (same fallbacks as decrypt_text).
+    Much cheaper than calling decrypt_text per value when decrypting a whole patient list.
+    """
+    values = list(values)
+    try:
+        cipher = get_fernet_cipher()
+    except Exception as e:
+        current_app.logger.warning(f"Decrypt unavailable, returning plaintext: {str(e)}")
+        return values
+    if not cipher:
+        return values
+    return [_decrypt_with(cipher, value) for value in values]
+
 def encrypt_token(token):
     """
     Encrypt a token. If encryption is disabled or key is missing, return input.
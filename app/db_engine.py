@@ -0,0 +1,183 @@
+# app/db_engine.py
+"""
+Dialect-aware database engine profiles.
+
+engine_options() picks SQLAlchemy engine options for the configured database:
+- SQLite: a small connection pool (WAL allows concurrent readers alongside one
+  writer) and a busy timeout, plus per-connection PRAGMAs applied on connect:
+  journal_mode=WAL, synchronous=NORMAL, mmap_size, cache_size, busy_timeout,
+  temp_store=MEMORY and foreign_keys (opt-in via SQLITE_FOREIGN_KEYS).
+- PostgreSQL: a sized pool with pre-ping and recycling, and server-side
+  statement_timeout / idle_in_transaction_session_timeout set at connect time.
+
+Anything set explicitly in SQLALCHEMY_ENGINE_OPTIONS overrides the profile, and
+DB_ENGINE_PROFILE = 'none' disables profiles entirely (plain SQLAlchemy defaults).
+effective_settings() reports what is actually in effect for /monitoring.
+"""
+
+import weakref
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+SQLITE_DEFAULTS = {
+    'SQLITE_POOL_SIZE': 8,
+    'SQLITE_BUSY_TIMEOUT_MS': 5000,
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,    # 256MB memory-mapped I/O
+    'SQLITE_CACHE_SIZE_KB': 64 * 1024,         # 64MB page cache per connection
+    # Off by default: the patient deletion paths do not yet remove diagnoses, AI
+    # conversations or referral links, which enforced foreign keys would reject
+    'SQLITE_FOREIGN_KEYS': False,
+}
+
+POSTGRES_DEFAULTS = {
+    'DB_POOL_SIZE': 10,
+    'DB_MAX_OVERFLOW': 20,
+    'DB_POOL_TIMEOUT': 30,
+    'DB_POOL_RECYCLE': 1800,
+    'DB_STATEMENT_TIMEOUT_MS': 30000,
+    'DB_IDLE_IN_TRANSACTION_TIMEOUT_MS': 60000,
+}
+
+# Engines that already have their connect hooks
+_profiled_engines = weakref.WeakSet()
+
+# PRAGMAs read back for effective_settings()
+SQLITE_REPORTED_PRAGMAS = ('journal_mode', 'synchronous', 'mmap_size', 'cache_size',
+                           'busy_timeout', 'foreign_keys', 'temp_store')
+
+
+def _setting(config, name, defaults):
+    value = config.get(name)
+    return defaults[name] if value is None else value
+
+
+def profiles_enabled(config):
+    return (config.get('DB_ENGINE_PROFILE') or 'auto') != 'none'
+
+
+def dialect_of(uri):
+    """'sqlite', 'postgresql', ... for a database URI"""
+    return make_url(uri).get_backend_name()
+
+
+def _is_memory_sqlite(uri):
+    database = make_url(uri).database
+    return not database or database == ':memory:' or 'mode=memory' in uri
+
+
+def engine_options(config):
+    """
+    Engine options for config['SQLALCHEMY_DATABASE_URI'], with any explicit
+    SQLALCHEMY_ENGINE_OPTIONS layered on top.
+    """
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    dialect = dialect_of(uri)
+    options = {}
+
+    if not profiles_enabled(config):
+        pass
+    elif dialect == 'sqlite':
+        connect_args = {
+            'timeout': _setting(config, 'SQLITE_BUSY_TIMEOUT_MS', SQLITE_DEFAULTS) / 1000,
+            # Connections move between request threads through the pool
+            'check_same_thread': False,
+        }
+        options['connect_args'] = connect_args
+        if not _is_memory_sqlite(uri):
+            options.update({
+                'pool_size': _setting(config, 'SQLITE_POOL_SIZE', SQLITE_DEFAULTS),
+                'max_overflow': 0,
+                'pool_timeout': 30,
+                'pool_pre_ping': False,  # Local file, connections don't go stale
+            })
+    elif dialect == 'postgresql':
+        timeouts = (
+            f"-c statement_timeout={int(_setting(config, 'DB_STATEMENT_TIMEOUT_MS', POSTGRES_DEFAULTS))} "
+            f"-c idle_in_transaction_session_timeout="
+            f"{int(_setting(config, 'DB_IDLE_IN_TRANSACTION_TIMEOUT_MS', POSTGRES_DEFAULTS))}"
+        )
+        options.update({
+            'pool_size': _setting(config, 'DB_POOL_SIZE', POSTGRES_DEFAULTS),
+            'max_overflow': _setting(config, 'DB_MAX_OVERFLOW', POSTGRES_DEFAULTS),
+            'pool_timeout': _setting(config, 'DB_POOL_TIMEOUT', POSTGRES_DEFAULTS),
+            'pool_recycle': _setting(config, 'DB_POOL_RECYCLE', POSTGRES_DEFAULTS),
+            'pool_pre_ping': True,
+            'connect_args': {'options': timeouts, 'application_name': 'physiotracker'},
+        })
+
+    explicit = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    if 'connect_args' in explicit and 'connect_args' in options:
+        explicit['connect_args'] = {**options['connect_args'], **explicit['connect_args']}
+    options.update(explicit)
+    return options
+
+
+def sqlite_pragmas(config):
+    """PRAGMA statements executed on every new SQLite connection"""
+    cache_kb = int(_setting(config, 'SQLITE_CACHE_SIZE_KB', SQLITE_DEFAULTS))
+    return [
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',
+        f"PRAGMA mmap_size={int(_setting(config, 'SQLITE_MMAP_SIZE', SQLITE_DEFAULTS))}",
+        f'PRAGMA cache_size=-{cache_kb}',  # Negative means KiB rather than pages
+        f"PRAGMA busy_timeout={int(_setting(config, 'SQLITE_BUSY_TIMEOUT_MS', SQLITE_DEFAULTS))}",
+        'PRAGMA temp_store=MEMORY',
+        f"PRAGMA foreign_keys={'ON' if _setting(config, 'SQLITE_FOREIGN_KEYS', SQLITE_DEFAULTS) else 'OFF'}",
+    ]
+
+
+def apply_engine_profile(engine, config):
+    """Attach dialect-specific connect hooks to an engine (idempotent)"""
+    if engine.dialect.name != 'sqlite' or engine in _profiled_engines:
+        return
+    pragmas = sqlite_pragmas(config)
+    if _is_memory_sqlite(str(engine.url)):
+        # WAL and mmap do not apply to in-memory databases
+        pragmas = [p for p in pragmas if 'journal_mode' not in p and 'mmap_size' not in p]
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    _profiled_engines.add(engine)
+
+
+def apply_engine_profiles(app, db):
+    """Install connect hooks on every engine Flask-SQLAlchemy created for the app"""
+    if not profiles_enabled(app.config):
+        return
+    with app.app_context():
+        for engine in db.engines.values():
+            apply_engine_profile(engine, app.config)
+
+
+def effective_settings(engine):
+    """Dialect, pool configuration and server-side settings actually in effect"""
+    pool = engine.pool
+    settings = {
+        'dialect': engine.dialect.name,
+        'driver': engine.dialect.driver,
+        'pool_class': type(pool).__name__,
+        'pool_size': pool.size() if hasattr(pool, 'size') else None,
+        'max_overflow': getattr(pool, '_max_overflow', None),
+        'pool_timeout': getattr(pool, '_timeout', None),
+        'pool_recycle': getattr(pool, '_recycle', None),
+        'pool_pre_ping': getattr(pool, '_pre_ping', None),
+        'checked_out': pool.checkedout() if hasattr(pool, 'checkedout') else None,
+        'server': {},
+    }
+    with engine.connect() as conn:
+        if engine.dialect.name == 'sqlite':
+            for pragma in SQLITE_REPORTED_PRAGMAS:
+                settings['server'][pragma] = conn.exec_driver_sql(f'PRAGMA {pragma}').scalar()
+        elif engine.dialect.name == 'postgresql':
+            for name in ('statement_timeout', 'idle_in_transaction_session_timeout',
+                         'max_connections', 'server_version'):
+                settings['server'][name] = conn.exec_driver_sql(f'SHOW {name}').scalar()
+    return settings
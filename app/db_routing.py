@@ -0,0 +1,145 @@
+# app/db_routing.py
+"""
+Read/write session routing with an optional read replica.
+
+When DATABASE_REPLICA_URL is set, a replica engine is created (with the same
+dialect profile as the primary, see app/db_engine.py) and SELECTs issued by views
+decorated with @replica_read go to it. Everything else keeps
+using the primary:
+- flushes, INSERT/UPDATE/DELETE and SELECTs outside @replica_read views,
+- any request from a user who wrote within the last DB_REPLICA_STICKY_SECONDS
+  (read-your-writes; the last write time is kept in the signed session cookie),
+- the rest of a request once it has written anything.
+
+The replica can be a PostgreSQL streaming replica or, for SQLite deployments, a
+snapshot file refreshed with ``flask replica snapshot``.
+"""
+
+import sqlite3
+import time
+from functools import wraps
+
+from flask import g, session, current_app, has_app_context, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, create_engine
+from sqlalchemy.engine import make_url
+
+from app.db_engine import engine_options, apply_engine_profile, profiles_enabled
+
+LAST_WRITE_SESSION_KEY = '_db_last_write'
+
+
+def replica_read(f):
+    """Route the view's read queries to the replica (if configured)."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g._db_read_only = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def _mark_write():
+    if has_app_context():
+        g._db_wrote = True
+
+
+def _replica_allowed():
+    return (
+        has_app_context()
+        and g.get('_db_read_only', False)
+        and not g.get('_db_sticky', False)
+        and not g.get('_db_wrote', False)
+    )
+
+
+def replica_engine():
+    """The current app's replica engine, or None when no replica is configured"""
+    router = current_app.extensions.get('replica_router')
+    return router.engine if router else None
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends read-only SELECTs to the replica engine"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and _replica_allowed():
+            is_select = clause is None or getattr(clause, 'is_select', False)
+            engine = replica_engine() if is_select else None
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    _mark_write()
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _on_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _mark_write()
+
+
+class ReplicaRouter:
+    """Owns the replica engine and the read-your-writes stickiness hooks"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self.engine = None
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the replica engine if DATABASE_REPLICA_URL is set"""
+        app.config.setdefault('DATABASE_REPLICA_URL', None)
+        app.config.setdefault('DB_REPLICA_STICKY_SECONDS', 5)
+        app.extensions['replica_router'] = self
+
+        replica_url = app.config['DATABASE_REPLICA_URL']
+        if not replica_url:
+            return
+
+        # Same dialect profile as the primary, without the primary's explicit overrides
+        replica_config = {key: value for key, value in app.config.items()
+                          if key != 'SQLALCHEMY_ENGINE_OPTIONS'}
+        replica_config['SQLALCHEMY_DATABASE_URI'] = replica_url
+        self.engine = create_engine(replica_url, **engine_options(replica_config))
+        if profiles_enabled(app.config):
+            apply_engine_profile(self.engine, app.config)
+
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+
+    def start_request(self):
+        """Stick to the primary for a few seconds after this user's last write"""
+        last_write = session.get(LAST_WRITE_SESSION_KEY)
+        sticky_seconds = current_app.config['DB_REPLICA_STICKY_SECONDS']
+        g._db_sticky = bool(last_write) and time.time() - last_write < sticky_seconds
+
+    def finish_request(self, response):
+        """Remember when this user last wrote"""
+        if g.get('_db_wrote') and has_request_context():
+            session[LAST_WRITE_SESSION_KEY] = time.time()
+        return response
+
+
+def snapshot_sqlite(primary_url, replica_url):
+    """
+    Copy a SQLite primary into the replica file using the online backup API
+    (consistent even while the primary is being written). Returns the page count.
+    """
+    primary, replica = make_url(primary_url), make_url(replica_url)
+    if primary.get_backend_name() != 'sqlite' or replica.get_backend_name() != 'sqlite':
+        raise ValueError('Snapshots are only supported between SQLite databases')
+    if not primary.database or not replica.database or ':memory:' in (primary.database, replica.database):
+        raise ValueError('Snapshots need file databases on both sides')
+
+    source = sqlite3.connect(primary.database)
+    target = sqlite3.connect(replica.database)
+    try:
+        source.backup(target)
+        return source.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        target.close()
+        source.close()
@@ -0,0 +1,240 @@
+# app/email_outbox.py
+"""
+Transactional email outbox.
+
+send_email() used to open a new SMTP connection and send inside the request,
+so registration, email verification and the trial reminders waited on (and
+failed with) the mail server. Emails are now queued instead:
+
+    enqueue_email(user.email, subject, html_body, text_body,
+                  idempotency_key=f'welcome:{user.id}')
+    db.session.commit()
+
+enqueue_email() adds an email_outbox row to the current session, so the email
+is committed (or rolled back) together with the change that caused it. A
+message whose idempotency key is already in the outbox is not queued again;
+keys name the recipient and the event (one welcome email per user, one
+reminder per subscription and day).
+
+The dispatcher drains the outbox in batches of EMAIL_OUTBOX_BATCH_SIZE over
+one SMTP connection. Batches are claimed with a conditional UPDATE, so any
+number of dispatchers can run at once. Failed sends are retried with
+exponential backoff (EMAIL_OUTBOX_RETRY_SECONDS, doubling per attempt) up to
+EMAIL_OUTBOX_MAX_ATTEMPTS; a permanent rejection (5xx, refused recipient)
+fails the message at once. A claim older than EMAIL_OUTBOX_CLAIM_TIMEOUT
+(a dispatcher that died mid-batch) is claimed again.
+
+OutboxDispatcher runs the dispatcher on a background thread of each serving
+process, woken by commits that queued email and draining every
+EMAIL_OUTBOX_POLL_SECONDS (see app/background_queue.py). With
+EMAIL_OUTBOX_DISPATCHER_ENABLED=false, `flask email worker` runs it as its own
+process instead. CLI commands that queue email call dispatch_pending() before
+exiting, and `flask email dispatch` drains the outbox once.
+"""
+
+import smtplib
+from datetime import datetime
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from app import db
+from app.background_queue import QueueWorker, backoff, claim_due
+from app.metrics import track_external
+from app.models import EmailOutbox
+
+_QUEUED_KEY = 'email_outbox_queued'
+
+
+def enqueue_email(to_email, subject, html_body, text_body=None, idempotency_key=None):
+    """
+    Queue an email in the current transaction; the caller commits. Returns the
+    outbox row, or the existing one when idempotency_key is already queued.
+    """
+    if idempotency_key:
+        existing = db.session.scalar(select(EmailOutbox).where(EmailOutbox.idempotency_key == idempotency_key))
+        if existing is not None:
+            return existing
+    message = EmailOutbox(
+        idempotency_key=idempotency_key,
+        to_email=to_email,
+        subject=subject,
+        html_body=html_body,
+        text_body=text_body,
+        status='pending',
+        attempts=0,
+        next_attempt_at=datetime.utcnow(),
+    )
+    db.session.add(message)
+    db.session.info[_QUEUED_KEY] = True
+    return message
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_dispatcher(session):
+    if session.info.pop(_QUEUED_KEY, None) and has_app_context():
+        dispatcher = current_app.extensions.get('email_dispatcher')
+        if dispatcher is not None:
+            dispatcher.wake()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_queued(session):
+    session.info.pop(_QUEUED_KEY, None)
+
+
+class SMTPConnection:
+    """One SMTP session shared by every message of a drain, reopened if the server drops it"""
+
+    def __init__(self, host, port, username=None, password=None, use_tls=True, timeout=30):
+        self.host, self.port = host, port
+        self.username, self.password = username, password
+        self.use_tls, self.timeout = use_tls, timeout
+        self._smtp = None
+
+    def _open(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password)
+        self._smtp = smtp
+
+    def send(self, sender, recipient, message):
+        if self._smtp is None:
+            self._open()
+        try:
+            self._smtp.sendmail(sender, [recipient], message)
+        except smtplib.SMTPServerDisconnected:
+            # Idle connection closed by the server: reconnect once
+            self._smtp = None
+            self._open()
+            self._smtp.sendmail(sender, [recipient], message)
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except smtplib.SMTPException:
+                pass
+            self._smtp = None
+
+
+class LogConnection:
+    """Stands in for SMTP when MAIL_SERVER/MAIL_USERNAME/MAIL_PASSWORD are not configured"""
+
+    def send(self, sender, recipient, message):
+        current_app.logger.info(f"""
+========== EMAIL WOULD BE SENT (NO SMTP CONFIG) ==========
+To: {recipient}
+{message[:400]}...
+=========================================================
+        """)
+
+    def close(self):
+        pass
+
+
+def smtp_connection():
+    """SMTP connection from the MAIL_* settings, or a LogConnection without them"""
+    config = current_app.config
+    if not all([config.get('MAIL_SERVER'), config.get('MAIL_USERNAME'), config.get('MAIL_PASSWORD')]):
+        return LogConnection()
+    return SMTPConnection(config['MAIL_SERVER'], config.get('MAIL_PORT', 587), config['MAIL_USERNAME'],
+                          config['MAIL_PASSWORD'], config.get('MAIL_USE_TLS', True),
+                          config.get('EMAIL_SMTP_TIMEOUT', 30))
+
+
+def _sender():
+    config = current_app.config
+    return config.get('MAIL_DEFAULT_SENDER') or config.get('MAIL_USERNAME')
+
+
+def render_message(message, sender):
+    """MIME text of an outbox row"""
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = current_app.config.get('MAIL_SUBJECT_PREFIX', '') + message.subject
+    msg['From'] = sender
+    msg['To'] = message.to_email
+    if message.idempotency_key:
+        msg['X-Idempotency-Key'] = message.idempotency_key
+    if message.text_body:
+        msg.attach(MIMEText(message.text_body, 'plain'))
+    msg.attach(MIMEText(message.html_body, 'html'))
+    return msg.as_string()
+
+
+def _permanent(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+def retry_delay(attempts):
+    return backoff(current_app.config.get('EMAIL_OUTBOX_RETRY_SECONDS', 60), attempts)
+
+
+def claim_batch(batch_size, now=None):
+    """Claim up to batch_size due messages for this dispatcher; returns them in queue order"""
+    timeout = current_app.config.get('EMAIL_OUTBOX_CLAIM_TIMEOUT', 300)
+    return claim_due(EmailOutbox, 'sending', batch_size, timeout, now)
+
+
+def dispatch_pending(connection=None, batch_size=None, max_batches=None):
+    """Send due outbox messages batch by batch; returns {'sent', 'retried', 'failed'} counts"""
+    config = current_app.config
+    batch_size = batch_size or config.get('EMAIL_OUTBOX_BATCH_SIZE', 50)
+    max_attempts = config.get('EMAIL_OUTBOX_MAX_ATTEMPTS', 6)
+    own_connection = connection is None
+    connection = connection or smtp_connection()
+    sender = _sender()
+    counts = {'sent': 0, 'retried': 0, 'failed': 0}
+    batches = 0
+    try:
+        while max_batches is None or batches < max_batches:
+            messages = claim_batch(batch_size)
+            if not messages:
+                break
+            batches += 1
+            for message in messages:
+                message.attempts += 1
+                message.claimed_by = None
+                try:
+                    with track_external('smtp'):
+                        connection.send(sender, message.to_email, render_message(message, sender))
+                except Exception as e:
+                    message.last_error = f'{type(e).__name__}: {e}'[:1000]
+                    if _permanent(e) or message.attempts >= max_attempts:
+                        message.status = 'failed'
+                        counts['failed'] += 1
+                        current_app.logger.error(f"Giving up on email {message.id} to {message.to_email}: {e}")
+                    else:
+                        message.status = 'pending'
+                        message.next_attempt_at = datetime.utcnow() + retry_delay(message.attempts)
+                        counts['retried'] += 1
+                        current_app.logger.warning(f"Email {message.id} to {message.to_email} failed, retrying: {e}")
+                else:
+                    message.status = 'sent'
+                    message.sent_at = datetime.utcnow()
+                    message.last_error = None
+                    counts['sent'] += 1
+            db.session.commit()
+    finally:
+        if own_connection:
+            connection.close()
+    if any(counts.values()):
+        current_app.logger.info("Email outbox: %(sent)s sent, %(retried)s to retry, %(failed)s failed", counts)
+    return counts
+
+
+class OutboxDispatcher(QueueWorker):
+    """Background thread that drains the outbox after commits that queue email, and on a timer"""
+
+    extension = 'email_dispatcher'
+    poll_setting = 'EMAIL_OUTBOX_POLL_SECONDS'
+
+    def process(self):
+        return dispatch_pending()
@@ -1,14 +1,19 @@
 """
-Email utilities for sending verification emails and other notifications
+Email utilities for sending verification emails and other notifications.
+
+The notification emails are queued in the email outbox (app/email_outbox.py)
+and go out when the caller commits; send_email() still sends immediately for
+diagnostics.
 """
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from flask import current_app, url_for
 import logging
+from app.email_outbox import enqueue_email
 
 def send_email(to_email, subject, html_body, text_body=None):
-    """Send an email using SMTP"""
+    """Send an email using SMTP right away (bypasses the outbox)"""
     try:
         # Check if email configuration is available
         mail_server = current_app.config.get('MAIL_SERVER')
@@ -62,7 +67,7 @@ HTML Body: {html_body[:200]}...
         return False
 
 def send_verification_email(user):
-    """Send email verification email to user"""
+    """Queue the email verification email; sent once the caller commits"""
     token = user.generate_email_verification_token()
     verification_url = url_for('auth.verify_email', token=token, _external=True)
     subject = "Verifica tu email - TRXCKER"
@@ -142,10 +147,12 @@ El equipo de TRXCKER
     </html>
     """
     
-    return send_email(user.email, subject, html_body, text_body)
+    enqueue_email(user.email, subject, html_body, text_body,
+                  idempotency_key=f"verify-email:{user.id}:{user.email_verification_token}")
+    return True
 
 def send_welcome_email(user):
-    """Send welcome email after verification"""
+    """Queue the welcome email sent after verification; sent once the caller commits"""
     subject = "¡Bienvenido a TRXCKER!"
     
     # Get user's name or use a generic greeting
@@ -235,10 +242,11 @@ El equipo de TRXCKER
     </html>
     """
     
-    return send_email(user.email, subject, html_body, text_body)
+    enqueue_email(user.email, subject, html_body, text_body, idempotency_key=f"welcome:{user.id}")
+    return True
 
-def send_trial_reminder_email(user, days_remaining):
-    """Send trial reminder email to user"""
+def send_trial_reminder_email(user, days_remaining, subscription=None):
+    """Queue a trial reminder email; sent once the caller commits"""
     subject = f"Your TRXCKER trial expires in {days_remaining} days"
     
     # Get user's name or use a generic greeting
@@ -392,10 +400,13 @@ The TRXCKER Team
     </html>
     """
     
-    return send_email(user.email, subject, html_body, text_body)
+    subscription = subscription or user.current_subscription
+    enqueue_email(user.email, subject, html_body, text_body,
+                  idempotency_key=f"trial-reminder:{user.id}:{subscription.id if subscription else 0}:{days_remaining}")
+    return True
 
 def send_trial_reminder_emails():
-    """Send trial reminder emails to users who need them"""
+    """Queue trial reminder emails for users who need them, in one transaction"""
     from app.models import User, UserSubscription, db
     from datetime import datetime, timedelta
     
@@ -417,29 +428,94 @@ def send_trial_reminder_emails():
         start_of_day = target_date.replace(hour=0, minute=0, second=0, microsecond=0)
         end_of_day = target_date.replace(hour=23, minute=59, second=59, microsecond=999999)
         
-        # Find users whose trial ends on the target date and haven't received this reminder
-        users_to_remind = User.query.join(UserSubscription).filter(
+        # Subscriptions whose trial ends on the target date and haven't had this reminder
+        reminders = db.session.query(User, UserSubscription).join(
+            UserSubscription, UserSubscription.user_id == User.id
+        ).filter(
             UserSubscription.status == 'trialing',
             UserSubscription.trial_ends_at >= start_of_day,
             UserSubscription.trial_ends_at <= end_of_day,
             getattr(UserSubscription, field_name) == False
         ).all()
         
-        for user in users_to_remind:
+        for user, subscription in reminders:
             try:
-                # Send the reminder email
-                if send_trial_reminder_email(user, days):
-                    # Mark this reminder as sent
-                    subscription = user.current_subscription
-                    if subscription:
-                        setattr(subscription, field_name, True)
-                        db.session.commit()
-                        total_sent += 1
-                        print(f"Sent {days}-day reminder to {user.email}")
-                else:
-                    print(f"Failed to send {days}-day reminder to {user.email}")
+                # Queued with the flag that marks the reminder as sent
+                send_trial_reminder_email(user, days, subscription)
+                setattr(subscription, field_name, True)
+                total_sent += 1
             except Exception as e:
-                print(f"Error sending {days}-day reminder to {user.email}: {str(e)}")
+                print(f"Error queueing {days}-day reminder to {user.email}: {str(e)}")
     
-    print(f"Total trial reminder emails sent: {total_sent}")
+    db.session.commit()
+    print(f"Total trial reminder emails queued: {total_sent}")
     return total_sent
+
+def send_clinic_invitation_email(email, clinic, inviter, invitation_link, invitation_token):
+    """Queue a clinic invitation email; sent once the caller commits"""
+    subject = f"Invitación a {clinic.name} - TRXCKER"
+    inviter_name = inviter.first_name if inviter.first_name else inviter.email
+    
+    text_body = f"""
+Hola,
+
+{inviter_name} te ha invitado a unirte a {clinic.name} en TRXCKER.
+
+Para aceptar la invitación, abre el siguiente enlace:
+
+{invitation_link}
+
+Esta invitación expirará en 7 días.
+
+Si no esperabas esta invitación, puedes ignorar este email.
+
+Saludos,
+El equipo de TRXCKER
+    """
+    
+    html_body = f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <style>
+            body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
+            .header {{ background-color: #0d6efd; color: white; padding: 20px; text-align: center; }}
+            .content {{ padding: 20px; }}
+            .button {{ 
+                background-color: #0d6efd !important; 
+                color: #ffffff !important; 
+                padding: 15px 30px !important; 
+                text-decoration: none !important; 
+                border-radius: 8px !important; 
+                display: inline-block !important; 
+                margin: 20px 0 !important; 
+                font-weight: bold !important;
+            }}
+            a.button {{ color: #ffffff !important; }}
+            .footer {{ background-color: #f8f9fa; padding: 15px; text-align: center; color: #6c757d; font-size: 0.9em; }}
+        </style>
+    </head>
+    <body>
+        <div class="header">
+            <h1>TRXCKER</h1>
+        </div>
+        <div class="content">
+            <p>Hola,</p>
+            <p><strong>{inviter_name}</strong> te ha invitado a unirte a <strong>{clinic.name}</strong> en TRXCKER.</p>
+            <a href="{invitation_link}" class="button">Aceptar invitación</a>
+            <p>También puedes copiar y pegar este enlace en tu navegador:</p>
+            <p><small>{invitation_link}</small></p>
+            <p><strong>Importante:</strong> Esta invitación expira en 7 días.</p>
+            <p>Si no esperabas esta invitación, puedes ignorar este email.</p>
+        </div>
+        <div class="footer">
+            <p>TRXCKER - Tu plataforma de gestión de fisioterapia</p>
+            <p>Este es un email automático, por favor no respondas a esta dirección.</p>
+        </div>
+    </body>
+    </html>
+    """
+    
+    enqueue_email(email, subject, html_body, text_body,
+                  idempotency_key=f"clinic-invite:{clinic.id}:{email.lower()}:{invitation_token}")
+    return True
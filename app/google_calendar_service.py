@@ -1,20 +1,50 @@
 """
 Google Calendar API integration service
 Handles OAuth2 authentication, token management, and calendar operations
+
+Sync is incremental: the first sync lists events from SYNC_DAYS_BACK days ago
+page by page and stores Google's nextSyncToken on the user; later syncs send
+that token and only receive the events changed since (Google answers 410 when
+a token expires, which falls back to a full listing). Treatments are only
+created for events starting within SYNC_DAYS_AHEAD days, so a recurring
+series does not fill the schedule for years ahead; each incremental sync also
+lists the events that crossed that horizon since the last sync, which the
+token would not return again. The token does not return unchanged events
+either, so when the user's patients were added or edited since the last sync
+the whole window is listed again, for events that matched no patient before.
+Event ids already linked to treatments are loaded into a set once per sync,
+and patients are matched against names and emails decrypted once per sync.
+
+Treatments record where their event came from: EVENT_FROM_GOOGLE for
+treatments the sync created from the user's own events, EVENT_FROM_APP for
+events push_treatments() created. Pushes only ever update the latter.
+
+Calendar clients are built once per user and thread (httplib2 connections are
+not thread-safe) and reused while the user's OAuth app and refresh token are
+unchanged. Access tokens the client refreshes are written back to the user.
+Event creates and updates go through the batch endpoint, BATCH_LIMIT requests
+per HTTP call.
+
+GOOGLE_CALENDAR_API_ROOT points the client at another server (tests use a
+local fake of the Calendar API).
 """
 
 import os
 import json
-from datetime import datetime, timedelta
-from typing import Optional, Dict, List, Any
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Optional, Dict, List, Any
 import requests
 from flask import current_app, url_for
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+from sqlalchemy import func, or_, select
+from app.integrations import google_credentials, google_discovery, google_errors, google_http, google_oauth_flow
 from app.models import User, Treatment, Patient, UnmatchedCalendlyBooking
 from app import db
+from app.crypto_utils import decrypt_many
+from app.metrics import track_external
+
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
 
 class GoogleCalendarService:
     """Service class for Google Calendar API operations"""
@@ -25,8 +55,20 @@ class GoogleCalendarService:
         'https://www.googleapis.com/auth/calendar.events'
     ]
     
+    # Incremental sync and batched writes
+    SYNC_DAYS_BACK = 30
+    SYNC_DAYS_AHEAD = 90
+    PAGE_SIZE = 250
+    BATCH_LIMIT = 50
+    DEFAULT_EVENT_MINUTES = 60
+    
+    # Treatment.google_calendar_event_origin
+    EVENT_FROM_GOOGLE = 'google'
+    EVENT_FROM_APP = 'app'
+    
     def __init__(self):
-        pass
+        # Calendar clients per thread: {user id: (client key, credentials, service)}
+        self._clients = threading.local()
     
     def get_user_credentials_config(self, user):
         """Get user's own Google Calendar app credentials"""
@@ -55,7 +97,7 @@ class GoogleCalendarService:
         config = self.get_user_credentials_config(user)
             
         try:
-            flow = Flow.from_client_config(
+            flow = google_oauth_flow.Flow.from_client_config(
                 {
                     "web": {
                         "client_id": config['client_id'],
@@ -95,7 +137,7 @@ class GoogleCalendarService:
             
             config = self.get_user_credentials_config(user)
             
-            flow = Flow.from_client_config(
+            flow = google_oauth_flow.Flow.from_client_config(
                 {
                     "web": {
                         "client_id": config['client_id'],
@@ -129,14 +171,14 @@ class GoogleCalendarService:
             current_app.logger.error(f"Error in Google OAuth callback: {str(e)}")
             return {'success': False, 'error': str(e)}
     
-    def get_credentials(self, user: User) -> Optional[Credentials]:
+    def get_credentials(self, user: User) -> Optional['Credentials']:
         """Get valid credentials for a user, refreshing if necessary"""
         if not user.google_calendar_configured:
             return None
         
         try:
             config = self.get_user_credentials_config(user)
-            credentials = Credentials(
+            credentials = google_credentials.Credentials(
                 token=user.google_calendar_token,
                 refresh_token=user.google_calendar_refresh_token,
                 token_uri="https://oauth2.googleapis.com/token",
@@ -149,14 +191,7 @@ class GoogleCalendarService:
             if credentials.expired:
                 from google.auth.transport.requests import Request
                 credentials.refresh(Request())
-                
-                # Update stored tokens
-                user.google_calendar_token = credentials.token
-                if credentials.refresh_token:
-                    user.google_calendar_refresh_token = credentials.refresh_token
-                db.session.commit()
-                
-                current_app.logger.info(f"Refreshed Google Calendar tokens for user {user.id}")
+                self._store_refreshed_token(user, credentials)
             
             return credentials
             
@@ -164,161 +199,326 @@ class GoogleCalendarService:
             current_app.logger.error(f"Error getting Google Calendar credentials for user {user.id}: {str(e)}")
             return None
     
+    def _store_refreshed_token(self, user: User, credentials) -> None:
+        """Write an access token the client refreshed back to the user"""
+        if credentials.token and credentials.token != user.google_calendar_token:
+            user.google_calendar_token = credentials.token
+            if credentials.refresh_token:
+                user.google_calendar_refresh_token = credentials.refresh_token
+            db.session.commit()
+            current_app.logger.info(f"Refreshed Google Calendar tokens for user {user.id}")
+    
+    def _client_key(self, user: User):
+        # A new OAuth app or a reconnect invalidates the cached client
+        return (user.google_calendar_client_id, user.google_calendar_client_secret,
+                user.google_calendar_refresh_token, current_app.config.get('GOOGLE_CALENDAR_API_ROOT'))
+    
     def get_calendar_service(self, user: User):
-        """Get authenticated Google Calendar service"""
+        """Get authenticated Google Calendar service, reusing this thread's client for the user"""
+        clients = self._clients.__dict__.setdefault('by_user', {})
+        key = self._client_key(user)
+        cached = clients.get(user.id)
+        if cached is not None and cached[0] == key:
+            credentials = cached[1]
+            # Another worker may have refreshed the token since
+            if not credentials.valid and user.google_calendar_token != credentials.token:
+                credentials.token = user.google_calendar_token
+            return cached[2]
+        
         credentials = self.get_credentials(user)
         if not credentials:
             return None
         
         try:
-            service = build('calendar', 'v3', credentials=credentials)
+            api_root = current_app.config.get('GOOGLE_CALENDAR_API_ROOT')
+            options = {'api_endpoint': api_root.rstrip('/') + '/calendar/v3/'} if api_root else None
+            service = google_discovery.build('calendar', 'v3', credentials=credentials,
+                                             cache_discovery=False, client_options=options)
+            clients[user.id] = (key, credentials, service)
             return service
         except Exception as e:
             current_app.logger.error(f"Error building Google Calendar service for user {user.id}: {str(e)}")
             return None
     
+    def _credentials_for(self, user: User):
+        cached = self._clients.__dict__.get('by_user', {}).get(user.id)
+        return cached[1] if cached else None
+    
+    def _new_batch(self, service):
+        api_root = current_app.config.get('GOOGLE_CALENDAR_API_ROOT')
+        if api_root:
+            # The discovery document's batch URI ignores client_options
+            return google_http.BatchHttpRequest(batch_uri=api_root.rstrip('/') + '/batch/calendar/v3')
+        return service.new_batch_http_request()
+    
+    def _list_changed_events(self, service, calendar_id: str, sync_token: Optional[str]):
+        """All events changed since sync_token (every event from SYNC_DAYS_BACK on without one), and the next token"""
+        params = {'calendarId': calendar_id, 'singleEvents': True, 'maxResults': self.PAGE_SIZE}
+        if sync_token:
+            params['syncToken'] = sync_token
+        else:
+            params['timeMin'] = (datetime.utcnow() - timedelta(days=self.SYNC_DAYS_BACK)).isoformat() + 'Z'
+        return self._list_events(service, params)
+    
+    def _list_events_between(self, service, calendar_id: str, time_min: datetime, time_max: datetime):
+        """All events starting before time_max and ending after time_min (naive UTC)"""
+        events, _ = self._list_events(service, {
+            'calendarId': calendar_id, 'singleEvents': True, 'maxResults': self.PAGE_SIZE,
+            'timeMin': time_min.isoformat() + 'Z', 'timeMax': time_max.isoformat() + 'Z',
+        })
+        return events
+    
+    def _list_events(self, service, params: Dict[str, Any]):
+        events = []
+        page_token = None
+        while True:
+            with track_external('google'):
+                page = service.events().list(pageToken=page_token, **params).execute()
+            events.extend(page.get('items', []))
+            page_token = page.get('nextPageToken')
+            if not page_token:
+                return events, page.get('nextSyncToken')
+    
+    def _patients_changed_since(self, user: User, since: datetime) -> bool:
+        last_change = db.session.scalar(select(func.max(Patient.updated_at)).where(Patient.user_id == user.id))
+        return last_change is not None and last_change > since
+    
+    def _patient_matcher(self, user: User):
+        """Match events to the user's patients by attendee email, then by name in the text"""
+        rows = db.session.execute(
+            select(Patient.id, Patient._name, Patient._email).where(Patient.user_id == user.id).order_by(Patient.id)
+        ).all()
+        plain = decrypt_many([row[1] for row in rows] + [row[2] for row in rows])
+        names, emails = plain[:len(rows)], plain[len(rows):]
+        by_email = {}
+        for row, email in zip(rows, emails):
+            if email:
+                by_email.setdefault(email.strip().lower(), row[0])
+        by_name = [(name.lower(), row[0]) for row, name in zip(rows, names) if name]
+        
+        def match(event: Dict[str, Any]) -> Optional[int]:
+            for attendee in event.get('attendees', []):
+                email = (attendee.get('email') or '').lower()
+                if '@' in email and email in by_email:
+                    return by_email[email]
+            event_text = f"{event.get('summary', '')} {event.get('description', '')}".lower()
+            for name, patient_id in by_name:
+                if name in event_text:
+                    return patient_id
+            return None
+        
+        return match
+    
+    @staticmethod
+    def _event_start(event: Dict[str, Any]) -> Optional[datetime]:
+        """Start of an event as naive UTC (the way treatments store times), or None"""
+        start = event.get('start', {})
+        start_time_str = start.get('dateTime', start.get('date'))
+        if not start_time_str:
+            return None
+        try:
+            start_time = datetime.fromisoformat(start_time_str.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+        if start_time.tzinfo is not None:
+            start_time = start_time.astimezone(timezone.utc).replace(tzinfo=None)
+        return start_time
+    
     def sync_events_for_user(self, user: User) -> Dict[str, int]:
         """Sync Google Calendar events for a specific user"""
         service = self.get_calendar_service(user)
         if not service:
             return {'new_treatments': 0, 'error': 'Unable to connect to Google Calendar'}
         
+        calendar_id = user.google_calendar_primary_calendar_id or 'primary'
+        now = datetime.utcnow()
+        horizon = now + timedelta(days=self.SYNC_DAYS_AHEAD)
         try:
-            # Get events from the last 30 days to next 90 days
-            time_min = (datetime.utcnow() - timedelta(days=30)).isoformat() + 'Z'
-            time_max = (datetime.utcnow() + timedelta(days=90)).isoformat() + 'Z'
-            
-            events_result = service.events().list(
-                calendarId=user.google_calendar_primary_calendar_id or 'primary',
-                timeMin=time_min,
-                timeMax=time_max,
-                singleEvents=True,
-                orderBy='startTime',
-                maxResults=100
-            ).execute()
+            incremental = bool(user.google_calendar_sync_token)
+            try:
+                events, next_sync_token = self._list_changed_events(service, calendar_id, user.google_calendar_sync_token)
+            except google_errors.HttpError as e:
+                if e.resp.status != 410 or not incremental:
+                    raise
+                # Sync token expired: list everything again
+                current_app.logger.info(f"Google Calendar sync token expired for user {user.id}, running a full sync")
+                events, next_sync_token = self._list_changed_events(service, calendar_id, None)
+                incremental = False
+            changed_events = len(events)
+            if incremental and user.google_calendar_last_sync:
+                if self._patients_changed_since(user, user.google_calendar_last_sync):
+                    # Unchanged events may match the new or edited patients
+                    window_start = now - timedelta(days=self.SYNC_DAYS_BACK)
+                else:
+                    # Unchanged events that were beyond the horizon at the last sync
+                    window_start = user.google_calendar_last_sync + timedelta(days=self.SYNC_DAYS_AHEAD)
+                if window_start < horizon:
+                    events = events + self._list_events_between(service, calendar_id, window_start, horizon)
             
-            events = events_result.get('items', [])
+            known_event_ids = set(db.session.scalars(
+                select(Treatment.google_calendar_event_id).join(Patient).where(
+                    Patient.user_id == user.id,
+                    Treatment.google_calendar_event_id.isnot(None),
+                )
+            ))
+            match_patient = self._patient_matcher(user)
             new_treatments_count = 0
             
             for event in events:
-                # Skip events without start time or summary
-                if 'start' not in event or 'summary' not in event:
+                # Skip cancelled events and events without start time or summary
+                if event.get('status') == 'cancelled' or 'start' not in event or 'summary' not in event:
                     continue
-                
                 event_id = event['id']
-                event_summary = event['summary']
-                event_description = event.get('description', '')
-                
-                # Parse start and end times
-                start_time_str = event['start'].get('dateTime', event['start'].get('date'))
-                end_time_str = event['end'].get('dateTime', event['end'].get('date'))
-                
-                if not start_time_str:
-                    continue
-                
-                try:
-                    # Handle both datetime and date formats
-                    if 'T' in start_time_str:
-                        start_time = datetime.fromisoformat(start_time_str.replace('Z', '+00:00'))
-                        end_time = datetime.fromisoformat(end_time_str.replace('Z', '+00:00')) if end_time_str else start_time + timedelta(hours=1)
-                    else:
-                        start_time = datetime.fromisoformat(start_time_str)
-                        end_time = datetime.fromisoformat(end_time_str) if end_time_str else start_time + timedelta(hours=1)
-                except ValueError:
+                if event_id in known_event_ids:
                     continue
-                
-                # Check if treatment already exists for this event
-                existing_treatment = Treatment.query.filter_by(
-                    google_calendar_event_id=event_id
-                ).join(Patient).filter(Patient.user_id == user.id).first()
-                
-                if existing_treatment:
+                start_time = self._event_start(event)
+                if start_time is None or start_time > horizon:
                     continue
                 
                 # Try to match with existing patients based on attendees or description
-                patient = self._match_patient_from_event(user, event)
-                
-                if patient:
+                patient_id = match_patient(event)
+                if patient_id:
                     # Create treatment from Google Calendar event
                     treatment = Treatment(
-                        patient_id=patient.id,
+                        patient_id=patient_id,
                         treatment_type='Appointment from Google Calendar',
-                        session_date=start_time.date(),
-                        session_time=start_time.time(),
-                        duration_minutes=int((end_time - start_time).total_seconds() / 60),
-                        assessment=event_description,
+                        status='Scheduled',
+                        created_at=start_time,
+                        assessment=event.get('description', ''),
                         google_calendar_event_id=event_id,
-                        google_calendar_event_summary=event_summary
+                        google_calendar_event_summary=event['summary'][:255],
+                        google_calendar_event_origin=self.EVENT_FROM_GOOGLE
                     )
-                    
                     db.session.add(treatment)
+                    known_event_ids.add(event_id)
                     new_treatments_count += 1
                     
-                    current_app.logger.info(f"Created treatment from Google Calendar event {event_id} for patient {patient.id}")
+                    current_app.logger.info(f"Created treatment from Google Calendar event {event_id} for patient {patient_id}")
             
-            # Update last sync time
-            user.google_calendar_last_sync = datetime.utcnow()
+            # Update last sync time and the token for the next incremental sync
+            user.google_calendar_sync_token = next_sync_token
+            user.google_calendar_last_sync = now
             db.session.commit()
+            credentials = self._credentials_for(user)
+            if credentials is not None:
+                self._store_refreshed_token(user, credentials)
             
-            current_app.logger.info(f"Google Calendar sync completed for user {user.id}: {new_treatments_count} new treatments")
-            return {'new_treatments': new_treatments_count}
+            current_app.logger.info(f"Google Calendar sync completed for user {user.id}: {len(events)} changed events, "
+                                    f"{new_treatments_count} new treatments")
+            return {'new_treatments': new_treatments_count, 'changed_events': changed_events}
             
-        except HttpError as e:
+        except google_errors.HttpError as e:
+            db.session.rollback()
             current_app.logger.error(f"Google Calendar API error for user {user.id}: {str(e)}")
             return {'new_treatments': 0, 'error': f'Google Calendar API error: {str(e)}'}
         except Exception as e:
+            db.session.rollback()
             current_app.logger.error(f"Error syncing Google Calendar for user {user.id}: {str(e)}")
             return {'new_treatments': 0, 'error': str(e)}
     
-    def create_calendar_event(self, user: User, event_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Create a new event in Google Calendar"""
+    def push_events(self, user: User, inserts: List[Dict[str, Any]] = (),
+                    updates: Optional[Dict[str, Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """
+        Create (inserts: event bodies) and patch (updates: {event_id: fields})
+        events through the batch endpoint. Returns one result per write, inserts
+        first: {'success', 'event_id', 'event_link'} or {'success': False, 'error'}.
+        """
+        writes = [(None, body) for body in inserts] + list((updates or {}).items())
+        if not writes:
+            return []
         service = self.get_calendar_service(user)
         if not service:
-            return {'success': False, 'error': 'Unable to connect to Google Calendar'}
+            return [{'success': False, 'error': 'Unable to connect to Google Calendar'}] * len(writes)
+        
+        calendar_id = user.google_calendar_primary_calendar_id or 'primary'
+        results = [None] * len(writes)
+        
+        def collect(request_id, response, exception):
+            index = int(request_id)
+            if exception is not None:
+                results[index] = {'success': False, 'error': f'Google Calendar API error: {exception}'}
+            else:
+                results[index] = {'success': True, 'event_id': response['id'], 'event_link': response.get('htmlLink')}
         
         try:
-            event = service.events().insert(
-                calendarId=user.google_calendar_primary_calendar_id or 'primary',
-                body=event_data
-            ).execute()
-            
-            current_app.logger.info(f"Created Google Calendar event {event['id']} for user {user.id}")
-            return {'success': True, 'event_id': event['id'], 'event_link': event.get('htmlLink')}
-            
-        except HttpError as e:
-            current_app.logger.error(f"Error creating Google Calendar event for user {user.id}: {str(e)}")
-            return {'success': False, 'error': f'Google Calendar API error: {str(e)}'}
+            for start in range(0, len(writes), self.BATCH_LIMIT):
+                batch = self._new_batch(service)
+                for index in range(start, min(start + self.BATCH_LIMIT, len(writes))):
+                    event_id, body = writes[index]
+                    if event_id is None:
+                        request = service.events().insert(calendarId=calendar_id, body=body)
+                    else:
+                        request = service.events().patch(calendarId=calendar_id, eventId=event_id, body=body)
+                    batch.add(request, callback=collect, request_id=str(index))
+                with track_external('google'):
+                    batch.execute()
         except Exception as e:
-            current_app.logger.error(f"Error creating Google Calendar event for user {user.id}: {str(e)}")
-            return {'success': False, 'error': str(e)}
-    
-    def _match_patient_from_event(self, user: User, event: Dict[str, Any]) -> Optional[Patient]:
-        """Try to match a Google Calendar event with an existing patient"""
-        # Extract attendee emails
-        attendees = event.get('attendees', [])
-        attendee_emails = [attendee.get('email', '').lower() for attendee in attendees if attendee.get('email')]
+            current_app.logger.error(f"Error writing Google Calendar events for user {user.id}: {str(e)}")
+            results = [result or {'success': False, 'error': str(e)} for result in results]
         
-        # Try to match by email first
-        for email in attendee_emails:
-            if email and '@' in email:
-                patient = Patient.query.filter(
-                    Patient.user_id == user.id,
-                    Patient._email.ilike(f'%{email}%')  # Use encrypted field search
-                ).first()
-                if patient:
-                    return patient
-        
-        # Try to match by name in summary or description
-        event_text = f"{event.get('summary', '')} {event.get('description', '')}".lower()
-        patients = Patient.query.filter_by(user_id=user.id).all()
+        credentials = self._credentials_for(user)
+        if credentials is not None:
+            self._store_refreshed_token(user, credentials)
+        written = sum(1 for result in results if result and result['success'])
+        current_app.logger.info(f"Wrote {written} of {len(writes)} Google Calendar events for user {user.id}")
+        return results
+    
+    def create_calendar_event(self, user: User, event_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Create a new event in Google Calendar"""
+        return self.push_events(user, inserts=[event_data])[0]
+    
+    def pushable_treatments(self, user: User) -> List[Treatment]:
+        """The user's scheduled treatments of the next SYNC_DAYS_AHEAD days, except those synced from Google"""
+        now = datetime.utcnow()
+        return (
+            Treatment.query.join(Patient)
+            .filter(Patient.user_id == user.id,
+                    Treatment.status == 'Scheduled',
+                    Treatment.created_at >= now,
+                    Treatment.created_at < now + timedelta(days=self.SYNC_DAYS_AHEAD),
+                    or_(Treatment.google_calendar_event_id.is_(None),
+                        Treatment.google_calendar_event_origin == self.EVENT_FROM_APP))
+            .order_by(Treatment.created_at)
+            .all()
+        )
+    
+    def push_treatments(self, user: User, treatments: List[Treatment]) -> Dict[str, int]:
+        """
+        Create or update the events of treatments in one batched push; stores
+        new event ids. Treatments synced from the user's own events are left
+        alone, so a push never rewrites them.
+        """
+        treatments = [t for t in treatments
+                      if not t.google_calendar_event_id or t.google_calendar_event_origin == self.EVENT_FROM_APP]
+        names = dict(zip(
+            [t.patient_id for t in treatments],
+            decrypt_many([t.patient._name for t in treatments]),
+        )) if treatments else {}
         
-        for patient in patients:
-            if patient.name and patient.name.lower() in event_text:
-                return patient
+        def body(treatment):
+            start = treatment.created_at.replace(tzinfo=timezone.utc)
+            return {
+                'summary': f"{treatment.treatment_type} - {names.get(treatment.patient_id) or ''}".strip(' -'),
+                'start': {'dateTime': start.isoformat(), 'timeZone': 'UTC'},
+                'end': {'dateTime': (start + timedelta(minutes=self.DEFAULT_EVENT_MINUTES)).isoformat(), 'timeZone': 'UTC'},
+            }
         
-        # If no match found, you might want to create an "unmatched" record
-        # similar to how Calendly works, but for now return None
-        return None
+        new = [t for t in treatments if not t.google_calendar_event_id]
+        existing = [t for t in treatments if t.google_calendar_event_id]
+        results = self.push_events(user, inserts=[body(t) for t in new],
+                                   updates={t.google_calendar_event_id: body(t) for t in existing})
+        for treatment, result in zip(new, results):
+            if result['success']:
+                treatment.google_calendar_event_id = result['event_id']
+                treatment.google_calendar_event_origin = self.EVENT_FROM_APP
+                treatment.google_calendar_event_summary = body(treatment)['summary'][:255]
+        db.session.commit()
+        return {
+            'created': sum(1 for result in results[:len(new)] if result['success']),
+            'updated': sum(1 for result in results[len(new):] if result['success']),
+            'failed': sum(1 for result in results if not result['success']),
+        }
+
 
 
 # Initialize the service
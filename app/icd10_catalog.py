@@ -0,0 +1,368 @@
+# app/icd10_catalog.py
+"""
+In-memory ICD-10 reference catalog.
+
+ICD-10 codes, diagnosis templates and pathology guides are reference data
+that changes only when the seed scripts or an admin touch it, yet every
+request used to query it again: get_patient_diagnoses() looked up a template
+and up to four guides per diagnosis, /api/icd10/categories re-counted codes,
+/api/icd10/templates re-sorted by usage.
+
+reference_catalog() returns one immutable snapshot per database, built with
+three queries the first time it is needed:
+- codes by id and by code, and a prefix trie over the active, physiotherapy
+  relevant codes for code-prefix lookups ("M54" -> M54.2, M54.3 ...),
+- category counts and the active templates in usage order, already
+  serialized the way the API returns them,
+- code -> template -> guide resolution, with the same name fallbacks the
+  routes used, a summary of every guide and the names it can be asked for.
+
+A snapshot is replaced when:
+- a session that changed codes, templates or guides commits in this process
+  (ORM events bump a version counter), or
+- the catalog stamp (row counts, highest ids, total template usage and the
+  latest update of a code, template or guide) has changed. The stamp is one
+  query, run at most every ICD10_CATALOG_CHECK_SECONDS, so seed scripts and
+  other worker processes are picked up without a restart.
+"""
+
+import json
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session, object_session
+
+from app import db
+from app.metrics import record_cache
+from app.models_icd10 import DiagnosisTemplate, ICD10Code, PathologyGuide
+
+REFERENCE_MODELS = (ICD10Code, DiagnosisTemplate, PathologyGuide)
+
+# Short descriptions whose guide is stored under another name
+GUIDE_NAME_ALIASES = {
+    'Low back pain': 'Acute Lower Back Pain',
+    'Frozen shoulder': 'Frozen Shoulder',
+    'Tennis elbow': 'Tennis Elbow',
+    'Plantar fasciitis': 'Plantar Fasciitis',
+    'Neck pain': 'Neck Pain/Cervicalgia',
+    'Stiff jaw/TMJ': 'TMJ Dysfunction',
+    'TMJ Dysfunction': 'TMJ Dysfunction',
+}
+
+_CHANGES_KEY = '_icd10_catalog_changed'
+
+
+class CodeEntry:
+    """One ICD-10 code in the catalog"""
+
+    __slots__ = ('id', 'code', 'description', 'short_description', 'category', 'subcategory',
+                 'is_active', 'is_physiotherapy_relevant')
+
+    def __init__(self, id, code, description, short_description, category, subcategory,
+                 is_active, is_physiotherapy_relevant):
+        self.id = id
+        self.code = code
+        self.description = description
+        self.short_description = short_description
+        self.category = category
+        self.subcategory = subcategory
+        self.is_active = is_active
+        self.is_physiotherapy_relevant = is_physiotherapy_relevant
+
+    @property
+    def searchable(self):
+        return bool(self.is_active and self.is_physiotherapy_relevant)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'code': self.code,
+            'description': self.description,
+            'short_description': self.short_description,
+            'category': self.category,
+            'subcategory': self.subcategory,
+        }
+
+    def __repr__(self):
+        return f'<CodeEntry {self.code}>'
+
+
+class CodeTrie:
+    """
+    Prefix trie over codes, one character per level. Codes are kept in one
+    sorted list and each node only stores the [start, end) slice of that list
+    its prefix covers, so a lookup returns codes in order without walking the
+    subtree.
+    """
+
+    __slots__ = ('_codes', '_root')
+
+    def __init__(self, entries):
+        self._codes = sorted(entries, key=lambda entry: entry.code.upper())
+        self._root = self._node(0, len(self._codes))
+        for index, entry in enumerate(self._codes):
+            node = self._root
+            for char in entry.code.upper():
+                child = node[0].get(char)
+                if child is None:
+                    child = node[0][char] = self._node(index, index)
+                child[2] = index + 1
+                node = child
+
+    @staticmethod
+    def _node(start, end):
+        # [children, start, end]; lists keep the nodes small
+        return [{}, start, end]
+
+    def __len__(self):
+        return len(self._codes)
+
+    def prefix(self, prefix, limit=None):
+        """Entries whose code starts with prefix (case-insensitive), in code order"""
+        node = self._root
+        for char in prefix.upper():
+            node = node[0].get(char)
+            if node is None:
+                return []
+        end = node[2] if limit is None else min(node[2], node[1] + limit)
+        return self._codes[node[1]:end]
+
+
+class ReferenceCatalog:
+    """Immutable snapshot of the ICD-10 reference data; share it, never modify it"""
+
+    def __init__(self, codes, templates, guides):
+        self.codes = {entry.id: entry for entry in codes}
+        self.by_code = {entry.code.upper(): entry for entry in codes}
+        self.trie = CodeTrie([entry for entry in codes if entry.searchable])
+
+        counts = {}
+        for entry in codes:
+            if entry.searchable:
+                counts[entry.category] = counts.get(entry.category, 0) + 1
+        self.categories = [{'name': name, 'count': counts[name]}
+                           for name in sorted(counts, key=lambda name: (name is not None, name or ''))]
+
+        # The first template of each code, as DiagnosisTemplate.query.filter_by(...).first() found it
+        self.template_by_code = {}
+        for template in sorted(templates, key=lambda t: t['id']):
+            self.template_by_code.setdefault(template['primary_icd10_code_id'], template)
+        self.templates = {template['id']: template for template in templates}
+        self.active_templates = sorted(
+            (t for t in templates if t['is_active']), key=lambda t: -(t['usage_count'] or 0))
+        self.template_payloads = [self.template_payload(t) for t in self.active_templates]
+        self.usage_by_code = {}
+        for template in self.active_templates:
+            code_id = template['primary_icd10_code_id']
+            self.usage_by_code[code_id] = self.usage_by_code.get(code_id, 0) + (template['usage_count'] or 0)
+
+        self.guides = {guide['id']: guide for guide in guides}
+        self.guides_by_name = {guide['name']: guide for guide in guides}
+        self.guide_by_template = {guide['template_id']: guide for guide in guides if guide['template_id']}
+        # Every name a guide can be asked for -> guide id; guide names win over
+        # template names, which win over the aliases
+        self.guide_aliases = {}
+        for alias, name in GUIDE_NAME_ALIASES.items():
+            if name in self.guides_by_name:
+                self.guide_aliases[alias] = self.guides_by_name[name]['id']
+        for template_id, guide in self.guide_by_template.items():
+            template = self.templates.get(template_id)
+            if template:
+                self.guide_aliases[template['name']] = guide['id']
+        self.guide_aliases.update((guide['name'], guide['id']) for guide in guides)
+        self.guide_by_code = {code_id: self._resolve_guide(entry) for code_id, entry in self.codes.items()}
+
+    def _resolve_guide(self, entry):
+        """(has_guide, template_name) for a code, with the name fallbacks the routes used"""
+        template = self.template_by_code.get(entry.id)
+        if template and template['name'] in self.guides_by_name:
+            return True, template['name']
+        short = entry.short_description
+        variations = [short, short.title() if short else short, entry.description]
+        if short in GUIDE_NAME_ALIASES:
+            variations.insert(0, GUIDE_NAME_ALIASES[short])
+        for variation in variations:
+            if variation in self.guides_by_name:
+                return True, variation
+        return False, short
+
+    def code(self, code):
+        """Entry for a code string (case-insensitive), or None"""
+        return self.by_code.get((code or '').upper())
+
+    def find_guide(self, name):
+        """Guide summary for a guide name, its template's name or an alias"""
+        return self.guides.get(self.guide_aliases.get(name))
+
+    def template_payload(self, template):
+        code = self.codes.get(template['primary_icd10_code_id'])
+        return {
+            'id': template['id'],
+            'name': template['name'],
+            'description': template['description'],
+            'icd10_code': code.code if code else None,
+            'icd10_description': code.short_description if code else None,
+            'default_severity': template['default_severity'],
+            'typical_duration_days': template['typical_duration_days'],
+            'usage_count': template['usage_count'],
+        }
+
+
+def _guide_stats(row):
+    # Same as PathologyGuide.get_summary_stats()
+    try:
+        faqs = json.loads(row.faq_data) if row.faq_data else []
+    except (json.JSONDecodeError, TypeError):
+        faqs = []
+    return {
+        'has_clinical_pearls': bool(row.clinical_pearls),
+        'has_patient_education': bool(row.patient_education),
+        'has_red_flags': bool(row.red_flags),
+        'faq_count': len(faqs),
+        'has_anatomy': bool(row.anatomy_overview),
+        'has_exercises': bool(row.home_exercises),
+    }
+
+
+def build_catalog():
+    """Read the reference tables (three queries) into a new ReferenceCatalog"""
+    codes = [CodeEntry(*row) for row in db.session.execute(select(
+        ICD10Code.id, ICD10Code.code, ICD10Code.description, ICD10Code.short_description,
+        ICD10Code.category, ICD10Code.subcategory, ICD10Code.is_active, ICD10Code.is_physiotherapy_relevant))]
+    templates = [dict(row._mapping) for row in db.session.execute(select(
+        DiagnosisTemplate.id, DiagnosisTemplate.name, DiagnosisTemplate.description,
+        DiagnosisTemplate.primary_icd10_code_id, DiagnosisTemplate.default_severity,
+        DiagnosisTemplate.typical_duration_days, DiagnosisTemplate.common_symptoms,
+        DiagnosisTemplate.treatment_guidelines, DiagnosisTemplate.usage_count, DiagnosisTemplate.is_active))]
+    guides = []
+    for row in db.session.execute(select(
+            PathologyGuide.id, PathologyGuide.name, PathologyGuide.diagnosis_template_id,
+            PathologyGuide.updated_at, PathologyGuide.clinical_pearls, PathologyGuide.patient_education,
+            PathologyGuide.red_flags, PathologyGuide.faq_data, PathologyGuide.anatomy_overview,
+            PathologyGuide.home_exercises)):
+        guides.append({
+            'id': row.id,
+            'name': row.name,
+            'template_id': row.diagnosis_template_id,
+            'updated_at': row.updated_at,
+            'stats': _guide_stats(row),
+        })
+    return ReferenceCatalog(codes, templates, guides)
+
+
+def catalog_stamp():
+    """One query summarizing the reference tables; changes whenever they do"""
+    return tuple(db.session.execute(select(
+        select(func.count(ICD10Code.id)).scalar_subquery(),
+        select(func.max(ICD10Code.id)).scalar_subquery(),
+        select(func.max(ICD10Code.updated_at)).scalar_subquery(),
+        select(func.count(DiagnosisTemplate.id)).scalar_subquery(),
+        select(func.max(DiagnosisTemplate.id)).scalar_subquery(),
+        select(func.sum(DiagnosisTemplate.usage_count)).scalar_subquery(),
+        select(func.max(DiagnosisTemplate.updated_at)).scalar_subquery(),
+        select(func.count(PathologyGuide.id)).scalar_subquery(),
+        select(func.max(PathologyGuide.updated_at)).scalar_subquery(),
+    )).one())
+
+
+class CatalogCache:
+    """Current catalog per database, with the version and stamp it was built at"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}      # key -> (version, stamp, checked_at, catalog)
+        self._version = 0
+
+    @property
+    def version(self):
+        return self._version
+
+    def changed(self):
+        with self._lock:
+            self._version += 1
+
+    def get(self, key):
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key, version, stamp, catalog):
+        with self._lock:
+            self._entries[key] = (version, stamp, time.monotonic(), catalog)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+catalog_cache = CatalogCache()
+
+
+def reference_catalog():
+    """The current ReferenceCatalog, built or refreshed when the data changed"""
+    config = current_app.config
+    if not config.get('ICD10_CATALOG_ENABLED', True):
+        return build_catalog()
+
+    key = str(db.engine.url)
+    version = catalog_cache.version
+    cached = catalog_cache.get(key)
+    if cached is not None and cached[0] == version:
+        if time.monotonic() - cached[2] < config.get('ICD10_CATALOG_CHECK_SECONDS', 60):
+            record_cache('icd10_catalog', True)
+            return cached[3]
+        stamp = catalog_stamp()
+        if stamp == cached[1]:
+            catalog_cache.put(key, version, stamp, cached[3])
+            record_cache('icd10_catalog', True)
+            return cached[3]
+    else:
+        stamp = catalog_stamp()
+
+    record_cache('icd10_catalog', False)
+    catalog = build_catalog()
+    catalog_cache.put(key, version, stamp, catalog)
+    return catalog
+
+
+# Invalidation: note changes to reference rows during a flush and bump the
+# version once the transaction commits
+
+def _reference_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is None:
+        catalog_cache.changed()
+    else:
+        session.info[_CHANGES_KEY] = True
+
+
+def _tables_changed(target, connection, **kw):
+    catalog_cache.changed()
+
+
+for _model in REFERENCE_MODELS:
+    for _event in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event, _reference_changed)
+    # Recreated tables can repeat the old stamp exactly
+    event.listen(_model.__table__, 'after_create', _tables_changed)
+    event.listen(_model.__table__, 'after_drop', _tables_changed)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _bulk_reference_change(orm_execute_state):
+    is_write = orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete
+    mapper = orm_execute_state.bind_mapper
+    if is_write and mapper is not None and mapper.class_ in REFERENCE_MODELS:
+        orm_execute_state.session.info[_CHANGES_KEY] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_reference_changes(session):
+    if session.info.pop(_CHANGES_KEY, None):
+        catalog_cache.changed()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_reference_changes(session):
+    session.info.pop(_CHANGES_KEY, None)
@@ -0,0 +1,323 @@
+# app/icd10_search.py
+"""
+Ranked ICD-10 code search.
+
+ICD10Code.search() and /api/icd10/search used to run ILIKE '%q%' over three
+columns: no index could serve the leading wildcard and matches came back in
+table order. Searches now go through a full-text index kept in sync with
+icd10_codes by the database itself:
+
+- SQLite: an external-content FTS5 table (icd10_codes_fts) maintained by
+  triggers, with prefix indexes for 2 and 3 characters,
+- PostgreSQL: expression GIN indexes on the tsvector and on the lowercased
+  text (pg_trgm), which need no triggers.
+Other databases fall back to the old ILIKE match.
+
+Every word of the query is a prefix ("tend" finds "tendinitis"), and words
+in the user's language are expanded with English synonyms ("hombro" finds
+"shoulder"). If a search finds fewer codes than asked for, misspelt words are
+corrected against the index vocabulary and the search is repeated.
+
+Code-like queries ("M54") also take the codes of that block from the
+reference catalog's prefix trie. Candidates are ranked by text relevance,
+then boosted for an exact code or code prefix match and for codes used by
+popular diagnosis templates (template usage is read from the catalog too).
+"""
+
+import difflib
+import math
+import re
+import unicodedata
+
+from sqlalchemy import event, or_, select, text
+
+from app import db
+from app.icd10_catalog import reference_catalog
+from app.models_icd10 import ICD10Code
+
+FTS_TABLE = 'icd10_codes_fts'
+
+SQLITE_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "code, description, short_description, content='icd10_codes', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE}_vocab USING fts5vocab({FTS_TABLE}, 'row')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON icd10_codes BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, code, description, short_description) "
+    "VALUES (new.id, new.code, new.description, new.short_description); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON icd10_codes BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, code, description, short_description) "
+    "VALUES ('delete', old.id, old.code, old.description, old.short_description); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE ON icd10_codes BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, code, description, short_description) "
+    "VALUES ('delete', old.id, old.code, old.description, old.short_description); "
+    f"INSERT INTO {FTS_TABLE}(rowid, code, description, short_description) "
+    "VALUES (new.id, new.code, new.description, new.short_description); END",
+)
+SQLITE_DROP = (
+    f"DROP TABLE IF EXISTS {FTS_TABLE}_vocab",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+)
+
+# Must match the index expressions below for the planner to use them
+PG_DOCUMENT = "coalesce(code, '') || ' ' || coalesce(description, '') || ' ' || coalesce(short_description, '')"
+PG_TEXT = "lower(coalesce(description, '') || ' ' || coalesce(short_description, ''))"
+POSTGRES_DDL = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX IF NOT EXISTS idx_icd10_fts ON icd10_codes USING gin (to_tsvector('simple', {PG_DOCUMENT}))",
+    f"CREATE INDEX IF NOT EXISTS idx_icd10_trgm ON icd10_codes USING gin (({PG_TEXT}) gin_trgm_ops)",
+)
+
+CODE_PATTERN = re.compile(r'^[A-Z][0-9][0-9A-Z.]*$')
+WORD_PATTERN = re.compile(r'\w+')
+
+# Ranking weights
+EXACT_CODE_BOOST = 100.0
+CODE_PREFIX_BOOST = 20.0
+USAGE_WEIGHT = 1.0          # Per log(1 + template uses)
+CORRECTED_PENALTY = 0.5     # Matches found only after spelling correction
+CANDIDATE_FACTOR = 5        # Candidates read per result asked for
+
+# Words in the supported locales (without accents) and the English terms the
+# catalog uses for them
+SYNONYMS = {
+    'es': {
+        'dolor': 'pain', 'espalda': 'back', 'lumbar': 'lumbar', 'lumbalgia': 'low back pain',
+        'cuello': 'neck', 'hombro': 'shoulder', 'codo': 'elbow', 'muneca': 'wrist', 'mano': 'hand',
+        'cadera': 'hip', 'rodilla': 'knee', 'tobillo': 'ankle', 'pie': 'foot', 'mandibula': 'jaw',
+        'esguince': 'sprain', 'rotura': 'tear', 'desgarro': 'tear', 'artrosis': 'osteoarthritis',
+        'ciatica': 'sciatica', 'hernia': 'displacement', 'disco': 'disc', 'fascitis': 'fasciitis',
+        'tendinopatia': 'tendinitis', 'tendinitis': 'tendinitis', 'bursitis': 'bursitis',
+        'hombro congelado': 'adhesive capsulitis', 'epicondilitis': 'epicondylitis',
+        'cefalea': 'headache', 'escoliosis': 'scoliosis', 'fractura': 'fracture',
+    },
+    'fr': {
+        'douleur': 'pain', 'dos': 'back', 'lombalgie': 'low back pain', 'cou': 'neck',
+        'epaule': 'shoulder', 'coude': 'elbow', 'poignet': 'wrist', 'main': 'hand', 'hanche': 'hip',
+        'genou': 'knee', 'cheville': 'ankle', 'pied': 'foot', 'machoire': 'jaw', 'entorse': 'sprain',
+        'dechirure': 'tear', 'arthrose': 'osteoarthritis', 'sciatique': 'sciatica',
+        'hernie': 'displacement', 'disque': 'disc', 'fasciite': 'fasciitis', 'tendinite': 'tendinitis',
+        'bursite': 'bursitis', 'cephalee': 'headache', 'scoliose': 'scoliosis', 'fracture': 'fracture',
+    },
+    'it': {
+        'dolore': 'pain', 'schiena': 'back', 'lombalgia': 'low back pain', 'collo': 'neck',
+        'spalla': 'shoulder', 'gomito': 'elbow', 'polso': 'wrist', 'mano': 'hand', 'anca': 'hip',
+        'ginocchio': 'knee', 'caviglia': 'ankle', 'piede': 'foot', 'mandibola': 'jaw',
+        'distorsione': 'sprain', 'lesione': 'tear', 'artrosi': 'osteoarthritis', 'sciatica': 'sciatica',
+        'ernia': 'displacement', 'disco': 'disc', 'fascite': 'fasciitis', 'tendinite': 'tendinitis',
+        'borsite': 'bursitis', 'cefalea': 'headache', 'scoliosi': 'scoliosis', 'frattura': 'fracture',
+    },
+}
+
+
+def install_search_index(connection):
+    """Create the dialect's full-text index objects (idempotent)"""
+    statements = {'sqlite': SQLITE_DDL, 'postgresql': POSTGRES_DDL}.get(connection.dialect.name, ())
+    for statement in statements:
+        connection.exec_driver_sql(statement)
+
+
+def _drop_search_index(connection):
+    # The FTS5 table outlives icd10_codes and would keep a stale index
+    if connection.dialect.name == 'sqlite':
+        for statement in SQLITE_DROP:
+            connection.exec_driver_sql(statement)
+
+
+event.listen(ICD10Code.__table__, 'after_create', lambda target, connection, **kw: install_search_index(connection))
+event.listen(ICD10Code.__table__, 'before_drop', lambda target, connection, **kw: _drop_search_index(connection))
+
+
+def _fold(value):
+    """Lowercase without accents, as the index tokenizes"""
+    decomposed = unicodedata.normalize('NFKD', value.lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _synonyms(locale):
+    if locale:
+        return SYNONYMS.get(str(locale).split('_')[0], {})
+    merged = {}
+    for terms in SYNONYMS.values():
+        merged.update(terms)
+    return merged
+
+
+def parse_query(query, locale=None):
+    """
+    Word groups for a query: each group is the word itself plus any English
+    synonym phrases. Multi-word synonym keys ("hombro congelado") are matched
+    before single words.
+    """
+    folded = _fold(query)
+    synonyms = _synonyms(locale)
+    groups = []
+    for phrase, english in synonyms.items():
+        if ' ' in phrase and phrase in folded:
+            folded = folded.replace(phrase, ' ')
+            groups.append({'words': [], 'phrases': [english.split()]})
+    for word in WORD_PATTERN.findall(folded):
+        phrases = [synonyms[word].split()] if word in synonyms and synonyms[word] != word else []
+        groups.append({'words': [word], 'phrases': phrases})
+    return groups
+
+
+def _code_prefix(query):
+    candidate = query.strip().upper()
+    return candidate if CODE_PATTERN.match(candidate) else None
+
+
+def _fts5_match(groups):
+    clauses = []
+    for group in groups:
+        options = [f'"{word}"*' for word in group['words']]
+        options += ['(' + ' AND '.join(f'"{w}"' for w in phrase) + ')' for phrase in group['phrases']]
+        if options:
+            clauses.append('(' + ' OR '.join(options) + ')')
+    return ' AND '.join(clauses)
+
+
+def _tsquery(groups):
+    clauses = []
+    for group in groups:
+        options = [f'{word}:*' for word in group['words']]
+        options += ['(' + ' & '.join(phrase) + ')' for phrase in group['phrases']]
+        if options:
+            clauses.append('(' + ' | '.join(options) + ')')
+    return ' & '.join(clauses)
+
+
+def _has_fts_table():
+    # Databases created before the index existed search with ILIKE until
+    # `flask db upgrade`; only a positive answer is remembered
+    url = str(db.engine.url)
+    if url not in _fts_installed:
+        found = db.session.execute(text("SELECT count(*) FROM sqlite_master WHERE name = :name"),
+                                   {'name': FTS_TABLE}).scalar()
+        if not found:
+            return False
+        _fts_installed.add(url)
+    return True
+
+
+_fts_installed = set()
+
+
+def _text_candidates(groups, limit):
+    """{code id: text score} of the best full-text matches (higher is better)"""
+    if not groups:
+        return {}
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite' and _has_fts_table():
+        rows = db.session.execute(text(
+            f"SELECT rowid, -bm25({FTS_TABLE}, 5.0, 1.0, 2.0) AS score FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH :match ORDER BY score DESC LIMIT :limit"
+        ), {'match': _fts5_match(groups), 'limit': limit})
+    elif dialect == 'postgresql':
+        rows = db.session.execute(text(
+            f"SELECT id, ts_rank(to_tsvector('simple', {PG_DOCUMENT}), to_tsquery('simple', :query)) * 10 AS score "
+            f"FROM icd10_codes WHERE to_tsvector('simple', {PG_DOCUMENT}) @@ to_tsquery('simple', :query) "
+            "ORDER BY score DESC LIMIT :limit"
+        ), {'query': _tsquery(groups), 'limit': limit})
+    else:
+        conditions = []
+        for group in groups:
+            terms = group['words'] + [' '.join(phrase) for phrase in group['phrases']]
+            conditions.append(or_(*(column.ilike(f'%{term}%') for term in terms
+                                    for column in (ICD10Code.code, ICD10Code.description,
+                                                   ICD10Code.short_description))))
+        rows = db.session.execute(select(ICD10Code.id, 1.0).where(*conditions).limit(limit))
+    return {row[0]: float(row[1]) for row in rows}
+
+
+def _vocabulary(words):
+    """Indexed words that could be corrections of the given ones, read with one query"""
+    dialect = db.engine.dialect.name
+    params = {}
+    if dialect == 'sqlite' and _has_fts_table():
+        # Words of a similar length starting with the same letter keep the scan small
+        ranges = []
+        for n, word in enumerate(words):
+            ranges.append(f"(term >= :first{n} AND term < :after{n} AND length(term) BETWEEN :short{n} AND :long{n})")
+            params.update({f'first{n}': word[0], f'after{n}': chr(ord(word[0]) + 1),
+                           f'short{n}': len(word) - 2, f'long{n}': len(word) + 2})
+        return db.session.scalars(text(
+            f"SELECT term FROM {FTS_TABLE}_vocab WHERE " + ' OR '.join(ranges)), params).all()
+    if dialect == 'postgresql':
+        similar = []
+        for n, word in enumerate(words):
+            similar.append(f":word{n} <% {PG_TEXT}")
+            params[f'word{n}'] = word
+        return db.session.scalars(text(
+            f"SELECT DISTINCT regexp_split_to_table({PG_TEXT}, '\\W+') FROM icd10_codes "
+            "WHERE " + ' OR '.join(similar) + " LIMIT 500"), params).all()
+    return []
+
+
+def _corrected(groups):
+    """The groups with close indexed words added to misspelt ones, or None"""
+    words = sorted({word for group in groups for word in group['words'] if len(word) >= 4})
+    vocabulary = _vocabulary(words) if words else []
+    if not vocabulary:
+        return None
+    known = set(vocabulary)
+    changed = False
+    corrected = []
+    for group in groups:
+        alternatives = []
+        for word in group['words']:
+            alternatives.append(word)
+            if len(word) >= 4 and word not in known:
+                matches = difflib.get_close_matches(word, vocabulary, n=3, cutoff=0.75)
+                changed = changed or bool(matches)
+                alternatives.extend(matches)
+        corrected.append({'words': alternatives, 'phrases': group['phrases']})
+    return corrected if changed else None
+
+
+def search_codes(query, limit=20, category=None, locale=None):
+    """
+    Active, physiotherapy-relevant codes matching query, best first.
+
+    Returns up to `limit` ICD10Code objects. `locale` selects the synonym set
+    (all of them when None).
+    """
+    query = (query or '').strip()
+    if not query:
+        return []
+    catalog = reference_catalog()
+    candidates_wanted = limit * CANDIDATE_FACTOR
+    groups = parse_query(query, locale)
+    scores = _text_candidates(groups, candidates_wanted)
+    if len(scores) < limit:
+        corrected = _corrected(groups)
+        if corrected:
+            for code_id, score in _text_candidates(corrected, candidates_wanted).items():
+                scores.setdefault(code_id, score * CORRECTED_PENALTY)
+
+    prefix = _code_prefix(query)
+    if prefix:
+        # Code blocks come from the reference catalog's prefix trie
+        for entry in catalog.trie.prefix(prefix, limit=candidates_wanted):
+            scores.setdefault(entry.id, 0.0)
+    if not scores:
+        return []
+
+    filters = [ICD10Code.id.in_(scores), ICD10Code.is_active == True, ICD10Code.is_physiotherapy_relevant == True]
+    if category:
+        filters.append(ICD10Code.category == category)
+    codes = ICD10Code.query.filter(*filters).all()
+    usage = catalog.usage_by_code
+
+    def rank(code):
+        score = USAGE_WEIGHT * math.log1p(usage.get(code.id, 0))
+        if prefix and code.code.upper() == prefix:
+            score += EXACT_CODE_BOOST
+        elif prefix and code.code.upper().startswith(prefix):
+            # Within a code block, list codes in order rather than by text score
+            score += CODE_PREFIX_BOOST
+        else:
+            score += scores.get(code.id, 0.0)
+        return -score, code.code
+
+    return sorted(codes, key=rank)[:limit]
@@ -0,0 +1,72 @@
+# app/integrations.py
+"""
+Lazily imported third-party integrations.
+
+Stripe, xhtml2pdf, the Google API clients and markdown take about 1.3s to
+import together, yet most requests, CLI commands and worker boots never use
+them. Modules import these facades instead of the libraries:
+
+    from app.integrations import stripe
+    stripe.checkout.Session.create(...)
+
+The library is imported on first attribute access. Attributes set before that
+(stripe.api_key in create_app()) are remembered and applied once it loads.
+Tests can keep patching the real modules (patch('stripe.Webhook...')):
+attributes are looked up on the real module at every access.
+"""
+
+import importlib
+import threading
+
+
+class LazyModule:
+    """Stands in for a module until one of its attributes is used"""
+
+    def __init__(self, name):
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_module', None)
+        object.__setattr__(self, '_pending', {})
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            with self._lock:
+                module = self._module
+                if module is None:
+                    module = importlib.import_module(self._name)
+                    for attr, value in self._pending.items():
+                        setattr(module, attr, value)
+                    self._pending.clear()
+                    object.__setattr__(self, '_module', module)
+        return module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        if self._module is None and attr in self._pending:
+            return self._pending[attr]
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        with self._lock:
+            if self._module is None:
+                self._pending[attr] = value
+                return
+        setattr(self._module, attr, value)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f'<LazyModule {self._name} ({state})>'
+
+
+stripe = LazyModule('stripe')
+markdown = LazyModule('markdown')
+pisa = LazyModule('xhtml2pdf.pisa')
+google_credentials = LazyModule('google.oauth2.credentials')
+google_oauth_flow = LazyModule('google_auth_oauthlib.flow')
+google_discovery = LazyModule('googleapiclient.discovery')
+google_errors = LazyModule('googleapiclient.errors')
+google_http = LazyModule('googleapiclient.http')
@@ -0,0 +1,320 @@
+"""
+Encryption key rotation for all encrypted columns.
+
+Re-encrypts every Fernet-encrypted value from the old keys to the new primary key
+using MultiFernet.rotate(). The id space of each table is split into fixed-width
+primary-key ranges which are fanned out to a process pool; each range is read,
+rotated and written back with one batched UPDATE in its own short transaction.
+Completed ranges are recorded in a JSON checkpoint so an interrupted rotation can
+be resumed without redoing finished work.
+
+Used by the ``flask crypto rotate`` and ``flask crypto benchmark`` commands.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+from sqlalchemy import create_engine, select, update, bindparam, func, table, column
+
+from app.crypto_utils import parse_key_list
+
+# Encrypted columns by table, using the database column names
+# (Patient._name is stored in "name", Treatment._notes in "notes", ...)
+ENCRYPTED_COLUMNS = {
+    'patient': ['name', 'email', 'phone', 'notes', 'anamnesis', 'referred_by_name'],
+    'treatment': ['notes'],
+    'user': [
+        'calendly_api_token_encrypted',
+        'google_calendar_token_encrypted',
+        'google_calendar_refresh_token_encrypted',
+        'google_calendar_client_secret_encrypted',
+    ],
+    'calendly_webhook_event': ['payload'],
+}
+
+DEFAULT_BATCH_SIZE = 500
+
+# One engine per worker process, created lazily on first use
+_worker_engines = {}
+
+
+def rotation_cipher(primary_key, old_keys=None):
+    """Build a MultiFernet that encrypts with primary_key and accepts any of old_keys."""
+    keys = [primary_key] + parse_key_list(old_keys)
+    return MultiFernet([Fernet(k.encode() if isinstance(k, str) else k) for k in keys])
+
+
+def key_fingerprint(key):
+    """Short, non-reversible identifier for a key (stored in the checkpoint file)."""
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def rotate_value(cipher, value):
+    """
+    Re-encrypt a single stored value. Returns the rotated value, or None if the value
+    is empty, plaintext, or was not encrypted with any of the cipher's keys.
+    """
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        token = base64.b64decode(value.encode(), validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    try:
+        rotated = cipher.rotate(token)
+    except InvalidToken:
+        return None
+    return base64.b64encode(rotated).decode()
+
+
+def _get_worker_engine(db_uri):
+    engine = _worker_engines.get(db_uri)
+    if engine is None:
+        connect_args = {'timeout': 30} if db_uri.startswith('sqlite') else {}
+        engine = create_engine(db_uri, connect_args=connect_args)
+        _worker_engines[db_uri] = engine
+    return engine
+
+
+def rotate_range(db_uri, table_name, columns, lo, hi, primary_key, old_keys):
+    """
+    Rotate all rows with lo <= id < hi in one transaction.
+    Runs inside a pool worker, so it only takes picklable arguments.
+    Returns (table_name, lo, hi, rows_scanned, rows_rotated).
+    """
+    cipher = rotation_cipher(primary_key, old_keys)
+    tbl = table(table_name, column('id'), *[column(c) for c in columns])
+    engine = _get_worker_engine(db_uri)
+
+    with engine.begin() as conn:
+        rows = conn.execute(
+            select(tbl).where(tbl.c.id >= lo, tbl.c.id < hi)
+        ).mappings().all()
+
+        params = []
+        for row in rows:
+            values = {}
+            changed = False
+            for col in columns:
+                rotated = rotate_value(cipher, row[col])
+                if rotated is not None:
+                    changed = True
+                    values['v_' + col] = rotated
+                else:
+                    values['v_' + col] = row[col]
+            if changed:
+                values['_id'] = row['id']
+                params.append(values)
+
+        if params:
+            stmt = (
+                update(tbl)
+                .where(tbl.c.id == bindparam('_id'))
+                .values({col: bindparam('v_' + col) for col in columns})
+            )
+            conn.execute(stmt, params)
+
+    return table_name, lo, hi, len(rows), len(params)
+
+
+def iter_pk_ranges(engine, table_name, batch_size):
+    """Yield (lo, hi) half-open primary-key ranges covering the table's id space."""
+    tbl = table(table_name, column('id'))
+    with engine.connect() as conn:
+        lo, hi = conn.execute(select(func.min(tbl.c.id), func.max(tbl.c.id))).one()
+    if lo is None:
+        return
+    start = lo
+    while start <= hi:
+        yield start, start + batch_size
+        start += batch_size
+
+
+class RotationCheckpoint:
+    """
+    JSON file recording which primary-key ranges have been rotated to which key.
+    A checkpoint written for a different target key is ignored.
+    """
+
+    def __init__(self, path, primary_key):
+        self.path = path
+        self.fingerprint = key_fingerprint(primary_key)
+        self.done = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {}
+            if data.get('key') == self.fingerprint:
+                self.done = {
+                    name: {tuple(r) for r in ranges}
+                    for name, ranges in data.get('tables', {}).items()
+                }
+
+    def is_done(self, table_name, lo, hi):
+        return (lo, hi) in self.done.get(table_name, ())
+
+    def mark_done(self, table_name, lo, hi):
+        self.done.setdefault(table_name, set()).add((lo, hi))
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        data = {
+            'key': self.fingerprint,
+            'tables': {name: sorted(ranges) for name, ranges in self.done.items()},
+        }
+        # Write to a temp file and rename so an interruption never leaves a torn checkpoint
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.done = {}
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def rotate_encrypted_columns(db_uri, primary_key, old_keys=None, workers=None,
+                             batch_size=DEFAULT_BATCH_SIZE, checkpoint_path=None,
+                             tables=None, progress=None):
+    """
+    Re-encrypt every encrypted column in the database at db_uri to primary_key.
+
+    Args:
+        db_uri (str): SQLAlchemy database URI
+        primary_key (str): The new Fernet key
+        old_keys (str|list): Previous keys (comma-separated string or list)
+        workers (int): Process pool size; 0 or 1 runs everything in-process
+        batch_size (int): Width of each primary-key range
+        checkpoint_path (str): Where to record progress; None disables resuming
+        tables (list): Restrict to these table names (default: all of ENCRYPTED_COLUMNS)
+        progress (callable): Called with (table_name, lo, hi, scanned, rotated) per range
+
+    Returns:
+        dict with rows_scanned, rows_rotated, ranges_processed, ranges_skipped,
+        elapsed_seconds and rows_per_second
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    old_keys = parse_key_list(old_keys)
+    # Validate keys up front rather than inside every worker
+    rotation_cipher(primary_key, old_keys)
+
+    selected = {
+        name: cols for name, cols in ENCRYPTED_COLUMNS.items()
+        if not tables or name in tables
+    }
+    checkpoint = RotationCheckpoint(checkpoint_path, primary_key)
+    engine = _get_worker_engine(db_uri)
+
+    stats = {
+        'rows_scanned': 0,
+        'rows_rotated': 0,
+        'ranges_processed': 0,
+        'ranges_skipped': 0,
+    }
+
+    def pending_ranges():
+        for table_name, cols in selected.items():
+            for lo, hi in iter_pk_ranges(engine, table_name, batch_size):
+                if checkpoint.is_done(table_name, lo, hi):
+                    stats['ranges_skipped'] += 1
+                    continue
+                yield table_name, cols, lo, hi
+
+    def record(result):
+        table_name, lo, hi, scanned, rotated = result
+        checkpoint.mark_done(table_name, lo, hi)
+        stats['rows_scanned'] += scanned
+        stats['rows_rotated'] += rotated
+        stats['ranges_processed'] += 1
+        if progress:
+            progress(table_name, lo, hi, scanned, rotated)
+
+    started = time.perf_counter()
+
+    if workers <= 1:
+        for table_name, cols, lo, hi in pending_ranges():
+            record(rotate_range(db_uri, table_name, cols, lo, hi, primary_key, old_keys))
+    else:
+        # Don't let forked workers inherit pooled connections from the parent
+        engine.dispose()
+        max_in_flight = workers * 4
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            in_flight = set()
+            for table_name, cols, lo, hi in pending_ranges():
+                in_flight.add(pool.submit(
+                    rotate_range, db_uri, table_name, cols, lo, hi, primary_key, old_keys
+                ))
+                if len(in_flight) >= max_in_flight:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        record(future.result())
+            for future in in_flight:
+                record(future.result())
+
+    elapsed = time.perf_counter() - started
+    stats['elapsed_seconds'] = elapsed
+    stats['rows_per_second'] = stats['rows_scanned'] / elapsed if elapsed > 0 else 0.0
+    return stats
+
+
+def create_benchmark_database(path, rows, key):
+    """Create a SQLite file with `rows` patients whose encrypted columns use `key`."""
+    engine = create_engine('sqlite:///' + path)
+    cipher = Fernet(key.encode())
+
+    def enc(text):
+        return base64.b64encode(cipher.encrypt(text.encode())).decode()
+
+    cols = ENCRYPTED_COLUMNS['patient']
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            'CREATE TABLE patient (id INTEGER PRIMARY KEY, '
+            + ', '.join(f'{c} TEXT' for c in cols) + ')'
+        )
+        tbl = table('patient', column('id'), *[column(c) for c in cols])
+        conn.execute(tbl.insert(), [
+            {
+                'id': i,
+                'name': enc(f'Patient {i}'),
+                'email': enc(f'patient{i}@example.com'),
+                'phone': enc(f'+34 600 {i:06d}'),
+                'notes': enc(f'Notes for patient {i}'),
+                'anamnesis': enc(f'Clinical history for patient {i}'),
+                'referred_by_name': None,
+            }
+            for i in range(1, rows + 1)
+        ])
+    engine.dispose()
+
+
+def benchmark_rotation(rows=10000, workers=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Rotate a synthetic patient table in a temporary SQLite file and return the stats."""
+    old_key = Fernet.generate_key().decode()
+    new_key = Fernet.generate_key().decode()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'rotation_benchmark.db')
+        create_benchmark_database(path, rows, old_key)
+        db_uri = 'sqlite:///' + path
+        try:
+            return rotate_encrypted_columns(
+                db_uri, new_key, [old_key], workers=workers,
+                batch_size=batch_size, tables=['patient']
+            )
+        finally:
+            engine = _worker_engines.pop(db_uri, None)
+            if engine is not None:
+                engine.dispose()
@@ -0,0 +1,203 @@
+# app/maintenance.py
+"""
+Maintenance jobs.
+
+mark_past_treatments_as_completed() used to load every past 'Scheduled'
+treatment and flip its status one object at a time, and
+mark_inactive_patients() ran a "latest treatment" query per active patient.
+Each is now a MaintenanceJob: a single set-based UPDATE ... WHERE (with a
+correlated MAX(created_at) subquery for inactivity), run over the table in
+primary-key ranges of `chunk_size` rows with a commit after each range, so
+no lock is held for the whole table.
+
+Runs started from `flask maintenance run` or the in-process scheduler are
+recorded in maintenance_job_run (start, duration, rows affected, status).
+The scheduler (MAINTENANCE_SCHEDULER_ENABLED) wakes every
+MAINTENANCE_SCHEDULER_POLL_SECONDS and runs the jobs whose interval has
+passed since their last recorded run; cron can do the same with
+`flask maintenance run --due`. The jobs are idempotent, so two workers
+running the same job at once only repeat an UPDATE that matches nothing.
+"""
+
+import threading
+import time as clock
+from datetime import datetime, time, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, func, or_, select, update
+
+from app import db
+from app.models import MaintenanceJobRun, Patient, Treatment
+
+DEFAULT_CHUNK_SIZE = 1000
+INACTIVE_AFTER_DAYS = 60
+
+
+class MaintenanceJob:
+    """
+    One status transition: set `values` on every row of `model` that matches
+    `condition(today, user_id)`. `interval` is how often the scheduler runs it.
+    """
+
+    def __init__(self, name, description, model, values, condition, interval):
+        self.name = name
+        self.description = description
+        self.model = model
+        self.values = values
+        self.condition = condition
+        self.interval = interval
+
+    def ranges(self, where, chunk_size):
+        """Primary-key ranges [low, high] of at most chunk_size ids covering the matching rows"""
+        pk = self.model.id
+        low, high = db.session.execute(select(func.min(pk), func.max(pk)).where(where)).one()
+        if low is None:
+            return
+        while low <= high:
+            yield low, min(low + chunk_size - 1, high)
+            low += chunk_size
+
+    def run(self, user_id=None, chunk_size=DEFAULT_CHUNK_SIZE, today=None):
+        """Apply the transition; returns (rows updated, chunks)"""
+        today = today or datetime.now().date()
+        where = self.condition(today, user_id)
+        pk = self.model.id
+        rows = chunks = 0
+        try:
+            for low, high in list(self.ranges(where, chunk_size)):
+                result = db.session.execute(
+                    update(self.model).where(pk.between(low, high), where).values(**self.values)
+                    .execution_options(synchronize_session=False)
+                )
+                db.session.commit()
+                rows += result.rowcount
+                chunks += 1
+        except Exception:
+            db.session.rollback()
+            raise
+        return rows, chunks
+
+
+def _past_treatments(today, user_id):
+    where = and_(Treatment.status == 'Scheduled', Treatment.created_at < datetime.combine(today, time.min))
+    if user_id:
+        where = and_(where, Treatment.patient_id.in_(select(Patient.id).where(Patient.user_id == user_id)))
+    return where
+
+
+def _inactive_patients(today, user_id):
+    cutoff = datetime.combine(today - timedelta(days=INACTIVE_AFTER_DAYS), time.min)
+    latest = (
+        select(func.max(Treatment.created_at))
+        .where(Treatment.patient_id == Patient.id)
+        .correlate(Patient)
+        .scalar_subquery()
+    )
+    where = and_(Patient.status == 'Active', or_(latest.is_(None), latest < cutoff))
+    if user_id:
+        where = and_(where, Patient.user_id == user_id)
+    return where
+
+
+JOBS = {
+    job.name: job for job in (
+        MaintenanceJob('complete-past-treatments', "Mark past 'Scheduled' treatments as 'Completed'",
+                       Treatment, {'status': 'Completed'}, _past_treatments, timedelta(hours=1)),
+        MaintenanceJob('mark-inactive-patients',
+                       f"Mark patients without a treatment in {INACTIVE_AFTER_DAYS} days as 'Inactive'",
+                       Patient, {'status': 'Inactive'}, _inactive_patients, timedelta(days=1)),
+    )
+}
+
+
+def run_job(name, chunk_size=None, user_id=None):
+    """Run a job and record it in maintenance_job_run; returns the run (failed runs are recorded too)"""
+    job = JOBS[name]
+    chunk_size = chunk_size or current_app.config.get('MAINTENANCE_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    run = MaintenanceJobRun(job=name, started_at=datetime.utcnow(), status='running')
+    db.session.add(run)
+    db.session.commit()
+    run_id = run.id
+    started = clock.perf_counter()
+    try:
+        rows, chunks = job.run(user_id=user_id, chunk_size=chunk_size)
+    except Exception as e:
+        current_app.logger.error(f"Maintenance job {name} failed: {e}")
+        run = db.session.get(MaintenanceJobRun, run_id)
+        run.status, run.error = 'failed', str(e)[:1000]
+        rows = chunks = None
+    else:
+        run = db.session.get(MaintenanceJobRun, run_id)
+        run.status = 'succeeded'
+        current_app.logger.info("Maintenance job %s updated %s rows in %s chunks", name, rows, chunks)
+    run.rows_affected, run.chunks = rows, chunks
+    run.finished_at = datetime.utcnow()
+    run.duration_ms = round((clock.perf_counter() - started) * 1000, 1)
+    db.session.commit()
+    return run
+
+
+def last_runs():
+    """Latest run of each job, by job name"""
+    latest = (
+        select(MaintenanceJobRun.job, func.max(MaintenanceJobRun.id).label('id'))
+        .group_by(MaintenanceJobRun.job)
+        .subquery()
+    )
+    runs = db.session.scalars(select(MaintenanceJobRun).join(latest, MaintenanceJobRun.id == latest.c.id))
+    return {run.job: run for run in runs}
+
+
+def due_jobs(now=None):
+    """Names of the jobs whose interval has passed since their last run started"""
+    now = now or datetime.utcnow()
+    runs = last_runs()
+    return [name for name, job in JOBS.items()
+            if name not in runs or runs[name].started_at + job.interval <= now]
+
+
+def run_due_jobs():
+    return [run_job(name) for name in due_jobs()]
+
+
+class MaintenanceScheduler:
+    """Daemon thread that runs due maintenance jobs while the app is up"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._thread = None
+        self._stop = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['maintenance_scheduler'] = self
+        if app.config.get('MAINTENANCE_SCHEDULER_ENABLED') and not app.config.get('TESTING'):
+            self.start()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='maintenance-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def tick(self):
+        """Run the due jobs once; returns their names"""
+        with self.app.app_context():
+            try:
+                return [run.job for run in run_due_jobs()]
+            except Exception as e:
+                # Missing table before `flask db upgrade`, or the database is down
+                self.app.logger.warning(f"Maintenance scheduler could not run jobs: {e}")
+                return []
+            finally:
+                db.session.remove()
+
+    def _loop(self):
+        poll = self.app.config.get('MAINTENANCE_SCHEDULER_POLL_SECONDS', 60)
+        while not self._stop.wait(poll):
+            self.tick()
@@ -0,0 +1,498 @@
+# app/metrics.py
+"""
+In-process metrics registry with Prometheus text exposition.
+
+Counters, gauges and fixed-bucket histograms are kept in memory behind a lock.
+When METRICS_DIR is set (required when running several gunicorn workers), every
+process periodically writes its values to METRICS_DIR/metrics_<pid>.json and
+/metrics merges all files: counters and histograms are summed across processes
+(including exited ones), gauges only across processes that are still alive.
+Gauges read from shared state (the job queue tables) are given a function
+instead: it runs in the collecting process and is never written to disk.
+
+Usage:
+    from app.metrics import track_external, CACHE_REQUESTS
+
+    with track_external('calendly'):
+        response = requests.get(...)
+    CACHE_REQUESTS.inc(cache='patient_directory', result='hit')
+"""
+
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request, current_app, has_app_context
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labelnames, labels):
+    missing = set(labelnames) - set(labels)
+    extra = set(labels) - set(labelnames)
+    if missing or extra:
+        raise ValueError(f"Expected labels {labelnames}, got {sorted(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def _snapshot_values(self):
+        return {json.dumps(list(key)): value for key, value in self.values.items()}
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = _label_key(self.labelnames, labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+            self.registry.dirty = True
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+    type = 'gauge'
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        super().__init__(registry, name, documentation, labelnames)
+        self.function = None
+
+    def set_function(self, function):
+        """
+        Read the gauge from function() whenever metrics are collected instead of
+        set(); function returns {label value tuple: value}. The values are not
+        per process, so they are neither flushed to disk nor summed.
+        """
+        self.function = function
+
+    def _snapshot_values(self):
+        return {} if self.function is not None else super()._snapshot_values()
+
+    def read_function(self):
+        try:
+            return {tuple(str(v) for v in key): float(value) for key, value in self.function().items()}
+        except Exception as e:
+            if has_app_context():
+                current_app.logger.warning(f"Could not read {self.name}: {str(e)}")
+            return {}
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.registry.lock:
+            self.values[key] = float(value)
+            self.registry.dirty = True
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+            self.registry.dirty = True
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Observations counted into fixed buckets, plus their sum and count"""
+    type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.registry.lock:
+            # [count per bucket..., count above the last bucket, sum]
+            state = self.values.get(key)
+            if state is None:
+                state = [0] * (len(self.buckets) + 1) + [0.0]
+                self.values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            else:
+                state[len(self.buckets)] += 1
+            state[-1] += value
+            self.registry.dirty = True
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+class MetricsRegistry:
+    """Holds all metrics of this process and merges them with other worker processes"""
+
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.lock = threading.RLock()
+        self.metrics = {}
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.dirty = False
+        self._last_flush = 0.0
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = cls(self, name, documentation, labelnames, **kwargs)
+                self.metrics[name] = metric
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} already registered with a different type or labels")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def reset(self):
+        """Drop all recorded values (metric definitions are kept)"""
+        with self.lock:
+            for metric in self.metrics.values():
+                metric.values = {}
+            self.dirty = True
+
+    # ------------------------------------------------------------------
+    # Multi-process aggregation
+    # ------------------------------------------------------------------
+
+    def snapshot(self):
+        """This process's values in the on-disk format"""
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'metrics': {
+                    name: {
+                        'type': metric.type,
+                        'values': {k: (list(v) if isinstance(v, list) else v)
+                                   for k, v in metric._snapshot_values().items()},
+                    }
+                    for name, metric in self.metrics.items()
+                },
+            }
+
+    def _path_for(self, pid):
+        return os.path.join(self.directory, f'metrics_{pid}.json')
+
+    def flush(self, force=False):
+        """Write this process's values to METRICS_DIR, at most once per flush_interval"""
+        if not self.directory:
+            return False
+        now = time.monotonic()
+        if not force and (not self.dirty or now - self._last_flush < self.flush_interval):
+            return False
+        data = self.snapshot()
+        self.dirty = False
+        self._last_flush = now
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self._path_for(data['pid']))
+        return True
+
+    @staticmethod
+    def _pid_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def collect(self):
+        """
+        Merged values for every metric, as {name: {label_key_tuple: value}}.
+        Includes other worker processes when METRICS_DIR is configured.
+        """
+        snapshots = [self.snapshot()]
+        if self.directory and os.path.isdir(self.directory):
+            own_pid = os.getpid()
+            for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+                try:
+                    with open(path) as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if data.get('pid') == own_pid:
+                    continue
+                data['alive'] = self._pid_alive(data.get('pid', 0))
+                snapshots.append(data)
+
+        merged = {name: {} for name in self.metrics}
+        for data in snapshots:
+            alive = data.get('alive', True)
+            for name, entry in data.get('metrics', {}).items():
+                metric = self.metrics.get(name)
+                if metric is None or metric.type != entry.get('type'):
+                    continue
+                if metric.type == 'gauge' and not alive:
+                    continue
+                target = merged[name]
+                for raw_key, value in entry['values'].items():
+                    key = tuple(json.loads(raw_key))
+                    if metric.type == 'histogram':
+                        current = target.get(key)
+                        target[key] = [a + b for a, b in zip(current, value)] if current else list(value)
+                    else:
+                        target[key] = target.get(key, 0.0) + value
+        for name, metric in self.metrics.items():
+            if getattr(metric, 'function', None) is not None:
+                merged[name] = metric.read_function()
+        return merged
+
+    # ------------------------------------------------------------------
+    # Exposition
+    # ------------------------------------------------------------------
+
+    def expose(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        merged = self.collect()
+        lines = []
+        for name in sorted(self.metrics):
+            metric = self.metrics[name]
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for key in sorted(merged[name]):
+                value = merged[name][key]
+                pairs = list(zip(metric.labelnames, key))
+                if metric.type == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (float('inf'),), value[:-1]):
+                        cumulative += count
+                        lines.append(
+                            f'{name}_bucket{_format_labels(pairs + [("le", _format_value(bound))])} {cumulative}'
+                        )
+                    lines.append(f'{name}_sum{_format_labels(pairs)} {_format_value(value[-1])}')
+                    lines.append(f'{name}_count{_format_labels(pairs)} {cumulative}')
+                else:
+                    lines.append(f'{name}{_format_labels(pairs)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def histogram_summary(self, name, merged=None):
+        """Per label set: count, average and approximate p95 (upper bucket bound) of a histogram"""
+        metric = self.metrics[name]
+        merged = merged if merged is not None else self.collect()
+        rows = []
+        for key, value in merged[name].items():
+            counts = value[:-1]
+            total = sum(counts)
+            if not total:
+                continue
+            p95 = None
+            running = 0
+            for bound, count in zip(metric.buckets + (float('inf'),), counts):
+                running += count
+                if running >= total * 0.95:
+                    p95 = bound
+                    break
+            rows.append({
+                'labels': dict(zip(metric.labelnames, key)),
+                'count': total,
+                'avg': value[-1] / total,
+                'p95': p95,
+            })
+        rows.sort(key=lambda r: r['count'], reverse=True)
+        return rows
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUESTS = registry.counter(
+    'http_requests_total', 'HTTP requests by endpoint, method and status',
+    ('endpoint', 'method', 'status'))
+HTTP_REQUEST_DURATION = registry.histogram(
+    'http_request_duration_seconds', 'HTTP request latency by endpoint', ('endpoint',))
+HTTP_REQUESTS_IN_PROGRESS = registry.gauge(
+    'http_requests_in_progress', 'HTTP requests currently being handled')
+DB_QUERIES = registry.counter(
+    'db_queries_total', 'SQL statements executed by endpoint', ('endpoint',))
+DB_DURATION = registry.histogram(
+    'db_duration_seconds', 'Time spent in the database per request', ('endpoint',))
+EXTERNAL_REQUESTS = registry.counter(
+    'external_api_requests_total', 'Calls to external APIs by service and outcome',
+    ('service', 'outcome'))
+EXTERNAL_DURATION = registry.histogram(
+    'external_api_duration_seconds', 'External API latency by service', ('service',),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 90.0))
+CACHE_REQUESTS = registry.counter(
+    'cache_requests_total', 'Cache lookups by cache and result (hit/miss)', ('cache', 'result'))
+JOB_QUEUE_DEPTH = registry.gauge(
+    'job_queue_depth', 'Pending background jobs by queue', ('queue',))
+
+
+@contextmanager
+def track_external(service):
+    """Time a call to an external API (calendly, google, deepseek, stripe, ...)"""
+    started = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except Exception:
+        outcome = 'error'
+        raise
+    finally:
+        EXTERNAL_DURATION.observe(time.perf_counter() - started, service=service)
+        EXTERNAL_REQUESTS.inc(service=service, outcome=outcome)
+
+
+def record_cache(cache, hit):
+    """Count a cache lookup"""
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def cache_hit_ratios(merged=None):
+    """{cache_name: {'hits', 'misses', 'ratio'}} from the cache_requests_total counter"""
+    merged = merged if merged is not None else registry.collect()
+    ratios = {}
+    for (cache, result), value in merged['cache_requests_total'].items():
+        entry = ratios.setdefault(cache, {'hits': 0, 'misses': 0, 'ratio': 0.0})
+        entry['hits' if result == 'hit' else 'misses'] += int(value)
+    for entry in ratios.values():
+        total = entry['hits'] + entry['misses']
+        entry['ratio'] = entry['hits'] / total if total else 0.0
+    return ratios
+
+
+def metrics_summary():
+    """Numbers shown on the /monitoring page (same source as /metrics)"""
+    merged = registry.collect()
+    requests_by_endpoint = {}
+    for (endpoint, method, status), value in merged['http_requests_total'].items():
+        entry = requests_by_endpoint.setdefault(endpoint, {'requests': 0, 'errors': 0})
+        entry['requests'] += int(value)
+        if status.startswith('5'):
+            entry['errors'] += int(value)
+
+    endpoints = []
+    for row in registry.histogram_summary('http_request_duration_seconds', merged):
+        endpoint = row['labels']['endpoint']
+        endpoints.append({
+            'endpoint': endpoint,
+            'requests': requests_by_endpoint.get(endpoint, {}).get('requests', row['count']),
+            'errors': requests_by_endpoint.get(endpoint, {}).get('errors', 0),
+            'avg_ms': row['avg'] * 1000,
+            'p95_ms': row['p95'] * 1000 if row['p95'] != float('inf') else None,
+        })
+
+    external = []
+    errors_by_service = {}
+    for (service, outcome), value in merged['external_api_requests_total'].items():
+        if outcome == 'error':
+            errors_by_service[service] = errors_by_service.get(service, 0) + int(value)
+    for row in registry.histogram_summary('external_api_duration_seconds', merged):
+        service = row['labels']['service']
+        external.append({
+            'service': service,
+            'requests': row['count'],
+            'errors': errors_by_service.get(service, 0),
+            'avg_ms': row['avg'] * 1000,
+            'p95_ms': row['p95'] * 1000 if row['p95'] != float('inf') else None,
+        })
+
+    return {
+        'total_requests': sum(e['requests'] for e in requests_by_endpoint.values()),
+        'in_progress': int(sum(merged['http_requests_in_progress'].values())),
+        'endpoints': endpoints,
+        'external': external,
+        'caches': cache_hit_ratios(merged),
+        'queues': {key[0]: int(value) for key, value in merged['job_queue_depth'].items()},
+    }
+
+
+class MetricsMiddleware:
+    """Records request rate, latency and DB time for every request"""
+
+    def __init__(self, app=None):
+        self.app = app
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize request metrics"""
+        app.config.setdefault('METRICS_DIR', None)
+        app.config.setdefault('METRICS_FLUSH_INTERVAL', 5.0)
+        registry.directory = app.config['METRICS_DIR']
+        registry.flush_interval = app.config['METRICS_FLUSH_INTERVAL']
+        app.extensions['metrics'] = registry
+
+        app.before_request(self.start_request)
+        # Registered after QueryMonitor, so this runs before it pops the request's SQL stats
+        app.after_request(self.finish_request)
+
+    def start_request(self):
+        """Count the request as in progress"""
+        if request.path.startswith('/static/'):
+            return
+        g._metrics_started_at = time.perf_counter()
+        HTTP_REQUESTS_IN_PROGRESS.inc()
+
+    def finish_request(self, response):
+        """Record request count, latency and DB time"""
+        started = g.pop('_metrics_started_at', None)
+        if started is None:
+            return response
+        HTTP_REQUESTS_IN_PROGRESS.dec()
+
+        # Unmatched URLs share one label so scanners can't blow up the series count
+        endpoint = request.endpoint or 'unmatched'
+        HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=str(response.status_code))
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, endpoint=endpoint)
+
+        stats = g.get('_query_stats')
+        if stats is not None:
+            DB_QUERIES.inc(stats.count, endpoint=endpoint)
+            DB_DURATION.observe(stats.duration, endpoint=endpoint)
+
+        try:
+            registry.flush()
+        except OSError as e:
+            current_app.logger.warning(f"Could not write metrics to {registry.directory}: {str(e)}")
+        return response
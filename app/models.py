@@ -69,6 +69,15 @@ class Patient(db.Model):
     # Self-referential relationship for patient referrals
     referred_by = db.relationship('Patient', remote_side=[id], backref='referrals', foreign_keys=[referred_by_patient_id])
     # Note: 'referrals' backref gives us all patients referred by this patient
+
+    # Indexes for the practitioner patient lists, dashboard and referral lookups
+    __table_args__ = (
+        db.Index('idx_patient_user_status', 'user_id', 'status'),
+        db.Index('idx_patient_user_id', 'user_id', 'id'),  # Keyset pages of the patient directory
+        db.Index('idx_patient_user_updated', 'user_id', 'updated_at'),  # Directory cache stamp
+        db.Index('idx_patient_user_created', 'user_id', 'created_at'),
+        db.Index('idx_patient_referred_by', 'referred_by_patient_id'),
+    )
     
     # Property getters and setters for encrypted fields
     @property
@@ -212,46 +221,15 @@ class Patient(db.Model):
             return self.referred_by_name
         return None
 
-    def get_referral_chain(self, visited=None):
+    def get_referral_chain(self):
         """Get the complete referral chain leading to this patient"""
-        if visited is None:
-            visited = set()
-        
-        # Prevent infinite loops
-        if self.id in visited:
-            return []
-        
-        visited.add(self.id)
-        chain = [self]
-        
-        if self.referred_by:
-            parent_chain = self.referred_by.get_referral_chain(visited.copy())
-            chain = parent_chain + chain
-            
-        return chain
+        from app.referral_graph import referral_chain
+        return referral_chain(self)
 
-    def get_referral_tree(self, visited=None):
+    def get_referral_tree(self):
         """Get the complete referral tree starting from this patient"""
-        if visited is None:
-            visited = set()
-        
-        # Prevent infinite loops
-        if self.id in visited:
-            return {'patient': self, 'referrals': []}
-        
-        visited.add(self.id)
-        
-        tree = {
-            'patient': self,
-            'referrals': []
-        }
-        
-        for referred_patient in self.referrals:
-            if referred_patient.id not in visited:
-                subtree = referred_patient.get_referral_tree(visited.copy())
-                tree['referrals'].append(subtree)
-        
-        return tree
+        from app.referral_graph import referral_subtree
+        return referral_subtree(self)
 
     def get_dry_needling_symbol(self):
         """Get visual symbol for dry needling preference"""
@@ -372,6 +350,10 @@ class Location(db.Model):
     # Relationships
     treatments = db.relationship('Treatment', backref='treatment_location', lazy=True)
     recurring_appointments = db.relationship('RecurringAppointment', backref='appointment_location', lazy=True)
+
+    __table_args__ = (
+        db.Index('idx_location_user_active', 'user_id', 'is_active'),
+    )
     
     def __repr__(self):
         return f'<Location {self.name}>'
@@ -409,11 +391,20 @@ class Treatment(db.Model):
     # Fields for Google Calendar integration
     google_calendar_event_id = db.Column(db.String(255), nullable=True, index=True)
     google_calendar_event_summary = db.Column(db.String(255), nullable=True)
+    google_calendar_event_origin = db.Column(db.String(20), nullable=True)  # 'google' (synced in) or 'app' (pushed)
     
     trigger_points = db.relationship('TriggerPoint', backref='treatment', lazy=True)
 
     clinic_share = db.Column(db.Float)
     therapist_share = db.Column(db.Float)
+
+    # Patient timelines, date-range analytics and the calendar
+    __table_args__ = (
+        db.Index('idx_treatment_patient_created', 'patient_id', 'created_at'),
+        db.Index('idx_treatment_status_created', 'status', 'created_at'),
+        db.Index('idx_treatment_created_at', 'created_at'),
+        db.Index('idx_treatment_location_id', 'location_id'),
+    )
     
     @property
     def location_name(self):
@@ -456,6 +447,10 @@ class TriggerPoint(db.Model):
     symptoms = db.Column(db.Text)
     referral_pattern = db.Column(db.Text)
 
+    __table_args__ = (
+        db.Index('idx_trigger_point_treatment_id', 'treatment_id'),
+    )
+
 class UnmatchedCalendlyBooking(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
@@ -470,6 +465,10 @@ class UnmatchedCalendlyBooking(db.Model):
     
     matched_patient = db.relationship('Patient', backref='calendly_matches')
 
+    __table_args__ = (
+        db.Index('idx_unmatched_calendly_user_status', 'user_id', 'status'),
+    )
+
 class PatientReport(db.Model):
     __tablename__ = 'patient_reports'
     
@@ -481,6 +480,10 @@ class PatientReport(db.Model):
     
     patient = db.relationship('Patient', backref=db.backref('reports', lazy=True))
 
+    __table_args__ = (
+        db.Index('idx_patient_report_patient_date', 'patient_id', 'generated_date'),
+    )
+
 class RecurringAppointment(db.Model):
     __tablename__ = 'recurring_appointment'
     
@@ -503,6 +506,10 @@ class RecurringAppointment(db.Model):
 
     patient = db.relationship('Patient', backref=db.backref('recurring_appointments', lazy=True))
 
+    __table_args__ = (
+        db.Index('idx_recurring_patient_active', 'patient_id', 'is_active'),
+    )
+
     @property
     def location_name(self):
         """Get location name, preferring the structured location over legacy string"""
@@ -527,6 +534,10 @@ class PatientAIConversation(db.Model):
     # Relationships
     patient = db.relationship('Patient', backref=db.backref('ai_conversations', lazy=True))
     user = db.relationship('User', backref=db.backref('ai_conversations', lazy=True))
+
+    __table_args__ = (
+        db.Index('idx_ai_conversation_patient_user_created', 'patient_id', 'user_id', 'created_at'),
+    )
     
     def __repr__(self):
         return f'<PatientAIConversation {self.id} for Patient {self.patient_id}>'
@@ -651,6 +662,8 @@ class User(db.Model, UserMixin):
     calendly_api_token_encrypted = db.Column(db.Text, nullable=True)  # New encrypted field
     calendly_user_uri = db.Column(db.String(255), nullable=True)
     calendly_enabled = db.Column(db.Boolean, default=False)  # Whether Calendly integration is enabled
+    calendly_last_sync = db.Column(db.DateTime, nullable=True)  # Last polling reconciliation (webhooks deliver bookings)
+    calendly_webhook_subscription = db.Column(db.String(255), nullable=True)  # Webhook subscription URI (`flask calendly subscribe`)
     
     # Google Calendar specific fields
     google_calendar_token_encrypted = db.Column(db.Text, nullable=True)  # OAuth2 access token
@@ -658,6 +671,7 @@ class User(db.Model, UserMixin):
     google_calendar_enabled = db.Column(db.Boolean, default=False)
     google_calendar_primary_calendar_id = db.Column(db.String(255), nullable=True)  # Usually 'primary'
     google_calendar_last_sync = db.Column(db.DateTime, nullable=True)
+    google_calendar_sync_token = db.Column(db.Text, nullable=True)  # nextSyncToken of the last events.list
     
     # User's own Google Calendar app credentials (for SaaS multi-tenant)
     google_calendar_client_id = db.Column(db.Text, nullable=True)  # User's own Client ID
@@ -1044,6 +1058,9 @@ class User(db.Model, UserMixin):
         
         SECURITY: Admins follow the same access rules as other users.
         No user should have blanket access to all patient data.
+
+        To check access to one patient use app.patient_access.can_access_patient,
+        which does not load the whole list.
         """
         # SECURITY FIX: Removed admin bypass - admins follow same rules as other users
         if include_clinic_patients and self.is_in_clinic and self.can_manage_clinic_patients():
@@ -1342,6 +1359,85 @@ class SecurityBreach(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+class MaintenanceJobRun(db.Model):
+    """One run of a maintenance job (app/maintenance.py)"""
+    __tablename__ = 'maintenance_job_run'
+
+    id = db.Column(db.Integer, primary_key=True)
+    job = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='running')  # running, succeeded, failed
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    duration_ms = db.Column(db.Float, nullable=True)
+    rows_affected = db.Column(db.Integer, nullable=True)
+    chunks = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+
+    __table_args__ = (
+        db.Index('idx_maintenance_job_run_job', 'job', 'id'),
+    )
+
+class EmailOutbox(db.Model):
+    """Email queued in the transaction that caused it, sent by the dispatcher (app/email_outbox.py)"""
+    __tablename__ = 'email_outbox'
+
+    id = db.Column(db.Integer, primary_key=True)
+    idempotency_key = db.Column(db.String(255), unique=True, nullable=True)  # e.g. 'welcome:<user id>'
+    to_email = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    html_body = db.Column(db.Text, nullable=False)
+    text_body = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed_by = db.Column(db.String(32), nullable=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('idx_email_outbox_status_next', 'status', 'next_attempt_at'),
+        db.Index('idx_email_outbox_claimed_by', 'claimed_by'),
+    )
+
+class CalendlyWebhookEvent(db.Model):
+    """Signed Calendly webhook delivery, stored on receipt and processed by app/calendly_webhooks.py"""
+    __tablename__ = 'calendly_webhook_event'
+
+    id = db.Column(db.Integer, primary_key=True)
+    idempotency_key = db.Column(db.String(255), unique=True, nullable=False)  # '<event>:<invitee uri>'
+    event_type = db.Column(db.String(50), nullable=False)  # invitee.created, invitee.canceled
+    invitee_uuid = db.Column(db.String(100), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    _payload = db.Column("payload", db.Text, nullable=False)  # Encrypted raw request body
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, processing, processed, ignored, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed_by = db.Column(db.String(32), nullable=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('idx_calendly_webhook_event_status_next', 'status', 'next_attempt_at'),
+        db.Index('idx_calendly_webhook_event_claimed_by', 'claimed_by'),
+    )
+
+    @property
+    def payload(self):
+        """Raw JSON body (holds the invitee's name and email, so it is encrypted)"""
+        if not self._payload or current_app.config.get('DISABLE_ENCRYPTION', False):
+            return self._payload
+        return decrypt_text(self._payload)
+
+    @payload.setter
+    def payload(self, value):
+        if value and not current_app.config.get('DISABLE_ENCRYPTION', False):
+            value = encrypt_text(value)
+        self._payload = value
+
 # --- Clinic Models ---
 
 class Clinic(db.Model):
@@ -20,6 +20,7 @@ class ICD10Code(db.Model):
     subcategory = db.Column(db.String(100))  # e.g., "Back pain", "Neck disorders"
     is_active = db.Column(db.Boolean, default=True)
     is_physiotherapy_relevant = db.Column(db.Boolean, default=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Part of the catalog stamp
     
     # Relationships
     patient_diagnoses = db.relationship('PatientDiagnosis', backref='icd10_code', lazy=True)
@@ -35,17 +36,9 @@ class ICD10Code(db.Model):
     
     @classmethod
     def search(cls, query, limit=20):
-        """Search ICD-10 codes by code or description"""
-        search_term = f"%{query}%"
-        return cls.query.filter(
-            db.or_(
-                cls.code.ilike(search_term),
-                cls.description.ilike(search_term),
-                cls.short_description.ilike(search_term)
-            ),
-            cls.is_active == True,
-            cls.is_physiotherapy_relevant == True
-        ).limit(limit).all()
+        """Search ICD-10 codes by code or description, best matches first (see app.icd10_search)"""
+        from .icd10_search import search_codes
+        return search_codes(query, limit=limit)
     
     @classmethod
     def get_by_category(cls, category):
@@ -89,6 +82,10 @@ class PatientDiagnosis(db.Model):
     
     # Relationships
     diagnosed_by = db.relationship('User', backref='diagnoses_made')
+
+    __table_args__ = (
+        Index('idx_patient_diagnosis_patient_status', 'patient_id', 'status'),
+    )
     
     def __repr__(self):
         return f'<PatientDiagnosis {self.patient_id}: {self.icd10_code.code}>'
@@ -132,6 +129,7 @@ class DiagnosisTemplate(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Part of the catalog stamp
     
     # Relationships
     primary_icd10_code = db.relationship('ICD10Code', backref='templates')
@@ -0,0 +1,142 @@
+# app/pathology_guides.py
+"""
+Pathology guide payloads.
+
+A guide is a few kilobytes of clinical text that only changes when the seed
+scripts or an admin edit it, but /api/pathology-guide/<name> used to look it
+up by name, retry with the alias table, parse its FAQ JSON twice and serialize
+it again on every request.
+
+Each guide is now serialized once into an immutable JSON body with a strong
+ETag (a hash of the body). Bodies are kept per guide and reused while the
+guide's updated_at and its template's fields are unchanged; names are resolved
+through the reference catalog's alias map (app.icd10_catalog). The routes
+answer If-None-Match with 304, and guide_bundle() concatenates every body for
+the bulk endpoint pathology_guide.js prefetches.
+"""
+
+import hashlib
+import json
+import threading
+
+from flask import current_app
+from sqlalchemy import select
+
+from app import db
+from app.icd10_catalog import reference_catalog
+from app.metrics import record_cache
+from app.models_icd10 import PathologyGuide
+
+# Template fields copied into a guide's payload
+TEMPLATE_FIELDS = ('description', 'typical_duration_days', 'common_symptoms', 'treatment_guidelines')
+
+
+class GuidePayload:
+    """Serialized guide: the response body and its ETag"""
+
+    __slots__ = ('guide_id', 'version', 'body', 'etag')
+
+    def __init__(self, guide_id, version, body):
+        self.guide_id = guide_id
+        self.version = version
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+
+
+def _version(catalog, summary):
+    template = catalog.templates.get(summary['template_id'])
+    return (summary['updated_at'],) + (tuple(template[f] for f in TEMPLATE_FIELDS) if template else ())
+
+
+def serialize_guide(guide, summary, template):
+    """JSON body of a guide, as /api/pathology-guide/<name> returns it"""
+    try:
+        faq_list = json.loads(guide.faq_data) if guide.faq_data else []
+    except (json.JSONDecodeError, TypeError):
+        current_app.logger.warning(f"Invalid FAQ data for guide {guide.name}")
+        faq_list = []
+    data = {
+        'id': guide.id,
+        'name': guide.name,
+        'description': template['description'] if template else None,
+        'clinical_pearls': guide.clinical_pearls,
+        'patient_education': guide.patient_education,
+        'red_flags': guide.red_flags,
+        'anatomy_overview': guide.anatomy_overview,
+        'treatment_phases': guide.treatment_phases,
+        'home_exercises': guide.home_exercises,
+        'faq_list': faq_list,
+        'typical_duration_days': template['typical_duration_days'] if template else None,
+        'common_symptoms': template['common_symptoms'] if template else None,
+        'treatment_guidelines': template['treatment_guidelines'] if template else None,
+        'created_at': guide.created_at.isoformat() if guide.created_at else None,
+        'updated_at': guide.updated_at.isoformat() if guide.updated_at else None,
+        'template_id': guide.diagnosis_template_id,
+        'stats': summary['stats'],
+    }
+    return current_app.json.dumps(data).encode('utf-8')
+
+
+class PayloadCache:
+    """Latest payload of each guide per database"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}      # (database, guide id) -> GuidePayload
+
+    def get(self, key, version):
+        with self._lock:
+            payload = self._entries.get(key)
+        return payload if payload is not None and payload.version == version else None
+
+    def put(self, key, payload):
+        with self._lock:
+            self._entries[key] = payload
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+payload_cache = PayloadCache()
+
+
+def _payloads(catalog, summaries):
+    """Payloads of the given guide summaries, serializing the missing ones with one query"""
+    database = str(db.engine.url)
+    found, missing = {}, {}
+    for summary in summaries:
+        payload = payload_cache.get((database, summary['id']), _version(catalog, summary))
+        record_cache('pathology_guide', payload is not None)
+        if payload is None:
+            missing[summary['id']] = summary
+        else:
+            found[summary['id']] = payload
+    if missing:
+        for guide in db.session.scalars(select(PathologyGuide).where(PathologyGuide.id.in_(missing))):
+            summary = missing[guide.id]
+            template = catalog.templates.get(summary['template_id'])
+            payload = GuidePayload(guide.id, _version(catalog, summary), serialize_guide(guide, summary, template))
+            payload_cache.put((database, guide.id), payload)
+            found[guide.id] = payload
+    return [found[summary['id']] for summary in summaries if summary['id'] in found]
+
+
+def guide_payload(name):
+    """Payload of the guide a name (guide, template or alias) resolves to, or None"""
+    catalog = reference_catalog()
+    summary = catalog.find_guide(name)
+    if summary is None:
+        return None
+    payloads = _payloads(catalog, [summary])
+    return payloads[0] if payloads else None
+
+
+def guide_bundle():
+    """(body, etag) of every guide plus the alias map, for prefetching"""
+    catalog = reference_catalog()
+    payloads = _payloads(catalog, sorted(catalog.guides.values(), key=lambda guide: guide['id']))
+    aliases = current_app.json.dumps(catalog.guide_aliases).encode('utf-8')
+    body = b'{"aliases":' + aliases + b',"guides":[' + b','.join(p.body for p in payloads) + b']}'
+    etag = hashlib.sha256(aliases + b''.join(p.etag.encode('ascii') for p in payloads)).hexdigest()[:32]
+    return body, etag
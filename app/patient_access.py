@@ -0,0 +1,98 @@
+"""
+Patient access checks.
+
+Answers "may this user see patient X?" with one EXISTS query on the patient's
+primary key instead of loading the user's whole caseload. The rules are the
+same as User.get_accessible_patients():
+
+- by default a user reaches only their own patients;
+- with include_clinic_patients, a member of a clinic whose active membership
+  can manage patients also reaches the patients of the other active members.
+
+Admins get no bypass here; routes that exempt admins keep doing so explicitly.
+Answers are memoized on flask.g, so repeated checks within one request (e.g. a
+view and the helpers it calls) cost one query per patient.
+"""
+from functools import wraps
+
+from flask import flash, g, has_request_context, jsonify, redirect, request, url_for
+from flask_login import current_user
+from sqlalchemy import exists, or_, select
+from sqlalchemy.orm import aliased
+
+from . import db
+from .models import ClinicMembership, Patient
+
+
+def _clinic_member_ids(user):
+    """User ids of the active members of clinics where user may manage patients"""
+    own = aliased(ClinicMembership)
+    member = aliased(ClinicMembership)
+    return select(member.user_id).join(own, own.clinic_id == member.clinic_id).where(
+        own.user_id == user.id,
+        own.is_active == True,
+        own.can_manage_patients == True,
+        member.is_active == True,
+    )
+
+
+def _access_filter(user, include_clinic_patients):
+    own_patients = Patient.user_id == user.id
+    if include_clinic_patients:
+        return or_(own_patients, Patient.user_id.in_(_clinic_member_ids(user)))
+    return own_patients
+
+
+def accessible_patient_ids_query(user, include_clinic_patients=False):
+    """SELECT of the patient ids user may access, for use as an IN (...) subquery"""
+    return select(Patient.id).where(_access_filter(user, include_clinic_patients))
+
+
+def _memo():
+    if not has_request_context():
+        return None
+    # g belongs to the app context, which an enclosing context can share
+    # between requests, so remember which request the answers are for
+    current_request = request._get_current_object()
+    memo = g.get('_patient_access')
+    if memo is None or memo[0] is not current_request:
+        memo = g._patient_access = (current_request, {})
+    return memo[1]
+
+
+def can_access_patient(user, patient_id, include_clinic_patients=False):
+    """Whether user may access the patient with this id (one indexed query, memoized per request)"""
+    if user is None or not getattr(user, 'is_authenticated', False) or patient_id is None:
+        return False
+    key = (user.id, int(patient_id), bool(include_clinic_patients))
+    memo = _memo()
+    if memo is not None and key in memo:
+        return memo[key]
+    allowed = bool(db.session.scalar(select(exists().where(
+        Patient.id == key[1],
+        _access_filter(user, include_clinic_patients),
+    ))))
+    if memo is not None:
+        memo[key] = allowed
+    return allowed
+
+
+def patient_access_required(view_arg='patient_id', include_clinic_patients=False):
+    """
+    Decorator to require access to the patient named by a URL argument.
+
+    API requests get a JSON 403; pages flash a message and go back to the
+    patient list.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not can_access_patient(current_user, kwargs.get(view_arg),
+                                      include_clinic_patients=include_clinic_patients):
+                if request.path.startswith('/api/') or request.is_json:
+                    return jsonify({'error': 'Access denied'}), 403
+                flash('You do not have permission to view this patient.', 'danger')
+                return redirect(url_for('main.patients_list'))
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
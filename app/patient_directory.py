@@ -0,0 +1,391 @@
+# app/patient_directory.py
+"""
+Paginated patient directory.
+
+The patient list used to load every patient with all of its columns, decrypt
+them and sort in Python. The directory instead:
+- pages through cached_directory() (below), which already holds every
+  patient's decrypted name in name order, so pages stay alphabetical without
+  decrypting or loading the large Text columns (anamnesis, AI analysis,
+  treatment plan, notes). Names are encrypted with a non-deterministic cipher,
+  so the database cannot order by them,
+- pages by keyset on (name, id): the cursor holds the last name and id, and the
+  next page starts after it,
+- fetches last visit / visit count for the whole page with one grouped query.
+
+Searching matches the decrypted name, the diagnosis and the decrypted notes.
+Notes are not cached, so they are loaded and decrypted for batches of the
+directory in name order, and a page stops after DIRECTORY_SEARCH_SCAN_LIMIT
+patients even if it is not full (the cursor then continues the scan).
+
+Dropdowns and name lookups use cached_directory() directly: a process-level
+cache of (id, decrypted name, sort key, status, diagnosis, email, created_at)
+per practitioner, clinic or (for admins) the whole practice, built with one
+query and one cipher. Entries are invalidated by:
+- a version counter bumped when a session that inserted, updated or deleted
+  patients commits (ORM events), and
+- a stamp (patient count and latest updated_at) read with one indexed query, so
+  changes made by other worker processes are seen too
+  (PATIENT_DIRECTORY_CACHE_CHECK_DB; can be turned off for single-process setups).
+The cache is an LRU bounded by PATIENT_DIRECTORY_CACHE_MAX_BYTES of estimated
+memory.
+"""
+
+import base64
+import bisect
+import json
+import sys
+import threading
+from collections import OrderedDict, defaultdict
+
+from flask import current_app
+from sqlalchemy import event, func, inspect, select, true
+from sqlalchemy.orm import Session, object_session
+
+from app import db
+from app.crypto_utils import decrypt_many
+from app.metrics import record_cache
+from app.models import Patient, Treatment, ClinicMembership
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+SEARCH_BATCH_SIZE = 200
+DIRECTORY_SEARCH_SCAN_LIMIT = 2000
+
+
+def encode_cursor(sort_key, patient_id):
+    """Opaque cursor for the page after the patient with this sort key (lowercased name) and id."""
+    raw = json.dumps({'name': sort_key, 'id': patient_id}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(sort key, patient id) encoded in a cursor. Raises ValueError for malformed cursors."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        sort_key, patient_id = data['name'], data['id']
+    except (TypeError, KeyError, UnicodeError, ValueError) as e:
+        raise ValueError('Invalid cursor') from e
+    if not isinstance(sort_key, str) or not isinstance(patient_id, int):
+        raise ValueError('Invalid cursor')
+    return sort_key, patient_id
+
+
+def _entry_key(entry):
+    return (entry.sort_key, entry.id)
+
+
+def _matching_entries(entries, term):
+    """Entries whose name, diagnosis or decrypted notes contain term (notes decrypted with one cipher)"""
+    ids = [entry.id for entry in entries]
+    notes = dict(db.session.query(Patient.id, Patient._notes).filter(Patient.id.in_(ids)).all())
+    plain = dict(zip(ids, decrypt_many([notes.get(patient_id) for patient_id in ids])))
+    return [
+        entry for entry in entries
+        if any(value and term in value.lower() for value in (entry.name, entry.diagnosis, plain[entry.id]))
+    ]
+
+
+def visit_stats(patient_ids):
+    """{patient_id: (last_visit, visit_count)} for completed treatments, in one grouped query."""
+    if not patient_ids:
+        return {}
+    rows = db.session.query(
+        Treatment.patient_id,
+        func.max(Treatment.created_at),
+        func.count(Treatment.id),
+    ).filter(
+        Treatment.patient_id.in_(patient_ids),
+        Treatment.status == 'Completed',
+    ).group_by(Treatment.patient_id).all()
+    return {patient_id: (last_visit, count) for patient_id, last_visit, count in rows}
+
+
+def _page_without_search(entries, start, limit):
+    page = entries[start:start + limit]
+    has_more = start + limit < len(entries)
+    return page, (page[-1] if has_more else None)
+
+
+def _page_with_search(entries, start, limit, term):
+    matches = []
+    end = min(len(entries), start + DIRECTORY_SEARCH_SCAN_LIMIT)
+    for batch_start in range(start, end, SEARCH_BATCH_SIZE):
+        batch = entries[batch_start:min(batch_start + SEARCH_BATCH_SIZE, end)]
+        matched = {entry.id for entry in _matching_entries(batch, term)}
+        for position, entry in enumerate(batch, batch_start):
+            if entry.id in matched:
+                matches.append(entry)
+                if len(matches) == limit:
+                    return matches, (entry if position + 1 < len(entries) else None)
+    # Scan budget used up: let the client continue from where we stopped
+    return matches, (entries[end - 1] if end < len(entries) else None)
+
+
+def serialize_entry(entry, stats):
+    last_visit, visit_count = stats.get(entry.id, (None, 0))
+    return {
+        'id': entry.id,
+        'name': entry.name,
+        'diagnosis': entry.diagnosis,
+        'status': entry.status,
+        'created_at': entry.created_at.isoformat() if entry.created_at else None,
+        'last_visit': last_visit.strftime('%Y-%m-%d') if last_visit else None,
+        'visit_count': visit_count,
+    }
+
+
+def directory_page(user, cursor=None, limit=DEFAULT_PAGE_SIZE, status=None, search=None):
+    """
+    One page of the user's patient directory, in name order.
+
+    Returns {'patients': [...], 'next_cursor': str or None, 'has_more': bool}.
+    Raises ValueError for a malformed cursor.
+    """
+    limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    after = decode_cursor(cursor) if cursor else None
+    term = (search or '').strip().lower()
+
+    entries = cached_directory(user, status=status if status and status != 'all' else None)
+    start = bisect.bisect_right(entries, after, key=_entry_key) if after else 0
+    if term:
+        patients, last = _page_with_search(entries, start, limit, term)
+    else:
+        patients, last = _page_without_search(entries, start, limit)
+
+    stats = visit_stats([p.id for p in patients])
+    return {
+        'patients': [serialize_entry(p, stats) for p in patients],
+        'next_cursor': encode_cursor(last.sort_key, last.id) if last is not None else None,
+        'has_more': last is not None,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Decrypted directory cache
+# ---------------------------------------------------------------------------
+
+_CHANGES_KEY = 'patient_directory_changes'
+_ALL_USERS = '*'
+
+
+class DirectoryEntry:
+    """One patient in a cached directory, with the name already decrypted"""
+
+    __slots__ = ('id', 'user_id', 'name', 'sort_key', 'status', 'diagnosis', 'email', 'created_at')
+
+    def __init__(self, id, user_id, name, status, diagnosis, email, created_at=None):
+        self.id = id
+        self.user_id = user_id
+        self.name = name
+        self.sort_key = (name or '').lower()
+        self.status = status
+        self.diagnosis = diagnosis
+        self.email = email
+        self.created_at = created_at
+
+    def __repr__(self):
+        return f'<DirectoryEntry {self.id}>'
+
+
+def _entries_size(entries):
+    """Rough memory footprint of a directory in bytes"""
+    size = sys.getsizeof(entries)
+    for entry in entries:
+        size += sys.getsizeof(entry)
+        for attr in ('name', 'sort_key', 'status', 'diagnosis', 'email', 'created_at'):
+            value = getattr(entry, attr)
+            if value is not None:
+                size += sys.getsizeof(value)
+    return size
+
+
+class PatientDirectoryCache:
+    """LRU of decrypted directories with per-practitioner version counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._directories = OrderedDict()  # key -> (version, stamp, entries, size)
+        self._bytes = 0
+        self._epoch = 0             # Bumped for changes that can't be attributed
+        self._global_version = 0    # Bumped for any patient change (clinic/admin scopes)
+        self._user_versions = defaultdict(int)
+
+    def version(self, scope):
+        with self._lock:
+            if scope[0] == 'user':
+                return (self._epoch, self._user_versions[scope[1]])
+            return (self._epoch, self._global_version)
+
+    def patients_changed(self, user_ids):
+        with self._lock:
+            if _ALL_USERS in user_ids:
+                self._epoch += 1
+                return
+            for user_id in user_ids:
+                self._user_versions[user_id] += 1
+            self._global_version += 1
+
+    def get(self, key, version, stamp):
+        with self._lock:
+            cached = self._directories.get(key)
+            if cached is None or cached[0] != version or cached[1] != stamp:
+                return None
+            self._directories.move_to_end(key)
+            return cached[2]
+
+    def put(self, key, version, stamp, entries, max_bytes):
+        size = _entries_size(entries)
+        with self._lock:
+            previous = self._directories.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[3]
+            if size > max_bytes:
+                return
+            self._directories[key] = (version, stamp, entries, size)
+            self._bytes += size
+            while self._bytes > max_bytes:
+                _, evicted = self._directories.popitem(last=False)
+                self._bytes -= evicted[3]
+
+    def clear(self):
+        with self._lock:
+            self._directories.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'directories': len(self._directories),
+                'patients': sum(len(cached[2]) for cached in self._directories.values()),
+                'bytes': self._bytes,
+            }
+
+
+directory_cache = PatientDirectoryCache()
+
+
+def directory_scope(user, include_clinic_patients=False, all_patients=False):
+    """Cache scope for the patients a user sees (same rules as User.get_accessible_patients)"""
+    if all_patients:
+        return ('all',)
+    if include_clinic_patients and user.is_in_clinic and user.can_manage_clinic_patients():
+        clinic = user.clinic
+        if clinic:
+            return ('clinic', clinic.id)
+    return ('user', user.id)
+
+
+def scope_filter(scope):
+    """Patient filter for a directory_scope(), for queries over the same patients as the cached directory"""
+    if scope[0] == 'user':
+        return Patient.user_id == scope[1]
+    if scope[0] == 'clinic':
+        members = select(ClinicMembership.user_id).where(
+            ClinicMembership.clinic_id == scope[1],
+            ClinicMembership.is_active == True,
+        )
+        return Patient.user_id.in_(members)
+    return true()
+
+
+def _directory_stamp(scope):
+    count, last_update = db.session.query(
+        func.count(Patient.id), func.max(Patient.updated_at)
+    ).filter(scope_filter(scope)).one()
+    return (count, last_update)
+
+
+def _build_directory(scope):
+    rows = db.session.query(
+        Patient.id, Patient.user_id, Patient._name, Patient._email, Patient.status, Patient.diagnosis,
+        Patient.created_at
+    ).filter(scope_filter(scope)).all()
+    # One cipher for every name and email in the directory
+    plain = decrypt_many([row[2] for row in rows] + [row[3] for row in rows])
+    names, emails = plain[:len(rows)], plain[len(rows):]
+    entries = [
+        DirectoryEntry(row[0], row[1], name, row[4], row[5], email, row[6])
+        for row, name, email in zip(rows, names, emails)
+    ]
+    entries.sort(key=_entry_key)
+    return entries
+
+
+def _load_directory(scope):
+    config = current_app.config
+    if not config.get('PATIENT_DIRECTORY_CACHE_ENABLED', True):
+        return _build_directory(scope)
+
+    # The engine URL keeps apps with different databases in one process apart
+    key = (str(db.engine.url), scope)
+    version = directory_cache.version(scope)
+    stamp = _directory_stamp(scope) if config.get('PATIENT_DIRECTORY_CACHE_CHECK_DB', True) else None
+    entries = directory_cache.get(key, version, stamp)
+    record_cache('patient_directory', entries is not None)
+    if entries is None:
+        entries = _build_directory(scope)
+        directory_cache.put(key, version, stamp, entries,
+                            config.get('PATIENT_DIRECTORY_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    return entries
+
+
+def cached_directory(user, status=None, include_clinic_patients=False, all_patients=False):
+    """
+    Decrypted patients visible to `user`, sorted by name. Entries are shared
+    between requests and must not be modified.
+    """
+    entries = _load_directory(directory_scope(user, include_clinic_patients, all_patients))
+    if status:
+        entries = [entry for entry in entries if entry.status == status]
+    return entries
+
+
+def patient_names(user, include_clinic_patients=False, all_patients=False):
+    """{patient_id: decrypted name} for the patients visible to `user`"""
+    return {entry.id: entry.name
+            for entry in cached_directory(user, include_clinic_patients=include_clinic_patients,
+                                          all_patients=all_patients)}
+
+
+# Invalidation: collect the practitioners whose patients changed during a flush
+# and bump their versions once the transaction commits
+
+def _pending_changes(session):
+    return session.info.setdefault(_CHANGES_KEY, set())
+
+
+@event.listens_for(Patient, 'after_insert')
+@event.listens_for(Patient, 'after_update')
+@event.listens_for(Patient, 'after_delete')
+def _patient_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is None:
+        directory_cache.patients_changed({_ALL_USERS})
+        return
+    changes = _pending_changes(session)
+    changes.add(target.user_id)
+    # A patient moved to another practitioner leaves the old directory too
+    changes.update(user_id for user_id in inspect(target).attrs.user_id.history.deleted or ()
+                   if user_id is not None)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _bulk_patient_change(orm_execute_state):
+    is_write = orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete
+    mapper = orm_execute_state.bind_mapper
+    if is_write and mapper is not None and mapper.class_ is Patient:
+        _pending_changes(orm_execute_state.session).add(_ALL_USERS)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    changes = session.info.pop(_CHANGES_KEY, None)
+    if changes:
+        directory_cache.patients_changed(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop(_CHANGES_KEY, None)
@@ -0,0 +1,166 @@
+# app/patient_timeline.py
+"""
+Paginated treatment timeline for one patient.
+
+patient_detail() used to load every treatment of the patient, query past
+scheduled treatments separately, look up each provider with one or two User
+queries, and let the template lazy-load trigger points and locations row by
+row. A timeline page instead:
+- reads treatments newest first by keyset on (created_at, id), which
+  idx_treatment_patient_created serves in index order,
+- loads trigger points and locations for the whole page with selectinload,
+- resolves provider display names for the page with one IN query (plus one
+  more only for providers recorded by username rather than email),
+- splits the page into completed, upcoming and overdue (past but still
+  scheduled) treatments in the same pass.
+Every page costs the same handful of queries however long the history is.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import load_only, selectinload
+
+from app.models import Treatment, User
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(created_at, treatment_id):
+    """Opaque cursor for the page after the given treatment."""
+    raw = json.dumps({'t': created_at.isoformat() if created_at else None, 'id': treatment_id},
+                     separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(created_at, treatment_id) encoded in a cursor. Raises ValueError for malformed cursors."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        created_at = datetime.fromisoformat(data['t']) if data['t'] is not None else None
+        treatment_id = data['id']
+    except (TypeError, KeyError, UnicodeError, ValueError) as e:
+        raise ValueError('Invalid cursor') from e
+    if not isinstance(treatment_id, int):
+        raise ValueError('Invalid cursor')
+    return created_at, treatment_id
+
+
+def _after(created_at, treatment_id):
+    """Rows that come after (created_at, id) in newest-first order; undated rows come last."""
+    if created_at is None:
+        return and_(Treatment.created_at.is_(None), Treatment.id < treatment_id)
+    return or_(
+        Treatment.created_at < created_at,
+        and_(Treatment.created_at == created_at, Treatment.id < treatment_id),
+        Treatment.created_at.is_(None),
+    )
+
+
+def timeline_query(patient_id, after=None):
+    query = Treatment.query.options(
+        selectinload(Treatment.trigger_points),
+        selectinload(Treatment.treatment_location),
+    ).filter(Treatment.patient_id == patient_id)
+    if after is not None:
+        query = query.filter(_after(*after))
+    return query.order_by(Treatment.created_at.desc().nulls_last(), Treatment.id.desc())
+
+
+def _display_name(user):
+    if user.first_name and user.last_name:
+        return f"{user.first_name} {user.last_name}"
+    return user.email
+
+
+def provider_names(providers):
+    """{provider: display name} for Treatment.provider values (emails, or usernames for older rows)"""
+    remaining = {p for p in providers if p}
+    names = {}
+    columns = load_only(User.id, User.email, User.username, User.first_name, User.last_name)
+    if remaining:
+        for user in User.query.options(columns).filter(User.email.in_(remaining)):
+            names[user.email] = _display_name(user)
+        remaining -= names.keys()
+    if remaining:
+        # username is not unique: keep the first match, as the old per-row lookup did
+        for user in User.query.options(columns).filter(User.username.in_(remaining)).order_by(User.id):
+            names.setdefault(user.username, _display_name(user))
+        remaining -= names.keys()
+    names.update((provider, provider) for provider in remaining)
+    return names
+
+
+def timeline_page(patient_id, cursor=None, limit=DEFAULT_PAGE_SIZE, now=None):
+    """
+    One page of a patient's treatments, newest first.
+
+    Returns {'treatments': [...], 'completed': [...], 'upcoming': [...],
+    'overdue': [...], 'providers': {provider: name}, 'next_cursor': str or None,
+    'has_more': bool}. Treatments are ORM objects with trigger points and
+    location already loaded. Raises ValueError for a malformed cursor.
+    """
+    limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    after = decode_cursor(cursor) if cursor else None
+    now = now or datetime.now()
+
+    rows = timeline_query(patient_id, after).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    treatments = rows[:limit]
+
+    completed, upcoming, overdue = [], [], []
+    for treatment in treatments:
+        if treatment.status == 'Completed':
+            completed.append(treatment)
+        elif treatment.status == 'Scheduled':
+            if treatment.created_at and treatment.created_at < now:
+                overdue.append(treatment)
+            else:
+                upcoming.append(treatment)
+
+    last = treatments[-1] if has_more else None
+    return {
+        'treatments': treatments,
+        'completed': completed,
+        'upcoming': upcoming,
+        'overdue': overdue,
+        'providers': provider_names({t.provider for t in treatments}),
+        'next_cursor': encode_cursor(last.created_at, last.id) if last else None,
+        'has_more': has_more,
+    }
+
+
+def serialize_treatment(treatment, providers):
+    return {
+        'id': treatment.id,
+        'created_at': treatment.created_at.isoformat() if treatment.created_at else None,
+        'treatment_type': treatment.treatment_type,
+        'status': treatment.status,
+        'provider': treatment.provider,
+        'provider_name': providers.get(treatment.provider, treatment.provider),
+        'location': treatment.location_name,
+        'pain_level': treatment.pain_level,
+        'fee_charged': treatment.fee_charged,
+        'payment_method': treatment.payment_method,
+        'trigger_points': [{
+            'x': point.location_x,
+            'y': point.location_y,
+            'type': point.type,
+            'muscle': point.muscle,
+            'intensity': point.intensity,
+        } for point in treatment.trigger_points],
+    }
+
+
+def serialize_page(page):
+    providers = page['providers']
+    return {
+        'treatments': [serialize_treatment(t, providers) for t in page['treatments']],
+        'overdue_ids': [t.id for t in page['overdue']],
+        'next_cursor': page['next_cursor'],
+        'has_more': page['has_more'],
+    }
@@ -0,0 +1,258 @@
+# app/point_layout.py
+"""
+Body-chart point layout.
+
+Trigger point markers are drawn as r=7 circles on the 500x800 chart, so points
+closer than two radii hide each other. This module pushes overlapping points
+apart and replaces the one-off spread_trigger_points.py and
+adjust_trigger_points.py scripts:
+
+- overlapping pairs are found with vectorized pairwise distances for small
+  charts, and with a uniform cell grid (cell = min distance, so only the
+  neighbouring cells need checking) for large point sets,
+- each iteration moves both points of every overlapping pair apart along the
+  line between them (coincident points along a fixed per-point direction, so
+  results are deterministic), all pairs at once,
+- points are kept inside the chart's safe area; a point that was already
+  outside it is never pushed further out,
+- points that do not overlap anything are never moved, so laying out an
+  already laid out chart changes nothing.
+
+layout_rows() is used when a treatment is saved; layout_treatments() re-lays
+stored points in batches (`flask trigger-points layout`).
+"""
+
+import math
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import bindparam, select, update
+
+from app import db
+from app.models import Treatment, TriggerPoint
+
+MARKER_RADIUS = 7
+MIN_DISTANCE = 2 * MARKER_RADIUS
+# (min_x, min_y, max_x, max_y) of the body chart's 500x800 viewBox
+SAFE_AREA = (100, 100, 400, 700)
+MAX_ITERATIONS = 100
+# Each point of a pair moves this many half-overlaps; above 1 so crowded
+# clusters settle in a few dozen iterations instead of creeping apart
+RELAXATION = 1.8
+# Above this many points the cell grid beats the n x n distance matrix
+PAIRWISE_LIMIT = 512
+
+_GOLDEN_ANGLE = math.pi * (3 - math.sqrt(5))
+# Stored coordinates are rounded to 2 decimals; closer than this is not an overlap
+_TOLERANCE = 0.01
+
+
+def _pairwise_pairs(xy, min_distance):
+    delta = xy[None, :, :] - xy[:, None, :]
+    close = np.einsum('ijk,ijk->ij', delta, delta) < (min_distance - _TOLERANCE) ** 2
+    i, j = np.nonzero(np.triu(close, k=1))
+    return i, j
+
+
+def _grid_pairs(xy, min_distance):
+    # Cells one min_distance wide, padded by one so neighbour keys never wrap rows
+    cells = np.floor((xy - xy.min(axis=0)) / min_distance).astype(np.int64) + 1
+    row_length = int(cells[:, 0].max()) + 2
+    keys = cells[:, 1] * row_length + cells[:, 0]
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    found_i, found_j = [], []
+    # Own cell plus half of the neighbours; the other half is covered from the other side
+    for dx, dy in ((0, 0), (1, 0), (-1, 1), (0, 1), (1, 1)):
+        target = keys + dy * row_length + dx
+        start = np.searchsorted(sorted_keys, target, side='left')
+        counts = np.searchsorted(sorted_keys, target, side='right') - start
+        total = int(counts.sum())
+        if not total:
+            continue
+        i = np.repeat(np.arange(len(xy)), counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        j = order[np.repeat(start, counts) + offsets]
+        if dx == 0 and dy == 0:
+            keep = i < j
+            i, j = i[keep], j[keep]
+        found_i.append(i)
+        found_j.append(j)
+    if not found_i:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    i, j = np.concatenate(found_i), np.concatenate(found_j)
+    delta = xy[j] - xy[i]
+    close = np.einsum('ij,ij->i', delta, delta) < (min_distance - _TOLERANCE) ** 2
+    i, j = i[close], j[close]
+    # Same order as the pairwise search
+    lo, hi = np.minimum(i, j), np.maximum(i, j)
+    pairs = np.lexsort((hi, lo))
+    return lo[pairs], hi[pairs]
+
+
+def overlapping_pairs(xy, min_distance=MIN_DISTANCE):
+    """(i, j) index arrays, i < j, of the points closer than min_distance"""
+    xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+    if len(xy) < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    if len(xy) <= PAIRWISE_LIMIT:
+        return _pairwise_pairs(xy, min_distance)
+    return _grid_pairs(xy, min_distance)
+
+
+def resolve_overlaps(xy, min_distance=MIN_DISTANCE, bounds=SAFE_AREA, max_iterations=MAX_ITERATIONS):
+    """
+    Push overlapping points apart. Returns (new_xy, iterations, overlaps_left).
+
+    xy is an (n, 2) array-like; it is not modified. overlaps_left is 0 unless
+    the points could not be separated within max_iterations (e.g. more points
+    than fit in the safe area).
+    """
+    original = np.asarray(xy, dtype=float).reshape(-1, 2)
+    xy = original.copy()
+    if bounds is None:
+        lower, upper = np.full(2, -np.inf), np.full(2, np.inf)
+    else:
+        lower, upper = np.array(bounds[:2], dtype=float), np.array(bounds[2:], dtype=float)
+    # Points already outside the safe area may stay where they are, but not go further
+    lower = np.minimum(lower, original)
+    upper = np.maximum(upper, original)
+    fallback = np.arange(len(xy)) * _GOLDEN_ANGLE
+    fallback = np.column_stack((np.cos(fallback), np.sin(fallback)))
+
+    i, j = overlapping_pairs(xy, min_distance)
+    iterations = 0
+    while len(i) and iterations < max_iterations:
+        iterations += 1
+        delta = xy[j] - xy[i]
+        distance = np.sqrt(np.einsum('ij,ij->i', delta, delta))
+        coincident = distance < 1e-9
+        direction = np.empty_like(delta)
+        direction[~coincident] = delta[~coincident] / distance[~coincident, None]
+        direction[coincident] = fallback[j[coincident]]
+        push = direction * (RELAXATION * (min_distance - distance) / 2)[:, None]
+        shift = np.zeros_like(xy)
+        np.add.at(shift, i, -push)
+        np.add.at(shift, j, push)
+        xy = np.clip(xy + shift, lower, upper)
+        i, j = overlapping_pairs(xy, min_distance)
+    return xy, iterations, len(i)
+
+
+def layout_rows(rows, min_distance=MIN_DISTANCE, bounds=SAFE_AREA, max_iterations=MAX_ITERATIONS):
+    """
+    Lay out normalized trigger point rows (see app.trigger_points) in place.
+    Returns the indexes of the rows that moved.
+    """
+    if len(rows) < 2:
+        return []
+    xy = np.array([(row['location_x'], row['location_y']) for row in rows], dtype=float)
+    new_xy, _, _ = resolve_overlaps(xy, min_distance, bounds, max_iterations)
+    moved = np.nonzero(np.any(new_xy != xy, axis=1))[0].tolist()
+    for index in moved:
+        rows[index]['location_x'] = round(float(new_xy[index, 0]), 2)
+        rows[index]['location_y'] = round(float(new_xy[index, 1]), 2)
+    return moved
+
+
+def layout_submitted_points(evaluation_data, rows):
+    """
+    Lay out a treatment's submitted points before they are saved, if
+    TRIGGER_POINT_LAYOUT_ON_SAVE is on. Moves are applied to the normalized
+    rows and to the submitted list they came from (kept as evaluation_data).
+    Returns the number of points moved.
+    """
+    config = current_app.config
+    if not config.get('TRIGGER_POINT_LAYOUT_ON_SAVE', True):
+        return 0
+    moved = layout_rows(rows, min_distance=config.get('TRIGGER_POINT_MIN_DISTANCE', MIN_DISTANCE))
+    if isinstance(evaluation_data, list) and len(evaluation_data) == len(rows):
+        for index in moved:
+            point = evaluation_data[index]
+            if isinstance(point, dict):
+                point['x'] = rows[index]['location_x']
+                point['y'] = rows[index]['location_y']
+    return len(moved)
+
+
+def _layout_batch(treatment_ids, min_distance, bounds, max_iterations, dry_run):
+    rows = db.session.execute(
+        select(TriggerPoint.treatment_id, TriggerPoint.id, TriggerPoint.location_x, TriggerPoint.location_y)
+        .where(TriggerPoint.treatment_id.in_(treatment_ids))
+        .order_by(TriggerPoint.treatment_id, TriggerPoint.id)
+    ).all()
+    if not rows:
+        return 0, []
+    owners = np.array([row[0] for row in rows], dtype=np.int64)
+    point_ids = np.array([row[1] for row in rows], dtype=np.int64)
+    xy = np.array([(row[2], row[3]) for row in rows], dtype=float)
+    starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+    ends = np.r_[starts[1:], len(rows)]
+
+    updates, changed = [], []
+    for start, end in zip(starts, ends):
+        if end - start < 2:
+            continue
+        chart = xy[start:end]
+        new_xy, _, _ = resolve_overlaps(chart, min_distance, bounds, max_iterations)
+        moved = np.nonzero(np.any(new_xy != chart, axis=1))[0]
+        if not len(moved):
+            continue
+        moves = [(int(k), round(float(new_xy[k, 0]), 2), round(float(new_xy[k, 1]), 2)) for k in moved]
+        changed.append((int(owners[start]), int(end - start), moves))
+        updates.extend({'b_id': int(point_ids[start + k]), 'b_x': x, 'b_y': y} for k, x, y in moves)
+    if updates and not dry_run:
+        db.session.execute(
+            update(TriggerPoint.__table__)
+            .where(TriggerPoint.__table__.c.id == bindparam('b_id'))
+            .values(location_x=bindparam('b_x'), location_y=bindparam('b_y')),
+            updates,
+        )
+        _sync_evaluation_data(changed)
+    return len(updates), changed
+
+
+def _sync_evaluation_data(changed):
+    treatments = {t.id: t for t in Treatment.query.filter(Treatment.id.in_([c[0] for c in changed]))}
+    for treatment_id, count, moves in changed:
+        treatment = treatments.get(treatment_id)
+        data = treatment.evaluation_data if treatment else None
+        # Submitted points are stored in list order, so positions line up when the lengths match
+        if not isinstance(data, list) or len(data) != count:
+            continue
+        data = [dict(point) if isinstance(point, dict) else point for point in data]
+        for index, x, y in moves:
+            if isinstance(data[index], dict):
+                data[index]['x'], data[index]['y'] = x, y
+        treatment.evaluation_data = data
+
+
+def layout_treatments(treatment_ids=None, min_distance=MIN_DISTANCE, bounds=SAFE_AREA,
+                      max_iterations=MAX_ITERATIONS, batch_size=500, dry_run=False, progress=None):
+    """
+    Re-lay the stored points of the given treatments (default: all with points),
+    batch_size treatments at a time, committing after each batch unless dry_run.
+    Returns {'treatments': scanned, 'changed': treatments changed, 'points_moved': n}.
+    """
+    if treatment_ids is None:
+        treatment_ids = db.session.scalars(
+            select(TriggerPoint.treatment_id).distinct().order_by(TriggerPoint.treatment_id)
+        ).all()
+    else:
+        treatment_ids = sorted(set(treatment_ids))
+
+    stats = {'treatments': len(treatment_ids), 'changed': 0, 'points_moved': 0}
+    for offset in range(0, len(treatment_ids), batch_size):
+        batch = treatment_ids[offset:offset + batch_size]
+        moved, changed = _layout_batch(batch, min_distance, bounds, max_iterations, dry_run)
+        stats['points_moved'] += moved
+        stats['changed'] += len(changed)
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+        if progress:
+            progress(offset + len(batch), stats)
+    return stats
@@ -0,0 +1,255 @@
+# app/profiling.py
+"""
+Opt-in request profiler.
+
+Disabled unless PROFILING_ENABLED is set; when disabled no hooks are registered.
+When enabled a request is profiled if:
+- an admin sends the X-Profile: 1 header or the ?_profile=1 query flag, or
+- it is picked at PROFILING_SAMPLE_RATE and then takes longer than PROFILING_SLOW_MS.
+
+Two profilers are available (PROFILING_MODE):
+- "sample" (default): a background thread samples the request thread's stack every
+  PROFILING_INTERVAL_MS and stores collapsed stacks ("a;b;c 12" per line), which
+  flamegraph.pl, speedscope and similar tools render as a flame graph.
+- "cprofile": deterministic cProfile, stored as a .pstats file (snakeviz, pstats).
+
+Profiles are written to PROFILING_DIR with a JSON metadata sidecar; the oldest are
+removed beyond PROFILING_MAX_PROFILES. Admins can list and download them at
+/monitoring/profiles.
+"""
+
+import cProfile
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request, current_app
+from flask_login import current_user
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_QUERY_FLAG = '_profile'
+
+_PROFILE_ID = re.compile(r'^[0-9]{8}T[0-9]{6}-[0-9a-f]{8}$')
+
+
+class StackSampler:
+    """Samples one thread's call stack from a background thread"""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    @property
+    def sample_count(self):
+        return sum(self.stacks.values())
+
+    def collapsed(self):
+        """Collapsed-stack text, one "frame;frame;frame count" line per distinct stack"""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class RequestProfiler:
+    """Profiles selected requests and stores the results for the admin profile page"""
+
+    def __init__(self, app=None):
+        self.app = app
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize request profiling (no-op unless PROFILING_ENABLED)"""
+        app.config.setdefault('PROFILING_ENABLED', False)
+        app.config.setdefault('PROFILING_MODE', 'sample')
+        app.config.setdefault('PROFILING_SAMPLE_RATE', 0.0)
+        app.config.setdefault('PROFILING_SLOW_MS', 1000)
+        app.config.setdefault('PROFILING_INTERVAL_MS', 5)
+        app.config.setdefault('PROFILING_MAX_PROFILES', 50)
+        app.config.setdefault('PROFILING_DIR', os.path.join(app.instance_path, 'profiles'))
+        app.extensions['request_profiler'] = self
+
+        if not app.config['PROFILING_ENABLED']:
+            return
+
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        # after_request is skipped when a view raises; the profiler must still be stopped
+        app.teardown_request(self.teardown_request)
+
+    def _requested_by_admin(self):
+        flagged = request.headers.get(PROFILE_HEADER) == '1' or request.args.get(PROFILE_QUERY_FLAG) == '1'
+        return flagged and current_user.is_authenticated and current_user.is_admin
+
+    def start_request(self):
+        """Start a profiler if this request was selected"""
+        if request.path.startswith('/static/'):
+            return
+        config = current_app.config
+        forced = self._requested_by_admin()
+        sample_rate = config['PROFILING_SAMPLE_RATE']
+        if not forced and not (sample_rate > 0 and random.random() < sample_rate):
+            return
+
+        if config['PROFILING_MODE'] == 'cprofile':
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler (coverage, debugger) is already active on this thread
+                return
+        else:
+            profiler = StackSampler(threading.get_ident(), config['PROFILING_INTERVAL_MS'] / 1000)
+            profiler.start()
+        g._profiler = profiler
+        g._profile_forced = forced
+        g._profile_started_at = time.perf_counter()
+
+    def _stop_profiler(self):
+        """Stop this request's profiler; returns (profiler, duration_ms, forced), or None if there was none"""
+        profiler = g.pop('_profiler', None)
+        if profiler is None:
+            return None
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+        else:
+            profiler.stop()
+        duration_ms = (time.perf_counter() - g.pop('_profile_started_at')) * 1000
+        return profiler, duration_ms, g.pop('_profile_forced', False)
+
+    def _store(self, profiler, duration_ms, status_code, forced):
+        """Save the profile if it was forced or the request was slow; returns the profile id or None"""
+        if not forced and duration_ms < current_app.config['PROFILING_SLOW_MS']:
+            return None
+        try:
+            return self.save(profiler, duration_ms, status_code, forced)
+        except OSError as e:
+            current_app.logger.warning(f"Could not store request profile: {str(e)}")
+            return None
+
+    def finish_request(self, response):
+        """Stop the profiler and store the profile if it was forced or the request was slow"""
+        stopped = self._stop_profiler()
+        if stopped is None:
+            return response
+        profiler, duration_ms, forced = stopped
+        profile_id = self._store(profiler, duration_ms, response.status_code, forced)
+        if profile_id and forced:
+            response.headers['X-Profile-Id'] = profile_id
+        return response
+
+    def teardown_request(self, exc):
+        """Stop a profiler finish_request never saw (the request raised) and store it as a 500"""
+        stopped = self._stop_profiler()
+        if stopped is not None:
+            profiler, duration_ms, forced = stopped
+            self._store(profiler, duration_ms, 500, forced)
+
+    # ------------------------------------------------------------------
+    # Storage
+    # ------------------------------------------------------------------
+
+    @property
+    def directory(self):
+        return current_app.config['PROFILING_DIR']
+
+    def save(self, profiler, duration_ms, status_code, forced):
+        """Write the profile and its metadata, then prune old profiles. Returns the profile id."""
+        os.makedirs(self.directory, exist_ok=True)
+        now = datetime.utcnow()
+        profile_id = f"{now.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+        if isinstance(profiler, cProfile.Profile):
+            filename = f'{profile_id}.pstats'
+            profiler.dump_stats(os.path.join(self.directory, filename))
+            samples = None
+        else:
+            filename = f'{profile_id}.collapsed'
+            with open(os.path.join(self.directory, filename), 'w') as f:
+                f.write(profiler.collapsed())
+            samples = profiler.sample_count
+
+        metadata = {
+            'id': profile_id,
+            'filename': filename,
+            'created_at': now.isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': status_code,
+            'duration_ms': round(duration_ms, 1),
+            'mode': 'cprofile' if filename.endswith('.pstats') else 'sample',
+            'samples': samples,
+            'trigger': 'manual' if forced else 'slow',
+            'user_id': current_user.get_id() if current_user.is_authenticated else None,
+        }
+        with open(os.path.join(self.directory, f'{profile_id}.json'), 'w') as f:
+            json.dump(metadata, f)
+
+        current_app.logger.info(
+            f"Stored profile {profile_id} for {request.method} {request.path} ({duration_ms:.0f}ms)"
+        )
+        self.prune()
+        return profile_id
+
+    def list_profiles(self):
+        """Metadata of stored profiles, newest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        profiles.sort(key=lambda p: p['id'], reverse=True)
+        return profiles
+
+    def get_profile(self, profile_id):
+        """Metadata for one profile, or None (also for malformed ids)"""
+        if not _PROFILE_ID.match(profile_id or ''):
+            return None
+        path = os.path.join(self.directory, f'{profile_id}.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def prune(self):
+        keep = current_app.config['PROFILING_MAX_PROFILES']
+        for metadata in self.list_profiles()[keep:]:
+            for name in (metadata['filename'], f"{metadata['id']}.json"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
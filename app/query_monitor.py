@@ -0,0 +1,302 @@
+# app/query_monitor.py
+"""
+Per-request SQL instrumentation.
+
+Hooks SQLAlchemy's before/after_cursor_execute events to record, for every request,
+the number of statements, the total time spent in the database and a normalized
+fingerprint of each statement. Fingerprints repeated more than
+SQL_N_PLUS_ONE_THRESHOLD times are reported as N+1 patterns and statements slower
+than SQL_SLOW_QUERY_MS get their EXPLAIN plan captured. query_plan() and
+full_table_scans() check the plans of known hot queries (tests/test_query_plans.py).
+
+Results are returned as a Server-Timing header, kept for the admin /monitoring
+page, and available to tests through capture_queries().
+"""
+
+import re
+import time
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+from flask import g, request, current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Statement normalization: literals become "?" so identical query shapes share a fingerprint
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*(?:\?|%\(\w+\)s|%s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|%s|:\w+))*\s*\)')
+_NAMED_PARAM = re.compile(r'%\(\w+\)s|%s|:\w+\b')
+_WHITESPACE = re.compile(r'\s+')
+
+# Statements recorded by capture_queries() (tests, scripts) outside of request handling
+_active_capture = ContextVar('sql_query_capture', default=None)
+
+_listeners_installed = False
+_install_lock = threading.Lock()
+
+
+def fingerprint(statement):
+    """Normalize a SQL statement so that executions differing only in parameters compare equal."""
+    sql = _STRING_LITERAL.sub('?', statement)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _NAMED_PARAM.sub('?', sql)
+    sql = _PLACEHOLDER_LIST.sub('(?)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+class QueryStats:
+    """Statements executed during one request (or one capture_queries() block)."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+        self.slow_queries = []
+
+    def record(self, statement, elapsed, plan=None, slow=False):
+        self.count += 1
+        self.duration += elapsed
+        self.fingerprints[fingerprint(statement)] += 1
+        if slow:
+            self.slow_queries.append({
+                'statement': statement,
+                'duration_ms': round(elapsed * 1000, 2),
+                'plan': plan,
+            })
+
+    def n_plus_one(self, threshold):
+        """Fingerprints executed at least `threshold` times, most frequent first."""
+        return [(fp, n) for fp, n in self.fingerprints.most_common() if n >= threshold]
+
+    @property
+    def duration_ms(self):
+        return self.duration * 1000
+
+
+def _explain(cursor, dialect_name, statement, parameters):
+    """Return the query plan for a slow SELECT as a list of strings, or None."""
+    if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    if dialect_name == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif dialect_name == 'postgresql':
+        prefix = 'EXPLAIN '
+    else:
+        return None
+
+    # Use a separate DBAPI cursor so SQLAlchemy events don't see the EXPLAIN
+    explain_cursor = cursor.connection.cursor()
+    try:
+        if dialect_name == 'postgresql':
+            # A failed EXPLAIN must not abort the request's transaction
+            explain_cursor.execute('SAVEPOINT query_monitor_explain')
+        try:
+            explain_cursor.execute(prefix + statement, parameters)
+            rows = explain_cursor.fetchall()
+        except Exception:
+            if dialect_name == 'postgresql':
+                explain_cursor.execute('ROLLBACK TO SAVEPOINT query_monitor_explain')
+            return None
+        if dialect_name == 'postgresql':
+            explain_cursor.execute('RELEASE SAVEPOINT query_monitor_explain')
+        if dialect_name == 'sqlite':
+            # (id, parent, notused, detail)
+            return [row[-1] for row in rows]
+        return [row[0] for row in rows]
+    finally:
+        explain_cursor.close()
+
+
+# SQLite plan rows that read a whole table: "SCAN treatment" (but not "SCAN t USING INDEX ...")
+_FULL_SCAN = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+
+
+def query_plan(connection, statement):
+    """EXPLAIN QUERY PLAN detail lines for a SQLAlchemy statement on a SQLite connection."""
+    compiled = statement.compile(dialect=connection.dialect,
+                                 compile_kwargs={'render_postcompile': True})
+    parameters = tuple(compiled.params[name] for name in compiled.positiontup)
+    rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), parameters).fetchall()
+    return [row[-1] for row in rows]
+
+
+def full_table_scans(plan):
+    """Tables read with a full scan in a SQLite query plan (list of detail lines)."""
+    scans = []
+    for line in plan:
+        match = _FULL_SCAN.match(line.strip())
+        if match and match.group(1) != 'CONSTANT':
+            scans.append(match.group(1))
+    return scans
+
+
+def _current_targets():
+    targets = []
+    capture = _active_capture.get()
+    if capture is not None:
+        targets.append(capture)
+    if has_app_context():
+        stats = g.get('_query_stats')
+        if stats is not None and stats is not capture:
+            targets.append(stats)
+    return targets
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_monitor_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_monitor_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+
+    targets = _current_targets()
+    if not targets:
+        return
+
+    slow = False
+    plan = None
+    if has_app_context():
+        config = current_app.config
+        if elapsed * 1000 >= config.get('SQL_SLOW_QUERY_MS', 100):
+            slow = True
+            if config.get('SQL_EXPLAIN_SLOW_QUERIES', True) and not executemany:
+                try:
+                    plan = _explain(cursor, conn.dialect.name, statement, parameters)
+                except Exception:
+                    plan = None
+
+    for stats in targets:
+        stats.record(statement, elapsed, plan=plan, slow=slow)
+
+
+def install_listeners():
+    """Register the cursor hooks on all engines (idempotent)."""
+    global _listeners_installed
+    with _install_lock:
+        if _listeners_installed:
+            return
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _listeners_installed = True
+
+
+@contextmanager
+def capture_queries():
+    """
+    Record the statements executed inside the block.
+
+        with capture_queries() as stats:
+            client.get('/patients')
+        assert stats.count <= 10
+    """
+    install_listeners()
+    stats = QueryStats()
+    token = _active_capture.set(stats)
+    try:
+        yield stats
+    finally:
+        _active_capture.reset(token)
+
+
+class QueryMonitor:
+    """Collects per-request SQL statistics and keeps the most recent ones for /monitoring"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self.recent_requests = deque(maxlen=50)
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize SQL instrumentation"""
+        app.config.setdefault('SQL_MONITOR_ENABLED', True)
+        app.config.setdefault('SQL_N_PLUS_ONE_THRESHOLD', 10)
+        app.config.setdefault('SQL_SLOW_QUERY_MS', 100)
+        app.config.setdefault('SQL_EXPLAIN_SLOW_QUERIES', True)
+        app.config.setdefault('SQL_MONITOR_HISTORY', 50)
+        self.recent_requests = deque(maxlen=app.config['SQL_MONITOR_HISTORY'])
+        app.extensions['query_monitor'] = self
+
+        if not app.config['SQL_MONITOR_ENABLED']:
+            return
+
+        install_listeners()
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+
+    def start_request(self):
+        """Start collecting statements for this request"""
+        g._query_stats = QueryStats()
+        g._query_started_at = time.perf_counter()
+
+    def finish_request(self, response):
+        """Add the Server-Timing header and record the request summary"""
+        stats = g.pop('_query_stats', None)
+        started = g.pop('_query_started_at', None)
+        if stats is None or request.path.startswith('/static/'):
+            return response
+
+        total_ms = (time.perf_counter() - started) * 1000 if started else 0.0
+        timing = (
+            f'db;dur={stats.duration_ms:.1f};desc="{stats.count} queries", '
+            f'app;dur={total_ms:.1f}'
+        )
+        existing = response.headers.get('Server-Timing')
+        response.headers['Server-Timing'] = f'{existing}, {timing}' if existing else timing
+
+        threshold = current_app.config['SQL_N_PLUS_ONE_THRESHOLD']
+        n_plus_one = stats.n_plus_one(threshold)
+        for fp, n in n_plus_one:
+            current_app.logger.warning(
+                f"Possible N+1 on {request.method} {request.path}: {n}x {fp[:200]}"
+            )
+        for slow in stats.slow_queries:
+            current_app.logger.warning(
+                f"Slow query on {request.method} {request.path} ({slow['duration_ms']}ms): "
+                f"{slow['statement'][:200]} plan={slow['plan']}"
+            )
+
+        if request.path.startswith('/api/'):
+            from app.utils import log_api_access
+            user = getattr(g, '_login_user', None)
+            log_api_access(
+                request.path,
+                user_id=user.get_id() if user is not None and user.is_authenticated else None,
+                method=request.method,
+                status_code=response.status_code,
+                response_time=total_ms / 1000,
+            )
+
+        self.recent_requests.appendleft({
+            'timestamp': datetime.utcnow(),
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'queries': stats.count,
+            'db_ms': round(stats.duration_ms, 1),
+            'total_ms': round(total_ms, 1),
+            'n_plus_one': [{'fingerprint': fp, 'count': n} for fp, n in n_plus_one],
+            'slow_queries': stats.slow_queries,
+        })
+        return response
+
+    def summary(self):
+        """Aggregate figures over the recent requests"""
+        requests = list(self.recent_requests)
+        if not requests:
+            return {'requests': 0, 'avg_queries': 0, 'avg_db_ms': 0, 'n_plus_one_requests': 0, 'slow_query_requests': 0}
+        return {
+            'requests': len(requests),
+            'avg_queries': round(sum(r['queries'] for r in requests) / len(requests), 1),
+            'avg_db_ms': round(sum(r['db_ms'] for r in requests) / len(requests), 1),
+            'n_plus_one_requests': sum(1 for r in requests if r['n_plus_one']),
+            'slow_query_requests': sum(1 for r in requests if r['slow_queries']),
+        }
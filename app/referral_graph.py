@@ -0,0 +1,301 @@
+# app/referral_graph.py
+"""
+Patient referral graph.
+
+/api/analytics/referral-tree used to load every patient, lazy-load each
+patient's treatments just to count them and its referrer just to name it,
+decrypt referred_by_name up to four times, dedupe external referrers with a
+scan of the growing node list and walk the patient list four more times for
+its statistics. The graph is now built with:
+- one projection query over the practitioner's patients (outer-joined to the
+  referring patient for its name),
+- one grouped treatment count,
+- one decryption pass over every name in the graph,
+after which nodes, edges, top referrers, referral depth and conversion per
+referral source are computed in a single pass each.
+
+Graphs are cached per practitioner and validated like the patient directory
+(app.patient_directory): the practitioner's patient version counter catches
+changes committed in this process, and a stamp (patient count and latest
+update, treatment count and highest treatment id) catches treatments and
+changes made by other workers.
+
+referral_chain() and referral_subtree() back Patient.get_referral_chain() and
+Patient.get_referral_tree() with one recursive query each.
+"""
+
+import heapq
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import func, select
+from sqlalchemy.orm import aliased
+
+from app import db
+from app.crypto_utils import decrypt_many
+from app.metrics import record_cache
+from app.models import Patient, Treatment
+from app.patient_directory import scope_filter, directory_cache, directory_scope
+
+TOP_REFERRERS = 5
+DIRECT_SOURCE = 'Direct'
+PATIENT_SOURCE = 'Patient referral'
+
+
+def _scope_ids(scope):
+    return select(Patient.id).where(scope_filter(scope))
+
+
+def _stamp(scope):
+    """Patient count and latest update, treatment count and highest treatment id, in one query"""
+    return tuple(db.session.execute(select(
+        select(func.count(Patient.id)).where(scope_filter(scope)).scalar_subquery(),
+        select(func.max(Patient.updated_at)).where(scope_filter(scope)).scalar_subquery(),
+        select(func.count(Treatment.id)).where(Treatment.patient_id.in_(_scope_ids(scope))).scalar_subquery(),
+        select(func.max(Treatment.id)).where(Treatment.patient_id.in_(_scope_ids(scope))).scalar_subquery(),
+    )).one())
+
+
+def _external_id(name):
+    return f'external_{name.replace(" ", "_").lower()}'
+
+
+def referral_depths(parents):
+    """
+    Referral depth of each patient: 0 when not referred by a patient in the
+    graph, otherwise one more than the referrer's. `parents` maps every patient
+    id to its referrer's id (or None); each patient is visited once, and a
+    referral cycle is cut where it closes.
+    """
+    depths = {}
+    for start in parents:
+        path, on_path = [], set()
+        node = start
+        while node in parents and node not in depths and node not in on_path:
+            path.append(node)
+            on_path.add(node)
+            node = parents[node]
+        depth = depths.get(node, -1)
+        for patient_id in reversed(path):
+            depth += 1
+            depths[patient_id] = depth
+    return depths
+
+
+def build_referral_graph(scope):
+    """Nodes, edges and statistics for the referral-tree endpoint"""
+    referrer = aliased(Patient)
+    rows = db.session.execute(
+        select(Patient.id, Patient._name, Patient.status, Patient.created_at, Patient.referred_by_patient_id,
+               Patient._referred_by_name, Patient.referral_notes, referrer._name)
+        .outerjoin(referrer, referrer.id == Patient.referred_by_patient_id)
+        .where(scope_filter(scope))
+        .order_by(Patient.id)
+    ).all()
+    treatment_counts = dict(db.session.execute(
+        select(Treatment.patient_id, func.count(Treatment.id))
+        .where(Treatment.patient_id.in_(_scope_ids(scope)))
+        .group_by(Treatment.patient_id)
+    ).all())
+
+    # Patient names, external referrer names and referring patients' names with one cipher
+    n = len(rows)
+    plain = decrypt_many([row[1] for row in rows] + [row[5] for row in rows] + [row[7] for row in rows])
+    names, external_names, referrer_names = plain[:n], plain[n:2 * n], plain[2 * n:]
+
+    in_graph = {row[0] for row in rows}
+    nodes, edges, patient_nodes = [], [], []
+    external_nodes = set()
+    parents = {}
+    referral_counts, external_counts = {}, {}
+    sources = {}    # source -> [type, patients, patients with a treatment]
+
+    for row, name, external_name, referrer_name in zip(rows, names, external_names, referrer_names):
+        patient_id, status, created_at, referred_by_id, notes = row[0], row[2], row[3], row[4], row[6]
+        treatments = treatment_counts.get(patient_id, 0)
+        parents[patient_id] = referred_by_id if referred_by_id in in_graph else None
+        node = {
+            'id': f'patient_{patient_id}',
+            'name': name,
+            'type': 'patient',
+            'referral_source': referrer_name if row[7] is not None else external_name,
+            'total_treatments': treatments,
+            'status': status,
+            'created_at': created_at.strftime('%Y-%m-%d') if created_at else None,
+        }
+        nodes.append(node)
+        patient_nodes.append(node)
+
+        if referred_by_id:
+            source, source_type = PATIENT_SOURCE, 'patient'
+            referral_counts[referred_by_id] = referral_counts.get(referred_by_id, 0) + 1
+            edges.append({
+                'from': f'patient_{referred_by_id}',
+                'to': f'patient_{patient_id}',
+                'type': 'patient_referral',
+                'referral_notes': notes,
+            })
+        elif external_name:
+            source, source_type = external_name, 'external'
+            external_counts[external_name] = external_counts.get(external_name, 0) + 1
+            external_id = _external_id(external_name)
+            # External referrers get a node after the first patient they referred
+            if external_id not in external_nodes:
+                external_nodes.add(external_id)
+                nodes.append({
+                    'id': external_id,
+                    'name': external_name,
+                    'type': 'external',
+                    'referral_source': None,
+                    'total_treatments': 0,
+                    'status': 'External Referrer',
+                    'created_at': None,
+                })
+            edges.append({
+                'from': external_id,
+                'to': f'patient_{patient_id}',
+                'type': 'external_referral',
+                'referral_notes': notes,
+            })
+        else:
+            source, source_type = DIRECT_SOURCE, 'direct'
+        counts = sources.setdefault(source, [source_type, 0, 0])
+        counts[1] += 1
+        if treatments:
+            counts[2] += 1
+
+    depths = referral_depths(parents)
+    for node, row in zip(patient_nodes, rows):
+        node['referral_depth'] = depths[row[0]]
+
+    total_patients = len(rows)
+    patient_referrals = sum(referral_counts.values())
+    external_referrals = sum(external_counts.values())
+    referred_patients = patient_referrals + external_referrals
+    top_patient_referrers = heapq.nlargest(
+        TOP_REFERRERS,
+        ({'name': name, 'referrals_count': referral_counts[row[0]]}
+         for row, name in zip(rows, names) if row[0] in referral_counts),
+        key=lambda referrer: referrer['referrals_count'])
+    top_external_referrers = heapq.nlargest(
+        TOP_REFERRERS,
+        ({'name': name, 'referrals_count': count} for name, count in external_counts.items()),
+        key=lambda referrer: referrer['referrals_count'])
+    conversion_by_source = sorted(
+        ({'source': source, 'type': source_type, 'patients': patients, 'converted': converted,
+          'conversion_rate': round(converted / patients * 100, 2)}
+         for source, (source_type, patients, converted) in sources.items()),
+        key=lambda entry: (-entry['patients'], entry['source']))
+
+    return {
+        'nodes': nodes,
+        'edges': edges,
+        'statistics': {
+            'total_patients': total_patients,
+            'referred_patients': referred_patients,
+            'patient_referrals': patient_referrals,
+            'external_referrals': external_referrals,
+            'referral_rate': round((referred_patients / total_patients * 100), 2) if total_patients > 0 else 0,
+            'top_patient_referrers': top_patient_referrers,
+            'top_external_referrers': top_external_referrers,
+            'max_referral_depth': max(depths.values(), default=0),
+            'conversion_by_source': conversion_by_source,
+        },
+    }
+
+
+class ReferralGraphCache:
+    """Small LRU of built graphs, each stored with the version and stamp it was built at"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key, version, stamp):
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None or cached[0] != version or cached[1] != stamp:
+                return None
+            self._entries.move_to_end(key)
+            return cached[2]
+
+    def put(self, key, version, stamp, graph, max_entries):
+        with self._lock:
+            self._entries[key] = (version, stamp, graph)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+graph_cache = ReferralGraphCache()
+
+
+def referral_graph(user):
+    """Referral graph of the patients the user sees; shared between requests, do not modify"""
+    scope = directory_scope(user)
+    config = current_app.config
+    if not config.get('REFERRAL_GRAPH_CACHE_ENABLED', True):
+        return build_referral_graph(scope)
+
+    key = (str(db.engine.url), scope)
+    version = directory_cache.version(scope)
+    stamp = _stamp(scope)
+    graph = graph_cache.get(key, version, stamp)
+    record_cache('referral_graph', graph is not None)
+    if graph is None:
+        graph = build_referral_graph(scope)
+        graph_cache.put(key, version, stamp, graph, config.get('REFERRAL_GRAPH_CACHE_SIZE', 256))
+    return graph
+
+
+# Chains and subtrees of one patient
+
+def referral_chain(patient):
+    """Patients from the first referrer down to `patient`, with one recursive query"""
+    chain = select(Patient.id, Patient.referred_by_patient_id).where(Patient.id == patient.id).cte(recursive=True)
+    parent = aliased(Patient)
+    # UNION (not UNION ALL) drops repeated rows, so a referral cycle ends the recursion
+    chain = chain.union(select(parent.id, parent.referred_by_patient_id).where(parent.id == chain.c.referred_by_patient_id))
+    patients = {p.id: p for p in Patient.query.filter(Patient.id.in_(select(chain.c.id)))}
+
+    ordered, seen = [], set()
+    current = patient.id
+    while current in patients and current not in seen:
+        seen.add(current)
+        ordered.append(patients[current])
+        current = patients[current].referred_by_patient_id
+    ordered.reverse()
+    return ordered
+
+
+def referral_subtree(patient):
+    """{'patient', 'referrals': [...]} for everyone `patient` referred, directly or not, with one recursive query"""
+    tree = select(Patient.id).where(Patient.id == patient.id).cte(recursive=True)
+    child = aliased(Patient)
+    tree = tree.union(select(child.id).where(child.referred_by_patient_id == tree.c.id))
+    patients = Patient.query.filter(Patient.id.in_(select(tree.c.id))).order_by(Patient.id).all()
+
+    children = {}
+    for p in patients:
+        if p.id != patient.id:
+            children.setdefault(p.referred_by_patient_id, []).append(p)
+
+    root = {'patient': patient, 'referrals': []}
+    stack, seen = [root], {patient.id}
+    while stack:
+        node = stack.pop()
+        for referred in children.get(node['patient'].id, ()):
+            if referred.id not in seen:
+                seen.add(referred.id)
+                subtree = {'patient': referred, 'referrals': []}
+                node['referrals'].append(subtree)
+                stack.append(subtree)
+    return root
@@ -9,10 +9,17 @@ import os
 import json
 from flask_login import login_required, current_user
 import traceback
-import stripe
+from app.integrations import stripe
 from flask import url_for
 from generate_patient_report import format_treatment_history
 from app.crypto_utils import decrypt_text
+from app.metrics import track_external
+from app.db_routing import replica_read
+from app.patient_directory import directory_page, DEFAULT_PAGE_SIZE
+from app.patient_access import patient_access_required, can_access_patient
+from app.body_heatmap import body_heatmap, parse_filters
+from app.referral_graph import referral_graph
+from app.patient_timeline import timeline_page, serialize_page, DEFAULT_PAGE_SIZE as TIMELINE_PAGE_SIZE
 import os
 
 api = Blueprint('api', __name__)
@@ -49,7 +56,8 @@ def sync_calendly_events():
             'sort': 'start_time:asc' # Good practice to sort
         }
         
-        events_response = requests.get(events_url, headers=headers, params=params)
+        with track_external('calendly'):
+            events_response = requests.get(events_url, headers=headers, params=params)
         
         if events_response.status_code != 200:
             error_message = f'Failed to get Calendly events for your account: {events_response.text}'
@@ -74,7 +82,8 @@ def sync_calendly_events():
             event_uuid = event_uri.split('/')[-1] # Calendly event UUID
             
             invitees_url = f'https://api.calendly.com/scheduled_events/{event_uuid}/invitees'
-            invitees_response = requests.get(invitees_url, headers=headers)
+            with track_external('calendly'):
+                invitees_response = requests.get(invitees_url, headers=headers)
             
             if invitees_response.status_code != 200:
                 current_app.logger.warning(f"Failed to get invitees for event {event_uuid} for user {current_user.id}: {invitees_response.text}")
@@ -211,6 +220,64 @@ def find_matching_patient(name, email):
     # No confident match found
     return None
 
+@api.route('/patients')
+@login_required
+def patient_directory():
+    """Keyset-paginated patient directory (?cursor=&limit=&status=&search=)"""
+    if current_user.role not in ['physio', 'admin']:
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    try:
+        page = directory_page(
+            current_user,
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', DEFAULT_PAGE_SIZE, type=int),
+            status=request.args.get('status'),
+            search=request.args.get('search'),
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify(page)
+
+@api.route('/patients/<int:patient_id>/treatments')
+@login_required
+@patient_access_required()
+def patient_timeline(patient_id):
+    """Keyset-paginated treatment timeline, newest first (?cursor=&limit=)"""
+    if current_user.role not in ['physio', 'admin']:
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    try:
+        page = timeline_page(
+            patient_id,
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', TIMELINE_PAGE_SIZE, type=int),
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify(serialize_page(page))
+
+@api.route('/heatmap')
+@login_required
+@replica_read
+def trigger_point_heatmap():
+    """Binned trigger point density (?patient_id=&muscle=&type=&start=&end=&icd10=&bins_x=&bins_y=)"""
+    if current_user.role not in ['physio', 'admin']:
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    patient_id = request.args.get('patient_id', type=int)
+    if patient_id is not None and not can_access_patient(current_user, patient_id):
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    try:
+        filters = parse_filters(request.args)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Dates must be YYYY-MM-DD'}), 400
+    heatmap = body_heatmap(
+        current_user,
+        patient_id=patient_id,
+        filters=filters,
+        bins_x=request.args.get('bins_x', type=int),
+        bins_y=request.args.get('bins_y', type=int),
+    )
+    return jsonify(heatmap)
+
 @api.route('/patients/search')
 @login_required
 def search_patients():
@@ -447,23 +514,24 @@ def generate_patient_report(id):
         # Modify system message to include language instruction
         system_message = f"You are a professional physiotherapist with expertise in creating detailed, evidence-based treatment progress reports. You use precise physiotherapy terminology while ensuring your reports remain clear and accessible. You must write all reports in {language_names[requested_language]} using professional medical terminology appropriate for that language."
 
-        response = requests.post(
-            "https://api.deepseek.com/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": "deepseek-chat",
-                "messages": [
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": 0.3,
-                "max_tokens": 4000
-            },
-            timeout=90
-        )
+        with track_external('deepseek'):
+            response = requests.post(
+                "https://api.deepseek.com/v1/chat/completions",
+                headers={
+                    "Authorization": f"Bearer {api_key}",
+                    "Content-Type": "application/json"
+                },
+                json={
+                    "model": "deepseek-chat",
+                    "messages": [
+                        {"role": "system", "content": system_message},
+                        {"role": "user", "content": prompt}
+                    ],
+                    "temperature": 0.3,
+                    "max_tokens": 4000
+                },
+                timeout=90
+            )
         if response.status_code != 200:
             return jsonify({'success': False, 'message': f"AI error: {response.text}"}), 500
 
@@ -749,23 +817,24 @@ def generate_exercise_prescription(id):
         # Modify system message to include language instruction
         system_message = f"You are a professional physiotherapist with expertise in creating home exercise programs. You must write all exercise prescriptions in {language_names[requested_language]} using professional physiotherapy terminology appropriate for that language. Use patient-friendly language while maintaining clinical accuracy."
 
-        response = requests.post(
-            "https://api.deepseek.com/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": "deepseek-chat",
-                "messages": [
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": 0.3,
-                "max_tokens": 2000
-            },
-            timeout=90
-        )
+        with track_external('deepseek'):
+            response = requests.post(
+                "https://api.deepseek.com/v1/chat/completions",
+                headers={
+                    "Authorization": f"Bearer {api_key}",
+                    "Content-Type": "application/json"
+                },
+                json={
+                    "model": "deepseek-chat",
+                    "messages": [
+                        {"role": "system", "content": system_message},
+                        {"role": "user", "content": prompt}
+                    ],
+                    "temperature": 0.3,
+                    "max_tokens": 2000
+                },
+                timeout=90
+            )
         if response.status_code != 200:
             return jsonify({'success': False, 'message': f"AI error: {response.text}"}), 500
 
@@ -865,6 +934,7 @@ def start_of_month(dt):
 
 @api.route('/analytics/treatments-by-month')
 @login_required
+@replica_read
 def treatments_by_month():
     try:
         data_query = db.session.query(
@@ -884,6 +954,7 @@ def treatments_by_month():
 
 @api.route('/analytics/patients-by-month')
 @login_required
+@replica_read
 def patients_by_month():
     try:
         data = db.session.query(
@@ -901,6 +972,7 @@ def patients_by_month():
 
 @api.route('/analytics/revenue-by-visit-type')
 @login_required
+@replica_read
 def revenue_by_visit_type():
     try:
         # First check if we have any treatments with fees for this user
@@ -943,6 +1015,7 @@ def revenue_by_visit_type():
 
 @api.route('/analytics/revenue-by-location')
 @login_required
+@replica_read
 def revenue_by_location():
     try:
         data = db.session.query(
@@ -960,6 +1033,7 @@ def revenue_by_location():
 
 @api.route('/analytics/common-diagnoses')
 @login_required
+@replica_read
 def common_diagnoses():
     try:
         data = db.session.query(
@@ -978,6 +1052,7 @@ def common_diagnoses():
 
 @api.route('/analytics/patient-status')
 @login_required
+@replica_read
 def patient_status_distribution():
     try:
         data = db.session.query(
@@ -994,6 +1069,7 @@ def patient_status_distribution():
 
 @api.route('/analytics/payment-methods')
 @login_required
+@replica_read
 def payment_method_distribution():
     try:
         data = db.session.query(
@@ -1011,6 +1087,7 @@ def payment_method_distribution():
 
 @api.route('/analytics/costaspine-fee-data')
 @login_required
+@replica_read
 def get_costaspine_fee_data():
     try:
         data = db.session.query(
@@ -1028,6 +1105,7 @@ def get_costaspine_fee_data():
 
 @api.route('/analytics/cancellations-by-month')
 @login_required
+@replica_read
 def cancellations_by_month():
     """Get monthly cancellation statistics"""
     try:
@@ -1051,6 +1129,7 @@ def cancellations_by_month():
 
 @api.route('/analytics/cancellation-rates')
 @login_required
+@replica_read
 def cancellation_rates():
     """Get cancellation rates by month"""
     try:
@@ -1262,7 +1341,7 @@ def sync_appointments_manually():
         user_id = None if current_user.is_admin else current_user.id
         
         from app.utils import auto_sync_appointments
-        sync_result = auto_sync_appointments(user_id)
+        sync_result = auto_sync_appointments(user_id, force_calendly=True)
         
         return jsonify({
             'success': True,
@@ -1276,6 +1355,7 @@ def sync_appointments_manually():
 
 @api.route('/analytics/recently-inactive-patients')
 @login_required
+@replica_read
 def recently_inactive_patients():
     try:
         three_months_ago = datetime.utcnow() - timedelta(days=90)
@@ -1300,6 +1380,7 @@ def recently_inactive_patients():
 
 @api.route('/analytics/top-patients-by-revenue')
 @login_required
+@replica_read
 def top_patients_by_revenue():
     try:
         # First check if we have any treatments with fees for this user
@@ -1349,6 +1430,7 @@ def top_patients_by_revenue():
 
 @api.route('/analytics/costaspine-service-fee')
 @login_required
+@replica_read
 def costaspine_service_fee():
     try:
         
@@ -1404,113 +1486,11 @@ def costaspine_service_fee():
 
 @api.route('/analytics/referral-tree')
 @login_required
+@replica_read
 def referral_tree():
     """Get referral tree data for visualization"""
     try:
-        # Get all patients accessible to the current user
-        patients = current_user.get_accessible_patients()
-        
-        # Build referral tree data
-        nodes = []
-        edges = []
-        
-        # Create nodes for all patients
-        for patient in patients:
-            node = {
-                'id': f'patient_{patient.id}',
-                'name': patient.name,
-                'type': 'patient',
-                'referral_source': patient.referral_source,
-                'total_treatments': len(patient.treatments),
-                'status': patient.status,
-                'created_at': patient.created_at.strftime('%Y-%m-%d') if patient.created_at else None
-            }
-            nodes.append(node)
-            
-            # Create edge if patient was referred by another patient
-            if patient.referred_by_patient_id:
-                edge = {
-                    'from': f'patient_{patient.referred_by_patient_id}',
-                    'to': f'patient_{patient.id}',
-                    'type': 'patient_referral',
-                    'referral_notes': patient.referral_notes
-                }
-                edges.append(edge)
-            elif patient.referred_by_name:
-                # Create a non-patient referrer node if it doesn't exist
-                referrer_id = f'external_{patient.referred_by_name.replace(" ", "_").lower()}'
-                
-                # Check if we already created this external referrer node
-                if not any(node['id'] == referrer_id for node in nodes):
-                    external_node = {
-                        'id': referrer_id,
-                        'name': patient.referred_by_name,
-                        'type': 'external',
-                        'referral_source': None,
-                        'total_treatments': 0,
-                        'status': 'External Referrer',
-                        'created_at': None
-                    }
-                    nodes.append(external_node)
-                
-                # Create edge from external referrer to patient
-                edge = {
-                    'from': referrer_id,
-                    'to': f'patient_{patient.id}',
-                    'type': 'external_referral',
-                    'referral_notes': patient.referral_notes
-                }
-                edges.append(edge)
-        
-        # Calculate referral statistics
-        total_patients = len(patients)
-        referred_patients = len([p for p in patients if p.referred_by_patient_id or p.referred_by_name])
-        patient_referrals = len([p for p in patients if p.referred_by_patient_id])
-        external_referrals = len([p for p in patients if p.referred_by_name and not p.referred_by_patient_id])
-        
-        # Find top referrers (patients who have referred the most)
-        referrer_counts = {}
-        for patient in patients:
-            if patient.referred_by_patient_id:
-                referrer_counts[patient.referred_by_patient_id] = referrer_counts.get(patient.referred_by_patient_id, 0) + 1
-        
-        top_patient_referrers = []
-        for patient in patients:
-            if patient.id in referrer_counts:
-                top_patient_referrers.append({
-                    'name': patient.name,
-                    'referrals_count': referrer_counts[patient.id]
-                })
-        
-        top_patient_referrers.sort(key=lambda x: x['referrals_count'], reverse=True)
-        top_patient_referrers = top_patient_referrers[:5]  # Top 5
-        
-        # Find top external referrers
-        external_referrer_counts = {}
-        for patient in patients:
-            if patient.referred_by_name and not patient.referred_by_patient_id:
-                external_referrer_counts[patient.referred_by_name] = external_referrer_counts.get(patient.referred_by_name, 0) + 1
-        
-        top_external_referrers = [{'name': name, 'referrals_count': count} 
-                                 for name, count in external_referrer_counts.items()]
-        top_external_referrers.sort(key=lambda x: x['referrals_count'], reverse=True)
-        top_external_referrers = top_external_referrers[:5]  # Top 5
-        
-        result = {
-            'nodes': nodes,
-            'edges': edges,
-            'statistics': {
-                'total_patients': total_patients,
-                'referred_patients': referred_patients,
-                'patient_referrals': patient_referrals,
-                'external_referrals': external_referrals,
-                'referral_rate': round((referred_patients / total_patients * 100), 2) if total_patients > 0 else 0,
-                'top_patient_referrers': top_patient_referrers,
-                'top_external_referrers': top_external_referrers
-            }
-        }
-        
-        return jsonify(result)
+        return jsonify(referral_graph(current_user))
     except Exception as e:
         current_app.logger.error(f"Error fetching referral-tree for user {current_user.id}: {e}\n{traceback.format_exc()}")
         return jsonify({"error": "Failed to fetch referral tree data"}), 500
@@ -1538,18 +1518,19 @@ def create_checkout_session():
         if current_user.is_in_clinic:
             return jsonify({'error': 'You are part of a clinic. Please use clinic plans instead.'}), 400
 
-        checkout_session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=[{'price': plan.stripe_price_id, 'quantity': 1}],
-            mode='subscription',
-            success_url=url_for('main.subscription_success', _external=True) + '?session_id={CHECKOUT_SESSION_ID}',
-            cancel_url=url_for('main.pricing_individual', _external=True),
-            client_reference_id=str(current_user.id),
-            customer_email=current_user.email,
-            metadata={
-                'plan_type': 'individual'
-            }
-        )
+        with track_external('stripe'):
+            checkout_session = stripe.checkout.Session.create(
+                payment_method_types=['card'],
+                line_items=[{'price': plan.stripe_price_id, 'quantity': 1}],
+                mode='subscription',
+                success_url=url_for('main.subscription_success', _external=True) + '?session_id={CHECKOUT_SESSION_ID}',
+                cancel_url=url_for('main.pricing_individual', _external=True),
+                client_reference_id=str(current_user.id),
+                customer_email=current_user.email,
+                metadata={
+                    'plan_type': 'individual'
+                }
+            )
         return jsonify({'sessionId': checkout_session.id})
 
     except Exception as e:
@@ -1602,19 +1583,20 @@ def create_clinic_checkout_session():
         if not current_user.is_clinic_admin:
             return jsonify({'error': 'Only clinic administrators can manage clinic subscriptions.'}), 400
 
-        checkout_session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=[{'price': plan.stripe_price_id, 'quantity': 1}],
-            mode='subscription',
-            success_url=url_for('main.subscription_success', _external=True) + '?session_id={CHECKOUT_SESSION_ID}',
-            cancel_url=url_for('main.pricing_clinic', _external=True),
-            client_reference_id=f"clinic_{current_user.clinic.id}",
-            customer_email=current_user.email,
-            metadata={
-                'clinic_id': current_user.clinic.id,
-                'plan_type': 'clinic'
-            }
-        )
+        with track_external('stripe'):
+            checkout_session = stripe.checkout.Session.create(
+                payment_method_types=['card'],
+                line_items=[{'price': plan.stripe_price_id, 'quantity': 1}],
+                mode='subscription',
+                success_url=url_for('main.subscription_success', _external=True) + '?session_id={CHECKOUT_SESSION_ID}',
+                cancel_url=url_for('main.pricing_clinic', _external=True),
+                client_reference_id=f"clinic_{current_user.clinic.id}",
+                customer_email=current_user.email,
+                metadata={
+                    'clinic_id': current_user.clinic.id,
+                    'plan_type': 'clinic'
+                }
+            )
         return jsonify({'sessionId': checkout_session.id})
 
     except Exception as e:
@@ -1756,7 +1738,8 @@ def list_invoices():
         return jsonify({'success': False, 'message': 'No Stripe customer ID found.'}), 400
 
     try:
-        invoices = stripe.Invoice.list(customer=customer_id, limit=20)
+        with track_external('stripe'):
+            invoices = stripe.Invoice.list(customer=customer_id, limit=20)
         result = []
         for inv in invoices.auto_paging_iter():
             result.append({
@@ -2092,15 +2075,16 @@ Focus on evidence-based recommendations specific to the presented condition. Inc
 """
             
             current_app.logger.info("Making API call to DeepSeek")
-            response = client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "system", "content": f"You are an expert physiotherapist providing clinical recommendations based on ANONYMIZED patient assessment data. Always respond with valid JSON in {language.upper()} language. Never request or use any personally identifiable information. {language_instruction}"},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1000,
-                temperature=0.3
-            )
+            with track_external('deepseek'):
+                response = client.chat.completions.create(
+                    model="deepseek-chat",
+                    messages=[
+                        {"role": "system", "content": f"You are an expert physiotherapist providing clinical recommendations based on ANONYMIZED patient assessment data. Always respond with valid JSON in {language.upper()} language. Never request or use any personally identifiable information. {language_instruction}"},
+                        {"role": "user", "content": prompt}
+                    ],
+                    max_tokens=1000,
+                    temperature=0.3
+                )
             
             # Parse the AI response
             ai_response = response.choices[0].message.content.strip()
@@ -2551,7 +2535,8 @@ Guidelines:
                     continue
                 try:
                     current_app.logger.info(f"Patient AI Chat - Attempting {endpoint}")
-                    response = requests.post(endpoint, headers=headers, json=payload, timeout=90)
+                    with track_external('deepseek'):
+                        response = requests.post(endpoint, headers=headers, json=payload, timeout=90)
                     if response.status_code == 200:
                         break
                 except requests.exceptions.RequestException:
@@ -2962,7 +2947,8 @@ Guidelines:
                     continue
                 try:
                     current_app.logger.info(f"Patient AI Chat - Attempting {endpoint}")
-                    response = requests.post(endpoint, headers=headers, json=payload, timeout=90)
+                    with track_external('deepseek'):
+                        response = requests.post(endpoint, headers=headers, json=payload, timeout=90)
                     if response.status_code == 200:
                         break
                 except requests.exceptions.RequestException:
@@ -2,11 +2,11 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request,
 from flask_login import login_user, logout_user, current_user, login_required
 from flask_babel import _
 from app.models import User, db
+from app.metrics import track_external
 from app.forms import RegistrationForm, LoginForm
 from app.email_utils import send_verification_email, send_welcome_email
 from datetime import datetime
 import logging
-from authlib.integrations.flask_client import OAuth
 import secrets
 
 # If the above import fails, try this alternative:
@@ -29,28 +29,35 @@ def is_safe_url(target):
 
 auth = Blueprint('auth', __name__)
 
-# OAuth configuration
-oauth = OAuth()
-
+# OAuth configuration; authlib is imported on the first Google login
 def init_oauth(app):
-    """Initialize OAuth with the Flask app"""
-    oauth.init_app(app)
-    
-    google = oauth.register(
-        name='google',
-        client_id=app.config['GOOGLE_CLIENT_ID'],
-        client_secret=app.config['GOOGLE_CLIENT_SECRET'],
-        authorize_url='https://accounts.google.com/o/oauth2/auth',
-        authorize_params=None,
-        access_token_url='https://oauth2.googleapis.com/token',
-        access_token_params=None,
-        refresh_token_url=None,
-        redirect_uri=None,
-        client_kwargs={
-            'scope': 'openid email profile',
-            'prompt': 'select_account'
-        },
-    )
+    """Enable Google login for the Flask app"""
+    app.extensions['google_oauth'] = None
+
+def google_oauth_client():
+    """The app's Google OAuth client, registered on first use"""
+    google = current_app.extensions.get('google_oauth')
+    if google is None:
+        from authlib.integrations.flask_client import OAuth
+
+        app = current_app._get_current_object()
+        oauth = OAuth(app)
+        google = oauth.register(
+            name='google',
+            client_id=app.config['GOOGLE_CLIENT_ID'],
+            client_secret=app.config['GOOGLE_CLIENT_SECRET'],
+            authorize_url='https://accounts.google.com/o/oauth2/auth',
+            authorize_params=None,
+            access_token_url='https://oauth2.googleapis.com/token',
+            access_token_params=None,
+            refresh_token_url=None,
+            redirect_uri=None,
+            client_kwargs={
+                'scope': 'openid email profile',
+                'prompt': 'select_account'
+            },
+        )
+        app.extensions['google_oauth'] = google
     return google
 
 @auth.route('/login', methods=['GET', 'POST'])
@@ -166,11 +173,12 @@ def register():
         # Send verification email (unless it's the first admin user)
         if not user.is_admin:
             try:
-                if send_verification_email(user):
-                    flash(_('Registration successful! We have sent you a verification email. Check your inbox.'), 'success')
-                else:
-                    flash(_('Registration successful, but there was a problem sending the verification email. Contact support.'), 'warning')
+                # The token and the queued email are committed together
+                send_verification_email(user)
+                db.session.commit()
+                flash(_('Registration successful! We have sent you a verification email. Check your inbox.'), 'success')
             except Exception as e:
+                db.session.rollback()
                 current_app.logger.error(f"Error sending verification email: {str(e)}")
                 flash(_('Registration successful, but there was a problem sending the verification email. Contact support.'), 'warning')
         else:
@@ -207,14 +215,13 @@ def verify_email(token):
     
     # Verify the token
     if user.verify_email_token(token):
-        db.session.commit()
-        current_app.logger.info(f"Email verified successfully for user: {user.email}")
-        
-        # Send welcome email
+        # Queue the welcome email in the same transaction as the verification
         try:
             send_welcome_email(user)
         except Exception as e:
             current_app.logger.error(f"Error sending welcome email: {str(e)}")
+        db.session.commit()
+        current_app.logger.info(f"Email verified successfully for user: {user.email}")
         
         flash(_('Email verified successfully! You can now sign in.'), 'success')
         return redirect(url_for('auth.login'))
@@ -262,7 +269,7 @@ def google_login():
         flash('Google login is not configured.', 'error')
         return redirect(url_for('auth.login'))
     
-    google = oauth.google
+    google = google_oauth_client()
     redirect_uri = url_for('auth.google_callback', _external=True)
     return google.authorize_redirect(redirect_uri)
 
@@ -270,7 +277,7 @@ def google_login():
 def google_callback():
     """Handle Google OAuth callback"""
     try:
-        google = oauth.google
+        google = google_oauth_client()
         token = google.authorize_access_token()
         
         # Get user info from Google using the access token
@@ -281,10 +288,11 @@ def google_callback():
             return redirect(url_for('auth.login'))
         
         # Fetch user info from Google API
-        user_info_response = requests.get(
-            'https://www.googleapis.com/oauth2/v2/userinfo',
-            headers={'Authorization': f'Bearer {access_token}'}
-        )
+        with track_external('google'):
+            user_info_response = requests.get(
+                'https://www.googleapis.com/oauth2/v2/userinfo',
+                headers={'Authorization': f'Bearer {access_token}'}
+            )
         
         if user_info_response.status_code != 200:
             flash('Failed to get user information from Google.', 'error')
@@ -2,6 +2,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required, current_user
 from app.models import db, Clinic, ClinicMembership, ClinicSubscription, Plan, User
 from app.forms import ClinicForm
+from app.email_utils import send_clinic_invitation_email
 from datetime import datetime, timedelta
 import secrets
 import string
@@ -350,9 +351,6 @@ def invite_practitioner():
         # Generate invitation token
         invitation.invitation_token = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(32))
         
-        db.session.commit()
-        
-        # In a real application, you would send an email here
         if message_type == "existing_user":
             invitation_link = url_for('clinic.join_with_token', token=invitation.invitation_token, _external=True)
             message = f'Invitation sent to existing user {email}'
@@ -360,6 +358,10 @@ def invite_practitioner():
             invitation_link = url_for('clinic.register_and_join', token=invitation.invitation_token, email=email, _external=True)
             message = f'Invitation sent to {email}. They will be able to create an account and join the clinic.'
         
+        # Queued in the same transaction as the invitation
+        send_clinic_invitation_email(email, clinic_obj, current_user, invitation_link, invitation.invitation_token)
+        db.session.commit()
+        
         return jsonify({
             'success': True, 
             'message': message,
@@ -36,6 +36,7 @@ def disconnect():
         current_user.google_calendar_enabled = False
         current_user.google_calendar_primary_calendar_id = None
         current_user.google_calendar_last_sync = None
+        current_user.google_calendar_sync_token = None
         
         db.session.commit()
         flash('Google Calendar has been disconnected successfully.', 'success')
@@ -169,6 +170,32 @@ def create_event():
             'error': str(e)
         }), 500
 
+@google_calendar_bp.route('/push-treatments', methods=['POST'])
+@login_required
+def push_treatments():
+    """Create or update Google Calendar events for the upcoming scheduled treatments"""
+    try:
+        if not current_user.google_calendar_configured:
+            return jsonify({
+                'success': False,
+                'error': 'Google Calendar is not properly configured.'
+            }), 400
+        
+        treatments = google_calendar_service.pushable_treatments(current_user)
+        result = google_calendar_service.push_treatments(current_user, treatments)
+        
+        return jsonify({
+            'success': result['failed'] == 0,
+            'message': f'{result["created"]} events created and {result["updated"]} updated in Google Calendar.',
+            **result
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @google_calendar_bp.route('/status')
 @login_required
 def status():
@@ -1,15 +1,20 @@
 # app/routes/icd10_api.py
 # ICD-10 Diagnosis System API Routes
 
-from flask import Blueprint, request, jsonify, render_template
+from flask import Blueprint, request, jsonify
 from flask_login import login_required, current_user
-from sqlalchemy import or_, and_
+from flask_babel import get_locale
+from sqlalchemy import exists, select
 from datetime import datetime, date, timedelta
 import json
 
 from ..models import db, Patient
-from ..models_icd10 import ICD10Code, PatientDiagnosis, DiagnosisTemplate, TreatmentOutcome
+from ..models_icd10 import ICD10Code, PatientDiagnosis, DiagnosisTemplate
 from ..decorators import physio_required
+from ..db_routing import replica_read
+from ..patient_access import patient_access_required, accessible_patient_ids_query
+from ..icd10_search import search_codes
+from ..icd10_catalog import reference_catalog
 
 icd10_api = Blueprint('icd10_api', __name__)
 
@@ -24,28 +29,8 @@ def search_icd10_codes():
     if len(query) < 2:
         return jsonify({'codes': [], 'message': 'Query too short'})
     
-    # Build search query
-    search_query = ICD10Code.query.filter(
-        ICD10Code.is_active == True,
-        ICD10Code.is_physiotherapy_relevant == True
-    )
-    
-    # Add text search
-    search_term = f"%{query}%"
-    search_query = search_query.filter(
-        or_(
-            ICD10Code.code.ilike(search_term),
-            ICD10Code.description.ilike(search_term),
-            ICD10Code.short_description.ilike(search_term)
-        )
-    )
-    
-    # Add category filter if specified
-    if category:
-        search_query = search_query.filter(ICD10Code.category == category)
-    
-    # Execute search
-    codes = search_query.limit(limit).all()
+    # Ranked full-text search; words in the user's language match English terms
+    codes = search_codes(query, limit=limit, category=category or None, locale=get_locale())
     
     # Format results
     results = []
@@ -69,116 +54,39 @@ def search_icd10_codes():
 @login_required
 def get_icd10_categories():
     """Get all available ICD-10 categories"""
-    categories = db.session.query(
-        ICD10Code.category,
-        db.func.count(ICD10Code.id).label('count')
-    ).filter(
-        ICD10Code.is_active == True,
-        ICD10Code.is_physiotherapy_relevant == True
-    ).group_by(ICD10Code.category).all()
-    
-    result = []
-    for category, count in categories:
-        result.append({
-            'name': category,
-            'count': count
-        })
-    
-    return jsonify({'categories': result})
+    return jsonify({'categories': reference_catalog().categories})
 
 @icd10_api.route('/api/icd10/templates')
 @login_required
 def get_diagnosis_templates():
     """Get available diagnosis templates"""
-    templates = DiagnosisTemplate.query.filter(
-        DiagnosisTemplate.is_active == True
-    ).order_by(DiagnosisTemplate.usage_count.desc()).all()
-    
-    result = []
-    for template in templates:
-        result.append({
-            'id': template.id,
-            'name': template.name,
-            'description': template.description,
-            'icd10_code': template.primary_icd10_code.code,
-            'icd10_description': template.primary_icd10_code.short_description,
-            'default_severity': template.default_severity,
-            'typical_duration_days': template.typical_duration_days,
-            'usage_count': template.usage_count
-        })
-    
-    return jsonify({'templates': result})
+    return jsonify({'templates': reference_catalog().template_payloads})
 
 @icd10_api.route('/api/patient/<int:patient_id>/diagnoses', methods=['GET'])
 @login_required
 @physio_required
+@patient_access_required()
 def get_patient_diagnoses(patient_id):
     """Get all diagnoses for a patient"""
     patient = Patient.query.get_or_404(patient_id)
     
-    # Check access permissions
-    accessible_patients = current_user.get_accessible_patients()
-    if patient not in accessible_patients:
-        return jsonify({'error': 'Access denied'}), 403
-    
     diagnoses = PatientDiagnosis.query.filter_by(
         patient_id=patient_id
     ).order_by(PatientDiagnosis.diagnosis_date.desc()).all()
     
+    # Codes and their pathology guides come from the reference catalog
+    catalog = reference_catalog()
     result = []
     for diagnosis in diagnoses:
-        # Check if there's a pathology guide for this diagnosis
-        from app.models_icd10 import PathologyGuide, DiagnosisTemplate
-        
-        # First, try to find a diagnosis template that matches this ICD-10 code
-        template = DiagnosisTemplate.query.filter_by(primary_icd10_code_id=diagnosis.icd10_code_id).first()
-        
-        has_pathology_guide = False
-        template_name = diagnosis.icd10_code.short_description
-        
-        if template:
-            # Check if there's a pathology guide for this template
-            pathology_guide = PathologyGuide.query.filter_by(name=template.name).first()
-            if pathology_guide:
-                has_pathology_guide = True
-                template_name = template.name
-        
-        if not has_pathology_guide:
-            # Fallback: try direct matching with ICD-10 description variations
-            variations = [
-                diagnosis.icd10_code.short_description,
-                diagnosis.icd10_code.short_description.title(),  # Capitalize first letters
-                diagnosis.icd10_code.description,
-            ]
-            
-            # Special case mappings for common mismatches
-            special_mappings = {
-                'Low back pain': 'Acute Lower Back Pain',
-                'Frozen shoulder': 'Frozen Shoulder',
-                'Tennis elbow': 'Tennis Elbow',
-                'Plantar fasciitis': 'Plantar Fasciitis',
-                'Neck pain': 'Neck Pain/Cervicalgia',
-                'Stiff jaw/TMJ': 'TMJ Dysfunction',
-                'TMJ Dysfunction': 'TMJ Dysfunction',
-            }
-            
-            # Add special mappings to variations
-            for original, mapped in special_mappings.items():
-                if diagnosis.icd10_code.short_description == original:
-                    variations.insert(0, mapped)  # Try mapped version first
-            
-            for variation in variations:
-                pathology_guide = PathologyGuide.query.filter_by(name=variation).first()
-                if pathology_guide:
-                    has_pathology_guide = True
-                    template_name = variation
-                    break
+        code = catalog.codes.get(diagnosis.icd10_code_id) or diagnosis.icd10_code
+        has_pathology_guide, template_name = catalog.guide_by_code.get(
+            diagnosis.icd10_code_id, (False, code.short_description))
         
         result.append({
             'id': diagnosis.id,
-            'icd10_code': diagnosis.icd10_code.code,
-            'description': diagnosis.icd10_code.short_description,
-            'full_description': diagnosis.icd10_code.description,
+            'icd10_code': code.code,
+            'description': code.short_description,
+            'full_description': code.description,
             'diagnosis_type': diagnosis.diagnosis_type,
             'status': diagnosis.status,
             'confidence_level': diagnosis.confidence_level,
@@ -201,26 +109,24 @@ def get_patient_diagnoses(patient_id):
 
 @icd10_api.route('/api/patient/<int:patient_id>/diagnoses/<int:diagnosis_id>', methods=['GET'])
 @login_required
+@patient_access_required()
 def get_patient_diagnosis(patient_id, diagnosis_id):
     """Get a specific diagnosis for a patient"""
     patient = Patient.query.get_or_404(patient_id)
     
-    # Check access permissions
-    accessible_patients = current_user.get_accessible_patients()
-    if patient not in accessible_patients:
-        return jsonify({'error': 'Access denied'}), 403
-    
     diagnosis = PatientDiagnosis.query.filter_by(
         id=diagnosis_id,
         patient_id=patient_id
     ).first_or_404()
     
+    code = reference_catalog().codes.get(diagnosis.icd10_code_id) or diagnosis.icd10_code
+    
     return jsonify({
         'id': diagnosis.id,
-        'icd10_code': diagnosis.icd10_code.code,
+        'icd10_code': code.code,
         'icd10_code_id': diagnosis.icd10_code_id,
-        'description': diagnosis.icd10_code.short_description,
-        'full_description': diagnosis.icd10_code.description,
+        'description': code.short_description,
+        'full_description': code.description,
         'diagnosis_type': diagnosis.diagnosis_type,
         'status': diagnosis.status,
         'confidence_level': diagnosis.confidence_level,
@@ -236,15 +142,11 @@ def get_patient_diagnosis(patient_id, diagnosis_id):
 @icd10_api.route('/api/patient/<int:patient_id>/diagnoses', methods=['POST'])
 @login_required
 @physio_required
+@patient_access_required()
 def add_patient_diagnosis(patient_id):
     """Add a new diagnosis to a patient"""
     patient = Patient.query.get_or_404(patient_id)
     
-    # Check access permissions
-    accessible_patients = current_user.get_accessible_patients()
-    if patient not in accessible_patients:
-        return jsonify({'error': 'Access denied'}), 403
-    
     data = request.get_json()
     
     # Validate required fields
@@ -299,15 +201,11 @@ def add_patient_diagnosis(patient_id):
 @icd10_api.route('/api/patient/<int:patient_id>/diagnoses/<int:diagnosis_id>', methods=['PUT'])
 @login_required
 @physio_required
+@patient_access_required()
 def update_patient_diagnosis(patient_id, diagnosis_id):
     """Update an existing patient diagnosis"""
     patient = Patient.query.get_or_404(patient_id)
     
-    # Check access permissions
-    accessible_patients = current_user.get_accessible_patients()
-    if patient not in accessible_patients:
-        return jsonify({'error': 'Access denied'}), 403
-    
     diagnosis = PatientDiagnosis.query.filter_by(
         id=diagnosis_id,
         patient_id=patient_id
@@ -341,15 +239,11 @@ def update_patient_diagnosis(patient_id, diagnosis_id):
 @icd10_api.route('/api/patient/<int:patient_id>/diagnoses/<int:diagnosis_id>', methods=['DELETE'])
 @login_required
 @physio_required
+@patient_access_required()
 def delete_patient_diagnosis(patient_id, diagnosis_id):
     """Delete a patient diagnosis"""
     patient = Patient.query.get_or_404(patient_id)
     
-    # Check access permissions
-    accessible_patients = current_user.get_accessible_patients()
-    if patient not in accessible_patients:
-        return jsonify({'error': 'Access denied'}), 403
-    
     diagnosis = PatientDiagnosis.query.filter_by(
         id=diagnosis_id,
         patient_id=patient_id
@@ -366,6 +260,7 @@ def delete_patient_diagnosis(patient_id, diagnosis_id):
 @icd10_api.route('/api/template/<int:template_id>/apply/<int:patient_id>', methods=['POST'])
 @login_required
 @physio_required
+@patient_access_required()
 def apply_diagnosis_template(template_id, patient_id):
     """Apply a diagnosis template to a patient"""
     # Debug CSRF token issue
@@ -376,11 +271,6 @@ def apply_diagnosis_template(template_id, patient_id):
     patient = Patient.query.get_or_404(patient_id)
     template = DiagnosisTemplate.query.get_or_404(template_id)
     
-    # Check access permissions
-    accessible_patients = current_user.get_accessible_patients()
-    if patient not in accessible_patients:
-        return jsonify({'error': 'Access denied'}), 403
-    
     data = request.get_json() or {}
     
     # Create diagnosis from template
@@ -426,12 +316,12 @@ def apply_diagnosis_template(template_id, patient_id):
 @icd10_api.route('/api/analytics/diagnoses')
 @login_required
 @physio_required
+@replica_read
 def get_diagnosis_analytics():
     """Get diagnosis analytics for the current user's patients"""
-    accessible_patients = current_user.get_accessible_patients()
-    patient_ids = [p.id for p in accessible_patients]
+    patient_ids = accessible_patient_ids_query(current_user)
     
-    if not patient_ids:
+    if not db.session.scalar(select(exists().where(Patient.id.in_(patient_ids)))):
         return jsonify({'error': 'No accessible patients'}), 403
     
     # Most common diagnoses
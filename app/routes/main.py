@@ -11,12 +11,19 @@ from app.models import (
     SecurityBreach, SecurityLog, Location
 )
 from app.utils import mark_past_treatments_as_completed, mark_inactive_patients, auto_sync_appointments
+from app.metrics import registry as metrics_registry, metrics_summary, track_external
+from app.db_engine import effective_settings
+from app.db_routing import replica_read
+from app.patient_directory import directory_page, cached_directory, patient_names
+from app.patient_access import can_access_patient, accessible_patient_ids_query
+from app.patient_timeline import timeline_page
+from app.trigger_points import normalize_points, add_points, replace_points, TriggerPointError
+from app.point_layout import layout_submitted_points
 from flask_login import login_required, current_user, logout_user
 from io import BytesIO
-from xhtml2pdf import pisa
-import markdown
 import os
 import json
+import hmac
 from collections import defaultdict, Counter
 from sqlalchemy.orm import joinedload
 from werkzeug.security import generate_password_hash
@@ -26,7 +33,7 @@ import pytz
 import traceback
 from flask_wtf import FlaskForm
 from flask_wtf.csrf import generate_csrf
-import stripe
+from app.integrations import markdown, pisa, stripe
 from app.forms import (
     UpdateEmailForm, ChangePasswordForm, UserProfileForm, ClinicForm,
     ApiIntegrationsForm, FinancialSettingsForm, UserConsentForm, LoginForm, RegistrationForm,
@@ -263,12 +270,67 @@ def health_check():
             'error': str(e)
         }), 500
 
+@main.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics for all worker processes: scrapers send METRICS_TOKEN, admins may browse them."""
+    token = current_app.config.get('METRICS_TOKEN')
+    is_admin = current_user.is_authenticated and current_user.is_admin
+    if token:
+        if not is_admin and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            abort(401)
+    elif not is_admin:
+        # Without a token there is no way to scrape; do not advertise the endpoint
+        abort(404)
+    response = make_response(metrics_registry.expose())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+@main.route('/monitoring/profiles')
+@login_required
+@admin_required
+def request_profiles():
+    """List recently captured request profiles."""
+    profiler = current_app.extensions.get('request_profiler')
+    return render_template(
+        'profiles.html',
+        profiles=profiler.list_profiles() if profiler else [],
+        profiling_enabled=current_app.config.get('PROFILING_ENABLED', False),
+    )
+
+@main.route('/monitoring/profiles/<profile_id>')
+@login_required
+@admin_required
+def download_profile(profile_id):
+    """Download a captured profile (collapsed stacks or pstats)."""
+    profiler = current_app.extensions.get('request_profiler')
+    metadata = profiler.get_profile(profile_id) if profiler else None
+    if not metadata:
+        abort(404)
+    return send_file(
+        os.path.join(profiler.directory, metadata['filename']),
+        as_attachment=True,
+        download_name=metadata['filename'],
+        mimetype='text/plain' if metadata['mode'] == 'sample' else 'application/octet-stream',
+    )
+
 @main.route('/monitoring')
 @login_required
 @admin_required
 def monitoring_dashboard():
     """Monitoring dashboard for system administrators."""
-    return render_template('monitoring.html')
+    query_monitor = current_app.extensions.get('query_monitor')
+    try:
+        engine_settings = effective_settings(db.engine)
+    except Exception as e:
+        current_app.logger.error(f"Could not read database engine settings: {str(e)}")
+        engine_settings = None
+    return render_template(
+        'monitoring.html',
+        engine_settings=engine_settings,
+        sql_summary=query_monitor.summary() if query_monitor else None,
+        sql_requests=list(query_monitor.recent_requests) if query_monitor else [],
+        metrics=metrics_summary(),
+    )
 
 @main.route('/welcome-choice', methods=['GET', 'POST'])
 @login_required
@@ -452,14 +514,12 @@ def index():
                 current_plan_name = 'No Active Plan'
         else:
             # Fallback if clinic not found
-            current_patients_count = len(current_user.get_accessible_patients())
+            current_patients_count = current_user.patients.count()
             patient_plan_limit = 10 if not current_user.is_admin else None
             current_plan_name = 'No Active Plan'
     else:
         # Individual user logic
-        accessible_patients = current_user.get_accessible_patients()
-        current_patients_count = len(accessible_patients)
-        active_patients = len([p for p in accessible_patients if p.status == 'Active'])
+        current_patients_count = current_user.patients.count()
         
         # Get user's individual subscription (with error handling for missing columns)
         try:
@@ -487,17 +547,8 @@ def index():
             current_subscription_ends_at = None
             patient_plan_limit = 10 if not current_user.is_admin else None
     
-    # Get accessible patients for all logic
-    accessible_patients = current_user.get_accessible_patients()
-    
-    # Calculate active patients for display
-    if current_user.is_in_clinic:
-        # For clinic members, show only their own patients for the dashboard display
-        user_patients = current_user.patients.filter_by(status='Active').all()
-        active_patients = len(user_patients)
-    else:
-        # For solo practitioners, show all their accessible patients
-        active_patients = len([p for p in accessible_patients if p.status == 'Active'])
+    # Active patients for display: own patients, also for clinic members
+    active_patients = current_user.patients.filter_by(status='Active').count()
     
     # Calcular citas de hoy
     today = datetime.utcnow().date()
@@ -506,12 +557,12 @@ def index():
     ).count()
     
     # Get upcoming appointments for the dashboard (from accessible patients)
-    accessible_patient_ids = [p.id for p in accessible_patients]
+    accessible_patient_ids = accessible_patient_ids_query(current_user)
     upcoming_appointments_query = Treatment.query.filter(
         Treatment.patient_id.in_(accessible_patient_ids),
         Treatment.status == 'Scheduled',
         func.date(Treatment.created_at) >= today
-    ).order_by(Treatment.created_at.asc()).limit(10)
+    ).options(joinedload(Treatment.patient)).order_by(Treatment.created_at.asc()).limit(10)
     
     upcoming_appointments = []
     
@@ -670,9 +721,7 @@ def get_treatment_details(id):
         return jsonify({'error': 'Forbidden'}), 403
     elif current_user.role == 'physio' and not current_user.is_admin:
         # Check if physio can access this patient (own patients or clinic patients)
-        accessible_patients = current_user.get_accessible_patients(include_clinic_patients=True)
-        patient_ids = [p.id for p in accessible_patients]
-        if treatment.patient_id not in patient_ids:
+        if not can_access_patient(current_user, treatment.patient_id, include_clinic_patients=True):
             return jsonify({'error': 'Forbidden'}), 403
     try:
         # --- Fix Indentation Start --- Removed extra comment line
@@ -767,9 +816,7 @@ def patient_detail(id):
     # SECURITY FIX: All users (including admins) must follow access control rules
     if current_user.role == 'physio' or current_user.is_admin:
         # Physios and admins can access their own patients or clinic patients
-        accessible_patients = current_user.get_accessible_patients()
-        patient_ids = [p.id for p in accessible_patients]
-        if patient.id not in patient_ids:
+        if not can_access_patient(current_user, patient.id):
             flash('You do not have permission to view this patient\'s details.', 'danger')
             return redirect(url_for('main.patients_list'))
     elif current_user.role == 'patient':
@@ -802,42 +849,24 @@ def patient_detail(id):
     else:
         print(f"DEBUG patient_detail: Anamnesis is None or empty")
 
-    print(f"Treatments for patient {patient.name}:")
-    treatments = Treatment.query.filter_by(patient_id=id).options(joinedload(Treatment.patient)).all()
-    for treatment in treatments:
-        print(f"Treatment Created At: {treatment.created_at}")
-
+    # One keyset page of the timeline; ?cursor= walks to older treatments
+    cursor = request.args.get('cursor')
+    try:
+        timeline = timeline_page(patient.id, cursor=cursor)
+    except ValueError:
+        cursor = None
+        timeline = timeline_page(patient.id)
     today = datetime.now()
-    
-    past_treatments = Treatment.query.filter(
-        Treatment.patient_id == id,
-        Treatment.created_at < today,
-        Treatment.status == 'Scheduled'
-    ).all()
+    if cursor or timeline['has_more']:
+        treatment_count = db.session.query(func.count(Treatment.id)).filter(Treatment.patient_id == patient.id).scalar()
+    else:
+        treatment_count = len(timeline['treatments'])
 
     # Add consent form
     form = UserConsentForm()
     
     # Check if this is the first visit
-    is_first_visit = not treatments
-
-    # Get practitioner names for treatments
-    practitioners = {}
-    for treatment in treatments:
-        if treatment.provider and treatment.provider not in practitioners:
-            # Try to find user by email first, then by username
-            practitioner_user = User.query.filter_by(email=treatment.provider).first()
-            if not practitioner_user:
-                practitioner_user = User.query.filter_by(username=treatment.provider).first()
-            
-            if practitioner_user:
-                # Try to get full name, fall back to email
-                if practitioner_user.first_name and practitioner_user.last_name:
-                    practitioners[treatment.provider] = f"{practitioner_user.first_name} {practitioner_user.last_name}"
-                else:
-                    practitioners[treatment.provider] = practitioner_user.email
-            else:
-                practitioners[treatment.provider] = treatment.provider
+    is_first_visit = treatment_count == 0
 
     # Load patient reports explicitly
     patient_reports = PatientReport.query.filter_by(patient_id=patient.id).order_by(PatientReport.generated_date.desc()).all()
@@ -845,12 +874,15 @@ def patient_detail(id):
 
     return render_template('patient_detail.html', 
                          patient=patient, 
-                         treatments=treatments,
-                         past_treatments=past_treatments,
+                         treatments=timeline['treatments'],
+                         past_treatments=timeline['overdue'],
+                         treatment_count=treatment_count,
+                         timeline_cursor=cursor,
+                         next_cursor=timeline['next_cursor'],
                          today=today,
                          form=form,
                          is_first_visit=is_first_visit,
-                         practitioners=practitioners,
+                         practitioners=timeline['providers'],
                          patient_reports=patient_reports)
 
 @main.route('/patient/<int:patient_id>/treatment', methods=['POST'])
@@ -970,6 +1002,18 @@ def add_treatment(patient_id):
         flash('Treatment Type is required.', 'danger')
         return redirect(url_for('main.patient_detail', id=patient_id))
         
+    # Validate all trigger points before anything is written
+    try:
+        point_rows = normalize_points(evaluation_data) if isinstance(evaluation_data, list) else []
+    except TriggerPointError as e:
+        error_message = f'Invalid trigger point data: {e}'
+        if is_ajax:
+            return jsonify({'success': False, 'message': error_message}), 400
+        flash(error_message, 'danger')
+        return redirect(url_for('main.patient_detail', id=patient_id))
+    # Overlapping markers are pushed apart before they are stored
+    layout_submitted_points(evaluation_data, point_rows)
+
     # Create new treatment object (before adding to session)
     print("DEBUG: Creating Treatment object...")
     treatment = Treatment(
@@ -995,56 +1039,11 @@ def add_treatment(patient_id):
     try:
         print("DEBUG: Adding treatment to session...")
         db.session.add(treatment)
-        print("DEBUG: Committing treatment...")
-        db.session.commit() # First commit for the treatment itself
+        # Trigger points go in with one executemany, in the same transaction
+        add_points(treatment, point_rows)
+        db.session.commit()
         print(f"DEBUG: Treatment committed successfully. ID: {treatment.id}")
         
-        # If we have trigger points data, create those records too after the treatment is saved
-        if evaluation_data and isinstance(evaluation_data, list):
-            print(f"DEBUG: Processing {len(evaluation_data)} trigger points...")
-            for point_data in evaluation_data:
-                if isinstance(point_data, dict):
-                    # Add more robust default handling and type checking
-                    intensity_val = None
-                    intensity_str = point_data.get('intensity')
-                    if intensity_str and str(intensity_str).strip() != '':
-                        try: 
-                           intensity_val = int(intensity_str)
-                        except (ValueError, TypeError):
-                           print(f"WARNING: Could not convert intensity '{intensity_str}' to int for point {point_data.get('id')}")
-                    
-                    location_x_val = 0.0
-                    location_x_str = point_data.get('x')
-                    if location_x_str is not None:
-                       try:
-                           location_x_val = float(location_x_str)
-                       except (ValueError, TypeError):
-                           print(f"WARNING: Could not convert location_x '{location_x_str}' to float for point {point_data.get('id')}")
-                    
-                    location_y_val = 0.0
-                    location_y_str = point_data.get('y')
-                    if location_y_str is not None:
-                        try:
-                            location_y_val = float(location_y_str)
-                        except (ValueError, TypeError):
-                            print(f"WARNING: Could not convert location_y '{location_y_str}' to float for point {point_data.get('id')}")
-
-                    trigger_point = TriggerPoint(
-                        treatment_id=treatment.id,
-                        location_x=location_x_val,
-                        location_y=location_y_val,
-                        type=point_data.get('type', 'unknown'),
-                        muscle=point_data.get('muscle', ''),
-                        intensity=intensity_val,
-                        symptoms=point_data.get('symptoms', ''),
-                        referral_pattern=point_data.get('referral', '')
-                    )
-                    print(f"DEBUG: Adding TriggerPoint object: {trigger_point.__dict__}")
-                    db.session.add(trigger_point)
-            print("DEBUG: Committing trigger points...")
-            db.session.commit() # Second commit for trigger points
-            print("DEBUG: Trigger points committed.")
-        
         success_message = 'Treatment added successfully'
         if is_ajax:
             # For AJAX, also return some event data if possible, or just success
@@ -1139,9 +1138,7 @@ def edit_recurring_appointment(id):
 
     # Ensure the current user can access this patient/rule
     if not current_user.is_admin:
-        accessible_patients = current_user.get_accessible_patients()
-        patient_ids = [p.id for p in accessible_patients]
-        if patient.id not in patient_ids:
+        if not can_access_patient(current_user, patient.id):
             flash('You are not authorized to edit this recurring appointment.', 'danger')
             return redirect(url_for('main.patients_list'))
 
@@ -1229,22 +1226,18 @@ def appointments():
     ).options(joinedload(Treatment.patient))
     
     if not current_user.is_admin and current_user.role == 'physio':
-        # Get accessible patients (own patients or clinic patients)
-        accessible_patients = current_user.get_accessible_patients()
-        patient_ids = [p.id for p in accessible_patients]
+        # Own patients, from the decrypted directory cache
+        patient_ids = [entry.id for entry in cached_directory(current_user)]
         appointments_query = appointments_query.filter(Treatment.patient_id.in_(patient_ids))
     
     appointments = appointments_query.order_by(Treatment.created_at).all()
 
     # Filter patients based on user role for the modal
     if current_user.is_admin:
-        patients = Patient.query.filter_by(status='Active').all()
-        patients.sort(key=lambda p: p.name.lower() if p.name else '')
+        patients = cached_directory(current_user, status='Active', all_patients=True)
     elif current_user.role == 'physio':
         # Get only own patients for appointment dropdown (for privacy)
-        accessible_patients = current_user.get_accessible_patients()  # This now defaults to own patients only
-        patients = [p for p in accessible_patients if p.status == 'Active']
-        patients.sort(key=lambda p: p.name.lower() if p.name else '')
+        patients = cached_directory(current_user, status='Active')
     else: # Should not happen due to @physio_required, but as a fallback
         patients = []
 
@@ -1259,6 +1252,7 @@ def appointments():
     return render_template('appointments.html',
                            appointments=appointments,
                            patients=patients,
+                           patient_names=patient_names(current_user, all_patients=current_user.is_admin),
                            start_date=start_date,
                            end_date=end_date,
                            calendly_sync_enabled=calendly_configured_for_user)
@@ -1298,9 +1292,8 @@ def get_appointments():
     ).options(joinedload(Treatment.patient)) # Eager load patient
     
     if not current_user.is_admin and current_user.role == 'physio':
-        # Get accessible patients (own patients or clinic patients)
-        accessible_patients = current_user.get_accessible_patients()
-        patient_ids = [p.id for p in accessible_patients]
+        # Own patients or clinic patients, as a subquery
+        patient_ids = accessible_patient_ids_query(current_user)
         treatments_query = treatments_query.filter(Treatment.patient_id.in_(patient_ids))
     
     treatments = treatments_query.all()
@@ -1352,9 +1345,8 @@ def get_appointments():
     recurring_query = RecurringAppointment.query.filter_by(is_active=True).options(joinedload(RecurringAppointment.patient))
     
     if not current_user.is_admin and current_user.role == 'physio':
-        # Get accessible patients (own patients or clinic patients)
-        accessible_patients = current_user.get_accessible_patients()
-        patient_ids = [p.id for p in accessible_patients]
+        # Own patients or clinic patients, as a subquery
+        patient_ids = accessible_patient_ids_query(current_user)
         recurring_query = recurring_query.filter(RecurringAppointment.patient_id.in_(patient_ids))
     
     active_rules = recurring_query.all()
@@ -1460,6 +1452,7 @@ def update_appointment(id):
 @main.route('/reports')
 @login_required
 @physio_required # <<< ADD DECORATOR
+@replica_read
 def reports():
     try:
         total_patients = Patient.query.count()
@@ -1549,9 +1542,7 @@ def patient_treatments(id):
     # SECURITY FIX: All users (including admins) must follow access control rules
     if current_user.role == 'physio' or current_user.is_admin:
         # Physios and admins can access their own patients or clinic patients
-        accessible_patients = current_user.get_accessible_patients()
-        patient_ids = [p.id for p in accessible_patients]
-        if patient.id not in patient_ids:
+        if not can_access_patient(current_user, patient.id):
             flash('You do not have permission to view these treatments.', 'danger')
             return redirect(url_for('main.patients_list'))
     elif current_user.role == 'patient':
@@ -1578,15 +1569,15 @@ def search():
     # --- End Access Control ---
     query = request.args.get('q', '')
     
-    # Get accessible patients (own patients or clinic patients)
-    accessible_patients = current_user.get_accessible_patients()
+    # Own patients, already decrypted and sorted by name
+    accessible_patients = cached_directory(current_user)
     
     # Filter by search query
     if query:
         query_lower = query.lower()
         patients = [
             p for p in accessible_patients 
-            if (p.name and query_lower in p.name.lower()) or
+            if query_lower in p.sort_key or
                (p.diagnosis and query_lower in p.diagnosis.lower())
         ]
     else:
@@ -1619,13 +1610,11 @@ def patients_list():
                 patient_plan_limit = effective_plan.patient_limit if effective_plan else None
             else:
                 # Fallback if clinic not found
-                accessible_patients = current_user.get_accessible_patients()
-                current_patients_count = len(accessible_patients)
+                current_patients_count = current_user.patients.count()
                 patient_plan_limit = 10 if not current_user.is_admin else None
         else:
             # Individual user logic
-            accessible_patients = current_user.get_accessible_patients()
-            current_patients_count = len(accessible_patients)
+            current_patients_count = current_user.patients.count()
             
             # Get user's individual subscription
             subscription = UserSubscription.query.filter_by(user_id=current_user.id).first()
@@ -1634,29 +1623,13 @@ def patients_list():
             else:
                 patient_plan_limit = 10 if not current_user.is_admin else None
 
-    # Get only own patients by default for privacy (use include_clinic_patients=True if needed for clinic management)
-    patients = current_user.get_accessible_patients()
-
-    # Apply status filter if specified
-    if status_filter != 'all':
-        patients = [p for p in patients if p.status == status_filter]
-    
-    # Apply search filter in Python (since Patient.name is a property)
-    if search:
-        search_lower = search.lower()
-        patients = [
-            p for p in patients 
-            if (p.name and search_lower in p.name.lower()) or
-               (p.diagnosis and search_lower in p.diagnosis.lower()) or
-               (p.notes and search_lower in p.notes.lower())
-        ]
-
-    # Sort by decrypted name in Python
-    # This ensures proper alphabetical ordering of the actual names
-    patients.sort(key=lambda p: p.name.lower() if p.name else '')
+    # First page of own patients (by name); the template loads further
+    # pages from /api/patients as the user scrolls
+    page = directory_page(current_user, status=status_filter, search=search)
 
     return render_template('patients_list.html',
-                           patients=patients,
+                           patients=page['patients'],
+                           next_cursor=page['next_cursor'],
                            search=search,
                            status_filter=status_filter,
                            current_patients_count=current_patients_count,
@@ -1672,9 +1645,7 @@ def patient_reports_list(patient_id):
     if not current_user.is_admin:
         if current_user.role == 'physio':
             # Physios can access their own patients or clinic patients
-            accessible_patients = current_user.get_accessible_patients()
-            patient_ids = [p.id for p in accessible_patients]
-            if patient.id not in patient_ids:
+            if not can_access_patient(current_user, patient.id):
                 flash('You do not have permission to view these reports.', 'danger')
                 return redirect(url_for('main.patients_list'))
         elif current_user.role == 'patient':
@@ -1770,9 +1741,7 @@ def match_booking_to_patient(booking_id):
         patient = Patient.query.get_or_404(patient_id)
         # Ensure selected patient is accessible to the current user
         if not current_user.is_admin:
-            accessible_patients = current_user.get_accessible_patients()
-            patient_ids = [p.id for p in accessible_patients]
-            if patient.id not in patient_ids:
+            if not can_access_patient(current_user, patient.id):
                 flash('Invalid patient selection.', 'danger')
                 return redirect(url_for('main.match_booking_to_patient', booking_id=booking_id))
 
@@ -1799,12 +1768,7 @@ def match_booking_to_patient(booking_id):
         return redirect(url_for('main.review_calendly_bookings'))
 
     # GET request:
-    if current_user.is_admin:
-        patients = Patient.query.all()
-        patients.sort(key=lambda p: p.name.lower() if p.name else '')
-    else:
-        patients = Patient.query.filter_by(user_id=current_user.id).all()
-        patients.sort(key=lambda p: p.name.lower() if p.name else '')
+    patients = cached_directory(current_user, all_patients=current_user.is_admin)
     
     return render_template('match_calendly_booking.html',
                            booking=booking,
@@ -1941,23 +1905,12 @@ def edit_treatment(id):
                 if not isinstance(new_evaluation_data, list):
                      raise ValueError("Evaluation data must be a list.")
                 
+                point_rows = normalize_points(new_evaluation_data)
+                layout_submitted_points(new_evaluation_data, point_rows)
                 treatment.evaluation_data = new_evaluation_data
                 
-                # Update or create trigger points in the database
-                TriggerPoint.query.filter_by(treatment_id=treatment.id).delete()
-                for point_data in treatment.evaluation_data:
-                    # Add more robust validation/conversion here if needed
-                    trigger_point = TriggerPoint(
-                        treatment_id=treatment.id,
-                        location_x=float(point_data['x']), # Add try-except
-                        location_y=float(point_data['y']), # Add try-except
-                        type=point_data.get('type', 'unknown'),
-                        muscle=point_data.get('muscle', ''),
-                        intensity=int(point_data['intensity']) if point_data.get('intensity') else None, # Add try-except
-                        symptoms=point_data.get('symptoms', ''),
-                        referral_pattern=point_data.get('referral', '')
-                    )
-                    db.session.add(trigger_point)
+                # Only the points that changed are deleted or inserted
+                replace_points(treatment, point_rows)
                 
             except (json.JSONDecodeError, ValueError, TypeError) as e: # Catch potential errors
                 print(f"ERROR: Processing trigger points for treatment {id}: {e}")
@@ -2096,9 +2049,7 @@ def view_treatment(id):
         try:
             if current_user.role == 'physio' or current_user.is_admin:
                 # Physios and admins can access their own patients or clinic patients
-                accessible_patients = current_user.get_accessible_patients(include_clinic_patients=True)
-                patient_ids = [p.id for p in accessible_patients]
-                if patient.id not in patient_ids:
+                if not can_access_patient(current_user, patient.id, include_clinic_patients=True):
                     flash('You do not have permission to view this treatment.', 'danger')
                     return redirect(url_for('main.patients_list'))
             elif current_user.role == 'patient':
@@ -2324,7 +2275,8 @@ def generate_deepseek_report(analytics_data):
     }
 
     try:
-        response = requests.post(DEEPSEEK_API_URL, headers=headers, json=payload, timeout=45) # Increased timeout
+        with track_external('deepseek'):
+            response = requests.post(DEEPSEEK_API_URL, headers=headers, json=payload, timeout=45) # Increased timeout
         response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
         result = response.json()
         print("\n--- DeepSeek API Response ---\n" + str(result) + "\n--- End Response ---\n")
@@ -2367,6 +2319,7 @@ def calculate_age(born):
 @main.route('/analytics')
 @login_required
 @physio_required
+@replica_read
 def analytics():
     # Check if user has permission to view analytics
     if current_user.is_in_clinic and not current_user.can_view_clinic_reports():
@@ -2563,6 +2516,7 @@ def analytics():
 @main.route('/api/analytics/costaspine-fee-data')
 @login_required
 @physio_required # <<< ADD DECORATOR
+@replica_read
 def get_costaspine_fee_data():
     """Returns the date, fee, and patient name for all treatments at the user's clinic with a fee."""
     try:
@@ -2712,9 +2666,7 @@ def download_report_pdf(report_id):
     # SECURITY FIX: All users (including admins) must follow access control rules
     if current_user.role == 'physio' or current_user.is_admin:
         # Physios and admins can access their own patients or clinic patients
-        accessible_patients = current_user.get_accessible_patients()
-        patient_ids = [p.id for p in accessible_patients]
-        if patient.id not in patient_ids:
+        if not can_access_patient(current_user, patient.id):
             flash('You do not have permission to download this report.', 'danger')
             return redirect(url_for('main.patients_list'))
     elif current_user.role == 'patient':
@@ -2793,9 +2745,7 @@ def view_homework(report_id):
     is_clinician_of_patient = False
     if current_user.role == 'physio':
         # Check if patient is accessible to current user (own patients or clinic patients)
-        accessible_patients = current_user.get_accessible_patients()
-        patient_ids = [p.id for p in accessible_patients]
-        if report.patient_id in patient_ids:
+        if can_access_patient(current_user, report.patient_id):
             is_clinician_of_patient = True
 
     # SECURITY FIX: Remove admin bypass - all users must follow same access rules
@@ -2906,6 +2856,7 @@ def bulk_update_treatments():
 @main.route('/financials')
 @login_required
 @physio_required # <<< ADD DECORATOR
+@replica_read
 def financials():
     # Check if user has Premium plan access to finances
     if not current_user.can_use_clinic_feature('reporting_advanced_ai') and not current_user.is_admin:
@@ -3264,13 +3215,11 @@ def new_patient():
             current_patients = clinic.patient_count
             patient_limit = effective_plan.patient_limit if effective_plan else None
         else:
-            accessible_patients = current_user.get_accessible_patients()
-            current_patients = len(accessible_patients)
+            current_patients = current_user.patients.count()
             patient_limit = 10 if not current_user.is_admin else None
     else:
         # Individual user logic
-        accessible_patients = current_user.get_accessible_patients()
-        current_patients = len(accessible_patients)
+        current_patients = current_user.patients.count()
         
         # Get user's individual subscription
         subscription = UserSubscription.query.filter_by(user_id=current_user.id).first()
@@ -3298,13 +3247,11 @@ def new_patient():
                 current_patients_post = clinic.patient_count
                 patient_limit_post = effective_plan.patient_limit if effective_plan else None
             else:
-                accessible_patients = current_user.get_accessible_patients()
-                current_patients_post = len(accessible_patients)
+                current_patients_post = current_user.patients.count()
                 patient_limit_post = 10 if not current_user.is_admin else None
         else:
             # Individual user logic
-            accessible_patients = current_user.get_accessible_patients()
-            current_patients_post = len(accessible_patients)
+            current_patients_post = current_user.patients.count()
             
             # Get user's individual subscription
             subscription = UserSubscription.query.filter_by(user_id=current_user.id).first()
@@ -3630,7 +3577,7 @@ def new_patient():
 
     # GET request
     # Get all patients for referral dropdown
-    all_patients = current_user.get_accessible_patients()
+    all_patients = cached_directory(current_user)
     return render_template('new_patient.html', all_patients=all_patients)
 
 @main.route('/patient/<int:id>/edit', methods=['GET', 'POST'])
@@ -3644,9 +3591,7 @@ def edit_patient(id):
     # SECURITY FIX: All users (including admins) must follow access control rules
     if current_user.role == 'physio' or current_user.is_admin:
         # Physios and admins can access their own patients or clinic patients
-        accessible_patients = current_user.get_accessible_patients()
-        patient_ids = [p.id for p in accessible_patients]
-        if patient.id not in patient_ids:
+        if not can_access_patient(current_user, patient.id):
             flash('You do not have permission to edit this patient\'s details.', 'danger')
             return redirect(url_for('main.patients_list'))
     elif current_user.role == 'patient':
@@ -3786,7 +3731,7 @@ def edit_patient(id):
     # --- GET Request ---
     # For GET, ensure patient data (including portal_user_account details if any) is passed
     # Get all patients for referral dropdown (excluding current patient)
-    all_patients = current_user.get_accessible_patients()
+    all_patients = cached_directory(current_user)
     return render_template('edit_patient.html', patient=patient, all_patients=all_patients)
 
 @main.route('/patient/<int:id>/delete', methods=['POST'])
@@ -3798,9 +3743,7 @@ def delete_patient(id):
 
     # Check if user can access this patient
     if not current_user.is_admin:
-        accessible_patients = current_user.get_accessible_patients()
-        patient_ids = [p.id for p in accessible_patients]
-        if patient.id not in patient_ids:
+        if not can_access_patient(current_user, patient.id):
             flash('You do not have permission to delete this patient.', 'danger')
             return redirect(url_for('main.patients_list'))
 
@@ -3849,9 +3792,8 @@ def merge_patient(id):
         
         # Access control - ensure user can access both patients
         if not current_user.is_admin:
-            accessible_patients = current_user.get_accessible_patients()
-            patient_ids = [p.id for p in accessible_patients]
-            if source_patient.id not in patient_ids or target_patient.id not in patient_ids:
+            if not (can_access_patient(current_user, source_patient.id) and
+                    can_access_patient(current_user, target_patient.id)):
                 return jsonify({'success': False, 'error': 'You do not have permission to merge these patients'}), 403
         
         # Prevent merging a patient with itself
@@ -4047,6 +3989,7 @@ def update_patient_contact():
 @main.route('/analytics/generate_new_report', methods=['POST'])
 @login_required
 @physio_required
+@replica_read
 def generate_new_analytics_report():
     try:
         user_generating_report = current_user # For clarity
@@ -4254,7 +4197,8 @@ def subscription_success():
     else:
         try:
             # Retrieve the session from Stripe to get details about the purchase
-            checkout_session = stripe.checkout.Session.retrieve(session_id, expand=['line_items'])
+            with track_external('stripe'):
+                checkout_session = stripe.checkout.Session.retrieve(session_id, expand=['line_items'])
             
             if checkout_session and checkout_session.line_items and checkout_session.line_items.data:
                 # Assuming the first line item is the plan they subscribed to
@@ -4347,10 +4291,11 @@ def cancel_subscription():
 
     try:
         # Update the subscription on Stripe to cancel at period end
-        stripe.Subscription.modify(
-            current_sub.stripe_subscription_id,
-            cancel_at_period_end=True
-        )
+        with track_external('stripe'):
+            stripe.Subscription.modify(
+                current_sub.stripe_subscription_id,
+                cancel_at_period_end=True
+            )
 
         # Update the local subscription record
         current_sub.cancel_at_period_end = True
@@ -4483,13 +4428,8 @@ def change_password():
 def calendar_page():
     """Renders the main calendar page."""
     # Fetch accessible patients for the new appointment modal
-    if current_user.is_admin:
-        patients = Patient.query.all() # Removed status filter
-        patients.sort(key=lambda p: p.name.lower() if p.name else '')
-    else: # Physio role (guaranteed by @physio_required)
-        # Get only own patients for calendar dropdown (for privacy)
-        patients = current_user.get_accessible_patients()  # This now defaults to own patients only
-        patients.sort(key=lambda p: p.name.lower() if p.name else '')
+    # (admins: all patients; physios: only their own, for privacy)
+    patients = cached_directory(current_user, all_patients=current_user.is_admin)
     
     return render_template('calendar.html', title="Calendar", patients=patients)
 
@@ -4529,9 +4469,8 @@ def get_calendar_appointments():
             Treatment.created_at < end_date_dt
         )
     else:
-        # Get accessible patients (own patients or clinic patients)
-        accessible_patients = current_user.get_accessible_patients()
-        patient_ids = [p.id for p in accessible_patients]
+        # Own patients or clinic patients, as a subquery
+        patient_ids = accessible_patient_ids_query(current_user)
         treatments_query = Treatment.query.filter(
             Treatment.patient_id.in_(patient_ids),
             Treatment.status == 'Scheduled',
@@ -4539,13 +4478,16 @@ def get_calendar_appointments():
             Treatment.created_at < end_date_dt
         )
     
-    scheduled_treatments = treatments_query.all()
+    # Patients are no longer preloaded by the access check, so load them with the rows
+    scheduled_treatments = treatments_query.options(joinedload(Treatment.patient)).all()
+    names = patient_names(current_user, all_patients=current_user.is_admin)
 
     for treatment in scheduled_treatments:
         event_start = treatment.created_at.isoformat()
         event_end = (treatment.created_at + timedelta(hours=1)).isoformat()
+        patient_name = names.get(treatment.patient_id) or treatment.patient.name
 
-        title = f"{treatment.patient.name} - {treatment.treatment_type if treatment.treatment_type else 'Appointment'}"
+        title = f"{patient_name} - {treatment.treatment_type if treatment.treatment_type else 'Appointment'}"
         
         # Determine color based on practitioner (patient's user_id)
         if treatment.patient and treatment.patient.user_id:
@@ -4575,7 +4517,7 @@ def get_calendar_appointments():
             'extendedProps': {
                 'type': 'treatment',
                 'patient_id': treatment.patient_id,
-                'patient_name': treatment.patient.name,
+                'patient_name': patient_name,
                 'treatment_type': treatment.treatment_type,
                 'status': treatment.status,
                 'notes': treatment.notes,
@@ -4587,9 +4529,8 @@ def get_calendar_appointments():
     if current_user.is_admin:
         recurring_appointments = RecurringAppointment.query.options(joinedload(RecurringAppointment.patient)).all()
     else:
-        # Get accessible patients (own patients or clinic patients)
-        accessible_patients = current_user.get_accessible_patients()
-        patient_ids = [p.id for p in accessible_patients]
+        # Own patients or clinic patients, as a subquery
+        patient_ids = accessible_patient_ids_query(current_user)
         recurring_appointments = RecurringAppointment.query.filter(
             RecurringAppointment.patient_id.in_(patient_ids)
         ).options(joinedload(RecurringAppointment.patient)).all()
@@ -4772,10 +4713,7 @@ def bulk_delete_patients():
                 continue
             
             # Check if patient is accessible to current user (using same logic as patients list)
-            accessible_patients = current_user.get_accessible_patients()
-            accessible_patient_ids = [p.id for p in accessible_patients]
-            
-            if patient_id_int in accessible_patient_ids:
+            if can_access_patient(current_user, patient_id_int):
                 patient = Patient.query.filter_by(id=patient_id_int).first()
                 current_app.logger.info(f"FOUND accessible patient: {patient.id} - {patient.name} - user_id: {patient.user_id}")
             else:
@@ -4911,6 +4849,9 @@ def user_settings():
                 if api_form.calendly_api_key.data:
                     current_user.calendly_api_token = api_form.calendly_api_key.data
                 if api_form.calendly_user_uri.data:
+                    if api_form.calendly_user_uri.data != current_user.calendly_user_uri:
+                        # The webhook subscription belongs to the previous Calendly user
+                        current_user.calendly_webhook_subscription = None
                     current_user.calendly_user_uri = api_form.calendly_user_uri.data
                 
                 # Set enabled state based on checkbox
@@ -5278,6 +5219,7 @@ def get_translated_month_name(month_number):
 @main.route('/api/analytics/inactive-patients') # Renamed endpoint
 @login_required
 @physio_required
+@replica_read
 def get_inactive_patients_data():
     """
     Returns count and list of patients who have not had a treatment in the last 90 days.
@@ -5381,13 +5323,11 @@ def create_patient_ajax():
                 current_patients = clinic.patient_count
                 patient_limit = effective_plan.patient_limit if effective_plan else None
             else:
-                accessible_patients = current_user.get_accessible_patients()
-                current_patients = len(accessible_patients)
+                current_patients = len(cached_directory(current_user))
                 patient_limit = 10 if not current_user.is_admin else None
         else:
             # Individual user logic - count only own patients
-            accessible_patients = current_user.get_accessible_patients()  # Defaults to own patients only
-            current_patients = len(accessible_patients)
+            current_patients = len(cached_directory(current_user))
             
             # Get user's individual subscription
             subscription = UserSubscription.query.filter_by(user_id=current_user.id).first()
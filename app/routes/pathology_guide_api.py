@@ -3,14 +3,24 @@ Pathology Guide API Routes
 Provides endpoints for Clinical Pathway Guide system
 """
 
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, Response, jsonify, request, current_app
 from flask_login import login_required, current_user
-from app.models_icd10 import PathologyGuide, DiagnosisTemplate
+from app.icd10_catalog import reference_catalog
+from app.pathology_guides import guide_bundle, guide_payload
 from app import db
-import json
 
 pathology_guide_api = Blueprint('pathology_guide_api', __name__)
 
+
+def _cacheable_json(body, etag):
+    """Serialized JSON with a strong ETag; answers If-None-Match with 304"""
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = current_app.config.get('PATHOLOGY_GUIDE_MAX_AGE', 300)
+    return response.make_conditional(request)
+
+
 @pathology_guide_api.route('/api/pathology-guide/<path:template_name>', methods=['GET'])
 @login_required
 def get_pathology_guide(template_name):
@@ -19,69 +29,16 @@ def get_pathology_guide(template_name):
     Returns rich clinical content for the specified diagnosis
     """
     try:
-        # Debug: log what we received
-        current_app.logger.info(f'Pathology guide request for: "{template_name}" (type: {type(template_name)})')
-        
-        # First, try to find the pathology guide by exact template name
-        guide = PathologyGuide.query.filter_by(name=template_name).first()
-        
-        # If not found, try the same mappings as in icd10_api.py
-        if not guide:
-            # Special case mappings for common mismatches
-            special_mappings = {
-                'Low back pain': 'Acute Lower Back Pain',
-                'Frozen shoulder': 'Frozen Shoulder',
-                'Tennis elbow': 'Tennis Elbow',
-                'Plantar fasciitis': 'Plantar Fasciitis',
-                'Neck pain': 'Neck Pain/Cervicalgia',
-                'Stiff jaw/TMJ': 'TMJ Dysfunction',
-                'TMJ Dysfunction': 'TMJ Dysfunction',
-            }
-            
-            mapped_name = special_mappings.get(template_name)
-            if mapped_name:
-                guide = PathologyGuide.query.filter_by(name=mapped_name).first()
+        # Serialized once per guide version; the name may be a guide, template or alias name
+        payload = guide_payload(template_name)
         
-        if not guide:
+        if payload is None:
             return jsonify({
                 'error': 'Guide not found',
                 'message': f'No pathology guide found for "{template_name}"'
             }), 404
         
-        # Get associated diagnosis template for additional info
-        template = guide.diagnosis_template
-        
-        # Parse FAQ data
-        faq_list = []
-        if guide.faq_data:
-            try:
-                faq_list = json.loads(guide.faq_data)
-            except (json.JSONDecodeError, TypeError):
-                current_app.logger.warning(f"Invalid FAQ data for guide {guide.name}")
-                faq_list = []
-        
-        # Prepare response data
-        guide_data = {
-            'id': guide.id,
-            'name': guide.name,
-            'description': template.description if template else None,
-            'clinical_pearls': guide.clinical_pearls,
-            'patient_education': guide.patient_education,
-            'red_flags': guide.red_flags,
-            'anatomy_overview': guide.anatomy_overview,
-            'treatment_phases': guide.treatment_phases,
-            'home_exercises': guide.home_exercises,
-            'faq_list': faq_list,
-            'typical_duration_days': template.typical_duration_days if template else None,
-            'common_symptoms': template.common_symptoms if template else None,
-            'treatment_guidelines': template.treatment_guidelines if template else None,
-            'created_at': guide.created_at.isoformat() if guide.created_at else None,
-            'updated_at': guide.updated_at.isoformat() if guide.updated_at else None,
-            'template_id': guide.diagnosis_template_id,
-            'stats': guide.get_summary_stats()
-        }
-        
-        return jsonify(guide_data)
+        return _cacheable_json(payload.body, payload.etag)
         
     except Exception as e:
         current_app.logger.error(f"Error fetching pathology guide {template_name}: {str(e)}")
@@ -90,6 +47,24 @@ def get_pathology_guide(template_name):
             'message': 'Failed to fetch pathology guide'
         }), 500
 
+@pathology_guide_api.route('/api/pathology-guides/bundle', methods=['GET'])
+@login_required
+def pathology_guide_bundle():
+    """
+    Every guide payload plus the name -> guide id alias map, in one response
+    Prefetched by pathology_guide.js so opening a guide needs no request
+    """
+    try:
+        body, etag = guide_bundle()
+        return _cacheable_json(body, etag)
+        
+    except Exception as e:
+        current_app.logger.error(f"Error building pathology guide bundle: {str(e)}")
+        return jsonify({
+            'error': 'Server error',
+            'message': 'Failed to fetch pathology guides'
+        }), 500
+
 @pathology_guide_api.route('/api/pathology-guides', methods=['GET'])
 # @login_required  # Temporarily disabled for testing
 def list_pathology_guides():
@@ -98,23 +73,24 @@ def list_pathology_guides():
     Returns summary information for all guides
     """
     try:
-        guides = PathologyGuide.query.join(DiagnosisTemplate).filter(
-            DiagnosisTemplate.is_active == True
-        ).all()
+        catalog = reference_catalog()
         
         guides_list = []
-        for guide in guides:
-            template = guide.diagnosis_template
+        for guide in sorted(catalog.guides.values(), key=lambda g: g['id']):
+            template = catalog.templates.get(guide['template_id'])
+            if not template or not template['is_active']:
+                continue
+            stats = guide['stats']
             guides_list.append({
-                'id': guide.id,
-                'name': guide.name,
-                'description': template.description if template else None,
-                'has_clinical_pearls': bool(guide.clinical_pearls),
-                'has_patient_education': bool(guide.patient_education),
-                'has_red_flags': bool(guide.red_flags),
-                'faq_count': len(guide.faq_list),
-                'template_id': guide.diagnosis_template_id,
-                'updated_at': guide.updated_at.isoformat() if guide.updated_at else None
+                'id': guide['id'],
+                'name': guide['name'],
+                'description': template['description'],
+                'has_clinical_pearls': stats['has_clinical_pearls'],
+                'has_patient_education': stats['has_patient_education'],
+                'has_red_flags': stats['has_red_flags'],
+                'faq_count': stats['faq_count'],
+                'template_id': guide['template_id'],
+                'updated_at': guide['updated_at'].isoformat() if guide['updated_at'] else None
             })
         
         return jsonify({
@@ -136,15 +112,21 @@ def get_guide_stats(guide_id):
     Get detailed statistics for a specific pathology guide
     """
     try:
-        guide = PathologyGuide.query.get_or_404(guide_id)
+        catalog = reference_catalog()
+        guide = catalog.guides.get(guide_id)
+        if guide is None:
+            return jsonify({
+                'error': 'Not found',
+                'message': 'The requested pathology guide was not found'
+            }), 404
         
-        stats = guide.get_summary_stats()
+        stats = dict(guide['stats'])
         
         # Add usage statistics if available
-        template = guide.diagnosis_template
+        template = catalog.templates.get(guide['template_id'])
         if template:
-            stats['template_usage_count'] = template.usage_count or 0
-            stats['template_name'] = template.name
+            stats['template_usage_count'] = template['usage_count'] or 0
+            stats['template_name'] = template['name']
         
         return jsonify(stats)
         
@@ -163,23 +145,23 @@ def list_templates_with_guides():
     Useful for showing info buttons in the UI
     """
     try:
-        templates = DiagnosisTemplate.query.filter_by(is_active=True).all()
+        catalog = reference_catalog()
         
         templates_list = []
-        for template in templates:
-            has_guide = template.pathology_guide is not None
+        for template in sorted((t for t in catalog.templates.values() if t['is_active']), key=lambda t: t['id']):
+            guide = catalog.guide_by_template.get(template['id'])
+            has_guide = guide is not None
             
             template_data = {
-                'id': template.id,
-                'name': template.name,
-                'description': template.description,
+                'id': template['id'],
+                'name': template['name'],
+                'description': template['description'],
                 'has_pathology_guide': has_guide,
-                'usage_count': template.usage_count or 0
+                'usage_count': template['usage_count'] or 0
             }
             
             if has_guide:
-                guide = template.pathology_guide
-                template_data['guide_stats'] = guide.get_summary_stats()
+                template_data['guide_stats'] = dict(guide['stats'])
             
             templates_list.append(template_data)
         
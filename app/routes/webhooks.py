@@ -1,11 +1,12 @@
 # app/routes/webhooks.py
 from flask import Blueprint, request, current_app, jsonify, abort
 import logging
-import stripe # Import the stripe library
+from app.integrations import stripe  # Imported on first use
 from app import csrf # Import the CSRF object
 from app.models import User, Plan, UserSubscription # Add these
 from app import db # Add this
 from datetime import datetime # Add this
+from app.metrics import track_external
 
 # It's good practice to get a specific logger for your module/blueprint
 logger = logging.getLogger(__name__)
@@ -59,10 +60,11 @@ def stripe_webhook():
         try:
             # Retrieve the full session object from Stripe to ensure all necessary data is present
             # This requires your Stripe API key to be configured (usually via STRIPE_SECRET_KEY env var)
-            full_checkout_session = stripe.checkout.Session.retrieve(
-                checkout_session_id,
-                expand=['line_items', 'subscription', 'customer']
-            )
+            with track_external('stripe'):
+                full_checkout_session = stripe.checkout.Session.retrieve(
+                    checkout_session_id,
+                    expand=['line_items', 'subscription', 'customer']
+                )
 
             client_reference_id = full_checkout_session.client_reference_id
             stripe_customer_id = full_checkout_session.customer.id if full_checkout_session.customer else None # Stripe Customer ID
@@ -179,4 +181,38 @@ def stripe_webhook():
     else:
         logger.info(f"Received unhandled event type: {event.type}")
 
-    return jsonify(status="success", event_id=event.id), 200 
\ No newline at end of file
+    return jsonify(status="success", event_id=event.id), 200 
+
+
+@webhook_bp.route('/calendly', methods=['POST'])
+@csrf.exempt
+def calendly_webhook():
+    """Store a signed invitee.created / invitee.canceled delivery; it is applied in the background"""
+    from app.calendly_webhooks import SIGNATURE_HEADER, SignatureError, receive_event, verify_signature, wake_processor
+
+    body = request.get_data()
+    signing_key = current_app.config.get('CALENDLY_WEBHOOK_SIGNING_KEY')
+    if not signing_key:
+        logger.error("Calendly webhook signing key is not configured.")
+        abort(500)
+
+    try:
+        verify_signature(body, request.headers.get(SIGNATURE_HEADER), signing_key,
+                         current_app.config.get('CALENDLY_WEBHOOK_TOLERANCE_SECONDS', 180))
+    except SignatureError as e:
+        logger.warning(f"Invalid Calendly webhook signature: {e}")
+        abort(400)
+
+    try:
+        event, stored = receive_event(body)
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Invalid Calendly webhook payload: {e}")
+        abort(400)
+
+    if event is None:
+        return jsonify(status="ignored"), 200
+    if stored:
+        wake_processor()
+    else:
+        logger.info(f"Calendly webhook redelivered: {event.idempotency_key}")
+    return jsonify(status="success", event_id=event.id), 200
@@ -12,6 +12,7 @@ class ICD10DiagnosisManager {
     constructor(patientId = null) {
         this.patientId = patientId;
         this.searchTimeout = null;
+        this.searchCache = new Map();  // Results per query; the catalog rarely changes
         this.selectedCodes = [];
         this.templates = [];
         
@@ -109,10 +110,16 @@ class ICD10DiagnosisManager {
                 params.append('category', category);
             }
             
-            const response = await fetch(`/api/icd10/search?${params}`);
-            const data = await response.json();
+            const key = params.toString();
+            let codes = this.searchCache.get(key);
+            if (!codes) {
+                const response = await fetch(`/api/icd10/search?${params}`);
+                const data = await response.json();
+                codes = data.codes;
+                this.searchCache.set(key, codes);
+            }
             
-            this.displaySearchResults(data.codes);
+            this.displaySearchResults(codes);
         } catch (error) {
             console.error('Error searching ICD-10 codes:', error);
             this.showError('Error searching codes. Please try again.');
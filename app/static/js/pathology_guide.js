@@ -7,7 +7,37 @@ class PathologyGuideManager {
     constructor() {
         this.currentGuide = null;
         this.modal = null;
+        // Prefetched guides by id, and guide/template/alias name -> guide id
+        this.guides = new Map();
+        this.aliases = {};
+        this.prefetched = null;
         this.initializeModal();
+        if (this.modal) {
+            this.prefetch();
+        }
+    }
+
+    /**
+     * Fetch every guide in one request so opening a guide is instant.
+     * The response carries an ETag, so later page loads revalidate cheaply.
+     */
+    prefetch() {
+        if (!this.prefetched) {
+            this.prefetched = fetch('/api/pathology-guides/bundle', { credentials: 'same-origin' })
+                .then(response => response.ok ? response.json() : null)
+                .then(bundle => {
+                    if (!bundle) return;
+                    this.aliases = bundle.aliases || {};
+                    (bundle.guides || []).forEach(guide => this.guides.set(guide.id, guide));
+                })
+                .catch(error => console.warn('Pathology guide prefetch failed:', error));
+        }
+        return this.prefetched;
+    }
+
+    cachedGuide(templateName) {
+        const guideId = this.aliases[templateName];
+        return guideId !== undefined ? this.guides.get(guideId) || null : null;
     }
 
     initializeModal() {
@@ -38,6 +68,15 @@ class PathologyGuideManager {
             this.showLoading();
             this.modal.show();
 
+            // Prefetched guides need no request
+            await this.prefetch();
+            const cached = this.cachedGuide(templateName);
+            if (cached) {
+                this.currentGuide = cached;
+                this.displayGuide(cached);
+                return;
+            }
+
             // Fetch guide data from API
             console.log('🔍 Fetching pathology guide:', templateName);
             const encodedName = encodeURIComponent(templateName);
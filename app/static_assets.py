@@ -0,0 +1,377 @@
+# app/static_assets.py
+"""
+Fingerprinted, precompressed static assets.
+
+`flask assets build` copies app/static into STATIC_ASSETS_DIR (default
+app/static/dist):
+- JS and CSS are minified (comments and indentation removed; line breaks are
+  kept, so automatic semicolon insertion behaves as before),
+- every file is written under a content-hashed name (js/app.js ->
+  js/app.3f2a1b9c0d.js) and url(...) references in CSS are rewritten to the
+  hashed names,
+- text files get .gz and .br (when the brotli package is installed) variants,
+  kept only when they are meaningfully smaller,
+- manifest.json maps each source name to its hashed name and encodings.
+
+Templates call static_url('js/app.js'). With a manifest entry it returns the
+hashed URL, served by /static/dist/<name> with a one-year immutable
+Cache-Control and the best precompressed variant the client accepts.
+Without one (no build yet, or a file added since) it falls back to the
+plain /static/ URL, so development needs no build step.
+
+Old hashed files are kept when rebuilding, so pages rendered by a worker that
+has not seen the new manifest yet still load; `--clean` removes them.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import threading
+
+from flask import abort, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:     # Optional: only gzip variants are written without it
+    brotli = None
+
+MANIFEST_NAME = 'manifest.json'
+HASH_LENGTH = 10
+ONE_YEAR = 365 * 24 * 3600
+COMPRESSIBLE = {'.js', '.css', '.svg', '.json', '.txt', '.html', '.xml', '.map', '.ico'}
+# Variants must save at least this fraction of the file to be kept
+MIN_SAVING = 0.1
+# Preferred first when the client accepts several
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+_JS_KEYWORDS_BEFORE_REGEX = {'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete',
+                             'void', 'throw', 'yield', 'await', 'instanceof'}
+_JS_PUNCTUATION_BEFORE_REGEX = set('(,=:[!&|?{};+-*%<>~^')
+_CSS_URL = re.compile(r'url\(\s*(["\']?)([^"\')]+)\1\s*\)')
+
+
+def _skip_string(text, i, quote):
+    """Index just past the string literal starting at text[i]"""
+    i += 1
+    while i < len(text):
+        if text[i] == '\\':
+            i += 2
+            continue
+        if text[i] == quote or (text[i] == '\n' and quote != '`'):
+            return i + 1
+        i += 1
+    return i
+
+
+def _skip_regex(text, i):
+    """Index just past the regex literal starting at text[i] (flags excluded)"""
+    i += 1
+    in_class = False
+    while i < len(text):
+        char = text[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char == '\n':
+            return i
+        if char == '[':
+            in_class = True
+        elif char == ']':
+            in_class = False
+        elif char == '/' and not in_class:
+            return i + 1
+        i += 1
+    return i
+
+
+def _regex_allowed(out):
+    """Whether a '/' after the code emitted so far starts a regex rather than a division"""
+    code = ''.join(out[-32:]).rstrip()
+    if not code:
+        return True
+    if code[-1] in _JS_PUNCTUATION_BEFORE_REGEX:
+        return True
+    word = re.search(r'[A-Za-z_$][\w$]*$', code)
+    return bool(word) and word.group() in _JS_KEYWORDS_BEFORE_REGEX
+
+
+def _space(out, whitespace):
+    # Runs of whitespace and removed comments become one space, or one newline if they held one
+    if out and out[-1] in (' ', '\n'):
+        if whitespace == '\n':
+            out[-1] = '\n'
+    else:
+        out.append(whitespace)
+
+
+def minify_js(text):
+    """
+    Remove comments (except /*! notices) and collapse whitespace outside
+    strings, template literals and regexes. Newlines are kept.
+    """
+    out = []
+    # One entry per open template literal: brace depth of its current ${...}
+    templates = []
+    i, n = 0, len(text)
+    while i < n:
+        char = text[i]
+        if templates and templates[-1] is None:
+            # Inside the text of a template literal
+            if char == '\\':
+                out.append(text[i:i + 2])
+                i += 2
+            elif char == '`':
+                out.append(char)
+                templates.pop()
+                i += 1
+            elif text.startswith('${', i):
+                out.append('${')
+                templates[-1] = 0
+                i += 2
+            else:
+                out.append(char)
+                i += 1
+            continue
+
+        if char in '\'"':
+            end = _skip_string(text, i, char)
+            out.append(text[i:end])
+            i = end
+        elif char == '`':
+            out.append(char)
+            templates.append(None)
+            i += 1
+        elif text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            end = n if end < 0 else end + 2
+            comment = text[i:end]
+            if comment.startswith('/*!'):
+                out.append(comment)
+            else:
+                _space(out, '\n' if '\n' in comment else ' ')
+            i = end
+        elif text.startswith('//', i):
+            end = text.find('\n', i)
+            i = n if end < 0 else end
+        elif char == '/' and _regex_allowed(out):
+            end = _skip_regex(text, i)
+            out.append(text[i:end])
+            i = end
+        elif char.isspace():
+            end = i
+            while end < n and text[end].isspace():
+                end += 1
+            _space(out, '\n' if '\n' in text[i:end] else ' ')
+            i = end
+        else:
+            if templates and char == '{':
+                templates[-1] += 1
+            elif templates and char == '}':
+                if templates[-1] == 0:
+                    # End of ${...}: back to the template literal's text
+                    templates[-1] = None
+                else:
+                    templates[-1] -= 1
+            out.append(char)
+            i += 1
+
+    return ''.join(out).strip() + '\n'
+
+
+def minify_css(text):
+    """Remove comments (except /*! notices) and whitespace that CSS does not need"""
+    out = []
+    i, n = 0, len(text)
+    while i < n:
+        char = text[i]
+        if char in '\'"':
+            end = _skip_string(text, i, char)
+            out.append(text[i:end])
+            i = end
+        elif text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            end = n if end < 0 else end + 2
+            if text.startswith('/*!', i):
+                out.append(text[i:end])
+            i = end
+        elif char.isspace():
+            while i < n and text[i].isspace():
+                i += 1
+            previous = out[-1][-1:] if out else ''
+            following = text[i:i + 1]
+            # A space before ':' can matter in selectors ("a :hover"), so only these
+            if previous and previous not in '{};,>' and following not in '{};,>' and following:
+                out.append(' ')
+        else:
+            if char == '}' and out and out[-1] == ';':
+                out.pop()
+            out.append(char)
+            i += 1
+    return ''.join(out).strip() + '\n'
+
+
+def _hashed_name(path, data):
+    root, ext = posixpath.splitext(path)
+    return f'{root}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}'
+
+
+def _rewrite_css_urls(css, path, manifest):
+    """Point relative url(...) references at the hashed files"""
+    base = posixpath.dirname(path)
+
+    def replace(match):
+        quote, target = match.group(1), match.group(2).strip()
+        if re.match(r'^([a-z][a-z0-9+.-]*:|/|#)', target, re.I):
+            return match.group(0)
+        # The query string was a cache buster; the hash replaces it
+        reference, _, fragment = target.partition('#')
+        reference = reference.split('?', 1)[0]
+        entry = manifest.get(posixpath.normpath(posixpath.join(base, reference)))
+        if entry is None:
+            return match.group(0)
+        hashed = posixpath.relpath(entry['path'], base or '.')
+        return f'url({quote}{hashed}{"#" + fragment if fragment else ""}{quote})'
+
+    return _CSS_URL.sub(replace, css)
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _compressed_variants(data):
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {encoding: body for encoding, body in variants.items()
+            if len(body) <= len(data) * (1 - MIN_SAVING)}
+
+
+def build_assets(source_dir, output_dir, minify=True, compress=True, clean=False):
+    """
+    Build every file under source_dir (except output_dir) into output_dir and
+    write the manifest. Returns the manifest: source name -> {'path', 'encodings',
+    'size'}, with '/' separated names relative to source_dir.
+    """
+    source_dir = os.path.abspath(source_dir)
+    output_dir = os.path.abspath(output_dir)
+    if clean and os.path.isdir(output_dir):
+        shutil.rmtree(output_dir)
+
+    sources = []
+    for root, dirs, files in os.walk(source_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.')
+                         and os.path.abspath(os.path.join(root, d)) != output_dir)
+        for name in sorted(files):
+            if not name.startswith('.'):
+                full = os.path.join(root, name)
+                sources.append(os.path.relpath(full, source_dir).replace(os.sep, '/'))
+    # CSS last, so the files it references already have their hashed names
+    sources.sort(key=lambda path: (path.endswith('.css'), path))
+
+    manifest = {}
+    for path in sources:
+        with open(os.path.join(source_dir, path), 'rb') as f:
+            data = f.read()
+        ext = posixpath.splitext(path)[1].lower()
+        if ext in ('.js', '.css'):
+            text = data.decode('utf-8')
+            if ext == '.css':
+                text = _rewrite_css_urls(text, path, manifest)
+            if minify and '.min.' not in path:
+                text = minify_js(text) if ext == '.js' else minify_css(text)
+            data = text.encode('utf-8')
+
+        hashed = _hashed_name(path, data)
+        target = os.path.join(output_dir, *hashed.split('/'))
+        _write(target, data)
+        encodings = []
+        if compress and ext in COMPRESSIBLE:
+            variants = _compressed_variants(data)
+            for encoding, suffix in ENCODINGS:
+                if encoding in variants:
+                    _write(target + suffix, variants[encoding])
+                    encodings.append(encoding)
+        manifest[path] = {'path': hashed, 'encodings': encodings, 'size': len(data)}
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump({'assets': manifest}, f, indent=1, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest
+
+
+class StaticAssets:
+    """static_url() template helper and the view serving built assets"""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._loaded = (None, {}, {})   # (manifest mtime, source -> entry, hashed path -> entry)
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['static_assets'] = self
+        app.add_url_rule('/static/dist/<path:filename>', 'static_asset', self.serve)
+        app.jinja_env.globals['static_url'] = self.static_url
+
+    @property
+    def output_dir(self):
+        return self.app.config.get('STATIC_ASSETS_DIR') or os.path.join(self.app.static_folder, 'dist')
+
+    def manifest(self):
+        """(source -> entry, hashed path -> entry), reloaded when manifest.json changes"""
+        path = os.path.join(self.output_dir, MANIFEST_NAME)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._loaded[0]:
+            with self._lock:
+                assets = {}
+                if mtime is not None:
+                    try:
+                        with open(path) as f:
+                            assets = json.load(f).get('assets', {})
+                    except (OSError, ValueError):
+                        self.app.logger.warning(f'Unreadable static asset manifest {path}')
+                self._loaded = (mtime, assets, {entry['path']: entry for entry in assets.values()})
+        return self._loaded[1], self._loaded[2]
+
+    def static_url(self, filename, **values):
+        """URL of the built asset for filename, or its plain /static/ URL"""
+        if self.app.config.get('STATIC_ASSETS_ENABLED', True):
+            entry = self.manifest()[0].get(filename)
+            if entry is not None:
+                return url_for('static_asset', filename=entry['path'], **values)
+        return url_for('static', filename=filename, **values)
+
+    def serve(self, filename):
+        entry = self.manifest()[1].get(filename)
+        if entry is None:
+            abort(404)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        encoding, suffix = None, ''
+        for name, variant_suffix in ENCODINGS:
+            if name in entry['encodings'] and request.accept_encodings[name]:
+                encoding, suffix = name, variant_suffix
+                break
+        response = send_from_directory(self.output_dir, filename + suffix, mimetype=mimetype,
+                                       max_age=ONE_YEAR, conditional=True)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if entry['encodings']:
+            response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
@@ -0,0 +1,262 @@
+"""
+Synthetic practice data generator.
+
+Creates a reproducible practice (practitioners, clinics, locations, patients with
+encrypted personal data, treatments with trigger points, recurring rules, ICD-10
+diagnoses and referrals) for benchmarking and local development.
+Used by ``flask bench seed`` and the benchmark suite in ``benchmarks/``.
+"""
+import random
+import uuid
+from datetime import datetime, date, time, timedelta
+
+from app.models import (
+    db, User, Patient, Treatment, TriggerPoint, RecurringAppointment, Location,
+    Clinic, ClinicMembership, Plan, UserSubscription
+)
+from app.models_icd10 import ICD10Code, PatientDiagnosis
+
+FIRST_NAMES = [
+    'Ana', 'Carlos', 'Lucía', 'Javier', 'María', 'David', 'Laura', 'Pablo', 'Elena', 'Sergio',
+    'Marta', 'Daniel', 'Sara', 'Jorge', 'Paula', 'James', 'Emma', 'Oliver', 'Sophie', 'Luca',
+]
+LAST_NAMES = [
+    'García', 'Martínez', 'López', 'Sánchez', 'Pérez', 'Gómez', 'Fernández', 'Ruiz', 'Díaz',
+    'Moreno', 'Smith', 'Brown', 'Rossi', 'Bianchi', 'Dubois', 'Moreau', 'Navarro', 'Romero',
+]
+DIAGNOSES = [
+    'Lumbalgia', 'Cervicalgia', 'Tendinopatía rotuliana', 'Esguince de tobillo',
+    'Hombro doloroso', 'Epicondilitis', 'Fascitis plantar', 'Ciática', 'Cefalea tensional',
+    'Síndrome del túnel carpiano',
+]
+TREATMENT_TYPES = ['Initial Assessment', 'Follow-up', 'Dry Needling', 'Manual Therapy', 'Exercise Session']
+MUSCLES = [
+    'Upper trapezius', 'Levator scapulae', 'Infraspinatus', 'Quadratus lumborum',
+    'Gluteus medius', 'Piriformis', 'Gastrocnemius', 'Sternocleidomastoid', 'Rhomboids',
+]
+TRIGGER_POINT_TYPES = ['active', 'latent', 'satellite']
+PAYMENT_METHODS = ['Cash', 'Card']
+RECURRENCE_TYPES = ['weekly', 'daily-mon-fri']
+REFERRAL_SOURCES = ['Google', 'Instagram', 'Dr. Romero (GP)', 'Gym Fit+', 'Word of mouth']
+
+# Minimal musculoskeletal ICD-10 set used when the catalog has not been seeded
+ICD10_SEED_CODES = [
+    ('M54.5', 'Low back pain', 'Low back pain', 'Dorsopathies', 'Back pain'),
+    ('M54.2', 'Cervicalgia', 'Neck pain', 'Dorsopathies', 'Neck disorders'),
+    ('M54.3', 'Sciatica', 'Sciatica', 'Dorsopathies', 'Back pain'),
+    ('M75.1', 'Rotator cuff tear or rupture, not specified as traumatic', 'Rotator cuff syndrome', 'Soft tissue disorders', 'Shoulder'),
+    ('M77.1', 'Lateral epicondylitis', 'Tennis elbow', 'Soft tissue disorders', 'Elbow'),
+    ('M72.2', 'Plantar fascial fibromatosis', 'Plantar fasciitis', 'Soft tissue disorders', 'Foot'),
+    ('S93.4', 'Sprain of ankle', 'Ankle sprain', 'Injuries', 'Ankle'),
+    ('M76.5', 'Patellar tendinitis', 'Patellar tendinopathy', 'Soft tissue disorders', 'Knee'),
+]
+
+# Body chart safe area (matches the 500x800 SVG coordinate space)
+CHART_MIN_X, CHART_MAX_X = 100, 400
+CHART_MIN_Y, CHART_MAX_Y = 100, 700
+
+
+def _ensure_plan():
+    plan = Plan.query.filter_by(is_active=True).order_by(Plan.display_order).first()
+    if plan:
+        return plan
+    plan = Plan(
+        name='Synthetic Premium', slug='synthetic-premium', plan_type='individual',
+        price_cents=0, billing_interval='month', currency='eur', patient_limit=None,
+        features={'reporting_advanced_ai': True}, is_active=True,
+    )
+    db.session.add(plan)
+    db.session.flush()
+    return plan
+
+
+def _ensure_icd10_codes():
+    codes = ICD10Code.query.filter_by(is_active=True).limit(200).all()
+    if codes:
+        return codes
+    codes = [
+        ICD10Code(code=code, description=desc, short_description=short,
+                  category=category, subcategory=subcategory)
+        for code, desc, short, category, subcategory in ICD10_SEED_CODES
+    ]
+    db.session.add_all(codes)
+    db.session.flush()
+    return codes
+
+
+def _random_chart_point(rng, treatment_id):
+    return TriggerPoint(
+        treatment_id=treatment_id,
+        location_x=round(rng.uniform(CHART_MIN_X, CHART_MAX_X), 1),
+        location_y=round(rng.uniform(CHART_MIN_Y, CHART_MAX_Y), 1),
+        type=rng.choice(TRIGGER_POINT_TYPES),
+        muscle=rng.choice(MUSCLES),
+        intensity=rng.randint(1, 10),
+    )
+
+
+def seed_synthetic_practice(users=2, patients=50, treatments=10, recurring=5, clinics=0,
+                            trigger_points=3, seed=42, password='benchmark'):
+    """
+    Create a synthetic practice and return a summary dict.
+
+    Args:
+        users (int): Number of practitioners to create
+        patients (int): Patients per practitioner
+        treatments (int): Treatments per patient (spread over the past year and next month)
+        recurring (int): Recurring rules per practitioner
+        clinics (int): Clinics to create; every practitioner except the first is
+                       assigned to one round-robin, the first always practises independently
+        trigger_points (int): Maximum trigger points per treatment
+        seed (int): Random seed, so the same arguments always produce the same data
+        password (str): Password for all generated practitioners
+
+    Patient names, emails, phones, notes and treatment notes go through the model
+    setters, so they are encrypted whenever encryption is enabled.
+    """
+    rng = random.Random(seed)
+    run_id = uuid.uuid4().hex[:8]
+    now = datetime.utcnow().replace(second=0, microsecond=0)
+    today = now.date()
+
+    plan = _ensure_plan()
+    icd10_codes = _ensure_icd10_codes()
+
+    created = {
+        'users': [], 'clinics': 0, 'patients': 0, 'treatments': 0,
+        'trigger_points': 0, 'recurring': 0, 'diagnoses': 0,
+    }
+
+    clinic_objs = []
+    for c in range(clinics):
+        clinic = Clinic(name=f'Synthetic Clinic {c + 1}', email=f'clinic{c + 1}_{run_id}@example.com')
+        db.session.add(clinic)
+        clinic_objs.append(clinic)
+    db.session.flush()
+    created['clinics'] = len(clinic_objs)
+
+    for u in range(users):
+        email = f'bench{u + 1}_{run_id}@example.com'
+        user = User(
+            username=email, email=email, role='physio', email_verified=True,
+            first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+            is_new_user=False, consent_given=True, consent_date=now,
+        )
+        user.set_password(password)
+        db.session.add(user)
+        db.session.flush()
+        created['users'].append(email)
+
+        db.session.add(UserSubscription(
+            user_id=user.id, plan_id=plan.id, status='trialing',
+            trial_starts_at=now, trial_ends_at=now + timedelta(days=365),
+            current_period_starts_at=now, current_period_ends_at=now + timedelta(days=365),
+        ))
+
+        if u > 0 and clinic_objs:
+            membership = ClinicMembership(
+                user_id=user.id, clinic_id=clinic_objs[(u - 1) % len(clinic_objs)].id,
+                role='admin' if u <= len(clinic_objs) else 'practitioner',
+                is_active=True, joined_at=now,
+            )
+            membership.set_permissions_by_role()
+            db.session.add(membership)
+
+        locations = [
+            Location(user_id=user.id, name='Main Clinic', location_type='Clinic',
+                     first_session_fee=60.0, subsequent_session_fee=45.0),
+            Location(user_id=user.id, name='Home Visits', location_type='Home Visit',
+                     first_session_fee=75.0, subsequent_session_fee=60.0),
+        ]
+        db.session.add_all(locations)
+        db.session.flush()
+
+        user_patients = []
+        for p in range(patients):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            created_at = now - timedelta(days=rng.randint(0, 730))
+            patient = Patient(
+                user_id=user.id,
+                name=f'{first} {last}',
+                email=f'{first.lower()}.{last.lower()}.{u}.{p}@example.com',
+                phone=f'+34 6{rng.randint(10000000, 99999999)}',
+                notes=f'Synthetic patient {p + 1} of practitioner {u + 1}.',
+                anamnesis='Dolor de {} meses de evolución.'.format(rng.randint(1, 24)),
+                date_of_birth=date(rng.randint(1945, 2008), rng.randint(1, 12), rng.randint(1, 28)),
+                diagnosis=rng.choice(DIAGNOSES),
+                status='Active' if rng.random() < 0.7 else 'Inactive',
+                created_at=created_at,
+                dry_needling_preference=rng.choice(['never', 'neutral', 'likes', 'unknown']),
+            )
+            # About a third of patients were referred, half of those by another patient
+            if user_patients and rng.random() < 0.15:
+                patient.referred_by_patient_id = rng.choice(user_patients).id
+            elif rng.random() < 0.15:
+                patient.referred_by_name = rng.choice(REFERRAL_SOURCES)
+            db.session.add(patient)
+            db.session.flush()
+            user_patients.append(patient)
+
+            code = rng.choice(icd10_codes)
+            db.session.add(PatientDiagnosis(
+                patient_id=patient.id, icd10_code_id=code.id, diagnosis_type='primary',
+                status='active', diagnosed_by_user_id=user.id,
+                diagnosis_date=created_at.date(),
+            ))
+            created['diagnoses'] += 1
+
+            for t in range(treatments):
+                when = now - timedelta(days=rng.randint(-30, 365), hours=rng.randint(0, 8))
+                when = when.replace(minute=rng.choice([0, 30]))
+                location = rng.choice(locations)
+                future = when > now
+                status = 'Scheduled' if future else rng.choices(
+                    ['Completed', 'Cancelled', 'No Show'], weights=[90, 7, 3])[0]
+                treatment = Treatment(
+                    patient_id=patient.id,
+                    treatment_type=TREATMENT_TYPES[0] if t == 0 else rng.choice(TREATMENT_TYPES[1:]),
+                    assessment='Synthetic assessment',
+                    notes=f'Session {t + 1}: mejoría progresiva.',
+                    status=status,
+                    provider=email,
+                    created_at=when,
+                    location=location.name,
+                    location_id=location.id,
+                    visit_type='Initial' if t == 0 else 'Subsequent',
+                    fee_charged=location.first_session_fee if t == 0 else location.subsequent_session_fee,
+                    payment_method=None if future else rng.choice(PAYMENT_METHODS),
+                    pain_level=rng.randint(0, 10),
+                )
+                db.session.add(treatment)
+                db.session.flush()
+                created['treatments'] += 1
+
+                for _ in range(rng.randint(0, trigger_points)):
+                    db.session.add(_random_chart_point(rng, treatment.id))
+                    created['trigger_points'] += 1
+
+        for r in range(recurring):
+            if not user_patients:
+                break
+            patient = rng.choice(user_patients)
+            db.session.add(RecurringAppointment(
+                patient_id=patient.id,
+                start_date=today - timedelta(days=rng.randint(0, 60)),
+                end_date=today + timedelta(days=rng.randint(30, 120)) if rng.random() < 0.5 else None,
+                recurrence_type=rng.choice(RECURRENCE_TYPES),
+                time_of_day=time(rng.randint(8, 19), rng.choice([0, 30])),
+                treatment_type='Standard Session',
+                location=locations[0].name,
+                location_id=locations[0].id,
+                provider=email,
+                fee_charged=locations[0].subsequent_session_fee,
+                payment_method=rng.choice(PAYMENT_METHODS),
+                is_active=True,
+            ))
+            created['recurring'] += 1
+
+        created['patients'] += len(user_patients)
+        # Commit per practitioner to keep the session small for large runs
+        db.session.commit()
+
+    return created
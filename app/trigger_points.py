@@ -0,0 +1,208 @@
+# app/trigger_points.py
+"""
+Trigger point storage.
+
+Treatments arrive with their body-chart points as a JSON list
+(trigger_points_data). This module:
+- validates a whole list at once and normalizes it to TriggerPoint column
+  values, reporting every bad point in one TriggerPointError,
+- inserts the rows with a single executemany in the caller's transaction, so a
+  treatment and its points commit (or roll back) together,
+- applies edits as a diff against the stored rows: unchanged points are left
+  alone, so saving the same chart twice writes nothing,
+- reads points for many treatments into a packed, column-oriented form
+  (arrays of x, y, intensity and type codes) for views that only plot them.
+"""
+
+import math
+from array import array
+from collections import Counter
+
+from sqlalchemy import delete, insert, select
+
+from app import db
+from app.models import TriggerPoint
+
+# Packed type codes; anything else (including missing) is stored as 'unknown'
+POINT_TYPES = ('unknown', 'active', 'latent', 'satellite')
+TYPE_CODES = {name: code for code, name in enumerate(POINT_TYPES)}
+
+# Columns that make up a point's identity when diffing an edit
+POINT_COLUMNS = ('location_x', 'location_y', 'type', 'muscle', 'intensity', 'symptoms', 'referral_pattern')
+
+MAX_ERRORS_REPORTED = 5
+
+
+class TriggerPointError(ValueError):
+    """The submitted trigger point data is invalid; .errors lists the problems"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        shown = '; '.join(errors[:MAX_ERRORS_REPORTED])
+        more = len(errors) - MAX_ERRORS_REPORTED
+        super().__init__(shown + (f' (and {more} more)' if more > 0 else ''))
+
+
+def _number(value, cast):
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    if isinstance(value, bool):
+        raise ValueError(value)
+    number = cast(value)
+    if isinstance(number, float) and not math.isfinite(number):
+        raise ValueError(value)
+    return number
+
+
+def normalize_points(points):
+    """
+    Validate a list of submitted points and return TriggerPoint column dicts.
+
+    Each point needs numeric 'x' and 'y'; 'intensity' is optional but must be
+    an integer when given. Raises TriggerPointError listing every invalid point.
+    """
+    if points is None:
+        return []
+    if not isinstance(points, list):
+        raise TriggerPointError(['trigger point data must be a list'])
+
+    rows, errors = [], []
+    for index, point in enumerate(points):
+        if not isinstance(point, dict):
+            errors.append(f'point {index}: not an object')
+            continue
+        try:
+            x = _number(point.get('x'), float)
+            y = _number(point.get('y'), float)
+        except (TypeError, ValueError):
+            errors.append(f'point {index}: x and y must be numbers')
+            continue
+        if x is None or y is None:
+            errors.append(f'point {index}: x and y are required')
+            continue
+        try:
+            intensity = _number(point.get('intensity'), int)
+        except (TypeError, ValueError):
+            errors.append(f'point {index}: intensity must be an integer')
+            continue
+        rows.append({
+            'location_x': x,
+            'location_y': y,
+            'type': point.get('type') or 'unknown',
+            'muscle': point.get('muscle') or '',
+            'intensity': intensity,
+            'symptoms': point.get('symptoms') or '',
+            'referral_pattern': point.get('referral') or '',
+        })
+    if errors:
+        raise TriggerPointError(errors)
+    return rows
+
+
+def _insert(treatment_id, rows):
+    if rows:
+        # Core insert: the ORM bulk path splits batches on rows with NULL columns
+        db.session.execute(insert(TriggerPoint.__table__), [dict(row, treatment_id=treatment_id) for row in rows])
+
+
+def add_points(treatment, rows):
+    """Insert normalized rows for a treatment with one executemany; no commit"""
+    if treatment.id is None:
+        db.session.flush()
+    _insert(treatment.id, rows)
+    if rows:
+        db.session.expire(treatment, ['trigger_points'])
+    return len(rows)
+
+
+def _key(row):
+    return tuple(row[column] for column in POINT_COLUMNS)
+
+
+def replace_points(treatment, rows):
+    """
+    Make the treatment's stored points equal to `rows` by diffing; no commit.
+
+    Points are compared by value, so only the ones that were actually removed
+    or added are written. Returns (added, removed).
+    """
+    stored = db.session.execute(
+        select(TriggerPoint.id, *(getattr(TriggerPoint, column) for column in POINT_COLUMNS))
+        .where(TriggerPoint.treatment_id == treatment.id)
+        .order_by(TriggerPoint.id)
+    ).all()
+
+    wanted = Counter(_key(row) for row in rows)
+    stale_ids = []
+    for stored_row in stored:
+        key = tuple(stored_row[1:])
+        if wanted[key] > 0:
+            wanted[key] -= 1
+        else:
+            stale_ids.append(stored_row[0])
+
+    added = []
+    for row in rows:
+        key = _key(row)
+        if wanted[key] > 0:
+            wanted[key] -= 1
+            added.append(row)
+
+    if stale_ids:
+        db.session.execute(delete(TriggerPoint).where(TriggerPoint.id.in_(stale_ids)),
+                           execution_options={'synchronize_session': False})
+    _insert(treatment.id, added)
+    if stale_ids or added:
+        # A loaded trigger_points collection no longer matches the table
+        db.session.expire(treatment, ['trigger_points'])
+    return len(added), len(stale_ids)
+
+
+class PackedPoints:
+    """Trigger points of one or more treatments as parallel arrays"""
+
+    __slots__ = ('treatment_id', 'x', 'y', 'intensity', 'type_code')
+
+    def __init__(self):
+        self.treatment_id = array('l')
+        self.x = array('d')
+        self.y = array('d')
+        self.intensity = array('b')     # -1 when not recorded
+        self.type_code = array('B')     # Index into POINT_TYPES
+
+    def __len__(self):
+        return len(self.x)
+
+    def append(self, treatment_id, x, y, intensity, point_type):
+        self.treatment_id.append(treatment_id)
+        self.x.append(x)
+        self.y.append(y)
+        self.intensity.append(-1 if intensity is None else max(-1, min(int(intensity), 127)))
+        self.type_code.append(TYPE_CODES.get(point_type, 0))
+
+    def to_dict(self):
+        return {
+            'types': list(POINT_TYPES),
+            'treatment_id': self.treatment_id.tolist(),
+            'x': self.x.tolist(),
+            'y': self.y.tolist(),
+            'intensity': self.intensity.tolist(),
+            'type': self.type_code.tolist(),
+        }
+
+
+def packed_points(treatment_ids):
+    """Packed points of the given treatments, read with one column-only query"""
+    packed = PackedPoints()
+    treatment_ids = list(treatment_ids)
+    if not treatment_ids:
+        return packed
+    rows = db.session.execute(
+        select(TriggerPoint.treatment_id, TriggerPoint.location_x, TriggerPoint.location_y,
+               TriggerPoint.intensity, TriggerPoint.type)
+        .where(TriggerPoint.treatment_id.in_(treatment_ids))
+        .order_by(TriggerPoint.treatment_id, TriggerPoint.id)
+    )
+    for row in rows:
+        packed.append(*row)
+    return packed
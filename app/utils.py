@@ -1,43 +1,24 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from flask import current_app
 from app.models import Treatment, Patient, RecurringAppointment, db
 from sqlalchemy import func, and_
+from app.metrics import track_external
+from app.maintenance import JOBS
 import logging
 import json
 
 def mark_past_treatments_as_completed(user_id=None):
     """Mark past treatments with status 'Scheduled' as 'Completed'"""
     try:
-        today = datetime.now().date()
-        
-        query = Treatment.query.filter(
-            and_(
-                Treatment.created_at < today,
-                Treatment.status == 'Scheduled'
-            )
-        )
-
-        if user_id:
-            query = query.join(Patient).filter(Patient.user_id == user_id)
-        
-        past_treatments = query.all()
-        
-        count = 0
-        for treatment in past_treatments:
-            treatment.status = 'Completed'
-            count += 1
-        
+        count, _ = JOBS['complete-past-treatments'].run(user_id=user_id)
         if count > 0:
-            db.session.commit()
             current_app.logger.info(
                 "Automatically marked %s past treatments as Completed (user_id: %s)",
                 count,
                 user_id if user_id else 'global'
             )
-        
         return count
     except Exception as e:
-        db.session.rollback()
         current_app.logger.error(f"Error marking past treatments as completed: {str(e)}")
         raise
 
@@ -136,6 +117,198 @@ def convert_past_recurring_to_treatments(user_id=None):
         raise
 
 
+def calendly_time(value):
+    """Calendly ISO 8601 timestamp as naive UTC, the way treatments store times"""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def ingest_calendly_invitee(user, invitee_uuid, name, email, start_time, event_type_name):
+    """
+    Apply the Calendly matching rules to one invitee of one of the user's
+    events: a treatment for the matching (or a new) patient, or an unmatched
+    booking for review. Returns 'treatment', 'unmatched' or None when the
+    invitee was already synced; the caller commits.
+    """
+    from app.models import UnmatchedCalendlyBooking
+    
+    # Check if already exists
+    existing_unmatched_booking = UnmatchedCalendlyBooking.query.filter_by(
+        calendly_invitee_id=invitee_uuid,
+        user_id=user.id
+    ).first()
+    
+    if existing_unmatched_booking:
+        current_app.logger.debug(f"Calendly sync for user {user.id}: skipping existing booking {invitee_uuid}")
+        return None  # Skip if already processed
+    
+    # Check if treatment already exists
+    existing_treatment = Treatment.query.filter_by(
+        calendly_invitee_uri=invitee_uuid
+    ).join(Patient).filter(Patient.user_id == user.id).first()
+    
+    if existing_treatment:
+        current_app.logger.debug(f"Calendly sync for user {user.id}: skipping existing treatment {invitee_uuid}")
+        return None  # Skip if treatment already exists
+    
+    # SMART MATCHING LOGIC - Try multiple strategies to find the right patient
+    patient = None
+    action_taken = None
+    
+    # 1. Try exact email match first
+    patient = Patient.query.filter_by(email=email, user_id=user.id).first()
+    if patient:
+        action_taken = "exact_email_match"
+    else:
+        # 2. Try name-based matching (fuzzy)
+        from sqlalchemy import func
+        
+        # Split the Calendly name to handle various formats
+        name_parts = name.lower().split()
+        
+        # Get all patients for this user
+        all_patients = Patient.query.filter_by(user_id=user.id).all()
+        
+        for existing_patient in all_patients:
+            if not existing_patient.name:
+                continue
+                
+            existing_name_lower = existing_patient.name.lower()
+            existing_name_parts = existing_name_lower.split()
+            
+            # Check if names match (fuzzy matching)
+            name_match = False
+            
+            # Strategy 1: Check if all name parts from Calendly are in existing patient name
+            if all(part in existing_name_lower for part in name_parts):
+                name_match = True
+            
+            # Strategy 2: Check if all existing patient name parts are in Calendly name
+            elif all(part in name.lower() for part in existing_name_parts):
+                name_match = True
+            
+            # Strategy 3: Check for at least 2 matching parts (for longer names)
+            elif len(name_parts) >= 2 and len(existing_name_parts) >= 2:
+                matching_parts = sum(1 for part in name_parts if part in existing_name_parts)
+                if matching_parts >= 2:
+                    name_match = True
+            
+            if name_match:
+                # Found a name match! Check email compatibility
+                if not existing_patient.email or existing_patient.email == email:
+                    # Perfect! Use this patient and update email if needed
+                    patient = existing_patient
+                    if not existing_patient.email:
+                        existing_patient.email = email
+                        action_taken = "name_match_email_updated"
+                        current_app.logger.info(f"Calendly sync: Updated email for existing patient {existing_patient.name} -> {email}")
+                    else:
+                        action_taken = "name_and_email_match"
+                    break
+                else:
+                    # Email conflict - this needs manual review
+                    current_app.logger.warning(f"Calendly sync: Name match found but email conflict - {existing_patient.name} has {existing_patient.email} vs Calendly {email}")
+                    # Continue searching for other matches, but mark this as a potential conflict
+                    pass
+    
+    if patient:
+        # Create treatment - either from exact email match, name match, or updated patient
+        treatment = Treatment(
+            patient_id=patient.id,
+            created_at=start_time,
+            treatment_type=event_type_name,
+            status="Scheduled",
+            provider=user.email,
+            notes=f"Auto-synced from Calendly ({action_taken}). Invitee: {name} ({email})",
+            calendly_invitee_uri=invitee_uuid
+        )
+        db.session.add(treatment)
+        current_app.logger.info(f"Calendly sync for user {user.id}: created treatment for {name} ({email}) on {start_time} via {action_taken}")
+        return 'treatment'
+    else:
+        # No match found - create new patient automatically
+        try:
+            new_patient = Patient(
+                name=name,
+                email=email,
+                phone="",  # Will be empty until manually updated
+                user_id=user.id,
+                status='Active'
+            )
+            db.session.add(new_patient)
+            db.session.flush()  # Get the patient ID
+            
+            # Create treatment for the new patient
+            treatment = Treatment(
+                patient_id=new_patient.id,
+                created_at=start_time,
+                treatment_type=event_type_name,
+                status="Scheduled",
+                provider=user.email,
+                notes=f"Auto-synced from Calendly (new_patient_created). Invitee: {name} ({email})",
+                calendly_invitee_uri=invitee_uuid
+            )
+            db.session.add(treatment)
+            current_app.logger.info(f"Calendly sync for user {user.id}: created NEW patient and treatment for {name} ({email}) on {start_time}")
+            return 'treatment'
+            
+        except Exception as create_error:
+            # If patient creation fails, fall back to unmatched booking
+            current_app.logger.error(f"Failed to create new patient for {name} ({email}): {str(create_error)}")
+            unmatched_booking = UnmatchedCalendlyBooking(
+                user_id=user.id,
+                name=name,
+                email=email,
+                event_type=event_type_name,
+                start_time=start_time,
+                calendly_invitee_id=invitee_uuid,
+                status='Pending'
+            )
+            db.session.add(unmatched_booking)
+            current_app.logger.info(f"Calendly sync for user {user.id}: created unmatched booking for {name} ({email}) on {start_time}")
+            return 'unmatched'
+
+
+def cancel_calendly_invitee(user, invitee_uuid):
+    """Cancel the scheduled treatment or pending booking of a canceled invitee; returns what changed"""
+    from app.models import UnmatchedCalendlyBooking
+    
+    treatment = Treatment.query.filter_by(
+        calendly_invitee_uri=invitee_uuid
+    ).join(Patient).filter(Patient.user_id == user.id).first()
+    if treatment and treatment.status == 'Scheduled':
+        treatment.status = 'Cancelled'
+        current_app.logger.info(f"Calendly: cancelled treatment {treatment.id} of invitee {invitee_uuid} for user {user.id}")
+        return 'treatment'
+    
+    booking = UnmatchedCalendlyBooking.query.filter_by(
+        calendly_invitee_id=invitee_uuid, user_id=user.id, status='Pending'
+    ).first()
+    if booking:
+        booking.status = 'Ignored'
+        current_app.logger.info(f"Calendly: dropped pending booking {booking.id} of canceled invitee {invitee_uuid} for user {user.id}")
+        return 'unmatched'
+    return None
+
+
+def calendly_reconcile_due(user, now=None):
+    """
+    Whether page loads should poll Calendly for the user: always, unless
+    webhooks deliver their bookings (a signing key and a recorded
+    subscription); then every CALENDLY_RECONCILE_HOURS.
+    """
+    if not user.calendly_configured_and_enabled:
+        return False
+    if not (current_app.config.get('CALENDLY_WEBHOOK_SIGNING_KEY') and user.calendly_webhook_subscription):
+        return True
+    if user.calendly_last_sync is None:
+        return True
+    hours = current_app.config.get('CALENDLY_RECONCILE_HOURS', 24)
+    return user.calendly_last_sync + timedelta(hours=hours) <= (now or datetime.utcnow())
+
+
 def sync_calendly_for_user(user):
     """
     Sync Calendly events for a specific user
@@ -146,7 +319,6 @@ def sync_calendly_for_user(user):
         
         import requests
         from datetime import timedelta
-        from app.models import UnmatchedCalendlyBooking, Patient, Treatment
         
         api_token = user.calendly_api_token
         user_calendly_uri_for_events = user.calendly_user_uri
@@ -172,7 +344,8 @@ def sync_calendly_for_user(user):
         }
         
         current_app.logger.info(f"Calendly sync for user {user.id}: requesting events from {min_time} to {max_time}")
-        events_response = requests.get(events_url, headers=headers, params=params, timeout=30)
+        with track_external('calendly'):
+            events_response = requests.get(events_url, headers=headers, params=params, timeout=30)
         
         if events_response.status_code != 200:
             current_app.logger.warning(f"Calendly sync failed for user {user.id}: {events_response.status_code} - {events_response.text}")
@@ -191,7 +364,8 @@ def sync_calendly_for_user(user):
             next_page_url = pagination['next_page']
             current_app.logger.info(f"Calendly sync for user {user.id}: fetching next page {next_page_url}")
             
-            next_response = requests.get(next_page_url, headers=headers, timeout=30)
+            with track_external('calendly'):
+                next_response = requests.get(next_page_url, headers=headers, timeout=30)
             if next_response.status_code == 200:
                 next_data = next_response.json()
                 all_events.extend(next_data.get('collection', []))
@@ -211,7 +385,8 @@ def sync_calendly_for_user(user):
             event_uuid = event_uri.split('/')[-1]
             
             invitees_url = f'https://api.calendly.com/scheduled_events/{event_uuid}/invitees'
-            invitees_response = requests.get(invitees_url, headers=headers, timeout=10)
+            with track_external('calendly'):
+                invitees_response = requests.get(invitees_url, headers=headers, timeout=10)
             
             if invitees_response.status_code != 200:
                 continue
@@ -222,147 +397,16 @@ def sync_calendly_for_user(user):
                 invitee_uri = invitee['uri']
                 invitee_uuid = invitee_uri.split('/')[-1]
                 
-                name = invitee['name']
-                email = invitee['email']
-                start_time = datetime.fromisoformat(event['start_time'].replace('Z', '+00:00'))
-                event_type_name = event['name']
-                
-                # Check if already exists
-                existing_unmatched_booking = UnmatchedCalendlyBooking.query.filter_by(
-                    calendly_invitee_id=invitee_uuid,
-                    user_id=user.id
-                ).first()
-                
-                if existing_unmatched_booking:
-                    current_app.logger.debug(f"Calendly sync for user {user.id}: skipping existing booking {invitee_uuid}")
-                    continue  # Skip if already processed
-                
-                # Check if treatment already exists
-                existing_treatment = Treatment.query.filter_by(
-                    calendly_invitee_uri=invitee_uuid
-                ).join(Patient).filter(Patient.user_id == user.id).first()
-                
-                if existing_treatment:
-                    current_app.logger.debug(f"Calendly sync for user {user.id}: skipping existing treatment {invitee_uuid}")
-                    continue  # Skip if treatment already exists
-                
-                # SMART MATCHING LOGIC - Try multiple strategies to find the right patient
-                patient = None
-                action_taken = None
-                
-                # 1. Try exact email match first
-                patient = Patient.query.filter_by(email=email, user_id=user.id).first()
-                if patient:
-                    action_taken = "exact_email_match"
-                else:
-                    # 2. Try name-based matching (fuzzy)
-                    from sqlalchemy import func
-                    
-                    # Split the Calendly name to handle various formats
-                    name_parts = name.lower().split()
-                    
-                    # Get all patients for this user
-                    all_patients = Patient.query.filter_by(user_id=user.id).all()
-                    
-                    for existing_patient in all_patients:
-                        if not existing_patient.name:
-                            continue
-                            
-                        existing_name_lower = existing_patient.name.lower()
-                        existing_name_parts = existing_name_lower.split()
-                        
-                        # Check if names match (fuzzy matching)
-                        name_match = False
-                        
-                        # Strategy 1: Check if all name parts from Calendly are in existing patient name
-                        if all(part in existing_name_lower for part in name_parts):
-                            name_match = True
-                        
-                        # Strategy 2: Check if all existing patient name parts are in Calendly name
-                        elif all(part in name.lower() for part in existing_name_parts):
-                            name_match = True
-                        
-                        # Strategy 3: Check for at least 2 matching parts (for longer names)
-                        elif len(name_parts) >= 2 and len(existing_name_parts) >= 2:
-                            matching_parts = sum(1 for part in name_parts if part in existing_name_parts)
-                            if matching_parts >= 2:
-                                name_match = True
-                        
-                        if name_match:
-                            # Found a name match! Check email compatibility
-                            if not existing_patient.email or existing_patient.email == email:
-                                # Perfect! Use this patient and update email if needed
-                                patient = existing_patient
-                                if not existing_patient.email:
-                                    existing_patient.email = email
-                                    action_taken = "name_match_email_updated"
-                                    current_app.logger.info(f"Calendly sync: Updated email for existing patient {existing_patient.name} -> {email}")
-                                else:
-                                    action_taken = "name_and_email_match"
-                                break
-                            else:
-                                # Email conflict - this needs manual review
-                                current_app.logger.warning(f"Calendly sync: Name match found but email conflict - {existing_patient.name} has {existing_patient.email} vs Calendly {email}")
-                                # Continue searching for other matches, but mark this as a potential conflict
-                                pass
-                
-                if patient:
-                    # Create treatment - either from exact email match, name match, or updated patient
-                    treatment = Treatment(
-                        patient_id=patient.id,
-                        created_at=start_time,
-                        treatment_type=event_type_name,
-                        status="Scheduled",
-                        provider=user.email,
-                        notes=f"Auto-synced from Calendly ({action_taken}). Invitee: {name} ({email})",
-                        calendly_invitee_uri=invitee_uuid
-                    )
-                    db.session.add(treatment)
+                result = ingest_calendly_invitee(
+                    user, invitee_uuid, invitee['name'], invitee['email'],
+                    calendly_time(event['start_time']), event['name']
+                )
+                if result == 'treatment':
                     synced_treatments_count += 1
-                    current_app.logger.info(f"Calendly sync for user {user.id}: created treatment for {name} ({email}) on {start_time} via {action_taken}")
-                else:
-                    # No match found - create new patient automatically
-                    try:
-                        new_patient = Patient(
-                            name=name,
-                            email=email,
-                            phone="",  # Will be empty until manually updated
-                            user_id=user.id,
-                            status='Active'
-                        )
-                        db.session.add(new_patient)
-                        db.session.flush()  # Get the patient ID
-                        
-                        # Create treatment for the new patient
-                        treatment = Treatment(
-                            patient_id=new_patient.id,
-                            created_at=start_time,
-                            treatment_type=event_type_name,
-                            status="Scheduled",
-                            provider=user.email,
-                            notes=f"Auto-synced from Calendly (new_patient_created). Invitee: {name} ({email})",
-                            calendly_invitee_uri=invitee_uuid
-                        )
-                        db.session.add(treatment)
-                        synced_treatments_count += 1
-                        current_app.logger.info(f"Calendly sync for user {user.id}: created NEW patient and treatment for {name} ({email}) on {start_time}")
-                        
-                    except Exception as create_error:
-                        # If patient creation fails, fall back to unmatched booking
-                        current_app.logger.error(f"Failed to create new patient for {name} ({email}): {str(create_error)}")
-                        unmatched_booking = UnmatchedCalendlyBooking(
-                            user_id=user.id,
-                            name=name,
-                            email=email,
-                            event_type=event_type_name,
-                            start_time=start_time,
-                            calendly_invitee_id=invitee_uuid,
-                            status='Pending'
-                        )
-                        db.session.add(unmatched_booking)
-                        newly_created_unmatched_bookings_count += 1
-                        current_app.logger.info(f"Calendly sync for user {user.id}: created unmatched booking for {name} ({email}) on {start_time}")
+                elif result == 'unmatched':
+                    newly_created_unmatched_bookings_count += 1
         
+        user.calendly_last_sync = datetime.utcnow()
         db.session.commit()
         
         return {
@@ -375,23 +419,23 @@ def sync_calendly_for_user(user):
         return {'new_treatments': 0, 'new_unmatched_bookings': 0}
 
 
-def auto_sync_appointments(user_id=None):
+def auto_sync_appointments(user_id=None, force_calendly=False):
     """
     Combined function to sync all appointment data:
     1. Convert past recurring appointments to treatments
     2. Mark past treatments as completed
-    3. Sync Calendly events (if configured)
+    3. Reconcile Calendly events (if configured and due, or force_calendly)
     """
     try:
         created_count = convert_past_recurring_to_treatments(user_id)
         completed_count = mark_past_treatments_as_completed(user_id)
         
-        # Sync Calendly for the specific user
+        # Webhooks deliver Calendly bookings; poll only as an occasional reconciliation
         calendly_synced = {'new_treatments': 0, 'new_unmatched_bookings': 0}
         if user_id:
             from app.models import User
             user = User.query.get(user_id)
-            if user:
+            if user and (force_calendly or calendly_reconcile_due(user)):
                 calendly_synced = sync_calendly_for_user(user)
         
         return {
@@ -408,37 +452,15 @@ def auto_sync_appointments(user_id=None):
 def mark_inactive_patients(user_id=None):
     """Mark patients as 'Inactive' if they haven't had a booking in the last 2 months"""
     try:
-        today = datetime.now().date()
-        two_months_ago = today - timedelta(days=60)
-        
-        patient_query = Patient.query.filter_by(status='Active')
-        if user_id:
-            patient_query = patient_query.filter_by(user_id=user_id)
-        
-        active_patients = patient_query.all()
-        
-        count = 0
-        for patient in active_patients:
-            # When checking latest_treatment, it should also be implicitly filtered by user if patient list is filtered.
-            # However, for clarity or if patient list wasn't pre-filtered, you might join Treatment and filter by Patient.user_id here too.
-            # For now, relying on the active_patients list being correctly filtered.
-            latest_treatment = Treatment.query.filter_by(patient_id=patient.id).order_by(Treatment.created_at.desc()).first()
-            
-            if not latest_treatment or latest_treatment.created_at.date() < two_months_ago:
-                patient.status = 'Inactive'
-                count += 1
-        
+        count, _ = JOBS['mark-inactive-patients'].run(user_id=user_id)
         if count > 0:
-            db.session.commit()
             current_app.logger.info(
                 "Automatically marked %s patients as Inactive (user_id: %s)",
                 count,
                 user_id if user_id else 'global'
             )
-        
         return count
     except Exception as e:
-        db.session.rollback()
         current_app.logger.error(f"Error marking patients as inactive: {str(e)}")
         raise
 
@@ -493,10 +515,11 @@ def log_api_access(endpoint, user_id=None, method='GET', status_code=200, respon
     try:
         # Log to application logger
         user_info = f"user_id:{user_id}" if user_id else "anonymous"
+        timing = f"{response_time:.3f}s" if response_time is not None else "N/A"
         current_app.logger.info(
             f"API Access: {method} {endpoint} - {user_info} - "
             f"Status: {status_code} - "
-            f"Response Time: {response_time:.3f}s" if response_time else "N/A"
+            f"Response Time: {timing}"
         )
         
         # Log sensitive API endpoints with extra detail
@@ -516,23 +539,36 @@ def log_api_access(endpoint, user_id=None, method='GET', status_code=200, respon
 
 def monitor_database_performance():
     """
-    Monitor database performance and log slow queries.
-    This is a basic implementation - you might want to use more sophisticated tools.
+    Log a summary of recent database activity collected by the query monitor
+    (see app/query_monitor.py) and return it.
+    
+    Returns:
+        dict: Database type plus average queries / DB time per request and the number
+              of recent requests with N+1 patterns or slow queries
     """
     try:
         # Get database connection info
         db_uri = current_app.config.get('SQLALCHEMY_DATABASE_URI', '')
         db_type = 'postgresql' if 'postgresql' in db_uri else 'sqlite' if 'sqlite' in db_uri else 'unknown'
         
-        current_app.logger.info(f"Database type: {db_type}")
+        summary = {'db_type': db_type}
+        query_monitor = current_app.extensions.get('query_monitor')
+        if query_monitor:
+            summary.update(query_monitor.summary())
         
-        # For PostgreSQL, you could add more sophisticated monitoring here
-        if db_type == 'postgresql':
-            # Example: Check connection pool status
-            current_app.logger.info("PostgreSQL database monitoring active")
+        current_app.logger.info(
+            f"Database type: {db_type} - "
+            f"Requests: {summary.get('requests', 0)} - "
+            f"Avg queries: {summary.get('avg_queries', 0)} - "
+            f"Avg DB time: {summary.get('avg_db_ms', 0)}ms - "
+            f"N+1 requests: {summary.get('n_plus_one_requests', 0)} - "
+            f"Slow query requests: {summary.get('slow_query_requests', 0)}"
+        )
+        return summary
             
     except Exception as e:
         current_app.logger.error(f"Database monitoring error: {str(e)}")
+        return None
 
 def log_error_with_context(error, context=None):
     """
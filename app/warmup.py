@@ -0,0 +1,80 @@
+# app/warmup.py
+"""
+Worker warmup.
+
+A fresh worker compiles each Jinja template and builds each in-memory cache
+on the first request that needs it, so the first users after a deploy wait
+for that work. warmup() does it up front:
+- compiles every .html template into the Jinja environment's cache,
+- builds the ICD-10 reference catalog (app.icd10_catalog),
+- loads the static asset manifest (app.static_assets).
+
+It runs from create_app() when WARMUP_ON_START is set, or as a gunicorn
+post_worker_init hook:
+
+    def post_worker_init(worker):
+        from app.warmup import warmup
+        warmup(worker.wsgi)
+
+Failures are logged and skipped; a worker that cannot warm up still serves.
+"""
+
+import time
+
+from jinja2 import TemplateError
+
+TEMPLATE_EXTENSIONS = ('.html',)
+
+
+def compile_templates(app):
+    """Load every template into the Jinja cache. Returns (compiled, failed names)."""
+    env = app.jinja_env
+    names = [name for name in env.list_templates() if name.endswith(TEMPLATE_EXTENSIONS)]
+    if env.cache is not None and env.cache.capacity < len(names):
+        app.logger.warning(f'Jinja cache holds {env.cache.capacity} templates, {len(names)} found')
+    failed = []
+    for name in names:
+        try:
+            env.get_template(name)
+        except TemplateError as e:
+            app.logger.warning(f'Warmup could not compile template {name}: {e}')
+            failed.append(name)
+    return len(names) - len(failed), failed
+
+
+def prime_caches(app):
+    """Build the in-memory reference caches. Returns the names of those primed."""
+    from app import db
+    from app.icd10_catalog import reference_catalog
+
+    primed = []
+    with app.app_context():
+        try:
+            reference_catalog()
+            primed.append('icd10_catalog')
+        except Exception as e:
+            # Missing tables on a fresh database, or the database is not reachable yet
+            app.logger.warning(f'Warmup could not build the ICD-10 catalog: {e}')
+        finally:
+            db.session.remove()
+        static_assets = app.extensions.get('static_assets')
+        if static_assets is not None:
+            static_assets.manifest()
+            primed.append('static_assets')
+    return primed
+
+
+def warmup(app):
+    """Compile templates and prime caches; returns a summary for logging"""
+    started = time.perf_counter()
+    compiled, failed = compile_templates(app)
+    primed = prime_caches(app)
+    summary = {
+        'templates': compiled,
+        'failed_templates': failed,
+        'caches': primed,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+    app.logger.info(f"Warmup: {compiled} templates compiled, caches primed: {', '.join(primed) or 'none'} "
+                    f"in {summary['seconds']}s")
+    return summary
@@ -0,0 +1,153 @@
+# benchmarks/conftest.py
+"""
+Fixtures for the endpoint benchmark suite.
+
+Run with:  pytest benchmarks/            (requires pytest-benchmark)
+Refresh the stored baseline with:  pytest benchmarks/ --update-baseline
+"""
+import json
+import os
+import pytest
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models import User, Patient, Treatment
+from app.synthetic_data import seed_synthetic_practice
+from config import TestConfig
+
+pytest.importorskip('pytest_benchmark')
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def pytest_addoption(parser):
+    parser.addoption('--update-baseline', action='store_true', default=False,
+                     help='Write the measured latencies and query counts to benchmarks/baseline.json')
+    parser.addoption('--latency-tolerance', type=float,
+                     default=float(os.environ.get('BENCH_LATENCY_TOLERANCE', '1.0')),
+                     help='Allowed median latency increase over the baseline (1.0 = +100%%)')
+
+
+class QueryCounter:
+    """Counts SQL statements executed on an engine while active."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+
+
+class Baseline:
+    """Stored per-endpoint median latency (seconds) and query count."""
+
+    def __init__(self, path, update, tolerance):
+        self.path = path
+        self.update = update
+        self.tolerance = tolerance
+        self.measured = {}
+        self.data = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.data = json.load(f)
+
+    def check(self, name, median, queries):
+        self.measured[name] = {'median_seconds': round(median, 6), 'queries': queries}
+        expected = self.data.get(name)
+        if self.update or expected is None:
+            return
+        assert queries <= expected['queries'], (
+            f"{name}: {queries} queries, baseline is {expected['queries']}"
+        )
+        limit = expected['median_seconds'] * (1 + self.tolerance)
+        assert median <= limit, (
+            f"{name}: median {median * 1000:.1f}ms exceeds baseline "
+            f"{expected['median_seconds'] * 1000:.1f}ms +{self.tolerance:.0%}"
+        )
+
+    def save(self):
+        data = dict(self.data)
+        data.update(self.measured)
+        with open(self.path, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+
+@pytest.fixture(scope='session')
+def baseline(request):
+    stored = Baseline(
+        BASELINE_PATH,
+        update=request.config.getoption('--update-baseline'),
+        tolerance=request.config.getoption('--latency-tolerance'),
+    )
+    yield stored
+    if stored.update:
+        stored.save()
+
+
+@pytest.fixture(scope='session')
+def bench_app(tmp_path_factory):
+    """An app backed by a fresh SQLite file seeded with a synthetic practice."""
+    db_path = tmp_path_factory.mktemp('bench') / 'bench.db'
+
+    class BenchmarkConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(db_path)
+        SQLALCHEMY_ENGINE_OPTIONS = {}
+        SQLALCHEMY_ECHO = False
+
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        db.create_all()
+        created = seed_synthetic_practice(
+            users=2,
+            patients=int(os.environ.get('BENCH_PATIENTS', '200')),
+            treatments=int(os.environ.get('BENCH_TREATMENTS', '8')),
+            recurring=10,
+            clinics=0,
+        )
+    app.config['BENCH_USER_EMAIL'] = created['users'][0]
+    app.config['BENCH_USER_PASSWORD'] = 'benchmark'
+    return app
+
+
+@pytest.fixture(scope='session')
+def bench_context(bench_app):
+    """Values substituted into the benchmarked URLs."""
+    with bench_app.app_context():
+        user = User.query.filter_by(email=bench_app.config['BENCH_USER_EMAIL']).first()
+        busiest = db.session.query(Patient.id).join(Treatment).filter(
+            Patient.user_id == user.id
+        ).group_by(Patient.id).order_by(db.func.count(Treatment.id).desc()).first()
+    return {
+        'patient_id': busiest[0],
+        'start': '2024-01-01T00:00:00Z',
+        'end': '2030-01-01T00:00:00Z',
+    }
+
+
+@pytest.fixture(scope='session')
+def bench_client(bench_app):
+    """A test client logged in as the first synthetic practitioner."""
+    client = bench_app.test_client()
+    response = client.post('/auth/login', data={
+        'email': bench_app.config['BENCH_USER_EMAIL'],
+        'password': bench_app.config['BENCH_USER_PASSWORD'],
+    })
+    assert response.status_code in (200, 302)
+    return client
+
+
+@pytest.fixture
+def query_counter(bench_app):
+    with bench_app.app_context():
+        engine = db.engine
+    return QueryCounter(engine)
@@ -0,0 +1,119 @@
+# benchmarks/test_concurrency.py
+"""
+Throughput with 8 parallel clients against the engine profiles of app/db_engine.py.
+
+"legacy" reproduces the old hard-coded settings (one pooled connection, no
+pragmas); "tuned" uses the dialect profile. SQLite always runs; PostgreSQL runs
+when BENCH_POSTGRES_URL points at an empty database.
+"""
+import os
+import shutil
+import threading
+import time
+import pytest
+
+from app import create_app, db
+from app.synthetic_data import seed_synthetic_practice
+from config import TestConfig
+
+CLIENTS = int(os.environ.get('BENCH_CLIENTS', '8'))
+REQUESTS_PER_CLIENT = int(os.environ.get('BENCH_REQUESTS_PER_CLIENT', '10'))
+
+# Read-heavy mix of the pages practitioners hit most
+URLS = ['/patients', '/api/appointments?start={start}&end={end}', '/health', '/patient/{patient_id}']
+
+LEGACY_OPTIONS = {'pool_size': 1, 'max_overflow': 0, 'pool_timeout': 30}
+
+
+def make_app(uri, profile):
+    class ConcurrencyConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = uri
+        SQLALCHEMY_ECHO = False
+        SQLALCHEMY_ENGINE_OPTIONS = LEGACY_OPTIONS if profile == 'legacy' else {}
+        DB_ENGINE_PROFILE = 'none' if profile == 'legacy' else 'auto'
+        SQL_MONITOR_ENABLED = False
+
+    return create_app(ConcurrencyConfig)
+
+
+def run_clients(app, email, urls):
+    """Run CLIENTS threads, each logged in and issuing REQUESTS_PER_CLIENT requests."""
+    errors = []
+    barrier = threading.Barrier(CLIENTS + 1)
+
+    def worker():
+        client = app.test_client()
+        client.post('/auth/login', data={'email': email, 'password': 'benchmark'})
+        barrier.wait()
+        for i in range(REQUESTS_PER_CLIENT):
+            response = client.get(urls[i % len(urls)])
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+    threads = [threading.Thread(target=worker) for _ in range(CLIENTS)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return CLIENTS * REQUESTS_PER_CLIENT / elapsed, errors
+
+
+@pytest.fixture(scope='module')
+def sqlite_source(tmp_path_factory):
+    """A seeded SQLite file in rollback-journal mode, copied for each profile."""
+    path = tmp_path_factory.mktemp('concurrency') / 'source.db'
+    app = make_app('sqlite:///' + str(path), 'legacy')
+    with app.app_context():
+        db.create_all()
+        created = seed_synthetic_practice(users=1, patients=100, treatments=5, recurring=5)
+        db.engine.dispose()
+    return path, created['users'][0]
+
+
+def database_for(backend, profile, sqlite_source, tmp_path):
+    if backend == 'sqlite':
+        source, email = sqlite_source
+        target = tmp_path / f'{profile}.db'
+        shutil.copy(source, target)
+        return 'sqlite:///' + str(target), email, False
+
+    uri = os.environ.get('BENCH_POSTGRES_URL')
+    if not uri:
+        pytest.skip('BENCH_POSTGRES_URL not set')
+    return uri, None, True
+
+
+@pytest.mark.parametrize('backend', ['sqlite', 'postgresql'])
+@pytest.mark.parametrize('profile', ['legacy', 'tuned'])
+def test_parallel_client_throughput(benchmark, sqlite_source, tmp_path, backend, profile):
+    """Measure requests/second with parallel clients for each backend and engine profile."""
+    uri, email, seed = database_for(backend, profile, sqlite_source, tmp_path)
+    app = make_app(uri, profile)
+    with app.app_context():
+        if seed:
+            db.drop_all()
+            db.create_all()
+            email = seed_synthetic_practice(users=1, patients=100, treatments=5, recurring=5)['users'][0]
+        from app.models import User, Patient
+        user = User.query.filter_by(email=email).first()
+        patient_id = Patient.query.filter_by(user_id=user.id).first().id
+
+    urls = [u.format(start='2024-01-01T00:00:00Z', end='2030-01-01T00:00:00Z', patient_id=patient_id) for u in URLS]
+
+    result = {}
+
+    def run():
+        result['throughput'], result['errors'] = run_clients(app, email, urls)
+
+    benchmark.pedantic(run, rounds=1, iterations=1)
+
+    benchmark.extra_info['clients'] = CLIENTS
+    benchmark.extra_info['requests_per_second'] = round(result['throughput'], 1)
+    print(f"\n{backend}/{profile}: {result['throughput']:.1f} req/s with {CLIENTS} clients")
+    assert not result['errors'], f"Failed requests: {result['errors'][:10]}"
+
+    with app.app_context():
+        db.engine.dispose()
@@ -0,0 +1,32 @@
+# benchmarks/test_endpoints.py
+import pytest
+
+ROUNDS = 5
+
+# (name, url template) for the hot pages and APIs
+ENDPOINTS = [
+    ('index', '/index'),
+    ('patients_list', '/patients'),
+    ('search', '/search?q=ma'),
+    ('calendar_appointments', '/api/calendar-appointments?start={start}&end={end}'),
+    ('appointments', '/api/appointments?start={start}&end={end}'),
+    ('analytics', '/analytics'),
+    ('financials', '/financials'),
+    ('patient_detail', '/patient/{patient_id}'),
+    ('referral_tree', '/api/analytics/referral-tree'),
+]
+
+@pytest.mark.parametrize('name,url', ENDPOINTS, ids=[e[0] for e in ENDPOINTS])
+def test_endpoint_latency(benchmark, bench_client, bench_context, query_counter, baseline, name, url):
+    """Benchmark an endpoint and compare latency and query count with the baseline."""
+    url = url.format(**bench_context)
+
+    # One counted request also serves as the warmup
+    with query_counter as counter:
+        response = bench_client.get(url)
+    assert response.status_code == 200, f'{url} returned {response.status_code}'
+
+    benchmark.extra_info['queries'] = counter.count
+    benchmark.pedantic(bench_client.get, args=(url,), rounds=ROUNDS, iterations=1)
+
+    baseline.check(name, benchmark.stats.stats.median, counter.count)
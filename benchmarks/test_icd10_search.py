@@ -0,0 +1,100 @@
+# benchmarks/test_icd10_search.py
+"""
+ICD-10 search over a catalog the size of the ICD-10-CM musculoskeletal
+chapter (M00-M99, about 6,000 codes). The codes are synthetic: conditions x
+body sites x laterality, numbered within each M block.
+
+Compares the ranked full-text search with the previous ILIKE '%q%' query.
+"""
+import itertools
+
+import pytest
+
+from app import create_app, db
+from app.icd10_catalog import reference_catalog
+from app.icd10_search import search_codes
+from app.models_icd10 import ICD10Code
+from app.query_monitor import capture_queries
+from config import TestConfig
+
+ROUNDS = 20
+
+CONDITIONS = ['Osteoarthritis', 'Tendinitis', 'Bursitis', 'Enthesopathy', 'Sprain', 'Strain', 'Contracture',
+              'Instability', 'Effusion', 'Stiffness', 'Pain', 'Calcific tendinitis', 'Synovitis',
+              'Ankylosis', 'Derangement', 'Fibromatosis', 'Myositis', 'Spondylosis', 'Radiculopathy',
+              'Disc displacement', 'Stress fracture', 'Osteonecrosis', 'Chondromalacia', 'Rotator cuff tear']
+SITES = ['shoulder', 'elbow', 'wrist', 'hand', 'hip', 'knee', 'ankle', 'foot', 'cervical region',
+         'thoracic region', 'lumbar region', 'sacral region', 'upper arm', 'forearm', 'thigh',
+         'lower leg', 'jaw', 'toe', 'finger', 'pelvis', 'heel', 'patella', 'clavicle', 'scapula']
+SIDES = ['right', 'left', 'bilateral', 'unspecified side']
+QUALIFIERS = ['', ' with effusion', ' with contracture']
+
+QUERIES = {
+    'words': {'query': 'shoulder tendinitis'},
+    'prefix': {'query': 'rotator cu'},
+    'code': {'query': 'M54'},
+    'synonym': {'query': 'hombro', 'locale': 'es'},
+    'typo': {'query': 'tendnitis knee'},
+}
+
+
+def _catalog():
+    combinations = itertools.product(CONDITIONS, SITES, SIDES, QUALIFIERS)
+    for number, (condition, site, side, qualifier) in enumerate(combinations):
+        block, item = divmod(number, 70)
+        description = f'{condition} of {site}, {side}{qualifier}'
+        yield ICD10Code(code=f'M{block:02d}.{item:02d}', description=description,
+                        short_description=f'{condition} {site}', category='Musculoskeletal', subcategory=site)
+
+
+@pytest.fixture(scope='module')
+def catalog_app(tmp_path_factory):
+    db_path = tmp_path_factory.mktemp('icd10') / 'icd10.db'
+
+    class SearchBenchmarkConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(db_path)
+        SQLALCHEMY_ECHO = False
+
+    app = create_app(SearchBenchmarkConfig)
+    with app.app_context():
+        db.create_all()
+        db.session.add_all(_catalog())
+        db.session.commit()
+    return app
+
+
+@pytest.fixture
+def catalog(catalog_app):
+    with catalog_app.app_context():
+        # Searches run against a warm reference catalog, as they do after the first request
+        reference_catalog()
+        yield
+
+
+def legacy_search(query, limit=20):
+    """What /api/icd10/search did before the full-text index."""
+    term = f'%{query}%'
+    return ICD10Code.query.filter(
+        ICD10Code.is_active == True, ICD10Code.is_physiotherapy_relevant == True,
+        db.or_(ICD10Code.code.ilike(term), ICD10Code.description.ilike(term),
+               ICD10Code.short_description.ilike(term)),
+    ).limit(limit).all()
+
+
+@pytest.mark.parametrize('name', sorted(QUERIES))
+def test_icd10_search(benchmark, catalog, baseline, name):
+    """Benchmark ranked searches; each must find codes with a handful of queries."""
+    kwargs = QUERIES[name]
+    with capture_queries() as counter:
+        codes = search_codes(**kwargs)
+    assert codes
+    assert counter.count <= 5
+
+    benchmark.extra_info['queries'] = counter.count
+    benchmark.pedantic(search_codes, kwargs=kwargs, rounds=ROUNDS, iterations=1)
+    baseline.check(f'icd10_search_{name}', benchmark.stats.stats.median, counter.count)
+
+
+def test_legacy_icd10_search(benchmark, catalog):
+    """Benchmark the previous ILIKE search for comparison."""
+    benchmark.pedantic(legacy_search, args=('shoulder tendinitis',), rounds=ROUNDS, iterations=1)
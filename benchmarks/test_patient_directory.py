@@ -0,0 +1,91 @@
+# benchmarks/test_patient_directory.py
+"""
+Patient directory at scale: one practitioner with BENCH_DIRECTORY_PATIENTS
+patients (default 20000; seeding takes about a minute).
+
+Compares the keyset-paginated directory with the previous approach (load every
+patient, decrypt, filter and sort in Python).
+"""
+import os
+
+import pytest
+
+from app import create_app, db
+from app.models import User
+from app.patient_directory import directory_page
+from app.query_monitor import capture_queries
+from app.synthetic_data import seed_synthetic_practice
+from config import TestConfig
+
+ROUNDS = 5
+PATIENTS = int(os.environ.get('BENCH_DIRECTORY_PATIENTS', '20000'))
+
+
+@pytest.fixture(scope='module')
+def directory_app(tmp_path_factory):
+    db_path = tmp_path_factory.mktemp('directory') / 'directory.db'
+
+    class DirectoryBenchmarkConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(db_path)
+        SQLALCHEMY_ECHO = False
+
+    app = create_app(DirectoryBenchmarkConfig)
+    with app.app_context():
+        db.create_all()
+        created = seed_synthetic_practice(users=1, patients=PATIENTS, treatments=2,
+                                          recurring=0, trigger_points=0)
+    app.config['BENCH_USER_EMAIL'] = created['users'][0]
+    return app
+
+
+@pytest.fixture
+def practitioner(directory_app):
+    with directory_app.app_context():
+        user = User.query.filter_by(email=directory_app.config['BENCH_USER_EMAIL']).first()
+        yield user
+
+
+def legacy_patient_list(user, search=''):
+    """What patients_list() did before pagination."""
+    patients = user.get_accessible_patients()
+    if search:
+        term = search.lower()
+        patients = [p for p in patients
+                    if (p.name and term in p.name.lower()) or
+                       (p.diagnosis and term in p.diagnosis.lower()) or
+                       (p.notes and term in p.notes.lower())]
+    patients.sort(key=lambda p: p.name.lower() if p.name else '')
+    return [(p.name, p.treatments[-1].created_at if p.treatments else None) for p in patients[:50]]
+
+
+def _deep_cursor(user):
+    page = None
+    for _ in range(20):
+        page = directory_page(user, cursor=page['next_cursor'] if page else None)
+    return page['next_cursor']
+
+
+@pytest.mark.parametrize('name', ['first_page', 'deep_page', 'search'])
+def test_directory_page(benchmark, practitioner, baseline, name):
+    """Benchmark directory pages; the query count must not grow with the practice."""
+    kwargs = {
+        'first_page': {},
+        'deep_page': {'cursor': _deep_cursor(practitioner)},
+        'search': {'search': 'garcía'},
+    }[name]
+
+    with capture_queries() as counter:
+        page = directory_page(practitioner, **kwargs)
+    assert page['patients']
+    if name != 'search':
+        assert counter.count == 2
+
+    benchmark.extra_info['queries'] = counter.count
+    benchmark.pedantic(directory_page, args=(practitioner,), kwargs=kwargs, rounds=ROUNDS, iterations=1)
+    baseline.check(f'directory_{name}', benchmark.stats.stats.median, counter.count)
+
+
+def test_legacy_patient_list(benchmark, practitioner):
+    """Benchmark the previous full-materialization list for comparison."""
+    db.session.expire_all()
+    benchmark.pedantic(legacy_patient_list, args=(practitioner,), rounds=1, iterations=1)
@@ -0,0 +1,43 @@
+# benchmarks/test_point_layout.py
+"""
+Trigger point layout at scale: 10000 points scattered over the body chart's
+safe area (seeded, so every run lays out the same chart).
+
+Compares the cell-grid neighbour search with the n x n distance matrix it
+replaces above PAIRWISE_LIMIT points, and times a full layout.
+"""
+import numpy as np
+import pytest
+
+from app import point_layout
+from app.point_layout import SAFE_AREA, overlapping_pairs, resolve_overlaps
+
+ROUNDS = 5
+POINTS = 10000
+# Dense enough to overlap heavily, sparse enough to fit in the safe area
+MIN_DISTANCE = 3.0
+
+
+@pytest.fixture(scope='module')
+def chart():
+    return np.random.default_rng(42).uniform(SAFE_AREA[:2], SAFE_AREA[2:], size=(POINTS, 2))
+
+
+def test_overlap_search(benchmark, baseline, chart):
+    """Benchmark finding the overlapping pairs among 10k points."""
+    benchmark.pedantic(overlapping_pairs, args=(chart, MIN_DISTANCE), rounds=ROUNDS, iterations=1)
+    baseline.check('point_layout_overlap_search', benchmark.stats.stats.median, 0)
+
+
+def test_pairwise_overlap_search(benchmark, chart, monkeypatch):
+    """Benchmark the distance-matrix search on the same points for comparison."""
+    monkeypatch.setattr(point_layout, 'PAIRWISE_LIMIT', POINTS)
+    benchmark.pedantic(overlapping_pairs, args=(chart, MIN_DISTANCE), rounds=1, iterations=1)
+
+
+def test_resolve_overlaps(benchmark, baseline, chart):
+    """Benchmark laying out 10k points; every overlap must be resolved."""
+    _, _, left = resolve_overlaps(chart, MIN_DISTANCE)
+    assert left == 0
+    benchmark.pedantic(resolve_overlaps, args=(chart, MIN_DISTANCE), rounds=ROUNDS, iterations=1)
+    baseline.check('point_layout_10k', benchmark.stats.stats.median, 0)
@@ -23,15 +23,66 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL", "sqlite:///" + os.path.join(basedir, 'instance', 'physio-2.db'))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
-    # Database connection pool settings - optimized for SQLite
-    SQLALCHEMY_ENGINE_OPTIONS = {
-        'pool_size': 1,            # SQLite is single-threaded
-        'pool_recycle': -1,        # No connection recycling needed for SQLite
-        'pool_pre_ping': False,    # Not needed for SQLite file access
-        'max_overflow': 0,         # No overflow for SQLite
-        'pool_timeout': 30,        # Keep timeout
-        'echo': False,             # Disable SQL logging in production
-    }
+    # Engine options are chosen per dialect by app/db_engine.py (SQLite: WAL pragmas and a
+    # small pool; PostgreSQL: sized pool, pre-ping, statement timeouts). Anything set here
+    # overrides the profile.
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    DB_ENGINE_PROFILE = os.getenv("DB_ENGINE_PROFILE", "auto")  # "none" disables the profiles
+    SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "8"))
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_FOREIGN_KEYS = os.getenv("SQLITE_FOREIGN_KEYS", "false").lower() in ["true", "1", "yes", "on"]
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+    
+    # Optional read replica for the analytics/financials/reports views (app/db_routing.py).
+    # A PostgreSQL replica, or a SQLite file refreshed with `flask replica snapshot`.
+    DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+    DB_REPLICA_STICKY_SECONDS = float(os.getenv("DB_REPLICA_STICKY_SECONDS", "5"))  # Read-your-writes window
+    
+    # Per-request SQL instrumentation (app/query_monitor.py)
+    SQL_MONITOR_ENABLED = os.getenv("SQL_MONITOR_ENABLED", "true").lower() in ["true", "1", "yes", "on"]
+    SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "10"))  # Same statement this many times per request
+    SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "100"))  # Capture EXPLAIN plan above this latency
+    SQL_MONITOR_HISTORY = 50  # Recent requests kept for /monitoring
+    
+    # Metrics (app/metrics.py). Set METRICS_DIR when running several worker processes
+    # so /metrics aggregates all of them. Scrapers send METRICS_TOKEN as a bearer token;
+    # without one only logged-in admins can read /metrics.
+    METRICS_DIR = os.getenv("METRICS_DIR")
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+    
+    # Request profiling (app/profiling.py) - no hooks are installed unless enabled
+    PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ["true", "1", "yes", "on"]
+    PROFILING_MODE = os.getenv("PROFILING_MODE", "sample")  # "sample" (collapsed stacks) or "cprofile"
+    PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))  # Fraction of requests profiled automatically
+    PROFILING_SLOW_MS = float(os.getenv("PROFILING_SLOW_MS", "1000"))  # Sampled requests are kept only above this
+
+    # Decrypted patient directory cache (app/patient_directory.py)
+    PATIENT_DIRECTORY_CACHE_ENABLED = os.getenv("PATIENT_DIRECTORY_CACHE_ENABLED", "true").lower() in ["true", "1", "yes", "on"]
+    PATIENT_DIRECTORY_CACHE_MAX_BYTES = int(os.getenv("PATIENT_DIRECTORY_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+    PATIENT_DIRECTORY_CACHE_CHECK_DB = os.getenv("PATIENT_DIRECTORY_CACHE_CHECK_DB", "true").lower() in ["true", "1", "yes", "on"]  # See changes from other worker processes
+    BODY_HEATMAP_CACHE_ENABLED = os.getenv("BODY_HEATMAP_CACHE_ENABLED", "true").lower() in ["true", "1", "yes", "on"]
+    BODY_HEATMAP_CACHE_SIZE = int(os.getenv("BODY_HEATMAP_CACHE_SIZE", "256"))  # Heatmaps kept per process
+    REFERRAL_GRAPH_CACHE_ENABLED = os.getenv("REFERRAL_GRAPH_CACHE_ENABLED", "true").lower() in ["true", "1", "yes", "on"]
+    REFERRAL_GRAPH_CACHE_SIZE = int(os.getenv("REFERRAL_GRAPH_CACHE_SIZE", "256"))  # Graphs kept per process
+    TRIGGER_POINT_LAYOUT_ON_SAVE = os.getenv("TRIGGER_POINT_LAYOUT_ON_SAVE", "true").lower() in ["true", "1", "yes", "on"]  # Push overlapping markers apart when saving
+    TRIGGER_POINT_MIN_DISTANCE = float(os.getenv("TRIGGER_POINT_MIN_DISTANCE", "14"))  # Two marker radii
+    ICD10_CATALOG_ENABLED = os.getenv("ICD10_CATALOG_ENABLED", "true").lower() in ["true", "1", "yes", "on"]
+    ICD10_CATALOG_CHECK_SECONDS = float(os.getenv("ICD10_CATALOG_CHECK_SECONDS", "60"))  # Stamp query interval
+    PATHOLOGY_GUIDE_MAX_AGE = int(os.getenv("PATHOLOGY_GUIDE_MAX_AGE", "300"))  # Browser cache seconds; revalidated by ETag after
+
+    # Fingerprinted static assets (app/static_assets.py, `flask assets build`)
+    STATIC_ASSETS_ENABLED = os.getenv("STATIC_ASSETS_ENABLED", "true").lower() in ["true", "1", "yes", "on"]
+    STATIC_ASSETS_DIR = os.getenv("STATIC_ASSETS_DIR")  # Default: app/static/dist
+
+    # Set-based maintenance jobs (app/maintenance.py)
+    MAINTENANCE_CHUNK_SIZE = int(os.getenv("MAINTENANCE_CHUNK_SIZE", "1000"))  # Primary-key range per UPDATE
+    MAINTENANCE_SCHEDULER_ENABLED = os.getenv("MAINTENANCE_SCHEDULER_ENABLED", "false").lower() in ["true", "1", "yes", "on"]
+    MAINTENANCE_SCHEDULER_POLL_SECONDS = float(os.getenv("MAINTENANCE_SCHEDULER_POLL_SECONDS", "60"))
+
+    # Compile templates and prime caches in create_app() (app/warmup.py)
+    WARMUP_ON_START = os.getenv("WARMUP_ON_START", "false").lower() in ["true", "1", "yes", "on"]
     
     # Server configuration for email URL generation (overridden in subclasses)
     # SERVER_NAME = 'localhost:5000'  # Commented out to allow flexible host access in development
@@ -45,9 +96,27 @@ class Config:
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER') or 'noreply@trxcker.com'
     MAIL_SUBJECT_PREFIX = '[TRXCKER] '
+    # Email outbox dispatcher (app/email_outbox.py)
+    EMAIL_OUTBOX_DISPATCHER_ENABLED = os.getenv("EMAIL_OUTBOX_DISPATCHER_ENABLED", "true").lower() in ["true", "1", "yes", "on"]  # Thread per serving process instead of `flask email worker`
+    EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", "50"))
+    EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", "6"))
+    EMAIL_OUTBOX_RETRY_SECONDS = int(os.getenv("EMAIL_OUTBOX_RETRY_SECONDS", "60"))  # Doubles per attempt
+    EMAIL_OUTBOX_CLAIM_TIMEOUT = int(os.getenv("EMAIL_OUTBOX_CLAIM_TIMEOUT", "300"))  # Reclaim batches of dead dispatchers
+    EMAIL_OUTBOX_POLL_SECONDS = float(os.getenv("EMAIL_OUTBOX_POLL_SECONDS", "30"))
+    EMAIL_SMTP_TIMEOUT = float(os.getenv("EMAIL_SMTP_TIMEOUT", "30"))
     
     # Calendly API configuration
     CALENDLY_API_TOKEN = os.environ.get('CALENDLY_API_TOKEN', '')
+    # Calendly webhooks (app/calendly_webhooks.py)
+    CALENDLY_WEBHOOK_SIGNING_KEY = os.environ.get('CALENDLY_WEBHOOK_SIGNING_KEY')  # signing_key of the webhook subscriptions
+    CALENDLY_WEBHOOK_TOLERANCE_SECONDS = int(os.getenv("CALENDLY_WEBHOOK_TOLERANCE_SECONDS", "180"))
+    CALENDLY_INBOX_PROCESSOR_ENABLED = os.getenv("CALENDLY_INBOX_PROCESSOR_ENABLED", "true").lower() in ["true", "1", "yes", "on"]  # Thread per serving process instead of `flask calendly worker`
+    CALENDLY_INBOX_BATCH_SIZE = int(os.getenv("CALENDLY_INBOX_BATCH_SIZE", "50"))
+    CALENDLY_INBOX_MAX_ATTEMPTS = int(os.getenv("CALENDLY_INBOX_MAX_ATTEMPTS", "5"))
+    CALENDLY_INBOX_RETRY_SECONDS = int(os.getenv("CALENDLY_INBOX_RETRY_SECONDS", "60"))  # Doubles per attempt
+    CALENDLY_INBOX_CLAIM_TIMEOUT = int(os.getenv("CALENDLY_INBOX_CLAIM_TIMEOUT", "300"))
+    CALENDLY_INBOX_POLL_SECONDS = float(os.getenv("CALENDLY_INBOX_POLL_SECONDS", "60"))
+    CALENDLY_RECONCILE_HOURS = float(os.getenv("CALENDLY_RECONCILE_HOURS", "24"))  # Polling pass per user on page loads
 
     # STRIPE PAYMENTS TEMPORARILY DISABLED FOR SYSTEM UPGRADES
     # Stripe Webhook Signing Secret
@@ -72,6 +141,9 @@ class Config:
     GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
     GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
     
+    # Root URL of the Google Calendar API; unset uses Google's (tests point it at a local fake)
+    GOOGLE_CALENDAR_API_ROOT = os.environ.get('GOOGLE_CALENDAR_API_ROOT')
+    
     # OAuth configuration
     OAUTH_CREDENTIALS = {
         'google': {
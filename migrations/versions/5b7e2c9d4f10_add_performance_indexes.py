@@ -0,0 +1,69 @@
+"""add_performance_indexes
+
+Declares the indexes that optimize_performance.py used to create by hand, plus
+composite indexes for the current access paths. Indexes that already exist
+(e.g. created by that script under the same name) are left alone.
+
+Revision ID: 5b7e2c9d4f10
+Revises: dbff4a688163
+Create Date: 2026-10-19 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b7e2c9d4f10'
+down_revision = 'dbff4a688163'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('patient', 'idx_patient_user_status', ['user_id', 'status']),
+    ('patient', 'idx_patient_user_created', ['user_id', 'created_at']),
+    ('patient', 'idx_patient_referred_by', ['referred_by_patient_id']),
+    ('location', 'idx_location_user_active', ['user_id', 'is_active']),
+    ('treatment', 'idx_treatment_patient_created', ['patient_id', 'created_at']),
+    ('treatment', 'idx_treatment_status_created', ['status', 'created_at']),
+    ('treatment', 'idx_treatment_created_at', ['created_at']),
+    ('treatment', 'idx_treatment_location_id', ['location_id']),
+    ('trigger_point', 'idx_trigger_point_treatment_id', ['treatment_id']),
+    ('unmatched_calendly_booking', 'idx_unmatched_calendly_user_status', ['user_id', 'status']),
+    ('patient_reports', 'idx_patient_report_patient_date', ['patient_id', 'generated_date']),
+    ('recurring_appointment', 'idx_recurring_patient_active', ['patient_id', 'is_active']),
+    ('patient_ai_conversations', 'idx_ai_conversation_patient_user_created', ['patient_id', 'user_id', 'created_at']),
+    ('patient_diagnoses', 'idx_patient_diagnosis_patient_status', ['patient_id', 'status']),
+]
+
+
+def _existing_indexes():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+    return tables, {
+        table: {index['name'] for index in inspector.get_indexes(table)}
+        for table in tables
+    }
+
+
+def upgrade():
+    tables, existing = _existing_indexes()
+    postgresql = op.get_bind().dialect.name == 'postgresql'
+    for table, name, columns in INDEXES:
+        # ICD-10 tables are created separately (migrations/create_icd10_tables.py)
+        if table not in tables or name in existing[table]:
+            continue
+        if postgresql:
+            # Don't block writes on large production tables while building
+            with op.get_context().autocommit_block():
+                op.create_index(name, table, columns, postgresql_concurrently=True)
+        else:
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    tables, existing = _existing_indexes()
+    for table, name, columns in reversed(INDEXES):
+        if table in tables and name in existing[table]:
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,34 @@
+"""add_patient_directory_index
+
+Index for the keyset-paginated patient directory (user_id, id): pages are read
+in index order instead of sorting all of a practitioner's patients.
+
+Revision ID: 8d41f0a6c2e3
+Revises: 5b7e2c9d4f10
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d41f0a6c2e3'
+down_revision = '5b7e2c9d4f10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('patient')}
+    if 'idx_patient_user_id' in existing:
+        return
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.create_index('idx_patient_user_id', 'patient', ['user_id', 'id'], postgresql_concurrently=True)
+    else:
+        op.create_index('idx_patient_user_id', 'patient', ['user_id', 'id'])
+
+
+def downgrade():
+    op.drop_index('idx_patient_user_id', table_name='patient')
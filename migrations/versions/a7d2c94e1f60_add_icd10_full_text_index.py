@@ -0,0 +1,77 @@
+"""add_icd10_full_text_index
+
+Full-text index for ICD-10 code search: an FTS5 table kept in sync by
+triggers on SQLite, tsvector and trigram GIN indexes on PostgreSQL.
+
+Revision ID: a7d2c94e1f60
+Revises: c3a9e5d17b42
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d2c94e1f60'
+down_revision = 'c3a9e5d17b42'
+branch_labels = None
+depends_on = None
+
+SQLITE_UPGRADE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS icd10_codes_fts USING fts5("
+    "code, description, short_description, content='icd10_codes', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS icd10_codes_fts_vocab USING fts5vocab(icd10_codes_fts, 'row')",
+    "CREATE TRIGGER IF NOT EXISTS icd10_codes_fts_ai AFTER INSERT ON icd10_codes BEGIN "
+    "INSERT INTO icd10_codes_fts(rowid, code, description, short_description) "
+    "VALUES (new.id, new.code, new.description, new.short_description); END",
+    "CREATE TRIGGER IF NOT EXISTS icd10_codes_fts_ad AFTER DELETE ON icd10_codes BEGIN "
+    "INSERT INTO icd10_codes_fts(icd10_codes_fts, rowid, code, description, short_description) "
+    "VALUES ('delete', old.id, old.code, old.description, old.short_description); END",
+    "CREATE TRIGGER IF NOT EXISTS icd10_codes_fts_au AFTER UPDATE ON icd10_codes BEGIN "
+    "INSERT INTO icd10_codes_fts(icd10_codes_fts, rowid, code, description, short_description) "
+    "VALUES ('delete', old.id, old.code, old.description, old.short_description); "
+    "INSERT INTO icd10_codes_fts(rowid, code, description, short_description) "
+    "VALUES (new.id, new.code, new.description, new.short_description); END",
+    # Index the codes that are already there
+    "INSERT INTO icd10_codes_fts(icd10_codes_fts) VALUES ('rebuild')",
+)
+SQLITE_DOWNGRADE = (
+    "DROP TRIGGER IF EXISTS icd10_codes_fts_ai",
+    "DROP TRIGGER IF EXISTS icd10_codes_fts_ad",
+    "DROP TRIGGER IF EXISTS icd10_codes_fts_au",
+    "DROP TABLE IF EXISTS icd10_codes_fts_vocab",
+    "DROP TABLE IF EXISTS icd10_codes_fts",
+)
+
+PG_DOCUMENT = "coalesce(code, '') || ' ' || coalesce(description, '') || ' ' || coalesce(short_description, '')"
+PG_TEXT = "lower(coalesce(description, '') || ' ' || coalesce(short_description, ''))"
+
+
+def upgrade():
+    bind = op.get_bind()
+    if 'icd10_codes' not in sa.inspect(bind).get_table_names():
+        # Created later by db.create_all(), which installs the index itself
+        return
+    dialect = bind.dialect.name
+    if dialect == 'sqlite':
+        for statement in SQLITE_UPGRADE:
+            op.execute(statement)
+    elif dialect == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        with op.get_context().autocommit_block():
+            op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_icd10_fts ON icd10_codes "
+                       f"USING gin (to_tsvector('simple', {PG_DOCUMENT}))")
+            op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_icd10_trgm ON icd10_codes "
+                       f"USING gin (({PG_TEXT}) gin_trgm_ops)")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for statement in SQLITE_DOWNGRADE:
+            op.execute(statement)
+    elif dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS idx_icd10_trgm")
+        op.execute("DROP INDEX IF EXISTS idx_icd10_fts")
@@ -0,0 +1,29 @@
+"""add_calendly_webhook_subscription
+
+URI of each user's Calendly webhook subscription; polling on page loads is
+only reduced for users whose bookings arrive by webhook.
+
+Revision ID: a7d41c9e2b63
+Revises: f3c9a2d17e48
+Create Date: 2026-10-19 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d41c9e2b63'
+down_revision = 'f3c9a2d17e48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('calendly_webhook_subscription', sa.String(length=255), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('calendly_webhook_subscription')
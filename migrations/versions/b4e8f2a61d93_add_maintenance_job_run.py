@@ -0,0 +1,40 @@
+"""add_maintenance_job_run
+
+Run history of the set-based maintenance jobs (app/maintenance.py).
+
+Revision ID: b4e8f2a61d93
+Revises: a7d2c94e1f60
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4e8f2a61d93'
+down_revision = 'a7d2c94e1f60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'maintenance_job_run',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('job', sa.String(length=64), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('duration_ms', sa.Float(), nullable=True),
+        sa.Column('rows_affected', sa.Integer(), nullable=True),
+        sa.Column('chunks', sa.Integer(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('idx_maintenance_job_run_job', 'maintenance_job_run', ['job', 'id'])
+
+
+def downgrade():
+    op.drop_index('idx_maintenance_job_run_job', table_name='maintenance_job_run')
+    op.drop_table('maintenance_job_run')
@@ -0,0 +1,35 @@
+"""add_icd10_reference_updated_at
+
+updated_at on ICD-10 codes and diagnosis templates, so the reference catalog
+stamp (app/icd10_catalog.py) changes when the seed scripts edit rows in place.
+
+Revision ID: b5e2f83a9c14
+Revises: a7d41c9e2b63
+Create Date: 2026-10-19 23:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e2f83a9c14'
+down_revision = 'a7d41c9e2b63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('icd10_codes', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+    with op.batch_alter_table('diagnosis_templates', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('diagnosis_templates', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
+
+    with op.batch_alter_table('icd10_codes', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
@@ -0,0 +1,35 @@
+"""add_patient_directory_stamp_index
+
+Covering index for the patient directory cache stamp
+(count and latest updated_at of a practitioner's patients).
+
+Revision ID: c3a9e5d17b42
+Revises: 8d41f0a6c2e3
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a9e5d17b42'
+down_revision = '8d41f0a6c2e3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('patient')}
+    if 'idx_patient_user_updated' in existing:
+        return
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.create_index('idx_patient_user_updated', 'patient', ['user_id', 'updated_at'],
+                            postgresql_concurrently=True)
+    else:
+        op.create_index('idx_patient_user_updated', 'patient', ['user_id', 'updated_at'])
+
+
+def downgrade():
+    op.drop_index('idx_patient_user_updated', table_name='patient')
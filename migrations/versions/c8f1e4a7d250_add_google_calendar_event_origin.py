@@ -0,0 +1,35 @@
+"""add_google_calendar_event_origin
+
+Where a treatment's Google Calendar event came from: 'google' for treatments
+the sync created from the user's own events, 'app' for events pushed from
+treatments. Pushes only update 'app' events.
+
+Revision ID: c8f1e4a7d250
+Revises: b5e2f83a9c14
+Create Date: 2026-10-20 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8f1e4a7d250'
+down_revision = 'b5e2f83a9c14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('treatment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('google_calendar_event_origin', sa.String(length=20), nullable=True))
+
+    # Only the sync linked events before pushes existed
+    op.execute("UPDATE treatment SET google_calendar_event_origin = "
+               "CASE WHEN treatment_type = 'Appointment from Google Calendar' THEN 'google' ELSE 'app' END "
+               "WHERE google_calendar_event_id IS NOT NULL")
+
+
+def downgrade():
+    with op.batch_alter_table('treatment', schema=None) as batch_op:
+        batch_op.drop_column('google_calendar_event_origin')
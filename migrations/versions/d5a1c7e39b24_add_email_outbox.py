@@ -0,0 +1,48 @@
+"""add_email_outbox
+
+Transactional email outbox drained by the dispatcher (app/email_outbox.py).
+
+Revision ID: d5a1c7e39b24
+Revises: b4e8f2a61d93
+Create Date: 2026-10-19 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a1c7e39b24'
+down_revision = 'b4e8f2a61d93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'email_outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('idempotency_key', sa.String(length=255), nullable=True),
+        sa.Column('to_email', sa.String(length=255), nullable=False),
+        sa.Column('subject', sa.String(length=255), nullable=False),
+        sa.Column('html_body', sa.Text(), nullable=False),
+        sa.Column('text_body', sa.Text(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('claimed_by', sa.String(length=32), nullable=True),
+        sa.Column('claimed_at', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('idempotency_key'),
+    )
+    op.create_index('idx_email_outbox_status_next', 'email_outbox', ['status', 'next_attempt_at'])
+    op.create_index('idx_email_outbox_claimed_by', 'email_outbox', ['claimed_by'])
+
+
+def downgrade():
+    op.drop_index('idx_email_outbox_claimed_by', table_name='email_outbox')
+    op.drop_index('idx_email_outbox_status_next', table_name='email_outbox')
+    op.drop_table('email_outbox')
@@ -0,0 +1,28 @@
+"""add_google_calendar_sync_token
+
+Google Calendar nextSyncToken per user for incremental event sync.
+
+Revision ID: e2f6b8d40c57
+Revises: d5a1c7e39b24
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2f6b8d40c57'
+down_revision = 'd5a1c7e39b24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('google_calendar_sync_token', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('google_calendar_sync_token')
@@ -0,0 +1,58 @@
+"""add_calendly_webhook_inbox
+
+Inbox of signed Calendly webhook deliveries (app/calendly_webhooks.py) and the
+time of each user's last polling reconciliation.
+
+Revision ID: f3c9a2d17e48
+Revises: e2f6b8d40c57
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c9a2d17e48'
+down_revision = 'e2f6b8d40c57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'calendly_webhook_event',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('idempotency_key', sa.String(length=255), nullable=False),
+        sa.Column('event_type', sa.String(length=50), nullable=False),
+        sa.Column('invitee_uuid', sa.String(length=100), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('claimed_by', sa.String(length=32), nullable=True),
+        sa.Column('claimed_at', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('received_at', sa.DateTime(), nullable=False),
+        sa.Column('processed_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('idempotency_key'),
+    )
+    op.create_index('ix_calendly_webhook_event_invitee_uuid', 'calendly_webhook_event', ['invitee_uuid'])
+    op.create_index('idx_calendly_webhook_event_status_next', 'calendly_webhook_event', ['status', 'next_attempt_at'])
+    op.create_index('idx_calendly_webhook_event_claimed_by', 'calendly_webhook_event', ['claimed_by'])
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('calendly_last_sync', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('calendly_last_sync')
+
+    op.drop_index('idx_calendly_webhook_event_claimed_by', table_name='calendly_webhook_event')
+    op.drop_index('idx_calendly_webhook_event_status_next', table_name='calendly_webhook_event')
+    op.drop_index('ix_calendly_webhook_event_invitee_uuid', table_name='calendly_webhook_event')
+    op.drop_table('calendly_webhook_event')
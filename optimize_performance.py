@@ -9,70 +9,32 @@ import sys
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from app import create_app, db
-from sqlalchemy import text
+from sqlalchemy import inspect, text
 
 
 def add_database_indexes():
-    """Add database indexes for commonly queried fields"""
+    """Create any index declared on the models that the database is missing.
+
+    The indexes themselves live on the models (``__table_args__``) and ship as an
+    Alembic migration; this only helps databases that are not managed by
+    ``flask db upgrade``.
+    """
     print("🔧 Adding database indexes for performance...")
-    
-    indexes_to_add = [
-        # Patient table indexes
-        "CREATE INDEX IF NOT EXISTS idx_patient_user_id ON patient(user_id);",
-        "CREATE INDEX IF NOT EXISTS idx_patient_status ON patient(status);",
-        "CREATE INDEX IF NOT EXISTS idx_patient_user_status ON patient(user_id, status);",
-        
-        # Treatment table indexes
-        "CREATE INDEX IF NOT EXISTS idx_treatment_patient_id ON treatment(patient_id);",
-        "CREATE INDEX IF NOT EXISTS idx_treatment_status ON treatment(status);",
-        "CREATE INDEX IF NOT EXISTS idx_treatment_created_at ON treatment(created_at);",
-        "CREATE INDEX IF NOT EXISTS idx_treatment_patient_status ON treatment(patient_id, status);",
-        "CREATE INDEX IF NOT EXISTS idx_treatment_patient_created ON treatment(patient_id, created_at);",
-        "CREATE INDEX IF NOT EXISTS idx_treatment_provider ON treatment(provider);",
-        "CREATE INDEX IF NOT EXISTS idx_treatment_fee_charged ON treatment(fee_charged);",
-        
-        # User table indexes
-        "CREATE INDEX IF NOT EXISTS idx_user_email ON \"user\"(email);",
-        "CREATE INDEX IF NOT EXISTS idx_user_role ON \"user\"(role);",
-        "CREATE INDEX IF NOT EXISTS idx_user_is_admin ON \"user\"(is_admin);",
-        
-        # PatientReport table indexes
-        "CREATE INDEX IF NOT EXISTS idx_patient_report_patient_id ON patient_reports(patient_id);",
-        "CREATE INDEX IF NOT EXISTS idx_patient_report_generated_date ON patient_reports(generated_date);",
-        
-        # RecurringAppointment table indexes
-        "CREATE INDEX IF NOT EXISTS idx_recurring_patient_id ON recurring_appointments(patient_id);",
-        "CREATE INDEX IF NOT EXISTS idx_recurring_is_active ON recurring_appointments(is_active);",
-        "CREATE INDEX IF NOT EXISTS idx_recurring_start_date ON recurring_appointments(start_date);",
-        
-        # TriggerPoint table indexes
-        "CREATE INDEX IF NOT EXISTS idx_trigger_point_treatment_id ON trigger_point(treatment_id);",
-        
-        # Location table indexes
-        "CREATE INDEX IF NOT EXISTS idx_location_user_id ON location(user_id);",
-        "CREATE INDEX IF NOT EXISTS idx_location_is_active ON location(user_id, is_active);",
-        
-        # UnmatchedCalendlyBooking table indexes
-        "CREATE INDEX IF NOT EXISTS idx_unmatched_calendly_status ON unmatched_calendly_booking(status);",
-        "CREATE INDEX IF NOT EXISTS idx_unmatched_calendly_user_id ON unmatched_calendly_booking(user_id);",
-        
-        # Composite indexes for common query patterns
-        "CREATE INDEX IF NOT EXISTS idx_treatment_analytics ON treatment(patient_id, created_at, fee_charged);",
-        "CREATE INDEX IF NOT EXISTS idx_patient_dashboard ON patient(user_id, status, created_at);",
-    ]
-    
+
+    existing_tables = set(inspect(db.engine).get_table_names())
     successful_indexes = 0
-    for index_sql in indexes_to_add:
-        try:
-            db.session.execute(text(index_sql))
-            db.session.commit()
-            successful_indexes += 1
-            print(f"  ✅ Added index: {index_sql.split(' ')[5] if 'idx_' in index_sql else 'Unknown'}")
-        except Exception as e:
-            print(f"  ⚠️  Index already exists or failed: {str(e)[:50]}...")
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
             continue
-    
-    print(f"✅ Added {successful_indexes} database indexes")
+        for index in table.indexes:
+            try:
+                index.create(bind=db.engine, checkfirst=True)
+                successful_indexes += 1
+                print(f"  ✅ Index present: {index.name}")
+            except Exception as e:
+                print(f"  ⚠️  Index failed: {index.name}: {str(e)[:50]}...")
+
+    print(f"✅ {successful_indexes} database indexes in place")
 
 
 def optimize_sqlalchemy_config():
@@ -4,8 +4,11 @@ import sys
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
 from app import create_app  # Changed from .app to app
+from app.background_queue import start_background_workers
 
 app = create_app()
+# Serving entry point (`python run.py`, `flask run`, WSGI files): start the queue workers
+start_background_workers(app)
 
 if __name__ == '__main__':
     app.run(debug=True, port=5002)  # Use port 5002 to avoid conflicts
@@ -4,21 +4,49 @@ from flask import Flask
 from app import create_app, db
 from app.models import User, Patient, Treatment, PatientReport, Plan, UserSubscription
 from sqlalchemy import text
+from contextlib import contextmanager
 from config import TestConfig
+from app.query_monitor import capture_queries
 
 
-@pytest.fixture(scope='session')
+def make_user(name='physio', role='physio', **fields):
+    """
+    Add a user with a unique email and the password 'password' to the session
+    and flush it; extra fields are set as attributes (encrypted ones included).
+    """
+    email = f"{name}_{uuid.uuid4().hex[:8]}@example.com"
+    user = User(username=email, email=email, role=role)
+    for field, value in fields.items():
+        setattr(user, field, value)
+    user.set_password('password')
+    db.session.add(user)
+    db.session.flush()
+    return user
+
+
+def login(client, user_id):
+    """Log the test client in as the user without going through the login form."""
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+
+
+@pytest.fixture(scope='function')
 def app():
-    """Create and configure a new app instance for each test session."""
-    app = create_app()
-    app.config.from_object(TestConfig)
+    """
+    Create a new app instance on the test database for each test, inside an
+    app context, with its tables created for the test and dropped after it.
+    TestConfig is passed to create_app() so the engine never points at the
+    development database.
+    """
+    app = create_app(TestConfig)
     app.config['STRIPE_WEBHOOK_SECRET'] = 'whsec_test_secret'
     
-    # Create all tables for the test session
     with app.app_context():
         db.create_all()
-    
-    return app
+        yield app
+        db.session.remove()
+        db.drop_all()
 
 
 @pytest.fixture(scope='function')
@@ -132,6 +160,28 @@ def sample_treatment(app, sample_patient):
         # Cleanup is handled by cleanup_database fixture
 
 
+@pytest.fixture(scope='function')
+def query_budget():
+    """
+    Assert the number of SQL statements executed inside a block.
+
+        with query_budget(5, n_plus_one_threshold=3):
+            client.get('/patients')
+    """
+    @contextmanager
+    def budget(max_queries, n_plus_one_threshold=None):
+        with capture_queries() as stats:
+            yield stats
+        assert stats.count <= max_queries, (
+            f"Expected at most {max_queries} queries, got {stats.count}:\n"
+            + "\n".join(f"{n}x {fp}" for fp, n in stats.fingerprints.most_common(10))
+        )
+        if n_plus_one_threshold:
+            repeated = stats.n_plus_one(n_plus_one_threshold)
+            assert not repeated, f"N+1 pattern detected: {repeated}"
+    return budget
+
+
 def pytest_configure(config):
     """Configure pytest to handle database connections properly."""
     # Set up any global test configuration here
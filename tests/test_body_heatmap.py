@@ -0,0 +1,103 @@
+# tests/test_body_heatmap.py
+from datetime import datetime
+
+from app import db
+from app.models import User, Patient, Treatment
+from app.models_icd10 import ICD10Code, PatientDiagnosis
+from app.body_heatmap import body_heatmap, parse_filters, heatmap_cache
+from app.trigger_points import add_points, normalize_points
+from app.query_monitor import capture_queries
+from tests.conftest import login, make_user
+import pytest
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    """Start each test with an empty heatmap cache."""
+    heatmap_cache.clear()
+
+def _treatment(patient, when, points):
+    treatment = Treatment(patient_id=patient.id, treatment_type='Follow-up', status='Completed', created_at=when)
+    db.session.add(treatment)
+    db.session.flush()
+    add_points(treatment, normalize_points(points))
+    return treatment
+
+@pytest.fixture
+def practice(app):
+    """Two patients of one physio (one with a lumbar diagnosis) and one patient of another physio."""
+    physio, other = make_user('physio'), make_user('other')
+    lumbar = Patient(name='Lumbar', user_id=physio.id)
+    neck = Patient(name='Neck', user_id=physio.id)
+    stranger = Patient(name='Stranger', user_id=other.id)
+    db.session.add_all([lumbar, neck, stranger])
+    db.session.flush()
+    code = ICD10Code(code='M54.5', description='Low back pain', short_description='Low back pain', category='Dorsopathies')
+    db.session.add(code)
+    db.session.flush()
+    db.session.add(PatientDiagnosis(patient_id=lumbar.id, icd10_code_id=code.id))
+    _treatment(lumbar, datetime(2025, 1, 10), [
+        {'x': 5, 'y': 5, 'intensity': 8, 'type': 'active', 'muscle': 'Quadratus lumborum'},
+        {'x': 7, 'y': 9, 'intensity': 2, 'type': 'latent', 'muscle': 'Quadratus lumborum'},
+        {'x': 495, 'y': 795, 'type': 'active', 'muscle': 'Gluteus medius'},
+    ])
+    _treatment(neck, datetime(2025, 3, 1), [
+        {'x': 260, 'y': 150, 'intensity': 6, 'type': 'active', 'muscle': 'Trapezius'},
+        {'x': 600, 'y': 150, 'intensity': 6, 'type': 'active', 'muscle': 'Trapezius'},
+    ])
+    _treatment(stranger, datetime(2025, 1, 10), [{'x': 5, 'y': 5, 'intensity': 10}])
+    db.session.commit()
+    return physio.id, other.id, lumbar.id, neck.id, stranger.id
+
+def test_points_are_binned_and_weighted(app, practice):
+    """Test that points land in their cells weighted by intensity (1 when missing)."""
+    physio_id, _, lumbar_id, _, _ = practice
+    heatmap = body_heatmap(db.session.get(User, physio_id), patient_id=lumbar_id, bins_x=50, bins_y=80)
+    grid = heatmap['grid']
+    assert len(grid) == 80 and len(grid[0]) == 50
+    assert grid[0][0] == 10.0       # Both points in the top-left 10x10 cell
+    assert grid[79][49] == 1.0      # No intensity recorded
+    assert heatmap['total'] == 11.0 and heatmap['max'] == 10.0 and heatmap['points'] == 3
+
+def test_caseload_scope_and_filters(app, practice):
+    """Test that the caseload covers only accessible patients and filters narrow it."""
+    physio_id, _, _, _, _ = practice
+    user = db.session.get(User, physio_id)
+    caseload = body_heatmap(user, bins_x=1, bins_y=1)
+    assert caseload['total'] == 17.0 and caseload['outside_chart'] == 1
+
+    def total(**args):
+        return body_heatmap(user, filters=parse_filters(args), bins_x=1, bins_y=1)['total']
+
+    assert total(muscle='quadratus LUMBORUM') == 10.0
+    assert total(type='latent') == 2.0
+    assert total(start='2025-02-01') == 6.0
+    assert total(end='2025-01-10') == 11.0
+    assert total(icd10='m54') == 11.0
+    assert total(icd10='M99') == 0.0
+
+def test_cache_is_reused_until_points_change(app, practice):
+    """Test that a cached heatmap costs one stamp query and is rebuilt after new points."""
+    physio_id, _, lumbar_id, _, _ = practice
+    user = db.session.get(User, physio_id)
+    first = body_heatmap(user, patient_id=lumbar_id)
+    with capture_queries() as stats:
+        assert body_heatmap(user, patient_id=lumbar_id) is first
+    assert stats.count == 1
+
+    _treatment(db.session.get(Patient, lumbar_id), datetime(2025, 4, 1), [{'x': 100, 'y': 100, 'intensity': 4}])
+    db.session.commit()
+    assert body_heatmap(user, patient_id=lumbar_id)['total'] == first['total'] + 4
+
+    app.config['BODY_HEATMAP_CACHE_ENABLED'] = False
+    assert body_heatmap(user, patient_id=lumbar_id) is not first
+
+def test_heatmap_api(app, practice):
+    """Test that the API checks patient access and validates dates."""
+    physio_id, _, lumbar_id, _, stranger_id = practice
+    client = app.test_client()
+    login(client, physio_id)
+    data = client.get(f'/api/heatmap?patient_id={lumbar_id}&bins_x=5&bins_y=8').get_json()
+    assert data['bins_x'] == 5 and len(data['grid']) == 8 and data['cell_width'] == 100
+    assert client.get(f'/api/heatmap?patient_id={stranger_id}').status_code == 403
+    assert client.get('/api/heatmap?start=January').status_code == 400
+    assert client.get('/api/heatmap').get_json()['points'] == 4
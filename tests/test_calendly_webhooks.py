@@ -0,0 +1,199 @@
+# tests/test_calendly_webhooks.py
+from datetime import datetime, timedelta
+import json
+import os
+import time
+
+from app import db
+from app.models import User, Patient, Treatment, CalendlyWebhookEvent
+from app.calendly_webhooks import sign, process_pending
+from tests.conftest import make_user
+import app.calendly_webhooks as calendly_webhooks
+import app.utils as utils
+import pytest
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'calendly')
+HOST_URI = 'https://api.calendly.com/users/AAAAAAAAAAAAAAAA'
+SIGNING_KEY = 'calendly-signing-key'
+
+@pytest.fixture(autouse=True)
+def signing_key(app):
+    """Verify deliveries against the test signing key."""
+    app.config['CALENDLY_WEBHOOK_SIGNING_KEY'] = SIGNING_KEY
+
+def _calendly_user(name, calendly_user_uri=HOST_URI):
+    return make_user(name, calendly_enabled=True, calendly_api_token='calendly-token',
+                     calendly_user_uri=calendly_user_uri)
+
+@pytest.fixture
+def physio(app):
+    """The Calendly host with Maria Santos among their patients, and another physio."""
+    user = _calendly_user('physio')
+    _calendly_user('other', calendly_user_uri='https://api.calendly.com/users/BBBBBBBBBBBBBBBB')
+    db.session.add(Patient(name='Maria Santos', user_id=user.id))
+    db.session.commit()
+    return user
+
+def _recorded(fixture, **changes):
+    """A recorded delivery as bytes, optionally with payload fields replaced."""
+    with open(os.path.join(FIXTURES, f'{fixture}.json')) as f:
+        data = json.load(f)
+    data['payload'].update(changes)
+    return json.dumps(data).encode()
+
+def _deliver(app, body, signature=None):
+    headers = {'Calendly-Webhook-Signature': signature or sign(body, SIGNING_KEY)}
+    return app.test_client().post('/webhooks/calendly', data=body, headers=headers, content_type='application/json')
+
+def _treatments(user):
+    return Treatment.query.join(Patient).filter(Patient.user_id == user.id).all()
+
+def test_booking_is_stored_once_and_applied_in_the_background(app, physio):
+    """Test that a signed booking is acknowledged, stored once and turned into a treatment."""
+    body = _recorded('invitee_created')
+    assert _deliver(app, body).status_code == 200
+    assert _deliver(app, body).status_code == 200       # Calendly retry
+    row = CalendlyWebhookEvent.query.one()
+    assert row.status == 'pending' and row.user_id == physio.id
+    assert row.invitee_uuid == '3f1d0c52-7f0b-4a8e-9a54-1c7e0d2b9e61'
+    assert json.loads(row.payload)['payload']['email'] == 'maria.santos@example.com'
+    assert _treatments(physio) == []                    # Nothing applied inside the request
+
+    assert process_pending() == {'processed': 1, 'ignored': 0, 'retried': 0, 'failed': 0}
+    treatment, = _treatments(physio)
+    assert treatment.patient.name == 'Maria Santos' and treatment.status == 'Scheduled'
+    assert treatment.created_at == datetime(2026, 10, 23, 9, 0)
+    assert treatment.treatment_type == 'Physiotherapy Session'
+    assert treatment.calendly_invitee_uri == row.invitee_uuid
+    assert process_pending()['processed'] == 0
+
+def test_invalid_signatures_are_rejected(app, physio):
+    """Test that unsigned, tampered and stale deliveries are refused and nothing is stored."""
+    body = _recorded('invitee_created')
+    assert app.test_client().post('/webhooks/calendly', data=body).status_code == 400
+    assert _deliver(app, body, signature=sign(body, 'wrong-key')).status_code == 400
+    assert _deliver(app, body.replace(b'Maria', b'Mario'), signature=sign(body, SIGNING_KEY)).status_code == 400
+    assert _deliver(app, body, signature=sign(body, SIGNING_KEY, time.time() - 600)).status_code == 400
+    assert _deliver(app, body, signature='t=abc').status_code == 400
+    app.config['CALENDLY_WEBHOOK_SIGNING_KEY'] = None
+    assert _deliver(app, body).status_code == 500
+    assert CalendlyWebhookEvent.query.count() == 0
+
+def test_cancellations_cancel_the_treatment(app, physio):
+    """Test that invitee.canceled cancels the booked treatment, in either arrival order."""
+    _deliver(app, _recorded('invitee_created'))
+    process_pending()
+    _deliver(app, _recorded('invitee_canceled'))
+    assert process_pending()['processed'] == 1
+    assert [t.status for t in _treatments(physio)] == ['Cancelled']
+
+    # A cancellation that arrives before its booking
+    invitee = 'https://api.calendly.com/scheduled_events/GBGBDCAADAEDCRZ2/invitees/aaaaaaaa-0000-0000-0000-000000000000'
+    _deliver(app, _recorded('invitee_canceled', uri=invitee))
+    _deliver(app, _recorded('invitee_created', uri=invitee))
+    assert process_pending() == {'processed': 1, 'ignored': 1, 'retried': 0, 'failed': 0}
+    assert len(_treatments(physio)) == 1
+
+def test_unknown_hosts_and_new_invitees(app, physio):
+    """Test that events of unknown hosts are ignored and unknown invitees get a new patient."""
+    stranger = _recorded('invitee_created', uri='https://api.calendly.com/invitees/stranger',
+                         scheduled_event={'event_memberships': [{'user': 'https://api.calendly.com/users/NOBODY'}]})
+    data = json.loads(stranger)
+    data['created_by'] = 'https://api.calendly.com/users/NOBODY'
+    stranger = json.dumps(data).encode()
+    _deliver(app, stranger)
+    _deliver(app, _recorded('invitee_created', uri='https://api.calendly.com/invitees/new', name='Rui Lopes',
+                            email='rui@example.com'))
+    assert _deliver(app, json.dumps({'event': 'routing_form_submission.created', 'payload': {}}).encode()).status_code == 200
+
+    assert process_pending() == {'processed': 1, 'ignored': 1, 'retried': 0, 'failed': 0}
+    assert sorted(t.patient.name for t in _treatments(physio)) == ['Rui Lopes']
+    assert CalendlyWebhookEvent.query.count() == 2
+
+def test_failures_are_retried_then_given_up(app, physio, monkeypatch):
+    """Test that an event that fails to apply is retried with backoff and failed after the last attempt."""
+    app.config['CALENDLY_INBOX_MAX_ATTEMPTS'] = 2
+    monkeypatch.setattr(calendly_webhooks, 'ingest_calendly_invitee',
+                        lambda *args: (_ for _ in ()).throw(RuntimeError('database hiccup')))
+    _deliver(app, _recorded('invitee_created'))
+    assert process_pending()['retried'] == 1
+    row = CalendlyWebhookEvent.query.one()
+    assert row.status == 'pending' and row.attempts == 1 and 'database hiccup' in row.last_error
+    assert row.next_attempt_at > datetime.utcnow() + timedelta(seconds=50)
+
+    row.next_attempt_at = datetime.utcnow()
+    db.session.commit()
+    assert process_pending()['failed'] == 1
+    assert CalendlyWebhookEvent.query.one().status == 'failed'
+
+def test_polling_only_reconciles_when_due(app, physio, monkeypatch):
+    """Test that page loads poll every time unless webhooks are subscribed, then once per CALENDLY_RECONCILE_HOURS."""
+    calls = []
+
+    def fake_sync(user):
+        calls.append(user.id)
+        user.calendly_last_sync = datetime.utcnow()
+        db.session.commit()
+        return {'new_treatments': 0, 'new_unmatched_bookings': 0}
+
+    monkeypatch.setattr(utils, 'sync_calendly_for_user', fake_sync)
+    utils.auto_sync_appointments(physio.id)
+    utils.auto_sync_appointments(physio.id)
+    assert calls == [physio.id, physio.id]              # No subscription: bookings only arrive by polling
+
+    physio.calendly_webhook_subscription = 'https://api.calendly.com/webhook_subscriptions/SUB'
+    db.session.commit()
+    utils.auto_sync_appointments(physio.id)
+    assert len(calls) == 2
+    utils.auto_sync_appointments(physio.id, force_calendly=True)
+    assert len(calls) == 3
+    assert utils.calendly_reconcile_due(physio, now=datetime.utcnow() + timedelta(hours=25))
+    app.config['CALENDLY_WEBHOOK_SIGNING_KEY'] = None
+    assert utils.calendly_reconcile_due(physio)
+
+def test_subscribe_records_the_subscription(app, physio, monkeypatch):
+    """Test that `flask calendly subscribe` creates a signed user-scoped subscription and records it."""
+    import requests
+    posted = []
+
+    class Response:
+        def __init__(self, status_code, data):
+            self.status_code, self.data, self.text = status_code, data, json.dumps(data)
+
+        def json(self):
+            return self.data
+
+    monkeypatch.setattr(requests, 'get', lambda url, **kwargs: Response(
+        200, {'resource': {'uri': url, 'current_organization': 'https://api.calendly.com/organizations/ORG'}}))
+
+    def post(url, json=None, **kwargs):
+        posted.append(json)
+        return Response(201, {'resource': {'uri': 'https://api.calendly.com/webhook_subscriptions/SUB'}})
+
+    monkeypatch.setattr(requests, 'post', post)
+    output = app.test_cli_runner().invoke(args=['calendly', 'subscribe', 'https://example.com/webhooks/calendly']).output
+    assert f'User {physio.id}: subscribed' in output
+    assert posted[0]['user'] == HOST_URI and posted[0]['scope'] == 'user'
+    assert posted[0]['signing_key'] == SIGNING_KEY and posted[0]['events'] == ['invitee.created', 'invitee.canceled']
+    assert db.session.get(User, physio.id).calendly_webhook_subscription.endswith('/SUB')
+
+def test_calendly_cli(app, physio):
+    """Test that `flask calendly process` drains the inbox and `status` reports it."""
+    _deliver(app, _recorded('invitee_created'))
+    runner = app.test_cli_runner()
+    assert 'pending: 1' in runner.invoke(args=['calendly', 'status']).output
+    assert '1 processed' in runner.invoke(args=['calendly', 'process']).output
+    assert 'processed: 1' in runner.invoke(args=['calendly', 'status']).output
+
+def test_inbox_processor_starts_with_serving_processes(app, physio, monkeypatch):
+    """Test that a delivery wakes the inbox thread but never starts it; serving processes start it."""
+    from app.background_queue import start_background_workers
+
+    processor = calendly_webhooks.InboxProcessor(app)
+    _deliver(app, _recorded('invitee_created'))
+    assert not processor.running
+    app.config['TESTING'] = False
+    monkeypatch.setattr(calendly_webhooks.InboxProcessor, 'start', lambda worker: setattr(worker, 'started', True))
+    monkeypatch.setattr('sys.argv', ['gunicorn', 'app:app'])
+    monkeypatch.delenv('FLASK_RUN_FROM_CLI', raising=False)
+    assert processor in start_background_workers(app) and processor.started
@@ -0,0 +1,70 @@
+# tests/test_db_engine.py
+from app import create_app, db
+from app.db_engine import engine_options, sqlite_pragmas, effective_settings
+from config import TestConfig
+
+def test_sqlite_file_profile():
+    """Test that a SQLite file database gets a pool and a busy timeout."""
+    options = engine_options({'SQLALCHEMY_DATABASE_URI': 'sqlite:////tmp/app.db'})
+    assert options['pool_size'] == 8
+    assert options['max_overflow'] == 0
+    assert options['connect_args'] == {'timeout': 5.0, 'check_same_thread': False}
+
+def test_sqlite_memory_profile_has_no_pool_size():
+    """Test that in-memory SQLite keeps Flask-SQLAlchemy's static pool."""
+    options = engine_options({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+    assert 'pool_size' not in options
+
+def test_postgres_profile():
+    """Test that PostgreSQL gets a sized pool, pre-ping and statement timeouts."""
+    options = engine_options({
+        'SQLALCHEMY_DATABASE_URI': 'postgresql://u:p@db/physio',
+        'DB_POOL_SIZE': 15,
+        'DB_STATEMENT_TIMEOUT_MS': 5000,
+    })
+    assert options['pool_size'] == 15
+    assert options['max_overflow'] == 20
+    assert options['pool_pre_ping'] is True
+    assert '-c statement_timeout=5000' in options['connect_args']['options']
+
+def test_explicit_options_override_profile():
+    """Test that SQLALCHEMY_ENGINE_OPTIONS wins over the profile."""
+    options = engine_options({
+        'SQLALCHEMY_DATABASE_URI': 'postgresql://u:p@db/physio',
+        'SQLALCHEMY_ENGINE_OPTIONS': {'pool_size': 3, 'connect_args': {'application_name': 'worker'}},
+    })
+    assert options['pool_size'] == 3
+    assert options['connect_args']['application_name'] == 'worker'
+    assert 'statement_timeout' in options['connect_args']['options']
+
+def test_profile_can_be_disabled():
+    """Test that DB_ENGINE_PROFILE = 'none' leaves only explicit options."""
+    options = engine_options({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:////tmp/app.db',
+        'DB_ENGINE_PROFILE': 'none',
+        'SQLALCHEMY_ENGINE_OPTIONS': {'pool_size': 1},
+    })
+    assert options == {'pool_size': 1}
+
+def test_foreign_keys_pragma_is_opt_in():
+    """Test that foreign key enforcement follows SQLITE_FOREIGN_KEYS."""
+    assert 'PRAGMA foreign_keys=OFF' in sqlite_pragmas({})
+    assert 'PRAGMA foreign_keys=ON' in sqlite_pragmas({'SQLITE_FOREIGN_KEYS': True})
+
+def test_sqlite_pragmas_are_applied(tmp_path):
+    """Test that every new SQLite connection runs with WAL and the tuned pragmas."""
+    class EngineConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'engine.db')
+        SQLALCHEMY_ENGINE_OPTIONS = {}
+
+    app = create_app(EngineConfig)
+    with app.app_context():
+        settings = effective_settings(db.engine)
+        db.engine.dispose()
+
+    assert settings['dialect'] == 'sqlite'
+    assert settings['pool_size'] == 8
+    assert settings['server']['journal_mode'] == 'wal'
+    assert settings['server']['synchronous'] == 1  # NORMAL
+    assert settings['server']['busy_timeout'] == 5000
+    assert settings['server']['cache_size'] == -65536
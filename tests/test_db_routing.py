@@ -0,0 +1,103 @@
+# tests/test_db_routing.py
+from app import create_app, db
+from app.models import Patient
+from app.db_routing import snapshot_sqlite, LAST_WRITE_SESSION_KEY
+from config import TestConfig
+from tests.conftest import login, make_user
+from datetime import datetime
+from flask import g, session
+import pytest
+import time
+
+@pytest.fixture
+def app(tmp_path):
+    """An app with a primary and a replica SQLite file."""
+    class ReplicaConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'primary.db')
+        DATABASE_REPLICA_URL = 'sqlite:///' + str(tmp_path / 'replica.db')
+        SQLALCHEMY_ENGINE_OPTIONS = {}
+
+    app = create_app(ReplicaConfig)
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+        app.extensions['replica_router'].engine.dispose()
+
+@pytest.fixture
+def physio_id(app):
+    """A practitioner with one patient, present on both databases."""
+    with app.app_context():
+        user = make_user('physio')
+        db.session.add(Patient(name='Replicated', user_id=user.id, created_at=datetime(2025, 1, 15)))
+        db.session.commit()
+        user_id = user.id
+        snapshot_sqlite(app.config['SQLALCHEMY_DATABASE_URI'], app.config['DATABASE_REPLICA_URL'])
+
+        # Written after the snapshot, so only the primary has it
+        db.session.add(Patient(name='Primary only', user_id=user_id, created_at=datetime(2025, 1, 20)))
+        db.session.commit()
+    return user_id
+
+def logged_in_client(app, user_id, last_write=None):
+    client = app.test_client()
+    login(client, user_id)
+    if last_write is not None:
+        with client.session_transaction() as sess:
+            sess[LAST_WRITE_SESSION_KEY] = last_write
+    return client
+
+def test_replica_engine_is_configured(app):
+    """Test that DATABASE_REPLICA_URL creates a tuned replica engine."""
+    replica = app.extensions['replica_router'].engine
+    with app.app_context():
+        assert replica.url != db.engine.url
+    with replica.connect() as conn:
+        assert conn.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+
+def test_no_replica_by_default():
+    """Test that without DATABASE_REPLICA_URL every query uses the primary."""
+    app = create_app(TestConfig)
+    assert app.extensions['replica_router'].engine is None
+
+def test_read_only_view_reads_from_replica(app, physio_id):
+    """Test that @replica_read views see the replica's (stale) data."""
+    client = logged_in_client(app, physio_id)
+    response = client.get('/api/analytics/patients-by-month')
+    assert response.status_code == 200
+    assert response.get_json() == [{'month': '2025-01', 'count': 1}]
+
+def test_recent_writer_reads_from_primary(app, physio_id):
+    """Test read-your-writes: a user who just wrote is routed to the primary."""
+    client = logged_in_client(app, physio_id, last_write=time.time())
+    response = client.get('/api/analytics/patients-by-month')
+    assert response.get_json() == [{'month': '2025-01', 'count': 2}]
+
+def test_stickiness_expires(app, physio_id):
+    """Test that the primary is only forced for DB_REPLICA_STICKY_SECONDS."""
+    client = logged_in_client(app, physio_id, last_write=time.time() - 60)
+    response = client.get('/api/analytics/patients-by-month')
+    assert response.get_json() == [{'month': '2025-01', 'count': 1}]
+
+def test_write_sets_sticky_marker(app, physio_id):
+    """Test that a request which flushes changes records the write time."""
+    router = app.extensions['replica_router']
+    with app.test_request_context('/'):
+        db.session.add(Patient(name='New', user_id=physio_id))
+        db.session.flush()
+        assert g._db_wrote
+        router.finish_request(app.response_class())
+        assert session[LAST_WRITE_SESSION_KEY] <= time.time()
+        db.session.rollback()
+
+def test_only_marked_requests_use_replica(app, physio_id):
+    """Test that queries go to the primary unless the request is marked read-only."""
+    with app.test_request_context('/'):
+        assert Patient.query.filter_by(user_id=physio_id).count() == 2
+        db.session.remove()
+    with app.test_request_context('/'):
+        g._db_read_only = True
+        assert Patient.query.filter_by(user_id=physio_id).count() == 1
+        db.session.remove()
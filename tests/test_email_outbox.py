@@ -0,0 +1,208 @@
+# tests/test_email_outbox.py
+from datetime import datetime, timedelta
+import smtplib
+import socket
+import sys
+
+from app import db
+from app.models import User, EmailOutbox
+from app.background_queue import QueueWorker, start_background_workers
+from app.email_outbox import enqueue_email, dispatch_pending, claim_batch, OutboxDispatcher, SMTPConnection
+from app.email_utils import send_welcome_email
+from tests.conftest import make_user
+import pytest
+
+@pytest.fixture(autouse=True)
+def server_name(app):
+    """Links in queued mail are built outside requests, in a context that knows the server name."""
+    app.config['SERVER_NAME'] = 'localhost'
+    with app.app_context():
+        yield
+
+class RecordingConnection:
+    """SMTP stand-in that records messages and raises the queued errors per recipient."""
+
+    def __init__(self, errors=None):
+        self.sent = []
+        self.errors = errors or {}
+        self.closed = False
+
+    def send(self, sender, recipient, message):
+        error = self.errors.get(recipient)
+        if error is not None:
+            raise error
+        self.sent.append((recipient, message))
+
+    def close(self):
+        self.closed = True
+
+def _queue(count):
+    for i in range(count):
+        enqueue_email(f'user{i}@example.com', f'Subject {i}', f'<p>{i}</p>', f'{i}', idempotency_key=f'test:{i}')
+    db.session.commit()
+
+def test_email_is_queued_with_the_transaction(app):
+    """Test that queued email is committed or rolled back with the change and deduplicated by key."""
+    user = make_user('ana', first_name='Ana')
+    db.session.commit()
+    send_welcome_email(user)
+    db.session.rollback()
+    assert EmailOutbox.query.count() == 0
+
+    send_welcome_email(user)
+    send_welcome_email(user)
+    db.session.commit()
+    send_welcome_email(user)
+    db.session.commit()
+    message = EmailOutbox.query.one()
+    assert message.idempotency_key == f'welcome:{user.id}' and message.status == 'pending'
+    assert message.to_email == user.email and 'Ana' in message.text_body
+
+def test_verify_email_queues_the_welcome_email(app):
+    """Test that verifying an email answers without SMTP and queues the welcome email."""
+    user = make_user('ben', first_name='Ben')
+    token = user.generate_email_verification_token()
+    db.session.commit()
+    response = app.test_client().get(f'/auth/verify_email/{token}')
+    assert response.status_code == 302
+    assert db.session.get(User, user.id).email_verified
+    assert EmailOutbox.query.filter_by(idempotency_key=f'welcome:{user.id}').count() == 1
+
+def test_dispatch_sends_batches_over_one_connection(app):
+    """Test that the dispatcher drains the outbox in batches and marks messages sent."""
+    _queue(5)
+    connection = RecordingConnection()
+    counts = dispatch_pending(connection=connection, batch_size=2)
+    assert counts == {'sent': 5, 'retried': 0, 'failed': 0}
+    assert [recipient for recipient, _ in connection.sent] == [f'user{i}@example.com' for i in range(5)]
+    assert 'X-Idempotency-Key: test:0' in connection.sent[0][1]
+    assert not connection.closed        # The caller owns the connection
+    assert {m.status for m in EmailOutbox.query} == {'sent'}
+    assert dispatch_pending(connection=connection) == {'sent': 0, 'retried': 0, 'failed': 0}
+
+def test_dispatch_retries_with_backoff_and_fails_permanent_errors(app):
+    """Test that transient errors are retried later, permanent ones fail at once, and attempts are capped."""
+    app.config['EMAIL_OUTBOX_MAX_ATTEMPTS'] = 2
+    _queue(3)
+    connection = RecordingConnection(errors={
+        'user0@example.com': smtplib.SMTPServerDisconnected('gone'),
+        'user1@example.com': smtplib.SMTPRecipientsRefused({'user1@example.com': (550, b'No such user')}),
+    })
+    assert dispatch_pending(connection=connection) == {'sent': 1, 'retried': 1, 'failed': 1}
+    retry = EmailOutbox.query.filter_by(to_email='user0@example.com').one()
+    assert retry.status == 'pending' and retry.attempts == 1
+    assert retry.next_attempt_at > datetime.utcnow() + timedelta(seconds=50)
+    assert dispatch_pending(connection=connection)['retried'] == 0     # Not due yet
+
+    retry.next_attempt_at = datetime.utcnow()
+    db.session.commit()
+    assert dispatch_pending(connection=connection) == {'sent': 0, 'retried': 0, 'failed': 1}
+    assert EmailOutbox.query.filter_by(status='failed').count() == 2
+
+def test_claims_are_exclusive_until_they_time_out(app):
+    """Test that a claimed batch is not handed to a second dispatcher unless its claim is stale."""
+    _queue(3)
+    assert len(claim_batch(10)) == 3
+    assert claim_batch(10) == []
+    later = datetime.utcnow() + timedelta(seconds=app.config['EMAIL_OUTBOX_CLAIM_TIMEOUT'] + 1)
+    assert len(claim_batch(10, now=later)) == 3
+
+def test_trial_reminders_are_queued_in_one_transaction(app):
+    """Test that trial reminders are queued once per subscription and day."""
+    from app.models import Plan, UserSubscription
+    from app.email_utils import send_trial_reminder_emails
+
+    plan = Plan(name='Pro', slug='pro', price_cents=1999, billing_interval='month', currency='eur')
+    db.session.add(plan)
+    db.session.flush()
+    for name in ('cara', 'dan'):
+        user = make_user(name, first_name=name.title())
+        db.session.add(UserSubscription(user_id=user.id, plan_id=plan.id, status='trialing',
+                                        trial_ends_at=datetime.utcnow() + timedelta(days=7)))
+    db.session.commit()
+    assert send_trial_reminder_emails() == 2
+    assert send_trial_reminder_emails() == 0
+    keys = sorted(m.idempotency_key for m in EmailOutbox.query)
+    assert len(keys) == 2 and all(key.startswith('trial-reminder:') and key.endswith(':7') for key in keys)
+
+def test_trial_reminder_command_sends_before_exiting(app):
+    """Test that `flask send-trial-reminders` sends the reminders it queued instead of leaving them to a thread."""
+    from app.models import Plan, UserSubscription
+
+    app.config['MAIL_USERNAME'] = None                  # Log the emails instead of sending them
+    plan = Plan(name='Pro', slug='pro', price_cents=1999, billing_interval='month', currency='eur')
+    db.session.add(plan)
+    db.session.flush()
+    db.session.add(UserSubscription(user_id=make_user('eve', first_name='Eve').id, plan_id=plan.id, status='trialing',
+                                    trial_ends_at=datetime.utcnow() + timedelta(days=7)))
+    db.session.commit()
+    output = app.test_cli_runner().invoke(args=['send-trial-reminders']).output
+    assert 'Email outbox: 1 sent' in output
+    assert [m.status for m in EmailOutbox.query] == ['sent']
+
+def test_dispatcher_thread_runs_only_in_serving_processes(app, monkeypatch):
+    """Test that the dispatcher starts with serving processes, not on wake, in tests or in CLI commands."""
+    assert isinstance(app.extensions.get('email_dispatcher'), OutboxDispatcher)   # Enabled by default
+    dispatcher = OutboxDispatcher(app)
+    _queue(1)
+    dispatcher.wake()
+    assert not dispatcher.running
+    started = []
+    monkeypatch.setattr(QueueWorker, 'start', lambda worker: started.append(worker))
+
+    assert start_background_workers(app) == []          # Tests drain the outbox themselves
+    app.config['TESTING'] = False
+    monkeypatch.setenv('FLASK_RUN_FROM_CLI', 'true')
+    monkeypatch.setattr(sys, 'argv', ['flask', 'send-trial-reminders'])
+    assert start_background_workers(app) == []
+    monkeypatch.setattr(sys, 'argv', ['flask', 'run'])
+    assert dispatcher in start_background_workers(app)
+    monkeypatch.delenv('FLASK_RUN_FROM_CLI')
+    monkeypatch.setattr(sys, 'argv', ['gunicorn', 'app:app'])
+    assert dispatcher in start_background_workers(app)
+    assert started.count(dispatcher) == 2
+
+def test_started_dispatcher_sends_when_woken(app):
+    """Test that a running dispatcher thread sends mail committed after it started."""
+    import time
+
+    app.config['MAIL_USERNAME'] = None
+    app.config['EMAIL_OUTBOX_POLL_SECONDS'] = 60
+    dispatcher = OutboxDispatcher(app)
+    dispatcher.start()
+    try:
+        _queue(2)                                       # The commit wakes the dispatcher
+        deadline = time.monotonic() + 5
+        while EmailOutbox.query.filter_by(status='sent').count() < 2 and time.monotonic() < deadline:
+            db.session.rollback()
+            time.sleep(0.05)
+        assert EmailOutbox.query.filter_by(status='sent').count() == 2
+    finally:
+        dispatcher.stop()
+        dispatcher._thread.join(5)
+
+def test_dispatch_against_a_local_smtp_server(app):
+    """Test a real SMTP conversation against an aiosmtpd server on localhost."""
+    controller_module = pytest.importorskip('aiosmtpd.controller')
+    received = []
+
+    class Handler:
+        async def handle_DATA(self, server, session, envelope):
+            received.append((envelope.rcpt_tos, envelope.content))
+            return '250 OK'
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    controller = controller_module.Controller(Handler(), hostname='127.0.0.1', port=port)
+    controller.start()
+    try:
+        _queue(3)
+        connection = SMTPConnection('127.0.0.1', port, use_tls=False)
+        try:
+            assert dispatch_pending(connection=connection)['sent'] == 3
+        finally:
+            connection.close()
+    finally:
+        controller.stop()
+    assert [rcpt for rcpt, _ in received] == [[f'user{i}@example.com'] for i in range(3)]
@@ -0,0 +1,277 @@
+# tests/test_google_calendar_sync.py
+from datetime import datetime, timedelta
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import json
+import threading
+
+from app import db
+from app.models import Patient, Treatment
+from app.google_calendar_service import google_calendar_service
+from tests.conftest import login, make_user
+import pytest
+import uuid
+
+pytest.importorskip('googleapiclient')
+
+
+class FakeCalendar:
+    """In-memory primary calendar speaking the parts of the Calendar API the sync uses."""
+
+    def __init__(self):
+        self.events = {}
+        self.version = 0
+        self.expired_tokens = set()
+        self.requests = []
+
+    def put(self, event_id, **fields):
+        self.version += 1
+        event = self.events.setdefault(event_id, {'id': event_id, 'status': 'confirmed'})
+        event.update(fields, _version=self.version)
+        return event
+
+    def token(self):
+        return f'sync-{self.version}'
+
+    def list(self, query):
+        if 'syncToken' in query:
+            token = query['syncToken'][0]
+            if token in self.expired_tokens:
+                return 410, {'error': {'code': 410, 'message': 'Sync token is no longer valid'}}
+            since = int(token.split('-')[1])
+        else:
+            since = 0
+        changed = sorted((e for e in self.events.values() if e['_version'] > since), key=lambda e: e['_version'])
+        if 'timeMax' in query:
+            time_min, time_max = query['timeMin'][0], query['timeMax'][0]
+            changed = [e for e in changed if e['start']['dateTime'] < time_max and e['end']['dateTime'] > time_min]
+        offset = int(query.get('pageToken', ['0'])[0])
+        size = int(query['maxResults'][0])
+        page = {'items': [{k: v for k, v in e.items() if k != '_version'} for e in changed[offset:offset + size]]}
+        if offset + size < len(changed):
+            page['nextPageToken'] = str(offset + size)
+        else:
+            page['nextSyncToken'] = self.token()
+        return 200, page
+
+    def write(self, method, path, body):
+        if method == 'POST':
+            event_id = f'created{len(self.events)}'
+        else:
+            event_id = path.rsplit('/', 1)[1]
+            if event_id not in self.events:
+                return 404, {'error': {'code': 404, 'message': 'Not Found'}}
+        event = self.put(event_id, **body)
+        return 200, {'id': event_id, 'htmlLink': f'https://calendar.example/{event_id}', 'summary': event.get('summary')}
+
+
+def _handler(calendar):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, body, content_type='application/json'):
+            data = body if isinstance(body, bytes) else json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            calendar.requests.append(('GET', url.path))
+            self._reply(*calendar.list(parse_qs(url.query)))
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            calendar.requests.append(('POST', self.path))
+            if self.path != '/batch/calendar/v3':
+                return self._reply(404, {'error': {'code': 404}})
+            message = BytesParser(policy=HTTP).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+            parts = []
+            for part in message.iter_parts():
+                head, _, payload = part.get_payload(decode=True).decode().replace('\r\n', '\n').partition('\n\n')
+                method, target, _ = head.split('\n', 1)[0].split(' ')
+                status, result = calendar.write(method, urlsplit(target).path, json.loads(payload))
+                content_id = part['Content-ID'].replace('<', '<response-', 1)
+                parts.append(f"--reply\r\nContent-Type: application/http\r\nContent-ID: {content_id}\r\n\r\n"
+                             f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n\r\n{json.dumps(result)}\r\n")
+            self._reply(200, (''.join(parts) + '--reply--\r\n').encode(), 'multipart/mixed; boundary=reply')
+
+    return Handler
+
+
+@pytest.fixture
+def fake_calendar():
+    calendar = FakeCalendar()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _handler(calendar))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    calendar.root = f'http://127.0.0.1:{server.server_address[1]}/'
+    yield calendar
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(autouse=True)
+def calendar_api(app, fake_calendar):
+    """Point the Calendar client at the fake."""
+    app.config['GOOGLE_CALENDAR_API_ROOT'] = fake_calendar.root
+
+def _calendar_user(name):
+    return make_user(name, google_calendar_enabled=True, google_calendar_client_id='client-id',
+                     google_calendar_client_secret='client-secret', google_calendar_token='access-token',
+                     google_calendar_refresh_token=f'refresh-{uuid.uuid4().hex}')
+
+def _event(calendar, event_id, summary, days=1, **fields):
+    start = (datetime.utcnow() + timedelta(days=days)).replace(microsecond=0)
+    return calendar.put(event_id, summary=summary, start={'dateTime': start.isoformat() + 'Z'},
+                        end={'dateTime': (start + timedelta(hours=1)).isoformat() + 'Z'}, **fields)
+
+@pytest.fixture
+def practice(app):
+    """A connected physio with two patients."""
+    user = _calendar_user('physio')
+    for name, email in (('Ana Silva', 'ana@example.com'), ('Bruno Costa', None)):
+        db.session.add(Patient(name=name, email=email, user_id=user.id))
+    db.session.commit()
+    return user
+
+def _treatments(user):
+    return Treatment.query.join(Patient).filter(Patient.user_id == user.id).order_by(Treatment.id).all()
+
+def test_first_sync_pages_through_events_and_stores_the_sync_token(practice, fake_calendar):
+    """Test that a full sync follows every page, matches patients and keeps nextSyncToken."""
+    google_calendar_service.PAGE_SIZE = 2
+    try:
+        _event(fake_calendar, 'e1', 'Session', attendees=[{'email': 'ANA@example.com'}])
+        _event(fake_calendar, 'e2', 'Physio - Bruno Costa', days=2)
+        _event(fake_calendar, 'e3', 'Team lunch')
+        _event(fake_calendar, 'e4', 'Ana Silva', status='cancelled')
+        _event(fake_calendar, 'e5', 'Ana Silva follow-up', description='Knee')
+        result = google_calendar_service.sync_events_for_user(practice)
+    finally:
+        del google_calendar_service.PAGE_SIZE
+
+    assert result == {'new_treatments': 3, 'changed_events': 5}
+    assert [r for r in fake_calendar.requests if r[0] == 'GET'] == [('GET', '/calendar/v3/calendars/primary/events')] * 3
+    assert practice.google_calendar_sync_token == 'sync-5'
+    treatments = _treatments(practice)
+    assert [t.google_calendar_event_id for t in treatments] == ['e1', 'e2', 'e5']
+    assert treatments[2].assessment == 'Knee' and treatments[2].status == 'Scheduled'
+    assert treatments[0].created_at.tzinfo is None
+
+def test_incremental_sync_only_sees_changes_and_skips_known_events(practice, fake_calendar):
+    """Test that later syncs send the token, skip already linked events and survive an expired token."""
+    _event(fake_calendar, 'e1', 'Ana Silva')
+    assert google_calendar_service.sync_events_for_user(practice)['new_treatments'] == 1
+
+    _event(fake_calendar, 'e1', 'Ana Silva (moved)', days=3)
+    _event(fake_calendar, 'e2', 'Bruno Costa')
+    assert google_calendar_service.sync_events_for_user(practice) == {'new_treatments': 1, 'changed_events': 2}
+    assert practice.google_calendar_sync_token == 'sync-3'
+    assert google_calendar_service.sync_events_for_user(practice) == {'new_treatments': 0, 'changed_events': 0}
+
+    fake_calendar.expired_tokens.add('sync-3')
+    result = google_calendar_service.sync_events_for_user(practice)
+    assert result == {'new_treatments': 0, 'changed_events': 2}
+    assert len(_treatments(practice)) == 2
+
+def test_events_beyond_the_horizon_wait_until_they_come_closer(practice, fake_calendar):
+    """Test that events more than SYNC_DAYS_AHEAD days out create no treatment until a later sync reaches them."""
+    _event(fake_calendar, 'e1', 'Ana Silva', days=30)
+    _event(fake_calendar, 'e2', 'Ana Silva', days=120)
+    _event(fake_calendar, 'e3', 'Ana Silva', days=400)
+    assert google_calendar_service.sync_events_for_user(practice) == {'new_treatments': 1, 'changed_events': 3}
+
+    # 40 days later e2 is within the horizon; it has not changed, so only the window listing returns it
+    practice.google_calendar_last_sync -= timedelta(days=40)
+    db.session.commit()
+    for event in fake_calendar.events.values():
+        for edge in ('start', 'end'):
+            moved = datetime.fromisoformat(event[edge]['dateTime'][:-1]) - timedelta(days=40)
+            event[edge] = {'dateTime': moved.isoformat() + 'Z'}
+    assert google_calendar_service.sync_events_for_user(practice) == {'new_treatments': 1, 'changed_events': 0}
+    assert [t.google_calendar_event_id for t in _treatments(practice)] == ['e1', 'e2']
+    assert google_calendar_service.sync_events_for_user(practice)['new_treatments'] == 0
+
+def test_events_are_matched_again_after_patients_change(practice, fake_calendar):
+    """Test that an event that matched no patient creates a treatment once the patient is added."""
+    _event(fake_calendar, 'e1', 'Carla Dias', days=5)
+    assert google_calendar_service.sync_events_for_user(practice) == {'new_treatments': 0, 'changed_events': 1}
+    assert google_calendar_service.sync_events_for_user(practice)['new_treatments'] == 0
+
+    db.session.add(Patient(name='Carla Dias', user_id=practice.id))
+    db.session.commit()
+    assert google_calendar_service.sync_events_for_user(practice) == {'new_treatments': 1, 'changed_events': 0}
+    assert [t.google_calendar_event_id for t in _treatments(practice)] == ['e1']
+
+def test_pushes_go_through_the_batch_endpoint(practice, fake_calendar):
+    """Test that creates and updates are sent in batches of BATCH_LIMIT and event ids are stored."""
+    patient = Patient.query.filter_by(user_id=practice.id).first()
+    start = datetime.utcnow() + timedelta(days=1)
+    treatments = [Treatment(patient_id=patient.id, treatment_type='Follow-up', status='Scheduled',
+                            created_at=start + timedelta(hours=i)) for i in range(5)]
+    db.session.add_all(treatments)
+    db.session.commit()
+
+    google_calendar_service.BATCH_LIMIT = 2
+    try:
+        assert google_calendar_service.push_treatments(practice, treatments) == {'created': 5, 'updated': 0, 'failed': 0}
+        assert fake_calendar.requests == [('POST', '/batch/calendar/v3')] * 3
+        assert all(t.google_calendar_event_id for t in treatments)
+        assert {t.google_calendar_event_origin for t in treatments} == {'app'}
+        assert fake_calendar.events[treatments[0].google_calendar_event_id]['summary'] == 'Follow-up - Ana Silva'
+
+        treatments[0].treatment_type = 'Reassessment'
+        fake_calendar.requests.clear()
+        assert google_calendar_service.push_treatments(practice, treatments[:2]) == {'created': 0, 'updated': 2, 'failed': 0}
+        assert fake_calendar.requests == [('POST', '/batch/calendar/v3')]
+        assert fake_calendar.events[treatments[0].google_calendar_event_id]['summary'] == 'Reassessment - Ana Silva'
+    finally:
+        del google_calendar_service.BATCH_LIMIT
+
+    results = google_calendar_service.push_events(practice, inserts=[{'summary': 'New'}], updates={'missing': {'summary': 'x'}})
+    assert results[0]['success'] and results[0]['event_link'].endswith(results[0]['event_id'])
+    assert not results[1]['success']
+
+def test_push_treatments_route(app, practice, fake_calendar):
+    """Test that the endpoint pushes the scheduled treatments of the next SYNC_DAYS_AHEAD days, never synced ones."""
+    _event(fake_calendar, 'own', 'Ana Silva - own title', days=2)
+    google_calendar_service.sync_events_for_user(practice)
+    patient = Patient.query.filter_by(user_id=practice.id).first()
+    db.session.add_all([
+        Treatment(patient_id=patient.id, treatment_type='Follow-up', status='Scheduled',
+                  created_at=datetime.utcnow() + timedelta(days=1)),
+        Treatment(patient_id=patient.id, treatment_type='Follow-up', status='Completed',
+                  created_at=datetime.utcnow() - timedelta(days=1)),
+        Treatment(patient_id=patient.id, treatment_type='Follow-up', status='Scheduled',
+                  created_at=datetime.utcnow() + timedelta(days=200)),
+    ])
+    db.session.commit()
+    client = app.test_client()
+    login(client, practice.id)
+    data = client.post('/google-calendar/push-treatments').get_json()
+    assert data['success'] and data['created'] == 1 and data['updated'] == 0
+    data = client.post('/google-calendar/push-treatments').get_json()
+    assert data['created'] == 0 and data['updated'] == 1
+    assert fake_calendar.events['own']['summary'] == 'Ana Silva - own title'
+
+def test_calendar_client_is_reused_per_user(practice, app):
+    """Test that the service is built once per user and rebuilt after a reconnect."""
+    first = google_calendar_service.get_calendar_service(practice)
+    assert google_calendar_service.get_calendar_service(practice) is first
+    other = _calendar_user('other')
+    assert google_calendar_service.get_calendar_service(other) is not first
+
+    practice.google_calendar_refresh_token = 'reconnected'
+    assert google_calendar_service.get_calendar_service(practice) is not first
+
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(google_calendar_service._clients.__dict__.get('by_user')))
+    thread.start()
+    thread.join()
+    assert seen == [None]
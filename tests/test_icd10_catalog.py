@@ -0,0 +1,152 @@
+# tests/test_icd10_catalog.py
+from app import db
+from app.models import Patient
+from app.models_icd10 import ICD10Code, DiagnosisTemplate, PathologyGuide, PatientDiagnosis
+from app.icd10_catalog import CodeEntry, CodeTrie, catalog_cache, reference_catalog
+from app.query_monitor import capture_queries
+from tests.conftest import login, make_user
+from sqlalchemy import text
+import json
+import pytest
+
+CODES = [
+    ('M54.5', 'Low back pain', 'Low back pain', 'Musculoskeletal'),
+    ('M54.2', 'Cervicalgia', 'Neck pain', 'Musculoskeletal'),
+    ('M54.3', 'Sciatica', 'Sciatica', 'Musculoskeletal'),
+    ('M75.0', 'Adhesive capsulitis of shoulder', 'Frozen shoulder', 'Musculoskeletal'),
+    ('S93.4', 'Sprain of ankle', 'Ankle sprain', 'Injuries'),
+]
+
+@pytest.fixture(autouse=True)
+def catalog(app):
+    """Codes, templates and guides in the catalog, starting from an empty catalog cache."""
+    catalog_cache.clear()
+    codes = {code: ICD10Code(code=code, description=desc, short_description=short, category=category)
+             for code, desc, short, category in CODES}
+    db.session.add_all(codes.values())
+    db.session.add(ICD10Code(code='M99.9', description='Retired code', is_active=False))
+    db.session.flush()
+    shoulder = DiagnosisTemplate(name='Frozen Shoulder', primary_icd10_code_id=codes['M75.0'].id,
+                                 description='Stiff, painful shoulder', usage_count=7)
+    neck = DiagnosisTemplate(name='Neck pain', primary_icd10_code_id=codes['M54.2'].id, usage_count=3)
+    back = DiagnosisTemplate(name='Lumbar strain', primary_icd10_code_id=codes['M54.5'].id, usage_count=1)
+    db.session.add_all([shoulder, neck, back])
+    db.session.flush()
+    db.session.add_all([
+        PathologyGuide(name='Frozen Shoulder', diagnosis_template_id=shoulder.id, clinical_pearls='Pearls',
+                       faq_data=json.dumps([{'q': 'How long?', 'a': 'Months'}])),
+        PathologyGuide(name='Acute Lower Back Pain', diagnosis_template_id=back.id, red_flags='Flags'),
+    ])
+    db.session.commit()
+
+def _logged_in_client(app, role='physio'):
+    user = make_user(role, role=role)
+    db.session.commit()
+    client = app.test_client()
+    login(client, user.id)
+    return client, user
+
+def test_trie_returns_prefix_matches_in_code_order():
+    """Test that the trie finds codes by prefix, in order and up to a limit."""
+    entries = [CodeEntry(i, code, code, code, None, None, True, True)
+               for i, code in enumerate(['M54.5', 'M75.0', 'M54.2', 'm54.3', 'S93.4'])]
+    trie = CodeTrie(entries)
+    assert [e.code for e in trie.prefix('m54')] == ['M54.2', 'm54.3', 'M54.5']
+    assert [e.code for e in trie.prefix('M54', limit=2)] == ['M54.2', 'm54.3']
+    assert [e.code for e in trie.prefix('M75.0')] == ['M75.0']
+    assert trie.prefix('X') == [] and len(trie.prefix('')) == 5
+
+def test_catalog_resolves_categories_templates_and_guides(app):
+    """Test that categories, template order and code -> guide resolution match the old queries."""
+    catalog = reference_catalog()
+    assert catalog.categories == [{'name': 'Injuries', 'count': 1}, {'name': 'Musculoskeletal', 'count': 4}]
+    assert [t['name'] for t in catalog.template_payloads] == ['Frozen Shoulder', 'Neck pain', 'Lumbar strain']
+    assert 'M99.9' not in [e.code for e in catalog.trie.prefix('M')]
+    assert catalog.guide_by_code[catalog.code('M75.0').id] == (True, 'Frozen Shoulder')
+    # No guide for the template name, found through the short description alias
+    assert catalog.guide_by_code[catalog.code('m54.5').id] == (True, 'Acute Lower Back Pain')
+    assert catalog.guide_by_code[catalog.code('M54.2').id] == (False, 'Neck pain')
+    assert catalog.find_guide('Low back pain')['name'] == 'Acute Lower Back Pain'
+
+def test_cached_catalog_needs_no_queries(app):
+    """Test that the catalog is reused, checking the stamp once the interval is up."""
+    catalog = reference_catalog()
+    with capture_queries() as stats:
+        assert reference_catalog() is catalog
+    assert stats.count == 0
+    app.config['ICD10_CATALOG_CHECK_SECONDS'] = 0
+    with capture_queries() as stats:
+        assert reference_catalog() is catalog
+    assert stats.count == 1
+
+def test_catalog_refreshes_after_changes(app):
+    """Test that ORM commits and writes the ORM never saw both replace the catalog."""
+    catalog = reference_catalog()
+    db.session.add(ICD10Code(code='M54.6', description='Pain in thoracic spine', category='Musculoskeletal'))
+    db.session.commit()
+    assert [e.code for e in reference_catalog().trie.prefix('M54')] == ['M54.2', 'M54.3', 'M54.5', 'M54.6']
+    assert reference_catalog() is not catalog
+
+    # A seed script or another worker: only the stamp can tell
+    app.config['ICD10_CATALOG_CHECK_SECONDS'] = 0
+    db.session.execute(text(
+        "INSERT INTO icd10_codes (code, description, category, is_active, is_physiotherapy_relevant) "
+        "VALUES ('M54.9', 'Dorsalgia, unspecified', 'Musculoskeletal', 1, 1)"))
+    db.session.commit()
+    assert reference_catalog().code('M54.9') is not None
+
+def test_catalog_refreshes_after_in_place_edits_elsewhere(app):
+    """Test that codes and templates edited in place by another connection (a seed script) are picked up."""
+    from datetime import datetime, timedelta
+
+    catalog = reference_catalog()
+    assert catalog.code('M54.5').short_description == 'Low back pain'
+    app.config['ICD10_CATALOG_CHECK_SECONDS'] = 0
+    later = datetime.utcnow() + timedelta(seconds=1)
+    with db.engine.connect() as connection:
+        connection.execute(text("UPDATE icd10_codes SET short_description = 'Lumbago', updated_at = :now "
+                                "WHERE code = 'M54.5'"), {'now': later})
+        connection.commit()
+    catalog = reference_catalog()
+    assert catalog.code('M54.5').short_description == 'Lumbago'
+
+    with db.engine.connect() as connection:
+        connection.execute(text("UPDATE diagnosis_templates SET description = 'Painful, stiff shoulder', "
+                                "updated_at = :now WHERE name = 'Frozen Shoulder'"), {'now': later})
+        connection.commit()
+    assert reference_catalog() is not catalog
+
+def test_endpoints_serve_the_catalog(app):
+    """Test that the reference endpoints keep their response formats."""
+    client, user = _logged_in_client(app)
+    assert client.get('/api/icd10/categories').get_json()['categories'][0] == {'name': 'Injuries', 'count': 1}
+    templates = client.get('/api/icd10/templates').get_json()['templates']
+    assert templates[0] == {'id': templates[0]['id'], 'name': 'Frozen Shoulder',
+                            'description': 'Stiff, painful shoulder', 'icd10_code': 'M75.0',
+                            'icd10_description': 'Frozen shoulder', 'default_severity': 'moderate',
+                            'typical_duration_days': None, 'usage_count': 7}
+
+    guide = client.get('/api/pathology-guide/Low back pain').get_json()
+    assert guide['name'] == 'Acute Lower Back Pain' and guide['red_flags'] == 'Flags'
+    assert client.get('/api/pathology-guide/Unknown').status_code == 404
+
+    guides = client.get('/api/pathology-guides').get_json()
+    assert guides['total'] == 2
+    shoulder = next(g for g in guides['guides'] if g['name'] == 'Frozen Shoulder')
+    assert shoulder['faq_count'] == 1 and shoulder['has_clinical_pearls'] and not shoulder['has_red_flags']
+    stats = client.get(f"/api/pathology-guide/{shoulder['id']}/stats").get_json()
+    assert stats['template_name'] == 'Frozen Shoulder' and stats['template_usage_count'] == 7
+    assert client.get('/api/pathology-guide/9999/stats').status_code == 404
+    with_guides = client.get('/api/diagnosis-templates-with-guides').get_json()
+    assert with_guides['total'] == 3 and with_guides['with_guides'] == 2
+
+    patient = Patient(name='Catalog Patient', user_id=user.id)
+    db.session.add(patient)
+    db.session.flush()
+    for code in ('M54.5', 'M54.2'):
+        db.session.add(PatientDiagnosis(patient_id=patient.id, icd10_code_id=reference_catalog().code(code).id,
+                                        diagnosed_by_user_id=user.id))
+    db.session.commit()
+    diagnoses = client.get(f'/api/patient/{patient.id}/diagnoses').get_json()['diagnoses']
+    assert {(d['icd10_code'], d['has_pathology_guide'], d['template_name']) for d in diagnoses} == {
+        ('M54.5', True, 'Acute Lower Back Pain'), ('M54.2', False, 'Neck pain')}
@@ -0,0 +1,87 @@
+# tests/test_icd10_search.py
+from app import db
+from app.models_icd10 import ICD10Code, DiagnosisTemplate
+from app.icd10_search import search_codes, parse_query
+from tests.conftest import login, make_user
+import pytest
+
+CODES = [
+    ('M54.5', 'Low back pain', 'Low back pain', 'Musculoskeletal', 'Back pain'),
+    ('M54.2', 'Cervicalgia', 'Neck pain', 'Musculoskeletal', 'Neck disorders'),
+    ('M54.3', 'Sciatica', 'Sciatica', 'Musculoskeletal', 'Back pain'),
+    ('M54.4', 'Lumbago with sciatica', 'Lower back pain with sciatica', 'Musculoskeletal', 'Back pain'),
+    ('M75.0', 'Adhesive capsulitis of shoulder', 'Frozen shoulder', 'Musculoskeletal', 'Shoulder disorders'),
+    ('M75.3', 'Calcific tendinitis of shoulder', 'Calcific shoulder tendinitis', 'Musculoskeletal', 'Shoulder disorders'),
+    ('M76.5', 'Patellar tendinitis', 'Patellar tendinopathy', 'Musculoskeletal', 'Knee disorders'),
+    ('M17.9', 'Osteoarthritis of knee, unspecified', 'Knee osteoarthritis', 'Musculoskeletal', 'Degenerative joint'),
+    ('S93.4', 'Sprain of ankle', 'Ankle sprain', 'Injuries', 'Ankle'),
+    ('M25.5', 'Pain in joint', 'Joint pain', 'Musculoskeletal', 'Joint disorders'),
+]
+
+@pytest.fixture(autouse=True)
+def catalog(app):
+    """The reference codes the searches run against."""
+    db.session.add_all([
+        ICD10Code(code=code, description=desc, short_description=short, category=category, subcategory=sub)
+        for code, desc, short, category, sub in CODES
+    ])
+    db.session.add(ICD10Code(code='M99.9', description='Retired shoulder code', is_active=False))
+    db.session.commit()
+
+def _codes(query, **kwargs):
+    return [code.code for code in search_codes(query, **kwargs)]
+
+def test_words_match_as_prefixes(app):
+    """Test that partial words find codes and inactive codes are left out."""
+    assert set(_codes('tendin')) == {'M75.3', 'M76.5'}
+    assert _codes('shoulder calc') == ['M75.3']
+    assert 'M99.9' not in _codes('shoulder')
+    assert _codes('ankle', category='Musculoskeletal') == []
+
+def test_code_queries_rank_exact_and_prefix_matches_first(app):
+    """Test that an exact code comes first and a code prefix lists that block."""
+    assert _codes('M54.3')[0] == 'M54.3'
+    assert _codes('m54') == ['M54.2', 'M54.3', 'M54.4', 'M54.5']
+
+def test_synonyms_for_the_users_locale(app):
+    """Test that words in the user's language find the English descriptions."""
+    assert set(_codes('hombro', locale='es')) == {'M75.0', 'M75.3'}
+    assert _codes('hombro congelado', locale='es') == ['M75.0']
+    assert _codes('entorse cheville', locale='fr') == ['S93.4']
+    assert _codes('ginocchio', locale='it')[0] in {'M17.9', 'M76.5'}
+    assert parse_query('Rodílla', locale='es') == [{'words': ['rodilla'], 'phrases': [['knee']]}]
+
+def test_misspelt_words_are_corrected(app):
+    """Test that a typo still finds the code when nothing matches as typed."""
+    assert set(_codes('sciatca')) == {'M54.3', 'M54.4'}
+    assert _codes('osteoartritis') == ['M17.9']
+
+def test_frequently_used_codes_rank_higher(app):
+    """Test that template usage breaks ties between equally relevant codes."""
+    make_user('admin', role='admin')
+    joint = ICD10Code.query.filter_by(code='M25.5').one()
+    db.session.add(DiagnosisTemplate(name='Joint pain', primary_icd10_code_id=joint.id, usage_count=500,
+                                     created_by_user_id=None))
+    db.session.commit()
+    assert _codes('pain')[0] == 'M25.5'
+
+def test_index_follows_catalog_changes(app):
+    """Test that updated and deleted codes are searchable as they are now."""
+    code = ICD10Code.query.filter_by(code='S93.4').one()
+    code.description = 'Sprain of ankle ligament'
+    db.session.commit()
+    assert _codes('ligament') == ['S93.4']
+    db.session.delete(code)
+    db.session.commit()
+    assert _codes('ankle') == []
+
+def test_search_api_response_format(app):
+    """Test that the endpoint keeps its response shape."""
+    user = make_user('physio')
+    db.session.commit()
+    client = app.test_client()
+    login(client, user.id)
+    data = client.get('/api/icd10/search?q=frozen').get_json()
+    assert data['count'] == 1 and data['query'] == 'frozen'
+    assert set(data['codes'][0]) == {'id', 'code', 'description', 'short_description', 'category', 'subcategory'}
+    assert client.get('/api/icd10/search?q=f').get_json() == {'codes': [], 'message': 'Query too short'}
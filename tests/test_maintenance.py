@@ -0,0 +1,107 @@
+# tests/test_maintenance.py
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import Patient, Treatment, MaintenanceJobRun
+from app.maintenance import JOBS, run_job, due_jobs, MaintenanceScheduler
+from app.utils import mark_past_treatments_as_completed, mark_inactive_patients
+from app.query_monitor import capture_queries
+from tests.conftest import make_user
+import pytest
+
+@pytest.fixture
+def practice(app):
+    """Two physios' patients with treatments spread around today and the 60-day cutoff."""
+    now = datetime.now()
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    # Treatment ages in days per patient; None is an already inactive patient
+    ages = [None, [], [1], [59], [60], [61], [3, 90], [90, 200], [0]]
+    user_ids = []
+    for physio in (make_user('physio'), make_user('other')):
+        user_ids.append(physio.id)
+        for i, days in enumerate(ages):
+            patient = Patient(name=f'Patient {i}', user_id=physio.id, status='Inactive' if days is None else 'Active')
+            db.session.add(patient)
+            db.session.flush()
+            for age in (days if days is not None else [5]):
+                for status in ('Scheduled', 'Completed', 'Cancelled'):
+                    db.session.add(Treatment(patient_id=patient.id, treatment_type='Follow-up', status=status,
+                                             created_at=now - timedelta(days=age)))
+        # Just before and at midnight: only the first one is in the past
+        for when in (midnight - timedelta(seconds=1), midnight):
+            db.session.add(Treatment(patient_id=patient.id, treatment_type='Follow-up', status='Scheduled',
+                                     created_at=when))
+    db.session.commit()
+    return user_ids
+
+def _legacy_past_treatments(user_id=None):
+    """Ids the object-at-a-time mark_past_treatments_as_completed() completed."""
+    query = Treatment.query.filter(Treatment.created_at < datetime.now().date(), Treatment.status == 'Scheduled')
+    if user_id:
+        query = query.join(Patient).filter(Patient.user_id == user_id)
+    return {treatment.id for treatment in query.all()}
+
+def _legacy_inactive_patients(user_id=None):
+    """Ids the per-patient mark_inactive_patients() deactivated."""
+    two_months_ago = datetime.now().date() - timedelta(days=60)
+    query = Patient.query.filter_by(status='Active')
+    if user_id:
+        query = query.filter_by(user_id=user_id)
+    ids = set()
+    for patient in query.all():
+        latest = Treatment.query.filter_by(patient_id=patient.id).order_by(Treatment.created_at.desc()).first()
+        if not latest or latest.created_at.date() < two_months_ago:
+            ids.add(patient.id)
+    return ids
+
+def _ids(model, status):
+    return {row.id for row in model.query.filter_by(status=status)}
+
+@pytest.mark.parametrize('scoped', [False, True])
+def test_jobs_match_the_legacy_functions(app, practice, scoped):
+    """Test that the set-based jobs change exactly the rows the old loops changed."""
+    user_id = practice[0] if scoped else None
+    expected_treatments = _legacy_past_treatments(user_id)
+    expected_patients = _legacy_inactive_patients(user_id)
+    before_treatments, before_patients = _ids(Treatment, 'Completed'), _ids(Patient, 'Inactive')
+    assert expected_treatments and expected_patients
+
+    assert mark_past_treatments_as_completed(user_id) == len(expected_treatments)
+    assert mark_inactive_patients(user_id) == len(expected_patients)
+    assert _ids(Treatment, 'Completed') == before_treatments | expected_treatments
+    assert _ids(Patient, 'Inactive') == before_patients | expected_patients
+    assert mark_past_treatments_as_completed(user_id) == 0 and mark_inactive_patients(user_id) == 0
+
+def test_jobs_run_in_chunks_with_one_update_each(app, practice):
+    """Test that a job issues one UPDATE per primary-key range, not one per row."""
+    expected = len(_legacy_past_treatments())
+    with capture_queries() as stats:
+        rows, chunks = JOBS['complete-past-treatments'].run(chunk_size=10)
+    assert rows == expected and chunks > 1
+    updates = [f for f in stats.fingerprints if f.lstrip().upper().startswith('UPDATE')]
+    assert len(updates) == 1 and stats.fingerprints[updates[0]] == chunks
+
+def test_runs_are_recorded_and_scheduled(app, practice):
+    """Test that runs land in maintenance_job_run and are not due again until their interval passes."""
+    assert set(due_jobs()) == set(JOBS)
+    expected = len(_legacy_inactive_patients())
+    run = run_job('mark-inactive-patients', chunk_size=4)
+    assert run.status == 'succeeded' and run.rows_affected == expected and run.chunks > 1
+    assert run.duration_ms is not None and run.finished_at >= run.started_at
+    assert due_jobs() == ['complete-past-treatments']
+    assert set(due_jobs(now=datetime.utcnow() + timedelta(days=2))) == set(JOBS)
+
+    assert MaintenanceScheduler(app).tick() == ['complete-past-treatments']
+    assert MaintenanceJobRun.query.count() == 2
+
+def test_maintenance_cli(app, practice):
+    """Test that `flask maintenance` still runs everything and the subcommands report runs."""
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['maintenance', 'run', 'complete-past-treatments'])
+    assert result.exit_code == 0 and 'complete-past-treatments:' in result.output
+    assert 'No jobs due' not in runner.invoke(args=['maintenance', 'run', '--due']).output
+    assert 'No jobs due' in runner.invoke(args=['maintenance', 'run', '--due']).output
+    assert runner.invoke(args=['maintenance', 'run', 'nope']).exit_code != 0
+    assert 'last run' in runner.invoke(args=['maintenance', 'status']).output
+    result = runner.invoke(args=['maintenance'])
+    assert 'Maintenance complete: 0 treatments updated, 0 patients marked inactive.' in result.output
@@ -0,0 +1,156 @@
+# tests/test_metrics.py
+from app import db
+from app.email_outbox import enqueue_email
+from app.metrics import MetricsRegistry, registry, track_external, record_cache, cache_hit_ratios, metrics_summary
+from tests.conftest import login, make_user
+import json
+import os
+import pytest
+
+def test_exposition_format():
+    """Test that counters, gauges and histograms render in Prometheus text format."""
+    reg = MetricsRegistry()
+    requests_total = reg.counter('requests_total', 'Requests', ('endpoint',))
+    latency = reg.histogram('latency_seconds', 'Latency', ('endpoint',), buckets=(0.1, 1.0))
+    queue = reg.gauge('queue_depth', 'Queue depth')
+
+    requests_total.inc(endpoint='main.index')
+    requests_total.inc(2, endpoint='main.index')
+    latency.observe(0.05, endpoint='main.index')
+    latency.observe(0.5, endpoint='main.index')
+    latency.observe(3, endpoint='main.index')
+    queue.set(4)
+
+    text = reg.expose()
+    assert '# TYPE requests_total counter' in text
+    assert 'requests_total{endpoint="main.index"} 3' in text
+    assert 'latency_seconds_bucket{endpoint="main.index",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{endpoint="main.index",le="1"} 2' in text
+    assert 'latency_seconds_bucket{endpoint="main.index",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{endpoint="main.index"} 3' in text
+    assert 'latency_seconds_sum{endpoint="main.index"} 3.55' in text
+    assert 'queue_depth 4' in text
+
+def test_labels_are_validated():
+    """Test that metrics reject missing or unknown labels."""
+    reg = MetricsRegistry()
+    counter = reg.counter('c_total', 'C', ('service',))
+    with pytest.raises(ValueError):
+        counter.inc()
+    with pytest.raises(ValueError):
+        counter.inc(service='stripe', outcome='ok')
+
+def test_multiprocess_aggregation(tmp_path):
+    """Test that values from other worker processes are merged from METRICS_DIR."""
+    directory = str(tmp_path)
+    reg = MetricsRegistry(directory=directory)
+    counter = reg.counter('jobs_total', 'Jobs')
+    gauge = reg.gauge('in_progress', 'In progress')
+    counter.inc(2)
+    gauge.set(1)
+
+    # An exited worker: its counters still count, its gauges do not
+    dead_pid = 2 ** 22 + 12345
+    with open(os.path.join(directory, f'metrics_{dead_pid}.json'), 'w') as f:
+        json.dump({'pid': dead_pid, 'metrics': {
+            'jobs_total': {'type': 'counter', 'values': {'[]': 5}},
+            'in_progress': {'type': 'gauge', 'values': {'[]': 3}},
+        }}, f)
+
+    merged = reg.collect()
+    assert merged['jobs_total'][()] == 7
+    assert merged['in_progress'][()] == 1
+
+    assert reg.flush(force=True)
+    assert os.path.exists(os.path.join(directory, f'metrics_{os.getpid()}.json'))
+
+def test_function_gauges_are_read_when_collected(tmp_path):
+    """Test that a gauge with a function is read at collection, not flushed or summed across processes."""
+    reg = MetricsRegistry(directory=str(tmp_path))
+    depth = reg.gauge('queue_depth', 'Queue depth', ('queue',))
+    depths = {('email',): 3}
+    depth.set_function(lambda: depths)
+    assert reg.collect()['queue_depth'] == {('email',): 3.0}
+    reg.flush(force=True)
+    reg.flush(force=True)
+    depths[('email',)] = 1
+    assert 'queue_depth{queue="email"} 1' in reg.expose()
+
+    depth.set_function(lambda: 1 / 0)
+    assert reg.collect()['queue_depth'] == {}
+
+def test_track_external_records_errors():
+    """Test that external calls are timed and failures counted."""
+    before = registry.collect()['external_api_requests_total'].get(('test-service', 'error'), 0)
+    with pytest.raises(RuntimeError):
+        with track_external('test-service'):
+            raise RuntimeError('timeout')
+    with track_external('test-service'):
+        pass
+    merged = registry.collect()
+    assert merged['external_api_requests_total'][('test-service', 'error')] == before + 1
+    assert merged['external_api_requests_total'][('test-service', 'ok')] >= 1
+
+def test_cache_hit_ratio():
+    """Test that cache lookups produce a hit ratio."""
+    record_cache('test-cache', True)
+    record_cache('test-cache', True)
+    record_cache('test-cache', False)
+    ratios = cache_hit_ratios()
+    assert ratios['test-cache']['hits'] >= 2
+    assert 0 < ratios['test-cache']['ratio'] < 1
+
+def _admin_client(app):
+    admin = make_user('admin', is_admin=True)
+    db.session.commit()
+    client = app.test_client()
+    login(client, admin.id)
+    return client
+
+def test_metrics_endpoint_counts_requests(app):
+    """Test that /metrics exposes request counts and latency per endpoint to admins."""
+    app.config['METRICS_TOKEN'] = None
+    client = _admin_client(app)
+    client.get('/health')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    body = response.get_data(as_text=True)
+    assert 'http_requests_total{endpoint="main.health_check",method="GET",status="200"}' in body
+    assert 'http_request_duration_seconds_bucket{endpoint="main.health_check"' in body
+    assert 'db_queries_total{endpoint="main.health_check"}' in body
+    assert 'job_queue_depth{queue="email_outbox"} 0' in body
+
+def test_queue_depth_counts_unfinished_jobs(app):
+    """Test that job_queue_depth reports the rows waiting in each queue table."""
+    app.config['METRICS_TOKEN'] = None
+    enqueue_email('ana@example.com', 'Hello', '<p>Hello</p>')
+    enqueue_email('ben@example.com', 'Hello', '<p>Hello</p>')
+    db.session.commit()
+    body = _admin_client(app).get('/metrics').get_data(as_text=True)
+    assert 'job_queue_depth{queue="email_outbox"} 2' in body
+    assert 'job_queue_depth{queue="calendly_inbox"} 0' in body
+    assert metrics_summary()['queues'] == {'email_outbox': 2, 'calendly_inbox': 0}
+
+def test_metrics_endpoint_is_hidden_without_a_token(app):
+    """Test that /metrics is not served anonymously when no METRICS_TOKEN is configured."""
+    app.config['METRICS_TOKEN'] = None
+    assert app.test_client().get('/metrics').status_code == 404
+
+def test_metrics_endpoint_token(app):
+    """Test that METRICS_TOKEN protects the endpoint."""
+    app.config['METRICS_TOKEN'] = 'scrape-secret'
+    client = app.test_client()
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'}).status_code == 200
+
+def test_monitoring_page_shows_metrics(app):
+    """Test that the admin monitoring page renders the metrics summary."""
+    client = _admin_client(app)
+    client.get('/health')
+    response = client.get('/monitoring')
+    assert response.status_code == 200
+    assert b'Endpoint Latency' in response.data
+    assert b'main.health_check' in response.data
+    assert b'Database Engine' in response.data
@@ -0,0 +1,92 @@
+# tests/test_pathology_guides.py
+from app import db
+from app.models_icd10 import ICD10Code, DiagnosisTemplate, PathologyGuide
+from app.icd10_catalog import catalog_cache
+from app.pathology_guides import payload_cache
+from app.query_monitor import capture_queries
+from tests.conftest import login, make_user
+import json
+import pytest
+
+@pytest.fixture(autouse=True)
+def catalog(app):
+    """Two coded templates with guides, starting from empty caches."""
+    catalog_cache.clear()
+    payload_cache.clear()
+    back = ICD10Code(code='M54.5', description='Low back pain', short_description='Low back pain')
+    shoulder = ICD10Code(code='M75.0', description='Adhesive capsulitis of shoulder',
+                         short_description='Frozen shoulder')
+    db.session.add_all([back, shoulder])
+    db.session.flush()
+    strain = DiagnosisTemplate(name='Lumbar strain', primary_icd10_code_id=back.id,
+                               description='Strained lower back', typical_duration_days=42)
+    frozen = DiagnosisTemplate(name='Frozen Shoulder', primary_icd10_code_id=shoulder.id)
+    db.session.add_all([strain, frozen])
+    db.session.flush()
+    db.session.add_all([
+        PathologyGuide(name='Acute Lower Back Pain', diagnosis_template_id=strain.id, red_flags='Numbness',
+                       faq_data=json.dumps([{'q': 'Bed rest?', 'a': 'No'}])),
+        PathologyGuide(name='Frozen Shoulder', diagnosis_template_id=frozen.id, clinical_pearls='Pearls'),
+    ])
+    db.session.commit()
+
+@pytest.fixture
+def client(app):
+    user = make_user('physio')
+    db.session.commit()
+    client = app.test_client()
+    login(client, user.id)
+    return client
+
+def test_guide_resolves_by_name_template_and_alias(client):
+    """Test that guide, template and alias names all return the same payload."""
+    by_name = client.get('/api/pathology-guide/Acute Lower Back Pain')
+    data = by_name.get_json()
+    assert data['red_flags'] == 'Numbness' and data['faq_list'] == [{'q': 'Bed rest?', 'a': 'No'}]
+    assert data['description'] == 'Strained lower back' and data['typical_duration_days'] == 42
+    assert data['stats']['faq_count'] == 1 and data['stats']['has_red_flags']
+    for name in ('Lumbar strain', 'Low back pain'):
+        response = client.get(f'/api/pathology-guide/{name}')
+        assert response.data == by_name.data and response.headers['ETag'] == by_name.headers['ETag']
+    assert client.get('/api/pathology-guide/Whiplash').status_code == 404
+
+def test_guide_is_cacheable(client):
+    """Test that a guide carries a strong ETag and is served once serialized."""
+    response = client.get('/api/pathology-guide/Frozen Shoulder')
+    etag = response.headers['ETag']
+    assert not etag.startswith('W/')
+    assert 'private' in response.headers['Cache-Control'] and 'max-age=300' in response.headers['Cache-Control']
+
+    revalidated = client.get('/api/pathology-guide/Frozen Shoulder', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304 and revalidated.data == b''
+
+    with capture_queries() as stats:
+        client.get('/api/pathology-guide/Frozen Shoulder')
+    assert 'pathology_guides' not in ' '.join(stats.fingerprints)
+
+def test_edits_change_the_payload(client):
+    """Test that editing a guide or its template replaces the payload and its ETag."""
+    etag = client.get('/api/pathology-guide/Frozen Shoulder').headers['ETag']
+    guide = PathologyGuide.query.filter_by(name='Frozen Shoulder').one()
+    guide.clinical_pearls = 'New pearls'
+    db.session.commit()
+    response = client.get('/api/pathology-guide/Frozen Shoulder', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.get_json()['clinical_pearls'] == 'New pearls'
+
+    etag = response.headers['ETag']
+    guide.diagnosis_template.description = 'Stiff shoulder'
+    db.session.commit()
+    response = client.get('/api/pathology-guide/Frozen Shoulder')
+    assert response.headers['ETag'] != etag and response.get_json()['description'] == 'Stiff shoulder'
+
+def test_bundle_holds_every_guide_and_alias(client):
+    """Test that the bulk endpoint returns all payloads and the alias map in one response."""
+    response = client.get('/api/pathology-guides/bundle')
+    bundle = response.get_json()
+    single = client.get('/api/pathology-guide/Frozen Shoulder').get_json()
+    assert [guide['name'] for guide in bundle['guides']] == ['Acute Lower Back Pain', 'Frozen Shoulder']
+    assert bundle['guides'][1] == single
+    back_id = bundle['guides'][0]['id']
+    assert bundle['aliases']['Low back pain'] == bundle['aliases']['Lumbar strain'] == back_id
+    assert client.get('/api/pathology-guides/bundle',
+                      headers={'If-None-Match': response.headers['ETag']}).status_code == 304
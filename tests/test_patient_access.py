@@ -0,0 +1,92 @@
+# tests/test_patient_access.py
+from app import db
+from app.models import User, Patient, Clinic, ClinicMembership
+from app.patient_access import can_access_patient, accessible_patient_ids_query
+from app.query_monitor import capture_queries
+from tests.conftest import login, make_user
+import pytest
+
+@pytest.fixture
+def practice(app):
+    """Two clinic members (only one may manage patients), a solo physio, an admin and an ex-member."""
+    clinic = Clinic(name='Clinic')
+    db.session.add(clinic)
+    db.session.flush()
+    users = {
+        'manager': make_user('manager'), 'assistant': make_user('assistant'), 'solo': make_user('solo'),
+        'admin': make_user('admin', role='admin', is_admin=True), 'former': make_user('former'),
+    }
+    db.session.add_all([
+        ClinicMembership(user_id=users['manager'].id, clinic_id=clinic.id, can_manage_patients=True),
+        ClinicMembership(user_id=users['assistant'].id, clinic_id=clinic.id, can_manage_patients=False),
+        ClinicMembership(user_id=users['former'].id, clinic_id=clinic.id, is_active=False),
+    ])
+    patients = {}
+    for name, user in users.items():
+        patient = Patient(name=f'Patient of {name}', user_id=user.id)
+        db.session.add(patient)
+        db.session.flush()
+        patients[name] = patient.id
+    db.session.commit()
+    return {name: user.id for name, user in users.items()}, patients
+
+@pytest.mark.parametrize('include_clinic_patients', [False, True])
+def test_matches_get_accessible_patients(app, practice, include_clinic_patients):
+    """Test that every user/patient answer agrees with User.get_accessible_patients()."""
+    users, patients = practice
+    for user_id in users.values():
+        user = db.session.get(User, user_id)
+        expected = {p.id for p in user.get_accessible_patients(include_clinic_patients=include_clinic_patients)}
+        ids = set(db.session.scalars(accessible_patient_ids_query(user, include_clinic_patients)))
+        assert ids == expected
+        for patient_id in patients.values():
+            assert can_access_patient(user, patient_id, include_clinic_patients) == (patient_id in expected)
+
+def test_access_rules(app, practice):
+    """Test own-patient, clinic, admin and inactive-membership rules."""
+    users, patients = practice
+    manager, assistant, admin, former = (db.session.get(User, users[name])
+                                         for name in ('manager', 'assistant', 'admin', 'former'))
+    assert can_access_patient(manager, patients['manager'])
+    assert not can_access_patient(manager, patients['assistant'])
+    assert can_access_patient(manager, patients['assistant'], include_clinic_patients=True)
+    assert not can_access_patient(manager, patients['former'], include_clinic_patients=True)
+    assert not can_access_patient(manager, patients['solo'], include_clinic_patients=True)
+    assert not can_access_patient(assistant, patients['manager'], include_clinic_patients=True)
+    assert not can_access_patient(former, patients['manager'], include_clinic_patients=True)
+    assert not can_access_patient(admin, patients['solo'])  # No admin bypass
+    assert not can_access_patient(manager, 999999)
+
+def test_check_is_one_query_memoized_per_request(app, practice):
+    """Test that a check costs one query and repeats within a request are free."""
+    users, patients = practice
+    user = db.session.get(User, users['solo'])
+    with app.test_request_context():
+        with capture_queries() as stats:
+            for _ in range(3):
+                assert can_access_patient(user, patients['solo'])
+        assert stats.count == 1
+    with app.test_request_context():
+        with capture_queries() as stats:
+            assert can_access_patient(user, patients['solo'])
+        assert stats.count == 1
+
+def test_decorator_guards_api_routes(app, practice):
+    """Test that patient API routes answer 403 for another practitioner's patient."""
+    users, patients = practice
+    client = app.test_client()
+    login(client, users['solo'])
+    response = client.get(f"/api/patient/{patients['solo']}/diagnoses")
+    assert response.status_code == 200
+    response = client.get(f"/api/patient/{patients['manager']}/diagnoses")
+    assert response.status_code == 403
+    assert response.get_json() == {'error': 'Access denied'}
+
+def test_patient_detail_redirects_for_other_patients(app, practice):
+    """Test that a physio is sent back to the patient list for someone else's patient."""
+    users, patients = practice
+    client = app.test_client()
+    login(client, users['solo'])
+    response = client.get(f"/patient/{patients['manager']}", follow_redirects=False)
+    assert response.status_code == 302
+    assert '/patients' in response.headers['Location']
@@ -0,0 +1,216 @@
+# tests/test_patient_directory.py
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import User, Patient, Treatment
+from app.patient_directory import (directory_page, encode_cursor, decode_cursor,
+                                   cached_directory, patient_names, directory_cache)
+from app.query_monitor import capture_queries
+from tests.conftest import login, make_user
+from sqlalchemy import text
+import pytest
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    """Start each test with an empty directory cache."""
+    directory_cache.clear()
+
+@pytest.fixture
+def physio_id(app):
+    """A practitioner with 25 patients; every fifth one matches 'lumbar'."""
+    user = make_user('physio')
+    for i in range(25):
+        patient = Patient(name=f'Patient {i:02d}', user_id=user.id,
+                          status='Active' if i % 2 == 0 else 'Inactive',
+                          diagnosis='Lumbar pain' if i % 5 == 0 else 'Neck pain',
+                          anamnesis='x' * 1000)
+        db.session.add(patient)
+        db.session.flush()
+        for day in range(i % 3):
+            db.session.add(Treatment(patient_id=patient.id, treatment_type='Follow-up', status='Completed',
+                                     created_at=datetime(2025, 1, 1) + timedelta(days=day)))
+        db.session.add(Treatment(patient_id=patient.id, treatment_type='Follow-up', status='Scheduled',
+                                 created_at=datetime(2025, 6, 1)))
+    other = make_user('other')
+    db.session.add(Patient(name='Not mine', user_id=other.id))
+    db.session.commit()
+    return user.id
+
+def test_cursor_round_trip():
+    """Test that cursors are opaque and malformed ones are rejected."""
+    assert decode_cursor(encode_cursor('maria santos', 1234)) == ('maria santos', 1234)
+    with pytest.raises(ValueError):
+        decode_cursor('not-a-cursor')
+
+def test_pages_cover_every_patient_once(app, physio_id):
+    """Test that following next_cursor walks all patients in name order without repeats."""
+    user = db.session.get(User, physio_id)
+    seen, cursor = [], None
+    while True:
+        page = directory_page(user, cursor=cursor, limit=10)
+        seen.extend(p['name'] for p in page['patients'])
+        if not page['has_more']:
+            break
+        cursor = page['next_cursor']
+    assert seen == [f'Patient {i:02d}' for i in range(25)]
+
+def test_pages_follow_names_not_ids(app, physio_id):
+    """Test that a new patient is listed under its name and cursors survive inserts before them."""
+    user = db.session.get(User, physio_id)
+    first = directory_page(user, limit=3)
+    db.session.add_all([Patient(name='Aaron First', user_id=physio_id), Patient(name='patient 01b', user_id=physio_id)])
+    db.session.commit()
+    assert [p['name'] for p in directory_page(user, limit=2)['patients']] == ['Aaron First', 'Patient 00']
+    second = directory_page(user, cursor=first['next_cursor'], limit=3)
+    assert [p['name'] for p in second['patients']] == ['Patient 03', 'Patient 04', 'Patient 05']
+    assert [p['name'] for p in first['patients']] == ['Patient 00', 'Patient 01', 'Patient 02']
+
+def test_page_uses_constant_queries_and_defers_heavy_columns(app, physio_id):
+    """Test that a page from the warm directory costs two queries and does not load large Text columns."""
+    user = db.session.get(User, physio_id)
+    directory_page(user, limit=20)
+    db.session.expire_all()
+    user.id  # Reload the user outside the measured block
+    with capture_queries() as stats:
+        page = directory_page(user, limit=20)
+    assert stats.count == 2  # The directory stamp and the visit stats
+    assert len(page['patients']) == 20
+    statements = ' '.join(stats.fingerprints)
+    for column in ('anamnesis', 'treatment_plan', 'ai_clinical_notes', 'patient.notes'):
+        assert column not in statements
+
+def test_visit_stats(app, physio_id):
+    """Test that last visit and visit count only consider completed treatments."""
+    user = db.session.get(User, physio_id)
+    rows = {p['name']: p for p in directory_page(user, limit=100)['patients']}
+    assert rows['Patient 02']['visit_count'] == 2
+    assert rows['Patient 02']['last_visit'] == '2025-01-02'
+    assert rows['Patient 00']['visit_count'] == 0
+    assert rows['Patient 00']['last_visit'] is None
+
+def test_search_and_status_filter(app, physio_id):
+    """Test that search matches decrypted fields and combines with the status filter."""
+    user = db.session.get(User, physio_id)
+    found = directory_page(user, search='lumbar', limit=100)['patients']
+    assert sorted(p['name'] for p in found) == ['Patient 00', 'Patient 05', 'Patient 10', 'Patient 15', 'Patient 20']
+    active = directory_page(user, search='lumbar', status='Active', limit=100)['patients']
+    assert sorted(p['name'] for p in active) == ['Patient 00', 'Patient 10', 'Patient 20']
+    assert [p['name'] for p in directory_page(user, search='patient 07')['patients']] == ['Patient 07']
+
+def test_api_directory(app, physio_id):
+    """Test that /api/patients pages through the current user's patients only."""
+    client = app.test_client()
+    login(client, physio_id)
+    first = client.get('/api/patients?limit=20').get_json()
+    assert len(first['patients']) == 20 and first['has_more']
+    second = client.get(f"/api/patients?limit=20&cursor={first['next_cursor']}").get_json()
+    assert len(second['patients']) == 5 and not second['has_more']
+    names = {p['name'] for p in first['patients'] + second['patients']}
+    assert 'Not mine' not in names
+    assert client.get('/api/patients?cursor=garbage').status_code == 400
+
+def test_patients_list_renders_first_page(app, physio_id):
+    """Test that the patient list renders the first page with its infinite-scroll cursor."""
+    client = app.test_client()
+    login(client, physio_id)
+    response = client.get('/patients')
+    assert response.status_code == 200
+    assert b'Patient 24' in response.data and b'Patient 00' in response.data
+    assert b'data-next-cursor=""' in response.data
+
+    response = client.get('/patients?status=Active&search=lumbar')
+    assert b'Patient 10' in response.data and b'Patient 05' not in response.data
+
+def test_cached_directory_is_sorted_and_filtered(app, physio_id):
+    """Test that the cached directory holds decrypted names sorted by name."""
+    user = db.session.get(User, physio_id)
+    entries = cached_directory(user)
+    assert [e.name for e in entries] == sorted(e.name for e in entries)
+    assert len(entries) == 25
+    assert {e.status for e in cached_directory(user, status='Active')} == {'Active'}
+    assert patient_names(user)[entries[0].id] == entries[0].name
+
+def test_cached_directory_hit_costs_one_query(app, physio_id):
+    """Test that a warm directory is served without rebuilding it."""
+    user = db.session.get(User, physio_id)
+    cached_directory(user)
+    with capture_queries() as stats:
+        cached_directory(user)
+    assert stats.count == 1  # The freshness stamp
+
+    app.config['PATIENT_DIRECTORY_CACHE_CHECK_DB'] = False
+    cached_directory(user)
+    with capture_queries() as stats:
+        cached_directory(user)
+    assert stats.count == 0
+
+def test_orm_changes_invalidate_the_directory(app, physio_id):
+    """Test that inserts, renames and deletes show up after commit."""
+    app.config['PATIENT_DIRECTORY_CACHE_CHECK_DB'] = False  # Only the version counter
+    user = db.session.get(User, physio_id)
+    assert len(cached_directory(user)) == 25
+
+    patient = Patient(name='Aaron New', user_id=physio_id)
+    db.session.add(patient)
+    db.session.commit()
+    assert cached_directory(user)[0].name == 'Aaron New'
+
+    patient.name = 'Zoe Renamed'
+    db.session.commit()
+    assert cached_directory(user)[-1].name == 'Zoe Renamed'
+
+    db.session.delete(patient)
+    db.session.commit()
+    assert len(cached_directory(user)) == 25
+
+    Patient.query.filter_by(user_id=physio_id).update({'status': 'Inactive'})
+    db.session.commit()
+    assert not cached_directory(user, status='Active')
+
+def test_rollback_keeps_the_directory(app, physio_id):
+    """Test that a rolled back change does not invalidate the directory."""
+    app.config['PATIENT_DIRECTORY_CACHE_CHECK_DB'] = False
+    user = db.session.get(User, physio_id)
+    cached_directory(user)
+    db.session.add(Patient(name='Never saved', user_id=physio_id))
+    db.session.flush()
+    db.session.rollback()
+    user = db.session.get(User, physio_id)
+    with capture_queries() as stats:
+        assert 'Never saved' not in [e.name for e in cached_directory(user)]
+    assert stats.count == 0
+
+def test_changes_from_other_processes_are_detected(app, physio_id):
+    """Test that the database stamp catches writes that bypass this process's events."""
+    user = db.session.get(User, physio_id)
+    before = cached_directory(user)
+    with db.engine.begin() as conn:
+        conn.execute(text("UPDATE patient SET status = 'Completed', updated_at = :now WHERE id = :id"),
+                      {'now': datetime.utcnow() + timedelta(minutes=1), 'id': before[0].id})
+    assert cached_directory(user)[0].status == 'Completed'
+
+def test_lru_respects_memory_budget(app, physio_id):
+    """Test that directories beyond the memory budget are evicted."""
+    user = db.session.get(User, physio_id)
+    app.config['PATIENT_DIRECTORY_CACHE_MAX_BYTES'] = 1024
+    cached_directory(user)
+    assert directory_cache.stats()['directories'] == 0
+    app.config['PATIENT_DIRECTORY_CACHE_MAX_BYTES'] = 1024 * 1024
+    cached_directory(user)
+    stats = directory_cache.stats()
+    assert stats['directories'] == 1 and stats['patients'] == 25 and 0 < stats['bytes'] <= 1024 * 1024
+
+def test_directory_decrypts_encrypted_names(app, monkeypatch):
+    """Test that names and emails are decrypted in bulk when encryption is on."""
+    from cryptography.fernet import Fernet
+    monkeypatch.setenv('FERNET_SECRET_KEY', Fernet.generate_key().decode())
+    monkeypatch.setitem(app.config, 'DISABLE_ENCRYPTION', False)
+    user = make_user('enc')
+    for name in ('Lucía Pérez', 'Ana García'):
+        db.session.add(Patient(name=name, email=f'{name[:3]}@example.com', user_id=user.id))
+    db.session.commit()
+    assert db.session.execute(text('SELECT name FROM patient')).scalars().first() != 'Lucía Pérez'
+
+    entries = cached_directory(user)
+    assert [(e.name, e.email) for e in entries] == [('Ana García', 'Ana@example.com'),
+                                                     ('Lucía Pérez', 'Luc@example.com')]
@@ -0,0 +1,127 @@
+# tests/test_patient_timeline.py
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import Patient, Treatment, TriggerPoint, Location
+from app.patient_timeline import timeline_page, provider_names, encode_cursor, decode_cursor
+from app.query_monitor import capture_queries
+from tests.conftest import login, make_user
+import pytest
+
+NOW = datetime(2025, 6, 15, 12, 0)
+
+@pytest.fixture
+def physio(app):
+    user = make_user('ana', username='ana', first_name='Ana', last_name='Ruiz')
+    db.session.commit()
+    return user
+
+def _patient_with_history(physio, visits):
+    """A patient with one treatment per day before NOW, two trigger points each, plus two upcoming."""
+    patient = Patient(name='Long term', user_id=physio.id)
+    location = Location(name='Clinic', user_id=physio.id)
+    db.session.add_all([patient, location])
+    db.session.flush()
+    for day in range(visits):
+        treatment = Treatment(patient_id=patient.id, treatment_type='Follow-up',
+                              status='Completed' if day % 4 else 'Scheduled',
+                              provider=physio.email if day % 2 else 'ana',
+                              location_id=location.id, created_at=NOW - timedelta(days=day + 1))
+        db.session.add(treatment)
+        db.session.flush()
+        for i in range(2):
+            db.session.add(TriggerPoint(treatment_id=treatment.id, location_x=i, location_y=i))
+    for day in (1, 2):
+        db.session.add(Treatment(patient_id=patient.id, treatment_type='Follow-up', status='Scheduled',
+                                 provider='someone@elsewhere.example',
+                                 created_at=datetime.now() + timedelta(days=day)))
+    db.session.commit()
+    return patient.id
+
+def test_cursor_round_trip():
+    """Test that cursors carry the keyset position and malformed ones are rejected."""
+    assert decode_cursor(encode_cursor(NOW, 7)) == (NOW, 7)
+    assert decode_cursor(encode_cursor(None, 7)) == (None, 7)
+    with pytest.raises(ValueError):
+        decode_cursor('garbage')
+
+def test_pages_walk_the_history_newest_first(app, physio):
+    """Test that following next_cursor returns every treatment once, undated ones last."""
+    patient_id = _patient_with_history(physio, 23)
+    undated = Treatment(patient_id=patient_id, treatment_type='Legacy', status='Completed')
+    db.session.add(undated)
+    db.session.flush()
+    undated.created_at = None
+    db.session.commit()
+
+    seen, cursor = [], None
+    while True:
+        page = timeline_page(patient_id, cursor=cursor, limit=10, now=NOW)
+        seen.extend(page['treatments'])
+        if not page['has_more']:
+            break
+        cursor = page['next_cursor']
+    assert len(seen) == 26 and len({t.id for t in seen}) == 26
+    dated = [t.created_at for t in seen[:-1]]
+    assert dated == sorted(dated, reverse=True)
+    assert seen[-1].id == undated.id
+
+@pytest.mark.parametrize('visits', [10, 120])
+def test_page_query_count_does_not_grow_with_history(app, physio, visits):
+    """Test that a page costs the same queries for short and long histories."""
+    patient_id = _patient_with_history(physio, visits)
+    db.session.expire_all()
+    with capture_queries() as stats:
+        page = timeline_page(patient_id, limit=10, now=NOW)
+        for treatment in page['treatments']:
+            treatment.trigger_points, treatment.location_name
+    # treatments, trigger points, locations, providers by email, providers by username
+    assert stats.count == 5
+
+def test_page_is_partitioned(app, physio):
+    """Test that completed, upcoming and overdue treatments are split in one pass."""
+    patient_id = _patient_with_history(physio, 8)
+    page = timeline_page(patient_id, limit=50, now=NOW)
+    assert len(page['upcoming']) == 2
+    assert {t.status for t in page['completed']} == {'Completed'}
+    assert len(page['completed']) == 6
+    assert all(t.status == 'Scheduled' and t.created_at < NOW for t in page['overdue'])
+    assert len(page['overdue']) == 2
+
+def test_provider_names(app, physio):
+    """Test that providers resolve by email, then username, else stay as recorded."""
+    names = provider_names({physio.email, 'ana', 'unknown@example.com', None})
+    assert names == {physio.email: 'Ana Ruiz', 'ana': 'Ana Ruiz',
+                     'unknown@example.com': 'unknown@example.com'}
+
+def test_timeline_api(app, physio):
+    """Test that the timeline API pages and enforces patient access."""
+    patient_id = _patient_with_history(physio, 30)
+    client = app.test_client()
+    login(client, physio.id)
+    first = client.get(f'/api/patients/{patient_id}/treatments?limit=20').get_json()
+    assert len(first['treatments']) == 20 and first['has_more']
+    assert first['treatments'][0]['trigger_points'] == []
+    second = client.get(f"/api/patients/{patient_id}/treatments?cursor={first['next_cursor']}").get_json()
+    assert len(second['treatments']) == 12 and not second['has_more']
+    assert second['treatments'][0]['provider_name'] == 'Ana Ruiz'
+    assert client.get(f'/api/patients/{patient_id}/treatments?cursor=bad').status_code == 400
+
+def test_timeline_api_denies_other_practitioners(app, physio):
+    """Test that another practitioner cannot read the timeline."""
+    patient_id = _patient_with_history(physio, 3)
+    other = make_user('other')
+    db.session.commit()
+    client = app.test_client()
+    login(client, other.id)
+    assert client.get(f'/api/patients/{patient_id}/treatments').status_code == 403
+
+def test_patient_detail_pages_treatments(app, physio):
+    """Test that the patient page shows one timeline page with a link to older treatments."""
+    patient_id = _patient_with_history(physio, 60)
+    client = app.test_client()
+    login(client, physio.id)
+    response = client.get(f'/patient/{patient_id}')
+    assert response.status_code == 200
+    assert b'Older treatments' in response.data
+    assert response.data.count(b'id="treatment-row-') == 48  # 50 minus the two upcoming ones
@@ -0,0 +1,117 @@
+# tests/test_point_layout.py
+import json
+
+import numpy as np
+
+from app import db
+from app.models import Patient, Treatment, TriggerPoint
+from app import point_layout
+from app.point_layout import (overlapping_pairs, resolve_overlaps, layout_rows, layout_treatments,
+                              MIN_DISTANCE, SAFE_AREA)
+from app.trigger_points import add_points, normalize_points
+from tests.conftest import login, make_user
+import pytest
+
+# Three markers on top of each other over the trapezius, one well clear of them
+CROWDED = [
+    {'x': 200, 'y': 200, 'type': 'active', 'muscle': 'Trapezius', 'intensity': 7},
+    {'x': 203, 'y': 201, 'type': 'latent', 'muscle': 'Trapezius'},
+    {'x': 200, 'y': 200, 'type': 'active', 'muscle': 'Trapezius', 'intensity': 5},
+    {'x': 300, 'y': 600, 'type': 'satellite', 'muscle': 'Gastrocnemius'},
+]
+
+@pytest.fixture
+def treatment(app):
+    user = make_user('physio')
+    patient = Patient(name='Chart patient', user_id=user.id, anamnesis='History')
+    db.session.add(patient)
+    db.session.flush()
+    treatment = Treatment(patient_id=patient.id, treatment_type='Initial', status='Completed')
+    db.session.add(treatment)
+    db.session.commit()
+    return treatment
+
+def _stored_xy(treatment_id):
+    return np.array(db.session.execute(
+        db.select(TriggerPoint.location_x, TriggerPoint.location_y)
+        .where(TriggerPoint.treatment_id == treatment_id).order_by(TriggerPoint.id)
+    ).all())
+
+def _min_gap(xy):
+    xy = np.asarray(xy, dtype=float)
+    distance = np.linalg.norm(xy[:, None] - xy[None, :], axis=-1)
+    return distance[np.triu_indices(len(xy), k=1)].min()
+
+def test_grid_search_matches_pairwise(monkeypatch):
+    """Test that the cell-grid neighbour search finds exactly the pairs the distance matrix does."""
+    xy = np.random.default_rng(7).uniform((100, 100), (400, 700), size=(400, 2))
+    pairwise = overlapping_pairs(xy)
+    monkeypatch.setattr(point_layout, 'PAIRWISE_LIMIT', 0)
+    grid = overlapping_pairs(xy)
+    assert len(pairwise[0]) > 0
+    assert np.array_equal(pairwise[0], grid[0]) and np.array_equal(pairwise[1], grid[1])
+
+def test_resolve_overlaps_separates_points_deterministically():
+    """Test that a tight cluster is spread to the minimum distance, the same way every time."""
+    xy = np.random.default_rng(1).normal((250, 300), 5, size=(40, 2))
+    first, iterations, left = resolve_overlaps(xy)
+    second, _, _ = resolve_overlaps(xy)
+    assert left == 0 and 0 < iterations <= point_layout.MAX_ITERATIONS
+    assert _min_gap(first) >= MIN_DISTANCE - 0.01
+    assert np.array_equal(first, second)
+    assert (first >= SAFE_AREA[:2]).all() and (first <= SAFE_AREA[2:]).all()
+
+def test_layout_only_moves_overlapping_points():
+    """Test that clear points stay put, coincident ones separate and a second pass changes nothing."""
+    rows = normalize_points(CROWDED)
+    moved = layout_rows(rows)
+    assert 3 not in moved and rows[3]['location_x'] == 300.0
+    xy = [(row['location_x'], row['location_y']) for row in rows]
+    assert _min_gap(xy[:3]) >= MIN_DISTANCE - 0.01
+    assert layout_rows(rows) == []
+
+def test_points_outside_safe_area_are_not_pushed_further_out():
+    """Test that the safe area bounds moved points without dragging in points already outside it."""
+    xy = np.array([[50.0, 200.0], [52.0, 200.0], [100.0, 100.0], [100.0, 100.0]])
+    new_xy, _, left = resolve_overlaps(xy)
+    assert left == 0
+    assert new_xy[:2, 0].min() >= 50.0
+    assert (new_xy[2:] >= 100.0).all()
+
+def test_add_treatment_lays_out_points(app, treatment):
+    """Test that overlapping points are pushed apart on save and evaluation_data matches the rows."""
+    patient = treatment.patient
+    client = app.test_client()
+    login(client, patient.user_id)
+    form = {'treatment_type': 'Follow-up', 'status': 'Completed', 'trigger_points_data': json.dumps(CROWDED)}
+    response = client.post(f'/patient/{patient.id}/treatment', data=form,
+                           headers={'X-Requested-With': 'XMLHttpRequest'})
+    assert response.status_code == 200
+    created = db.session.get(Treatment, response.get_json()['event']['id'])
+    stored = _stored_xy(created.id)
+    assert _min_gap(stored) >= MIN_DISTANCE - 0.01
+    assert [(p['x'], p['y']) for p in created.evaluation_data] == [tuple(xy) for xy in stored]
+
+    app.config['TRIGGER_POINT_LAYOUT_ON_SAVE'] = False
+    response = client.post(f'/patient/{patient.id}/treatment', data=form,
+                           headers={'X-Requested-With': 'XMLHttpRequest'})
+    assert _min_gap(_stored_xy(response.get_json()['event']['id'])) == 0
+
+def test_layout_treatments_batch(app, treatment):
+    """Test that the batch layout honours dry runs, updates both stores and is idempotent."""
+    add_points(treatment, normalize_points(CROWDED))
+    treatment.evaluation_data = CROWDED
+    db.session.commit()
+
+    stats = layout_treatments(dry_run=True)
+    assert stats == {'treatments': 1, 'changed': 1, 'points_moved': 3}
+    assert _min_gap(_stored_xy(treatment.id)) == 0
+
+    result = app.test_cli_runner().invoke(args=['trigger-points', 'layout'])
+    assert result.exit_code == 0 and 'moved 3 points in 1 of 1 treatments' in result.output
+    db.session.expire_all()
+    stored = _stored_xy(treatment.id)
+    assert _min_gap(stored) >= MIN_DISTANCE - 0.01
+    assert [(p['x'], p['y']) for p in db.session.get(Treatment, treatment.id).evaluation_data] == \
+        [tuple(xy) for xy in stored]
+    assert layout_treatments([treatment.id])['points_moved'] == 0
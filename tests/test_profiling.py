@@ -0,0 +1,106 @@
+# tests/test_profiling.py
+from app import create_app, db
+from app.profiling import StackSampler
+from config import TestConfig
+from tests.conftest import login, make_user
+import pytest
+import threading
+import time
+
+@pytest.fixture
+def app(tmp_path):
+    """Create an app with profiling enabled and profiles stored in a temp dir."""
+    class ProfilingConfig(TestConfig):
+        PROFILING_ENABLED = True
+        PROFILING_DIR = str(tmp_path / 'profiles')
+
+    app = create_app(ProfilingConfig)
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        try:
+            db.drop_all()
+        except Exception:
+            db.session.close()
+
+def logged_in_client(app, is_admin):
+    user = make_user('user', is_admin=is_admin)
+    db.session.commit()
+    client = app.test_client()
+    login(client, user.id)
+    return client
+
+def test_stack_sampler_collects_collapsed_stacks():
+    """Test that the sampler records the sampled thread's stacks."""
+    def busy_wait():
+        end = time.perf_counter() + 0.1
+        while time.perf_counter() < end:
+            pass
+
+    sampler = StackSampler(threading.get_ident(), interval=0.002)
+    sampler.start()
+    busy_wait()
+    sampler.stop()
+
+    assert sampler.sample_count > 0
+    collapsed = sampler.collapsed()
+    assert 'busy_wait (test_profiling.py:' in collapsed
+    assert collapsed.splitlines()[0].rsplit(' ', 1)[1].isdigit()
+
+def test_profiling_disabled_registers_no_hooks():
+    """Test that no request hooks are installed when profiling is off."""
+    app = create_app(TestConfig)
+    profiler = app.extensions['request_profiler']
+    assert not app.config['PROFILING_ENABLED']
+    hooks = app.before_request_funcs.get(None, []) + app.after_request_funcs.get(None, [])
+    assert profiler.start_request not in hooks
+    assert profiler.finish_request not in hooks
+
+def test_admin_can_profile_request_and_download(app):
+    """Test that an admin-flagged request is profiled, listed and downloadable."""
+    profiler = app.extensions['request_profiler']
+
+    client = logged_in_client(app, is_admin=True)
+    response = client.get('/health', headers={'X-Profile': '1'})
+    profile_id = response.headers['X-Profile-Id']
+
+    profiles = profiler.list_profiles()
+    assert [p['id'] for p in profiles] == [profile_id]
+    assert profiles[0]['path'] == '/health'
+    assert profiles[0]['trigger'] == 'manual'
+
+    listing = client.get('/monitoring/profiles')
+    assert listing.status_code == 200
+    assert profile_id.encode() in listing.data
+
+    download = client.get(f'/monitoring/profiles/{profile_id}')
+    assert download.status_code == 200
+    assert download.headers['Content-Disposition'].startswith('attachment')
+    assert client.get('/monitoring/profiles/..%2Fsecret').status_code == 404
+
+def test_non_admin_flag_is_ignored(app):
+    """Test that the profile flag has no effect for regular users."""
+    profiler = app.extensions['request_profiler']
+
+    client = logged_in_client(app, is_admin=False)
+    response = client.get('/health?_profile=1')
+    assert 'X-Profile-Id' not in response.headers
+    assert profiler.list_profiles() == []
+    assert client.get('/monitoring/profiles').status_code == 403
+
+def test_profiler_stops_when_the_view_raises(app):
+    """Test that a profiled request that raises stops its sampler thread and stores the profile as a 500."""
+    @app.route('/boom')
+    def boom():
+        raise RuntimeError('boom')
+
+    profiler = app.extensions['request_profiler']
+    client = logged_in_client(app, is_admin=True)
+    with pytest.raises(RuntimeError):
+        client.get('/boom', headers={'X-Profile': '1'})
+
+    assert not [t for t in threading.enumerate() if t.name == 'request-profiler']
+    profile, = profiler.list_profiles()
+    assert profile['path'] == '/boom' and profile['status'] == 500
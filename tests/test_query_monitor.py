@@ -0,0 +1,77 @@
+# tests/test_query_monitor.py
+from app import db
+from app.models import User, Patient, Treatment
+from app.query_monitor import fingerprint, capture_queries, QueryStats
+from sqlalchemy import text
+import pytest
+import uuid
+
+@pytest.fixture
+def physio(app):
+    """A practitioner with three patients, each with two treatments."""
+    email = f"physio_{uuid.uuid4().hex[:8]}@example.com"
+    user = User(username=email, email=email, role='physio')
+    user.set_password('password')
+    db.session.add(user)
+    db.session.flush()
+    for i in range(3):
+        patient = Patient(name=f'Patient {i}', user_id=user.id)
+        db.session.add(patient)
+        db.session.flush()
+        for _ in range(2):
+            db.session.add(Treatment(patient_id=patient.id, treatment_type='Follow-up', status='Completed'))
+    db.session.commit()
+    return user
+
+def test_fingerprint_normalizes_literals():
+    """Test that statements differing only in parameters share a fingerprint."""
+    a = fingerprint("SELECT * FROM patient WHERE id = 12 AND name = 'Ana'")
+    b = fingerprint("SELECT *   FROM patient\n WHERE id = 7 AND name = 'O''Brien'")
+    assert a == b == "SELECT * FROM patient WHERE id = ? AND name = ?"
+    assert fingerprint("SELECT 1 FROM t WHERE id IN (?, ?, ?)") == fingerprint("SELECT 1 FROM t WHERE id IN (?)")
+    assert fingerprint("SELECT * FROM t WHERE id = :id_1") == "SELECT * FROM t WHERE id = ?"
+
+def test_n_plus_one_is_flagged():
+    """Test that a fingerprint repeated past the threshold is reported."""
+    stats = QueryStats()
+    for i in range(5):
+        stats.record(f"SELECT * FROM treatment WHERE patient_id = {i}", 0.001)
+    stats.record("SELECT * FROM patient", 0.001)
+    assert stats.count == 6
+    assert stats.n_plus_one(5) == [("SELECT * FROM treatment WHERE patient_id = ?", 5)]
+    assert stats.n_plus_one(6) == []
+
+def test_capture_queries_counts_statements(app, physio):
+    """Test that capture_queries records statements executed inside the block."""
+    user_id = physio.id
+    with capture_queries() as stats:
+        for patient in Patient.query.filter_by(user_id=user_id).all():
+            Treatment.query.filter_by(patient_id=patient.id).all()
+    assert stats.count == 4
+    assert stats.n_plus_one(3)
+
+def test_slow_query_captures_plan(app):
+    """Test that statements over the latency budget get their EXPLAIN plan."""
+    app.config['SQL_SLOW_QUERY_MS'] = 0
+    with capture_queries() as stats:
+        db.session.execute(text('SELECT * FROM patient WHERE id = :id'), {'id': 1}).all()
+    assert stats.slow_queries
+    if db.engine.dialect.name in ('sqlite', 'postgresql'):
+        assert stats.slow_queries[0]['plan']
+
+def test_server_timing_header(app):
+    """Test that responses carry the database Server-Timing metric."""
+    client = app.test_client()
+    response = client.get('/health')
+    assert 'db;dur=' in response.headers['Server-Timing']
+    assert 'queries"' in response.headers['Server-Timing']
+
+    monitor = app.extensions['query_monitor']
+    assert monitor.recent_requests[0]['path'] == '/health'
+    assert monitor.recent_requests[0]['queries'] >= 1
+
+def test_health_query_budget(app, query_budget):
+    """Test that the health check stays within its query budget."""
+    client = app.test_client()
+    with query_budget(5, n_plus_one_threshold=3):
+        client.get('/health')
@@ -0,0 +1,97 @@
+# tests/test_query_plans.py
+"""
+Plan checks for the hot queries: each must be answered through an index.
+Declaring an index on the models is not enough on its own; these tests catch
+queries that drift away from the indexes (or indexes that get dropped).
+"""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select, func, exists
+
+from app import create_app, db
+from app.models import (Patient, Treatment, TriggerPoint, Location, PatientReport,
+                        RecurringAppointment, PatientAIConversation, UnmatchedCalendlyBooking)
+from app.models_icd10 import PatientDiagnosis
+from app.patient_access import accessible_patient_ids_query
+from app.patient_timeline import timeline_query
+from app.query_monitor import query_plan, full_table_scans
+from config import TestConfig
+
+SINCE = datetime(2025, 1, 1)
+UNTIL = SINCE + timedelta(days=30)
+USER = SimpleNamespace(id=1)
+
+HOT_QUERIES = {
+    'active_patients_of_practitioner': lambda: select(Patient).where(
+        Patient.user_id == 1, Patient.status == 'Active'),
+    'recent_patients_of_practitioner': lambda: select(Patient).where(
+        Patient.user_id == 1).order_by(Patient.created_at.desc()).limit(20),
+    'patient_directory_build': lambda: select(
+        Patient.id, Patient._name, Patient._email, Patient.status, Patient.diagnosis, Patient.created_at).where(
+        Patient.user_id == 1),
+    'patient_directory_stamp': lambda: select(func.count(Patient.id), func.max(Patient.updated_at)).where(
+        Patient.user_id == 1),
+    'patient_access_check': lambda: select(exists().where(
+        Patient.id == 1, Patient.id.in_(accessible_patient_ids_query(USER, include_clinic_patients=True)))),
+    'clinic_accessible_patient_ids': lambda: accessible_patient_ids_query(USER, include_clinic_patients=True),
+    'patients_referred_by': lambda: select(Patient).where(Patient.referred_by_patient_id == 1),
+    'patient_timeline': lambda: select(Treatment).where(
+        Treatment.patient_id == 1).order_by(Treatment.created_at.desc()),
+    'patient_timeline_page': lambda: timeline_query(1, after=(SINCE, 10)).limit(51).statement,
+    'completed_treatments_in_range': lambda: select(func.count(Treatment.id)).where(
+        Treatment.status == 'Completed', Treatment.created_at.between(SINCE, UNTIL)),
+    'treatments_in_range': lambda: select(Treatment).where(
+        Treatment.created_at >= SINCE, Treatment.created_at < UNTIL),
+    'practitioner_treatments_in_range': lambda: select(Treatment).join(Patient).where(
+        Patient.user_id == 1, Treatment.created_at.between(SINCE, UNTIL)),
+    'trigger_points_of_treatments': lambda: select(TriggerPoint).where(
+        TriggerPoint.treatment_id.in_([1, 2, 3])),
+    'active_recurring_for_patients': lambda: select(RecurringAppointment).where(
+        RecurringAppointment.patient_id.in_([1, 2]), RecurringAppointment.is_active == True),
+    'ai_conversation_history': lambda: select(PatientAIConversation).where(
+        PatientAIConversation.patient_id == 1, PatientAIConversation.user_id == 1
+    ).order_by(PatientAIConversation.created_at.asc()).limit(20),
+    'pending_calendly_bookings': lambda: select(UnmatchedCalendlyBooking).where(
+        UnmatchedCalendlyBooking.user_id == 1, UnmatchedCalendlyBooking.status == 'Pending'),
+    'patient_reports': lambda: select(PatientReport).where(
+        PatientReport.patient_id == 1).order_by(PatientReport.generated_date.desc()),
+    'active_locations': lambda: select(Location).where(
+        Location.user_id == 1, Location.is_active == True),
+    'active_diagnoses': lambda: select(PatientDiagnosis).where(
+        PatientDiagnosis.patient_id == 1, PatientDiagnosis.status == 'active'),
+}
+
+
+@pytest.fixture
+def app():
+    app = create_app(TestConfig)
+    app.config.update({'TESTING': True, 'WTF_CSRF_ENABLED': False})
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.mark.parametrize('name', sorted(HOT_QUERIES))
+def test_hot_query_uses_an_index(app, name):
+    """Test that a hot query does not fall back to a full table scan."""
+    with db.engine.connect() as conn:
+        plan = query_plan(conn, HOT_QUERIES[name]())
+    assert not full_table_scans(plan), f'{name} scans a whole table: {plan}'
+
+
+def test_patient_timeline_page_needs_no_sort(app):
+    """Test that timeline pages are read in index order rather than sorted."""
+    with db.engine.connect() as conn:
+        plan = query_plan(conn, HOT_QUERIES['patient_timeline_page']())
+    assert not any('TEMP B-TREE' in line for line in plan), plan
+
+
+def test_full_table_scans_detects_unindexed_filter(app):
+    """Test that the checker flags a filter on an unindexed column."""
+    with db.engine.connect() as conn:
+        plan = query_plan(conn, select(Treatment).where(Treatment.payment_method == 'Cash'))
+    assert full_table_scans(plan) == ['treatment']
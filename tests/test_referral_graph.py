@@ -0,0 +1,99 @@
+# tests/test_referral_graph.py
+from app import db
+from app.models import User, Patient, Treatment
+from app.referral_graph import referral_graph, referral_depths, graph_cache
+from app.query_monitor import capture_queries
+from tests.conftest import login, make_user
+import pytest
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    """Start each test with an empty referral graph cache."""
+    graph_cache.clear()
+
+def _patient(user, name, referred_by=None, referred_by_name=None):
+    patient = Patient(name=name, user_id=user.id, referred_by_name=referred_by_name,
+                      referred_by_patient_id=referred_by.id if referred_by else None)
+    db.session.add(patient)
+    db.session.flush()
+    return patient
+
+@pytest.fixture
+def practice(app):
+    """Ann referred Ben, Ben referred Cat; Dr Lee referred Dan and Eve; Fay came directly; a stranger elsewhere."""
+    physio, other = make_user('physio'), make_user('other')
+    ann = _patient(physio, 'Ann')
+    ben = _patient(physio, 'Ben', referred_by=ann)
+    cat = _patient(physio, 'Cat', referred_by=ben)
+    dan = _patient(physio, 'Dan', referred_by_name='Dr Lee')
+    _patient(physio, 'Eve', referred_by_name='Dr Lee')
+    _patient(physio, 'Fay')
+    _patient(other, 'Stranger', referred_by_name='Dr Lee')
+    for patient in (ben, ben, cat, dan):
+        db.session.add(Treatment(patient_id=patient.id, treatment_type='Initial', status='Completed'))
+    db.session.commit()
+    return physio.id, ann.id, ben.id, cat.id
+
+def test_graph_nodes_edges_and_statistics(app, practice):
+    """Test that the graph keeps the endpoint's format and adds depth and conversion."""
+    physio_id, ann_id, ben_id, cat_id = practice
+    graph = referral_graph(db.session.get(User, physio_id))
+    nodes = {node['id']: node for node in graph['nodes']}
+    assert len(nodes) == 7      # Six patients and one external referrer
+    assert nodes['external_dr_lee']['type'] == 'external'
+    assert nodes[f'patient_{ben_id}']['referral_source'] == 'Ann'
+    assert nodes[f'patient_{ben_id}']['total_treatments'] == 2
+    assert [nodes[f'patient_{i}']['referral_depth'] for i in (ann_id, ben_id, cat_id)] == [0, 1, 2]
+    assert sorted(edge['type'] for edge in graph['edges']) == ['external_referral'] * 2 + ['patient_referral'] * 2
+
+    stats = graph['statistics']
+    assert (stats['total_patients'], stats['referred_patients']) == (6, 4)
+    assert (stats['patient_referrals'], stats['external_referrals']) == (2, 2)
+    assert stats['referral_rate'] == 66.67
+    assert stats['top_external_referrers'] == [{'name': 'Dr Lee', 'referrals_count': 2}]
+    assert {r['name'] for r in stats['top_patient_referrers']} == {'Ann', 'Ben'}
+    assert stats['max_referral_depth'] == 2
+    conversion = {entry['source']: (entry['patients'], entry['converted']) for entry in stats['conversion_by_source']}
+    assert conversion == {'Patient referral': (2, 2), 'Dr Lee': (2, 1), 'Direct': (2, 0)}
+
+def test_graph_is_built_with_a_fixed_number_of_queries(app, practice):
+    """Test that a build does not grow with the patient count and a cached graph costs one query."""
+    physio_id = practice[0]
+    user = db.session.get(User, physio_id)
+    with capture_queries() as stats:
+        first = referral_graph(user)
+    assert stats.count <= 3
+    with capture_queries() as stats:
+        assert referral_graph(user) is first
+    assert stats.count == 1
+
+    ann = Patient.query.filter_by(user_id=physio_id).order_by(Patient.id).first()
+    db.session.add(Treatment(patient_id=ann.id, treatment_type='Follow-up', status='Completed'))
+    db.session.commit()
+    assert referral_graph(user)['statistics']['conversion_by_source'] != first['statistics']['conversion_by_source']
+
+def test_referral_depths_cut_cycles():
+    """Test that depths follow the referrer chain and a cycle does not loop forever."""
+    assert referral_depths({1: None, 2: 1, 3: 2, 4: 9}) == {1: 0, 2: 1, 3: 2, 4: 0}
+    depths = referral_depths({1: 2, 2: 1})
+    assert sorted(depths.values()) == [0, 1]
+
+def test_referral_chain_and_tree(app, practice):
+    """Test that chains and trees keep their shapes with one recursive query each."""
+    _, ann_id, ben_id, cat_id = practice
+    cat, ann = db.session.get(Patient, cat_id), db.session.get(Patient, ann_id)
+    with capture_queries() as stats:
+        chain = cat.get_referral_chain()
+    assert [p.id for p in chain] == [ann_id, ben_id, cat_id]
+    assert stats.count == 1
+    tree = ann.get_referral_tree()
+    assert tree['patient'] is ann
+    assert tree['referrals'][0]['patient'].id == ben_id
+    assert tree['referrals'][0]['referrals'][0]['patient'].id == cat_id
+
+def test_referral_tree_api(app, practice):
+    """Test that the endpoint returns the practitioner's graph."""
+    client = app.test_client()
+    login(client, practice[0])
+    data = client.get('/api/analytics/referral-tree').get_json()
+    assert data['statistics']['total_patients'] == 6
@@ -0,0 +1,63 @@
+# tests/test_startup.py
+from app.integrations import LazyModule
+from app.query_monitor import capture_queries
+from app.icd10_catalog import catalog_cache, reference_catalog
+from app.warmup import warmup
+import os
+import re
+import subprocess
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Cumulative `import app` time allowed, in milliseconds (about 0.6s on a laptop)
+IMPORT_BUDGET_MS = float(os.environ.get('IMPORT_TIME_BUDGET_MS', '1500'))
+HEAVY_MODULES = ('stripe', 'xhtml2pdf', 'googleapiclient', 'google_auth_oauthlib', 'authlib', 'sentry_sdk')
+
+def _python(*args):
+    env = dict(os.environ, SECRET_KEY=os.environ.get('SECRET_KEY', 'test'), FLASK_ENV='testing')
+    return subprocess.run([sys.executable, *args], cwd=ROOT, env=env, capture_output=True, text=True, timeout=120)
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    """Start each test with an empty catalog cache."""
+    catalog_cache.clear()
+
+def test_import_app_stays_within_budget():
+    """Test that `import app` builds no app and stays under the import time budget."""
+    result = _python('-X', 'importtime', '-c', "import app; print('app' in vars(app))")
+    assert result.returncode == 0, result.stderr[-2000:]
+    assert result.stdout.strip() == 'False'
+    total = [int(m.group(1)) for m in re.finditer(r'^import time:\s+\d+ \|\s+(\d+) \| app$', result.stderr, re.M)]
+    assert total, result.stderr[-2000:]
+    assert total[0] / 1000 < IMPORT_BUDGET_MS, f"import app took {total[0] / 1000:.0f}ms"
+
+def test_create_app_leaves_heavy_integrations_unimported():
+    """Test that building the app does not import Stripe, xhtml2pdf, Google clients or Sentry."""
+    result = _python('-c', (
+        "import sys, app\n"
+        "app.create_app()\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    ))
+    assert result.returncode == 0, result.stderr[-2000:]
+    assert result.stdout.strip().splitlines()[-1:] in ([], [''])
+
+def test_lazy_module_imports_on_first_use():
+    """Test that a lazy module imports on attribute access and applies attributes set earlier."""
+    sys.modules.pop('colorsys', None)
+    colorsys = LazyModule('colorsys')
+    colorsys.marker = 'set early'
+    assert not colorsys.loaded and 'colorsys' not in sys.modules
+    assert colorsys.marker == 'set early' and not colorsys.loaded
+    assert colorsys.rgb_to_hsv(1, 0, 0) == (0.0, 1.0, 1)
+    assert colorsys.loaded and sys.modules['colorsys'].marker == 'set early'
+
+def test_warmup_compiles_templates_and_primes_the_catalog(app):
+    """Test that warmup fills the Jinja cache and builds the ICD-10 catalog."""
+    summary = warmup(app)
+    assert summary['templates'] > 50
+    assert set(summary['caches']) == {'icd10_catalog', 'static_assets'}
+    assert len(app.jinja_env.cache) >= summary['templates']
+    with capture_queries() as stats:
+        reference_catalog()
+    assert stats.count == 0
@@ -0,0 +1,101 @@
+# tests/test_static_assets.py
+from app import create_app
+from app.static_assets import build_assets, minify_css, minify_js, MANIFEST_NAME
+import gzip
+import json
+import os
+import pytest
+
+@pytest.fixture
+def app(tmp_path):
+    """Create an app whose built assets go to a temporary directory."""
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['STATIC_ASSETS_DIR'] = str(tmp_path / 'dist')
+    with app.app_context():
+        yield app
+
+def _write(root, path, text):
+    full = root / path
+    full.parent.mkdir(parents=True, exist_ok=True)
+    full.write_text(text)
+
+def test_minifiers_keep_strings_templates_and_regexes():
+    """Test that minifying removes comments and indentation but not literal content."""
+    js = (
+        "/*! keep */\n"
+        "function f(a) {\n"
+        "    // comment\n"
+        "    const url = 'http://x // not a comment';\n"
+        "    const html = `<div>\n        ${a ? `<b>${a}</b>` : ''} /* text */\n    </div>`;\n"
+        "    return /\\/\\*[a-z]+/g.test(url) && a / 2;  /* block */\n"
+        "}\n"
+    )
+    assert minify_js(js) == (
+        "/*! keep */\n"
+        "function f(a) {\n"
+        "const url = 'http://x // not a comment';\n"
+        "const html = `<div>\n        ${a ? `<b>${a}</b>` : ''} /* text */\n    </div>`;\n"
+        "return /\\/\\*[a-z]+/g.test(url) && a / 2;\n"
+        "}\n"
+    )
+    css = "/* theme */\n.card ,\n.panel > p {\n  color : red;\n  content: \"a  b\";\n}\ndiv :hover { margin: 0 auto; }\n"
+    assert minify_css(css) == '.card,.panel>p{color : red;content: "a  b"}div :hover{margin: 0 auto}\n'
+
+def test_build_writes_hashed_files_manifest_and_variants(tmp_path):
+    """Test that the build fingerprints files, rewrites CSS urls and precompresses text."""
+    source = tmp_path / 'static'
+    _write(source, 'js/app.js', "// app\nconsole.log('hello');\n" * 50)
+    _write(source, 'fonts/icons.woff2', 'font')
+    _write(source, 'css/site.css', '.a { src: url("../fonts/icons.woff2?v=1#x") }\n' * 20)
+    manifest = build_assets(source, source / 'dist')
+
+    entry = manifest['js/app.js']
+    assert entry['path'].startswith('js/app.') and entry['path'].endswith('.js')
+    built = (source / 'dist' / entry['path']).read_bytes()
+    assert built.startswith(b"console.log('hello');")
+    assert entry['encodings'][-1] == 'gzip'
+    assert gzip.decompress((source / 'dist' / (entry['path'] + '.gz')).read_bytes()) == built
+    assert manifest['fonts/icons.woff2']['encodings'] == []
+
+    font = os.path.basename(manifest['fonts/icons.woff2']['path'])
+    css = (source / 'dist' / manifest['css/site.css']['path']).read_text()
+    assert f'url("../fonts/{font}#x")' in css
+    stored = json.loads((source / 'dist' / MANIFEST_NAME).read_text())['assets']
+    assert stored == manifest and 'dist' not in ' '.join(stored)
+
+    # Same content, same names
+    assert build_assets(source, source / 'dist') == manifest
+
+def test_static_url_uses_the_manifest_and_falls_back(app):
+    """Test that static_url returns hashed URLs for built files and /static/ otherwise."""
+    static_url = app.jinja_env.globals['static_url']
+    with app.test_request_context():
+        assert static_url('js/pathology_guide.js') == '/static/js/pathology_guide.js'
+        manifest = build_assets(app.static_folder, app.config['STATIC_ASSETS_DIR'])
+        hashed = manifest['js/pathology_guide.js']['path']
+        assert static_url('js/pathology_guide.js') == f'/static/dist/{hashed}'
+        assert static_url('js/missing.js') == '/static/js/missing.js'
+        app.config['STATIC_ASSETS_ENABLED'] = False
+        assert static_url('js/pathology_guide.js') == '/static/js/pathology_guide.js'
+
+def test_built_assets_are_served_immutable_and_precompressed(app):
+    """Test that hashed assets get far-future caching and the accepted encoding."""
+    result = app.test_cli_runner().invoke(args=['assets', 'build'])
+    assert result.exit_code == 0 and 'Built' in result.output
+    with open(os.path.join(app.config['STATIC_ASSETS_DIR'], MANIFEST_NAME)) as f:
+        entry = json.load(f)['assets']['css/bootstrap-icons.css']
+    client = app.test_client()
+    url = f"/static/dist/{entry['path']}"
+
+    response = client.get(url, headers={'Accept-Encoding': 'gzip, br'})
+    assert response.status_code == 200 and response.headers['Content-Encoding'] == 'br'
+    assert response.mimetype == 'text/css'
+    assert 'immutable' in response.headers['Cache-Control'] and 'max-age=31536000' in response.headers['Cache-Control']
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    plain = client.get(url)
+    assert 'Content-Encoding' not in plain.headers and b'bootstrap-icons' in plain.data
+    assert client.get('/static/dist/css/bootstrap-icons.css').status_code == 404
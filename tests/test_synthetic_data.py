@@ -0,0 +1,35 @@
+# tests/test_synthetic_data.py
+from app.models import User, Patient, Treatment, RecurringAppointment
+from app.synthetic_data import seed_synthetic_practice
+
+def test_seed_synthetic_practice_counts(app):
+    """Test that the generator creates the requested amount of data."""
+    with app.app_context():
+        created = seed_synthetic_practice(users=2, patients=3, treatments=2, recurring=1, clinics=1)
+
+        assert len(created['users']) == 2
+        assert created['patients'] == 6
+        assert created['treatments'] == 12
+        assert created['recurring'] == 2
+
+        first = User.query.filter_by(email=created['users'][0]).first()
+        second = User.query.filter_by(email=created['users'][1]).first()
+        assert Patient.query.filter_by(user_id=first.id).count() == 3
+        assert Treatment.query.join(Patient).filter(Patient.user_id == first.id).count() == 6
+        assert RecurringAppointment.query.join(Patient).filter(Patient.user_id == second.id).count() == 1
+
+        # The first practitioner practises independently, the others join a clinic
+        assert not first.is_in_clinic
+        assert second.is_in_clinic
+
+def test_seed_is_reproducible(app):
+    """Test that the same seed produces the same patient names."""
+    with app.app_context():
+        first = seed_synthetic_practice(users=1, patients=4, treatments=0, recurring=0, seed=7)
+        second = seed_synthetic_practice(users=1, patients=4, treatments=0, recurring=0, seed=7)
+
+        def names(email):
+            user = User.query.filter_by(email=email).first()
+            return [p.name for p in Patient.query.filter_by(user_id=user.id).order_by(Patient.id)]
+
+        assert names(first['users'][0]) == names(second['users'][0])
@@ -0,0 +1,135 @@
+# tests/test_trigger_points.py
+import json
+
+from app import db
+from app.models import Patient, Treatment, TriggerPoint
+from app.trigger_points import (normalize_points, add_points, replace_points, packed_points,
+                                TriggerPointError, POINT_TYPES)
+from app.query_monitor import capture_queries
+from tests.conftest import login, make_user
+import pytest
+
+POINTS = [
+    {'x': 120, 'y': 340.5, 'type': 'active', 'muscle': 'Trapezius', 'intensity': '7'},
+    {'x': '210.25', 'y': 400, 'type': 'latent', 'intensity': ''},
+    {'x': 300, 'y': 650, 'type': 'satellite', 'muscle': 'Gluteus medius', 'intensity': 3},
+]
+
+@pytest.fixture
+def treatment(app):
+    user = make_user('physio')
+    patient = Patient(name='Chart patient', user_id=user.id, anamnesis='History')
+    db.session.add(patient)
+    db.session.flush()
+    treatment = Treatment(patient_id=patient.id, treatment_type='Initial', status='Completed')
+    db.session.add(treatment)
+    db.session.commit()
+    return treatment
+
+def _stored(treatment_id):
+    return db.session.execute(
+        db.select(TriggerPoint.id, TriggerPoint.location_x, TriggerPoint.location_y)
+        .where(TriggerPoint.treatment_id == treatment_id).order_by(TriggerPoint.id)
+    ).all()
+
+def test_normalize_points():
+    """Test that points are converted to column values with defaults filled in."""
+    rows = normalize_points(POINTS)
+    assert rows[0] == {'location_x': 120.0, 'location_y': 340.5, 'type': 'active', 'muscle': 'Trapezius',
+                       'intensity': 7, 'symptoms': '', 'referral_pattern': ''}
+    assert rows[1]['location_x'] == 210.25 and rows[1]['intensity'] is None and rows[1]['muscle'] == ''
+    assert normalize_points(None) == []
+
+def test_normalize_points_reports_every_bad_point():
+    """Test that validation checks the whole list and lists each problem."""
+    with pytest.raises(TriggerPointError) as excinfo:
+        normalize_points([{'x': 1, 'y': 2}, 'junk', {'x': 'left', 'y': 2}, {'y': 3},
+                          {'x': 1, 'y': 2, 'intensity': 'high'}, {'x': float('nan'), 'y': 1}])
+    assert len(excinfo.value.errors) == 5
+    assert 'point 1' in excinfo.value.errors[0] and 'point 5' in excinfo.value.errors[-1]
+    with pytest.raises(TriggerPointError):
+        normalize_points({'x': 1, 'y': 2})
+
+def test_add_points_is_one_insert(app, treatment):
+    """Test that all points of a treatment are written with one statement."""
+    rows = normalize_points(POINTS * 10)
+    treatment.id  # Reload the committed treatment outside the measured block
+    with capture_queries() as stats:
+        assert add_points(treatment, rows) == 30
+    assert stats.count == 1
+    db.session.commit()
+    assert len(treatment.trigger_points) == 30
+
+def test_replace_points_is_idempotent(app, treatment):
+    """Test that re-saving the same chart writes nothing and keeps row ids."""
+    add_points(treatment, normalize_points(POINTS))
+    db.session.commit()
+    before = _stored(treatment.id)
+    treatment.id
+    with capture_queries() as stats:
+        assert replace_points(treatment, normalize_points(POINTS)) == (0, 0)
+    assert stats.count == 1  # Only the read
+    db.session.commit()
+    assert _stored(treatment.id) == before
+
+def test_replace_points_writes_only_the_difference(app, treatment):
+    """Test that an edit deletes removed points, inserts new ones and keeps the rest."""
+    add_points(treatment, normalize_points(POINTS))
+    db.session.commit()
+    kept_ids = [row.id for row in _stored(treatment.id)][1:]
+
+    edited = POINTS[1:] + [{'x': 250, 'y': 500, 'type': 'active', 'intensity': 5}]
+    assert replace_points(treatment, normalize_points(edited)) == (1, 1)
+    db.session.commit()
+    rows = _stored(treatment.id)
+    assert [row.id for row in rows][:2] == kept_ids
+    assert (rows[-1].location_x, rows[-1].location_y) == (250.0, 500.0)
+    assert len(treatment.trigger_points) == 3
+
+    # Duplicated points are matched one for one
+    assert replace_points(treatment, normalize_points(edited + edited[:1])) == (1, 0)
+    assert replace_points(treatment, []) == (0, 4)
+
+def test_packed_points(app, treatment):
+    """Test that packed points keep order and encode missing values."""
+    add_points(treatment, normalize_points(POINTS + [{'x': 1, 'y': 2, 'type': 'odd'}]))
+    db.session.commit()
+    packed = packed_points([treatment.id])
+    assert len(packed) == 4
+    data = packed.to_dict()
+    assert data['x'] == [120.0, 210.25, 300.0, 1.0]
+    assert data['intensity'] == [7, -1, 3, -1]
+    assert [POINT_TYPES[code] for code in data['type']] == ['active', 'latent', 'satellite', 'unknown']
+    assert data['treatment_id'] == [treatment.id] * 4
+    assert len(packed_points([])) == 0
+
+def test_add_treatment_saves_points_in_one_transaction(app, treatment):
+    """Test that a new treatment and its points are committed together, or not at all."""
+    patient = treatment.patient
+    client = app.test_client()
+    login(client, patient.user_id)
+    form = {'treatment_type': 'Follow-up', 'status': 'Completed', 'trigger_points_data': json.dumps(POINTS)}
+    response = client.post(f'/patient/{patient.id}/treatment', data=form,
+                           headers={'X-Requested-With': 'XMLHttpRequest'})
+    assert response.status_code == 200 and response.get_json()['success']
+    created = db.session.get(Treatment, response.get_json()['event']['id'])
+    assert len(created.trigger_points) == 3
+
+    form['trigger_points_data'] = json.dumps(POINTS + [{'x': 'oops', 'y': 1}])
+    response = client.post(f'/patient/{patient.id}/treatment', data=form,
+                           headers={'X-Requested-With': 'XMLHttpRequest'})
+    assert response.status_code == 400
+    assert Treatment.query.filter_by(patient_id=patient.id).count() == 2
+
+def test_edit_treatment_keeps_unchanged_points(app, treatment):
+    """Test that saving the edit form twice with the same chart leaves the rows untouched."""
+    add_points(treatment, normalize_points(POINTS))
+    db.session.commit()
+    before = _stored(treatment.id)
+    client = app.test_client()
+    login(client, treatment.patient.user_id)
+    form = {'treatment_type': 'Initial', 'status': 'Completed', 'trigger_points_data': json.dumps(POINTS)}
+    for _ in range(2):
+        response = client.post(f'/treatment/{treatment.id}/edit', data=form)
+        assert response.status_code == 302
+    assert _stored(treatment.id) == before